@@ -11,8 +11,10 @@ from utils.perms import perm_required
 from utils.excel import make_xlsx_bytes, make_xlsx_bytes_multi
 from utils.importer import read_excel_rows, pick, to_str, to_int, to_bool, upsert_by_code, replace_all
 from utils.org_dynamic import ensure_dynamic_org_seed, sync_legacy_now
+from utils import org_tree
 
-from models import Organization, Directorate, Unit, Department, Section, Division, Role, User, UserPermission, RequestType, WorkflowRoutingRule, WorkflowRequest, Committee, CommitteeAssignee, WorkflowTemplateStep, WorkflowTemplateParallelAssignee, WorkflowInstanceStep, OrgNodeType, OrgNode, SystemSetting
+from models import Organization, Directorate, Unit, Department, Section, Division, Role, User, UserPermission, RequestType, WorkflowRoutingRule, WorkflowRequest, Committee, CommitteeAssignee, WorkflowTemplateStep, WorkflowTemplateParallelAssignee, WorkflowInstanceStep, OrgNodeType, OrgNode
+from services import settings_service
 
 masterdata_bp = Blueprint("masterdata", __name__, url_prefix="/admin/masterdata")
 
@@ -45,17 +47,11 @@ def _clean(s): return (s or "").strip()
 # -------------------------
 
 def _get_setting(key: str, default: str | None = None) -> str | None:
-    row = SystemSetting.query.filter_by(key=key).first()
-    return (row.value if row else default)
+    return settings_service.get(key, default)
 
 
 def _set_setting(key: str, value: str | None):
-    row = SystemSetting.query.filter_by(key=key).first()
-    if not row:
-        row = SystemSetting(key=key, value=(value or ""))
-        db.session.add(row)
-    else:
-        row.value = (value or "")
+    settings_service.set_value(key, (value or ""))
 
 
 def _legacy_org_locked() -> bool:
@@ -3015,14 +3011,7 @@ def _build_node_tree_for_picker(selected_type: OrgNodeType | None, exclude_node_
     # compute disabled ids (exclude node + descendants)
     disabled_ids: set[int] = set()
     if exclude_node_id and exclude_node_id in by_id:
-        stack = [exclude_node_id]
-        while stack:
-            cur = stack.pop()
-            if cur in disabled_ids:
-                continue
-            disabled_ids.add(cur)
-            for ch in children_map.get(cur, []):
-                stack.append(ch.id)
+        disabled_ids = set(org_tree.descendant_ids(exclude_node_id))
 
     allowed_type_ids = set()
     root_allowed = True
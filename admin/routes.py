@@ -3,18 +3,24 @@ from flask import (
     render_template, Blueprint,
     request, redirect, url_for, flash,
     send_file,
-    current_app
+    current_app, jsonify, Response, stream_with_context
 )
 from flask_login import login_required, current_user, logout_user
+from utils import loader_profiles
 from utils.perms import perm_required
 from permissions import roles_required, role_perm_required
-from models import WorkflowRequest, SystemSetting, AuditLog, ArchivedFile, WorkflowRoutingRule, RequestType, Organization, Directorate, Department, WorkflowTemplate, RequestEscalation, OrgNode, OrgNodeType
+from models import WorkflowRequest, AuditLog, WorkflowRoutingRule, RequestType, Organization, Directorate, Department, WorkflowTemplate, RequestEscalation, OrgNode, OrgNodeType
 from extensions import db
+from services import settings_service
+from services import backup_engine
+from services import sla_service
+from services import dashboard_snapshot
+from services import request_profiler
+from workflow import routing_index
 from sqlalchemy import func, or_
 from datetime import datetime, timedelta
 from filters.request_filters import apply_request_filters
 from filters.request_filters import get_sla_days, get_escalation_days
-from sqlalchemy import case
 from io import BytesIO
 
 import os
@@ -47,14 +53,6 @@ register_evaluation_routes(admin_bp)
 # =========================
 FINAL_STATUSES = ["APPROVED", "REJECTED"]
 
-DASHBOARD_CACHE = {
-    "data": None,
-    "last_update": None
-}
-
-DASHBOARD_TTL_SECONDS = 30
-
-
 ESCALATION_ROLE_MAP = {
     "dept_head": "secretary_general",
     "finance": "secretary_general"
@@ -67,22 +65,13 @@ SYSTEM_USER_ID = None  # system action
 # Helpers
 # =========================
 def get_sla_days():
-    setting = SystemSetting.query.filter_by(key="SLA_DAYS").first()
-    return int(setting.value) if setting else 3
+    value = settings_service.get("SLA_DAYS")
+    return int(value) if value is not None else 3
 
 
 def get_escalation_days():
-    setting = SystemSetting.query.filter_by(key="ESCALATION_DAYS").first()
-    return int(setting.value) if setting else 2
-
-
-def get_trash_retention_days() -> int:
-    """How many days deleted archive files remain in recycle bin before purge."""
-    setting = SystemSetting.query.filter_by(key="TRASH_RETENTION_DAYS").first()
-    try:
-        return int(setting.value) if setting and setting.value is not None else 30
-    except Exception:
-        return 30
+    value = settings_service.get("ESCALATION_DAYS")
+    return int(value) if value is not None else 2
 
 
 # =========================
@@ -99,18 +88,11 @@ def update_sla():
         flash("Invalid SLA value", "danger")
         return redirect(url_for("admin.dashboard"))
 
-    setting = SystemSetting.query.filter_by(key="SLA_DAYS").first()
-
-    if not setting:
-        setting = SystemSetting(
-            key="SLA_DAYS",
-            value=str(sla_days)
-        )
-        db.session.add(setting)
-    else:
-        setting.value = str(sla_days)
-
+    settings_service.set_value("SLA_DAYS", str(sla_days))
     db.session.commit()
+    # Stored deadlines (sla_due_at / escalation_due_at) follow the new setting
+    sla_service.ensure_deadlines_current()
+    dashboard_snapshot.refresh(current_app._get_current_object())
 
     flash(f"SLA updated to {sla_days} days", "success")
     return redirect(url_for("admin.dashboard"))
@@ -128,14 +110,9 @@ def update_trash_retention():
         flash("قيمة سياسة الاحتفاظ غير صحيحة", "danger")
         return redirect(url_for("admin.dashboard"))
 
-    setting = SystemSetting.query.filter_by(key="TRASH_RETENTION_DAYS").first()
-    if not setting:
-        setting = SystemSetting(key="TRASH_RETENTION_DAYS", value=str(days))
-        db.session.add(setting)
-    else:
-        setting.value = str(days)
-
+    settings_service.set_value("TRASH_RETENTION_DAYS", str(days))
     db.session.commit()
+    dashboard_snapshot.refresh(current_app._get_current_object())
     flash(f"تم تحديث سياسة الاحتفاظ بسلة المحذوفات إلى {days} يوم", "success")
     return redirect(url_for("admin.dashboard"))
 
@@ -147,128 +124,39 @@ def update_trash_retention():
 @login_required
 @role_perm_required("VIEW_DASHBOARD")
 def dashboard():
-    now = datetime.utcnow()
-
-    if (
-        DASHBOARD_CACHE["data"]
-        and DASHBOARD_CACHE["last_update"]
-        and (now - DASHBOARD_CACHE["last_update"]).seconds < DASHBOARD_TTL_SECONDS
-    ):
-        return render_template(
-            "admin/dashboard.html",
-            **DASHBOARD_CACHE["data"]
-        )
-
-    stats = db.session.query(
-        func.count(WorkflowRequest.id),
-        func.sum(case((WorkflowRequest.status == "APPROVED", 1), else_=0)),
-        func.sum(case((WorkflowRequest.status == "REJECTED", 1), else_=0)),
-        func.sum(case((WorkflowRequest.status == "DRAFT", 1), else_=0)),
-        func.sum(
-            case(
-                (WorkflowRequest.status.notin_(FINAL_STATUSES + ["DRAFT"]), 1),
-                else_=0
-            )
-        )
-    ).one()
-
-    total, approved, rejected, drafts, in_progress = stats
-    delegated = 0
-
-    SLA_DAYS = get_sla_days()
-    sla_threshold = now - timedelta(days=SLA_DAYS)
-
-    aging_requests = (
-        WorkflowRequest.query
-        .filter(
-            WorkflowRequest.status.notin_(FINAL_STATUSES),
-            WorkflowRequest.created_at <= sla_threshold
-        )
-        .order_by(WorkflowRequest.created_at.asc())
-        .limit(10)
-        .all()
+    snap, stale = dashboard_snapshot.get_snapshot(current_app._get_current_object())
+    return render_template(
+        "admin/dashboard.html",
+        **dashboard_snapshot.template_context(snap, stale)
     )
 
-    archive_total = ArchivedFile.query.count()
-    archive_active = ArchivedFile.query.filter_by(is_deleted=False).count()
-    archive_deleted = ArchivedFile.query.filter_by(is_deleted=True).count()
-
-    context = {
-        "counters": {
-            "total": total,
-            "approved": approved,
-            "rejected": rejected,
-            "drafts": drafts,
-            "in_progress": in_progress,
-            "delegated": delegated
-        },
-        "archive_counters": {
-            "total": archive_total,
-            "active": archive_active,
-            "deleted": archive_deleted
-        },
-        "aging_requests": aging_requests,
-        "sla_days": SLA_DAYS,
-        "trash_retention_days": get_trash_retention_days(),
-        "now": now
-    }
-
-    DASHBOARD_CACHE["data"] = context
-    DASHBOARD_CACHE["last_update"] = now
-
-    return render_template("admin/dashboard.html", **context)
+
+@admin_bp.route("/dashboard/refresh", methods=["POST"])
+@login_required
+@role_perm_required("VIEW_DASHBOARD")
+def dashboard_refresh():
+    dashboard_snapshot.refresh(current_app._get_current_object())
+    flash("تم تحديث بيانات لوحة التحكم", "success")
+    return redirect(url_for("admin.dashboard"))
 
 
 @admin_bp.route("/dashboard/export.xlsx")
 @login_required
 @role_perm_required("VIEW_DASHBOARD")
 def dashboard_export_excel():
-    """Export dashboard counters + overdue list to Excel."""
-    now = datetime.utcnow()
-    SLA_DAYS = get_sla_days()
-    sla_threshold = now - timedelta(days=SLA_DAYS)
-
-    stats = db.session.query(
-        func.count(WorkflowRequest.id),
-        func.sum(case((WorkflowRequest.status == "APPROVED", 1), else_=0)),
-        func.sum(case((WorkflowRequest.status == "REJECTED", 1), else_=0)),
-        func.sum(case((WorkflowRequest.status == "DRAFT", 1), else_=0)),
-        func.sum(
-            case(
-                (WorkflowRequest.status.notin_(FINAL_STATUSES + ["DRAFT"]), 1),
-                else_=0
-            )
-        )
-    ).one()
-
-    total, approved, rejected, drafts, in_progress = stats
-    archive_total = ArchivedFile.query.count()
-    archive_active = ArchivedFile.query.filter_by(is_deleted=False).count()
-    archive_deleted = ArchivedFile.query.filter_by(is_deleted=True).count()
-
-    overdue = (
-        WorkflowRequest.query
-        .filter(
-            WorkflowRequest.status.notin_(FINAL_STATUSES),
-            WorkflowRequest.created_at <= sla_threshold
-        )
-        .order_by(WorkflowRequest.created_at.asc())
-        .all()
-    )
+    """Export dashboard counters + overdue list (from the shared snapshot) to Excel."""
+    snap, _ = dashboard_snapshot.get_snapshot(current_app._get_current_object())
+    now = snap.computed_at
+    counters = snap.counters
+    archive_counters = snap.archive_counters
 
     headers = [
         "Request ID", "Title", "Status", "Created At", "Days Open",
-        "Escalated", "Current Role"
-        "PORTAL_VIEW",
-        "HR_ATTENDANCE_IMPORT",
-        "CORR_VIEW",
-        "CORR_IN_CREATE",
-        "CORR_OUT_CREATE",
-        "CORR_MANAGE",
+        "Escalated", "Current Role",
     ]
 
     rows = []
-    for r in overdue:
+    for r in snap.overdue:
         rows.append([
             r.id,
             r.title,
@@ -282,17 +170,18 @@ def dashboard_export_excel():
     # Prepend summary rows (as plain rows)
     summary_headers = ["Metric", "Value"]
     summary_rows = [
-        ("Total Requests", total),
-        ("Approved", approved),
-        ("Rejected", rejected),
-        ("Drafts", drafts),
-        ("In Progress", in_progress),
-        ("SLA Days", SLA_DAYS),
-        ("Archive Total", archive_total),
-        ("Archive Active", archive_active),
-        ("Archive Deleted", archive_deleted),
-        ("Trash Retention Days", get_trash_retention_days()),
-        ("Exported At", now.strftime("%Y-%m-%d %H:%M")),
+        ("Total Requests", counters["total"]),
+        ("Approved", counters["approved"]),
+        ("Rejected", counters["rejected"]),
+        ("Drafts", counters["drafts"]),
+        ("In Progress", counters["in_progress"]),
+        ("SLA Days", snap.sla_days),
+        ("Archive Total", archive_counters["total"]),
+        ("Archive Active", archive_counters["active"]),
+        ("Archive Deleted", archive_counters["deleted"]),
+        ("Trash Retention Days", snap.trash_retention_days),
+        ("Data As Of", now.strftime("%Y-%m-%d %H:%M")),
+        ("Exported At", datetime.utcnow().strftime("%Y-%m-%d %H:%M")),
     ]
 
     # Build workbook with two sheets
@@ -510,6 +399,7 @@ def escalations():
     # 2) Full escalation log (manual + system) stored in RequestEscalation
     manual_escalations = (
         RequestEscalation.query
+        .options(*loader_profiles.options(RequestEscalation, "list"))
         .order_by(RequestEscalation.created_at.desc(), RequestEscalation.id.desc())
         .limit(500)
         .all()
@@ -544,6 +434,7 @@ def escalations_export_excel():
     limit = request.args.get("limit", type=int) or 10000
     escalation_log = (
         RequestEscalation.query
+        .options(*loader_profiles.options(RequestEscalation, "export"))
         .order_by(RequestEscalation.created_at.desc(), RequestEscalation.id.desc())
         .limit(limit)
         .all()
@@ -622,6 +513,7 @@ def workflow_routing_list():
 
     query = (
         WorkflowRoutingRule.query
+        .options(*loader_profiles.options(WorkflowRoutingRule, "list"))
         .outerjoin(RequestType, WorkflowRoutingRule.request_type_id == RequestType.id)
         .outerjoin(WorkflowTemplate, WorkflowRoutingRule.template_id == WorkflowTemplate.id)
         .outerjoin(Organization, WorkflowRoutingRule.organization_id == Organization.id)
@@ -663,6 +555,31 @@ def workflow_routing_list():
     return render_template("admin/workflow_routing/list.html", rules=rules, q=q)
 
 
+@admin_bp.route("/workflow-routing/explain")
+@login_required
+@perm_required("WORKFLOW_ROUTING_READ")
+def workflow_routing_explain():
+    """JSON: why a template is selected for (user, request type).
+
+    ?request_type_id=<id>&user_id=<id> (user defaults to the current user).
+    """
+    rt_id = request.args.get("request_type_id", type=int)
+    if not rt_id:
+        return jsonify({"ok": False, "error": "request_type_id is required"}), 400
+
+    user_id = request.args.get("user_id", type=int)
+    user = db.session.get(User, user_id) if user_id else current_user
+    if user is None:
+        return jsonify({"ok": False, "error": "user not found"}), 404
+
+    data = routing_index.explain(rt_id, routing_index.user_context(user))
+    data["user_id"] = user.id
+    if data["selected"]:
+        tpl = db.session.get(WorkflowTemplate, data["selected"]["template_id"])
+        data["selected"]["template_name"] = tpl.name if tpl else None
+    return jsonify({"ok": True, **data})
+
+
 @admin_bp.route("/workflow-routing/org-node-tree")
 @login_required
 @perm_required("WORKFLOW_ROUTING_READ")
@@ -688,6 +605,7 @@ def workflow_routing_export_excel():
 
     query = (
         WorkflowRoutingRule.query
+        .options(*loader_profiles.options(WorkflowRoutingRule, "export"))
         .outerjoin(RequestType, WorkflowRoutingRule.request_type_id == RequestType.id)
         .outerjoin(WorkflowTemplate, WorkflowRoutingRule.template_id == WorkflowTemplate.id)
         .outerjoin(Organization, WorkflowRoutingRule.organization_id == Organization.id)
@@ -1134,98 +1052,6 @@ def _get_backups_dir() -> str:
     return d
 
 
-def _create_sqlite_snapshot(src_db_path: str, snapshot_path: str) -> None:
-    """Create a consistent snapshot of a SQLite DB using the sqlite3 backup API."""
-    os.makedirs(os.path.dirname(snapshot_path), exist_ok=True)
-
-    if not os.path.exists(src_db_path):
-        # If DB doesn't exist yet, create an empty snapshot.
-        sqlite3.connect(snapshot_path).close()
-        return
-
-    src = sqlite3.connect(src_db_path)
-    try:
-        try:
-            # Integrate WAL if enabled
-            src.execute("PRAGMA wal_checkpoint(FULL);")
-        except Exception:
-            pass
-
-        dst = sqlite3.connect(snapshot_path)
-        try:
-            src.backup(dst)
-            dst.commit()
-        finally:
-            dst.close()
-    finally:
-        src.close()
-
-
-def _build_backup_zip() -> str:
-    """Build a ZIP backup containing DB + storage/archive + portal uploads."""
-    ts = datetime.utcnow().strftime("%Y%m%d_%H%M%S")
-    backups_dir = _get_backups_dir()
-
-    zip_path = os.path.join(backups_dir, f"workflow_backup_{ts}.zip")
-    tmp_db_path = os.path.join(backups_dir, f"workflow_snapshot_{ts}.db")
-
-    # DB snapshot
-    _create_sqlite_snapshot(_get_db_path(), tmp_db_path)
-
-    meta = {
-        "created_at_utc": datetime.utcnow().isoformat() + "Z",
-        "project": "Workflow-PNCECS",
-        "includes": [
-            "db/workflow.db",
-            "storage/archive/*",
-            "instance/uploads/*",
-            "static/uploads/*",
-        ],
-    }
-
-    with zipfile.ZipFile(zip_path, "w", compression=zipfile.ZIP_DEFLATED) as z:
-        z.writestr("backup_meta.json", json.dumps(meta, ensure_ascii=False, indent=2))
-        z.write(tmp_db_path, "db/workflow.db")
-
-        # Archive storage
-        archive_dir = _get_archive_storage_dir()
-        if os.path.isdir(archive_dir):
-            for root, _dirs, files in os.walk(archive_dir):
-                for fn in files:
-                    full = os.path.join(root, fn)
-                    rel = os.path.relpath(full, _get_project_root())
-                    z.write(full, rel)
-
-        # Portal uploads (instance/uploads/*)
-        uploads_dir = _get_portal_uploads_dir()
-        if os.path.isdir(uploads_dir):
-            for root, _dirs, files in os.walk(uploads_dir):
-                for fn in files:
-                    full = os.path.join(root, fn)
-                    rel_inside = os.path.relpath(full, uploads_dir)
-                    arcname = os.path.join("instance", "uploads", rel_inside)
-                    z.write(full, arcname)
-
-
-
-        # Static uploads (static/uploads/*) - e.g., user avatars/photos
-        static_uploads_dir = _get_static_uploads_dir()
-        if os.path.isdir(static_uploads_dir):
-            for root, _dirs, files in os.walk(static_uploads_dir):
-                for fn in files:
-                    full = os.path.join(root, fn)
-                    rel_inside = os.path.relpath(full, static_uploads_dir)
-                    arcname = os.path.join("static", "uploads", rel_inside)
-                    z.write(full, arcname)
-    # cleanup temp snapshot
-    try:
-        os.remove(tmp_db_path)
-    except Exception:
-        pass
-
-    return zip_path
-
-
 def _restore_sqlite_from_snapshot(snapshot_db: str, dest_db: str) -> None:
     """Restore SQLite DB content from snapshot into the destination DB file."""
     os.makedirs(os.path.dirname(dest_db), exist_ok=True)
@@ -1273,7 +1099,7 @@ def _copy_tree(src_dir: str, dst_dir: str) -> None:
 @login_required
 @roles_required("ADMIN", "SUPER_ADMIN")
 def backup_page():
-    # show last few backups if exist
+    # show last few (legacy) ZIP backups if exist
     backups_dir = _get_backups_dir()
     backups = []
     try:
@@ -1285,21 +1111,108 @@ def backup_page():
     except Exception:
         backups = []
 
-    return render_template("admin/backup.html", backups=backups)
+    try:
+        runs = backup_engine.list_runs(current_app)
+    except Exception:
+        runs = []
+
+    return render_template(
+        "admin/backup.html",
+        backups=backups,
+        runs=runs,
+        job=backup_engine.job_status(),
+        retention_runs=settings_service.get_int("BACKUP_RETENTION_RUNS", backup_engine.DEFAULT_RETENTION_RUNS),
+    )
 
 
-@admin_bp.route("/backup/download", methods=["GET"])
+@admin_bp.route("/backup/run", methods=["POST"])
 @login_required
 @roles_required("ADMIN", "SUPER_ADMIN")
-def backup_download():
-    zip_path = _build_backup_zip()
-    filename = os.path.basename(zip_path)
-    return send_file(
-        zip_path,
-        as_attachment=True,
-        download_name=filename,
-        mimetype="application/zip"
+def backup_run():
+    """Start an incremental backup run in the background."""
+    app = current_app._get_current_object()
+    db_path = _get_db_path()
+    started = backup_engine.start_job(
+        app, "BACKUP",
+        lambda progress: backup_engine.run_backup(app, db_path, progress=progress),
     )
+    if started:
+        flash("بدأ إنشاء نسخة احتياطية تزايدية في الخلفية.", "info")
+    else:
+        flash("توجد عملية نسخ/استيراد قيد التنفيذ حالياً.", "warning")
+    return redirect(url_for("admin.backup_page"))
+
+
+@admin_bp.route("/backup/status", methods=["GET"])
+@login_required
+@roles_required("ADMIN", "SUPER_ADMIN")
+def backup_status():
+    return jsonify({"ok": True, "job": backup_engine.job_status()})
+
+
+@admin_bp.route("/backup/retention", methods=["POST"])
+@login_required
+@roles_required("ADMIN", "SUPER_ADMIN")
+def backup_retention():
+    keep = request.form.get("retention_runs", type=int)
+    if keep is None or keep < 1:
+        flash("قيمة الاحتفاظ غير صحيحة.", "danger")
+        return redirect(url_for("admin.backup_page"))
+
+    settings_service.set_value("BACKUP_RETENTION_RUNS", str(keep))
+    db.session.commit()
+    try:
+        res = backup_engine.prune(current_app, keep=keep)
+        flash(f"تم حفظ سياسة الاحتفاظ ({keep} نسخ). حُذفت {res['removed_runs']} نسخة قديمة.", "success")
+    except Exception:
+        flash("تم حفظ سياسة الاحتفاظ، لكن تعذر تنظيف النسخ القديمة.", "warning")
+    return redirect(url_for("admin.backup_page"))
+
+
+@admin_bp.route("/backup/runs/<run_id>/download", methods=["GET"])
+@login_required
+@roles_required("ADMIN", "SUPER_ADMIN")
+def backup_run_download(run_id):
+    """Stream a run as ZIP (stored, no recompression) in the legacy layout."""
+    app = current_app._get_current_object()
+    try:
+        m = backup_engine.load_manifest(backup_engine.repo_dir(app), run_id)
+    except Exception:
+        m = None
+    if not m or m.get("status") != "COMPLETE":
+        flash("النسخة الاحتياطية غير موجودة أو غير مكتملة.", "danger")
+        return redirect(url_for("admin.backup_page"))
+
+    filename = f"workflow_backup_{m['run_id']}.zip"
+    return Response(
+        stream_with_context(backup_engine.iter_run_zip(app, m["run_id"])),
+        mimetype="application/zip",
+        headers={"Content-Disposition": f"attachment; filename={filename}"},
+    )
+
+
+@admin_bp.route("/backup/runs/<run_id>/restore", methods=["POST"])
+@login_required
+@roles_required("ADMIN", "SUPER_ADMIN")
+def backup_run_restore(run_id):
+    """Point-in-time restore of a run (DB + files) in the background."""
+    if request.form.get("confirm_restore") != "1":
+        flash("يجب تأكيد الاستيراد قبل المتابعة.", "danger")
+        return redirect(url_for("admin.backup_page"))
+
+    app = current_app._get_current_object()
+    db_path = _get_db_path()
+    started = backup_engine.start_job(
+        app, "RESTORE",
+        lambda progress: backup_engine.restore_run(
+            app, run_id, _restore_sqlite_from_snapshot, db_path, progress=progress
+        ),
+    )
+    if started:
+        flash("بدأت استعادة النسخة الاحتياطية في الخلفية. يُفضّل إعادة تشغيل التطبيق وتسجيل الدخول من جديد بعد الانتهاء.", "warning")
+    else:
+        flash("توجد عملية نسخ/استيراد قيد التنفيذ حالياً.", "warning")
+    return redirect(url_for("admin.backup_page"))
 
 
 @admin_bp.route("/backup/download/<path:fname>", methods=["GET"])
@@ -1453,4 +1366,80 @@ def backup_restore():
     flash("✅ تم استيراد النسخة الاحتياطية بنجاح. يرجى تسجيل الدخول من جديد.", "success")
     flash("ملاحظة: يُفضّل إعادة تشغيل التطبيق بعد الاستيراد لضمان تحديث الاتصالات.", "warning")
 
-    return redirect(url_for("login"))
\ No newline at end of file
+    return redirect(url_for("login"))
+
+# =========================
+# Request profiler
+# =========================
+PROFILER_SORTS = ("total_ms", "avg_ms", "p95_ms", "avg_queries", "max_queries", "avg_sql_ms", "avg_template_ms", "avg_bytes", "violations")
+
+
+@admin_bp.route("/profiler", methods=["GET"])
+@login_required
+@roles_required("ADMIN", "SUPER_ADMIN")
+def profiler_page():
+    sort = request.args.get("sort") or "total_ms"
+    if sort not in PROFILER_SORTS:
+        sort = "total_ms"
+    return render_template(
+        "admin/profiler.html",
+        rows=request_profiler.snapshot(sort=sort),
+        sort=sort,
+        sorts=PROFILER_SORTS,
+        started_at=request_profiler.started_at(),
+        sample_rate=request_profiler.sample_rate(),
+        budgets_raw=settings_service.get_str("PROFILER_BUDGETS") or "",
+    )
+
+
+@admin_bp.route("/profiler.json", methods=["GET"])
+@login_required
+@roles_required("ADMIN", "SUPER_ADMIN")
+def profiler_json():
+    return jsonify({
+        "ok": True,
+        "pid": os.getpid(),
+        "since": request_profiler.started_at().isoformat(timespec="seconds"),
+        "sample_rate": request_profiler.sample_rate(),
+        "budgets": request_profiler.budgets(),
+        "endpoints": request_profiler.snapshot(sort=request.args.get("sort") or "total_ms"),
+    })
+
+
+@admin_bp.route("/profiler/settings", methods=["POST"])
+@login_required
+@roles_required("ADMIN", "SUPER_ADMIN")
+def profiler_settings():
+    try:
+        rate = float(request.form.get("sample_rate") or 0)
+    except ValueError:
+        rate = -1
+    if not 0 <= rate <= 1:
+        flash("نسبة العيّنة يجب أن تكون بين 0 و 1.", "danger")
+        return redirect(url_for("admin.profiler_page"))
+
+    raw = (request.form.get("budgets") or "").strip()
+    if raw:
+        try:
+            parsed = json.loads(raw)
+        except ValueError:
+            parsed = None
+        if not isinstance(parsed, dict):
+            flash("صيغة الحدود غير صحيحة (JSON مطلوب).", "danger")
+            return redirect(url_for("admin.profiler_page"))
+
+    settings_service.set_value("PROFILER_SAMPLE_RATE", str(rate))
+    settings_service.set_value("PROFILER_BUDGETS", raw)
+    db.session.commit()
+    request_profiler.reload_settings()
+    flash("تم حفظ إعدادات قياس الأداء.", "success")
+    return redirect(url_for("admin.profiler_page"))
+
+
+@admin_bp.route("/profiler/reset", methods=["POST"])
+@login_required
+@roles_required("ADMIN", "SUPER_ADMIN")
+def profiler_reset():
+    request_profiler.reset()
+    flash("تم تصفير إحصاءات قياس الأداء.", "success")
+    return redirect(url_for("admin.profiler_page"))
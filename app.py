@@ -12,7 +12,7 @@ from flask_migrate import Migrate
 from flask_wtf.csrf import generate_csrf
 from sqlalchemy import func, event
 from sqlalchemy.engine import Engine
-from datetime import datetime, timedelta
+from datetime import datetime
 import io
 import os
 import time
@@ -57,9 +57,9 @@ from store import store_bp
 from filters.request_filters import apply_request_filters
 from utils.permissions import get_effective_user
 from filters.request_filters import get_sla_state
+from services import audit_fields, audit_rollup, audit_writer, fleet_analytics, payslip_import, report_jobs, request_profiler, sla_service, tracking_ingest
 from services.escalation_service import run_escalation_if_needed
 
-from filters.request_filters import get_sla_days, get_escalation_days
 from flask import g
 
 # ======================
@@ -403,6 +403,79 @@ def _ensure_runtime_schema():
                         db.session.commit()
                     except Exception:
                         db.session.rollback()
+
+            # SLA deadlines (services/sla_service.py) + (status, due) indexes
+            for table, col in [
+                ("workflow_request", "sla_due_at"),
+                ("workflow_request", "escalation_due_at"),
+            ]:
+                if not _col_exists(table, col):
+                    _add_column_retry(table, col, "DATETIME")
+            for name, table, cols in [
+                ("ix_workflow_request_status_sla_due", "workflow_request", "status, sla_due_at"),
+                ("ix_workflow_request_status_esc_due", "workflow_request", "status, escalation_due_at"),
+                ("ix_wis_status_due", "workflow_instance_steps", "status, due_at"),
+            ]:
+                try:
+                    db.session.execute(text(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({cols})"))
+                    db.session.commit()
+                except Exception:
+                    db.session.rollback()
+
+            # audit_log: normalized ref_request_id / step_order + timeline (created_at, id) indexes
+            for col in ("ref_request_id", "step_order"):
+                if not _col_exists("audit_log", col):
+                    _add_column_retry("audit_log", col, "INTEGER")
+            for name, cols in [
+                ("ix_audit_log_created_id", "created_at, id"),
+                ("ix_audit_log_user_created_id", "user_id, created_at, id"),
+                ("ix_audit_log_action_created_id", "action, created_at, id"),
+                ("ix_audit_log_ref_request_created_id", "ref_request_id, created_at, id"),
+                ("ix_audit_log_step_created_id", "step_order, created_at, id"),
+                ("ix_audit_log_target", "target_type, target_id"),
+            ]:
+                try:
+                    db.session.execute(text(f"CREATE INDEX IF NOT EXISTS {name} ON audit_log ({cols})"))
+                    db.session.commit()
+                except Exception:
+                    db.session.rollback()
+
+            # employee_file: (filter column, user_id) indexes for the HR report semi-joins
+            for name, cols in [
+                ("ix_employee_file_work_location_user", "work_location_lookup_id, user_id"),
+                ("ix_employee_file_appointment_type_user", "appointment_type_lookup_id, user_id"),
+                ("ix_employee_file_org_user", "organization_id, user_id"),
+                ("ix_employee_file_directorate_user", "directorate_id, user_id"),
+                ("ix_employee_file_department_user", "department_id, user_id"),
+                ("ix_employee_file_division_user", "division_id, user_id"),
+            ]:
+                try:
+                    db.session.execute(text(f"CREATE INDEX IF NOT EXISTS {name} ON employee_file ({cols})"))
+                    db.session.commit()
+                except Exception:
+                    db.session.rollback()
+
+            # file_permission: a user's active shares (archive counters) + per-file share maps
+            for name, cols in [
+                ("ix_file_permission_user_expires", "user_id, expires_at, file_id"),
+                ("ix_file_permission_file", "file_id"),
+            ]:
+                try:
+                    db.session.execute(text(f"CREATE INDEX IF NOT EXISTS {name} ON file_permission ({cols})"))
+                    db.session.commit()
+                except Exception:
+                    db.session.rollback()
+
+            # transport_trip_point: unique (trip_id, seq) replaces the plain index (tracking ingestion dedup)
+            try:
+                db.session.execute(text(
+                    "CREATE UNIQUE INDEX IF NOT EXISTS ux_transport_trip_point_trip_seq ON transport_trip_point (trip_id, seq)"
+                ))
+                db.session.execute(text("DROP INDEX IF EXISTS ix_transport_trip_point_trip_seq"))
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+
             # employee_attachment: payslip period (month/year)
             for col, ctype in [
                 ("payslip_year", "INTEGER"),
@@ -595,6 +668,62 @@ def _ensure_runtime_schema():
                 except Exception:
                     pass
 
+            # SLA deadlines: stamp existing requests / recompute after settings changes
+            try:
+                sla_service.ensure_deadlines_current()
+            except Exception:
+                try:
+                    db.session.rollback()
+                except Exception:
+                    pass
+
+            # Audit log: stamp ref_request_id / step_order on rows older than the columns
+            try:
+                audit_fields.ensure_backfilled()
+            except Exception:
+                try:
+                    db.session.rollback()
+                except Exception:
+                    pass
+
+            # Audit log rollups: backfill / reconcile with audit_log
+            try:
+                audit_rollup.ensure_rollups_current()
+            except Exception:
+                try:
+                    db.session.rollback()
+                except Exception:
+                    pass
+
+            # Fleet analytics cube: backfill / reconcile with trips, fuel and maintenance
+            try:
+                fleet_analytics.ensure_cube_current()
+            except Exception:
+                try:
+                    db.session.rollback()
+                except Exception:
+                    pass
+
+            # Inventory snapshots: per-period flow totals. Rows written before the column
+            # existed are dropped; jobs/inv_balance_snapshots.py rebuilds them.
+            if not _col_exists("inv_balance_snapshot", "flows"):
+                if _add_column_retry("inv_balance_snapshot", "flows", "TEXT"):
+                    try:
+                        db.session.execute(text("DELETE FROM inv_balance_snapshot"))
+                        db.session.commit()
+                    except Exception:
+                        db.session.rollback()
+
+            # Inventory stock ledger: one-time backfill for existing vouchers
+            try:
+                from services.inventory_ledger import ensure_ledger_seeded
+                ensure_ledger_seeded()
+            except Exception:
+                try:
+                    db.session.rollback()
+                except Exception:
+                    pass
+
             # -------------------------
             # Seed "basic" permissions (RolePermission)
             # -------------------------
@@ -642,6 +771,17 @@ def _ensure_runtime_schema():
 # by setting SKIP_RUNTIME_SCHEMA=1.
 if not os.getenv("SKIP_RUNTIME_SCHEMA"):
     _ensure_runtime_schema()
+    # Audit entries are written after commit by a batching thread (services/audit_writer.py)
+    audit_writer.init_app(app)
+    # Report exports run on a worker pool with cached results (services/report_jobs.py)
+    report_jobs.init_app(app)
+    # Bulk payslip uploads (ZIP / combined PDF) are split and saved by a worker (services/payslip_import.py)
+    payslip_import.init_app(app)
+    # GPS points (device push / provider poller) are buffered and bulk-inserted (services/tracking_ingest.py)
+    tracking_ingest.init_app(app)
+
+# Sampled per-endpoint query / latency profiler (/admin/profiler)
+request_profiler.init_app(app)
 login_manager.init_app(app)
 login_manager.login_view = "login"
 migrate = Migrate(app, db)
@@ -1027,35 +1167,9 @@ def inbox():
         ).count(),
     }
 
-    sla_days = get_sla_days()
-    esc_days = get_escalation_days()
-
+    # SLA counters: one aggregate over the stored deadlines
     now = datetime.utcnow()
-    sla_deadline = now - timedelta(days=sla_days)
-    esc_deadline = now - timedelta(days=sla_days + esc_days)
-
-    sla_counters = {
-        "on_track": filtered_query.filter(
-            WorkflowRequest.status.notin_(["APPROVED", "REJECTED"]),
-            WorkflowRequest.created_at >= sla_deadline
-        ).count(),
-
-        "breached": filtered_query.filter(
-            WorkflowRequest.status.notin_(["APPROVED", "REJECTED"]),
-            WorkflowRequest.created_at < sla_deadline,
-            WorkflowRequest.created_at >= esc_deadline
-        ).count(),
-
-        "escalated": filtered_query.filter(
-            WorkflowRequest.status.notin_(["APPROVED", "REJECTED"]),
-            WorkflowRequest.created_at < esc_deadline
-        ).count(),
-    }
-
-    now = datetime.utcnow()
-    esc_deadline = now - timedelta(
-        days=get_sla_days() + get_escalation_days()
-    )
+    sla_counters = sla_service.sla_counts(filtered_query, now=now)
 
 
     if (
@@ -1069,7 +1183,7 @@ def inbox():
         escalation_alerts_count = WorkflowRequest.query.filter(
             WorkflowRequest.current_role == effective_user.id,
             WorkflowRequest.status.notin_(["APPROVED", "REJECTED"]),
-            WorkflowRequest.created_at < esc_deadline
+            WorkflowRequest.escalation_due_at < now
         ).count()
 
         ESCALATION_BADGE_CACHE["value"] = escalation_alerts_count
@@ -1181,14 +1295,14 @@ def request_action(request_id):
 # Audit / PDF
 # ======================
 def log_action(request_obj, user, action, old_status, new_status, note=None):
-    db.session.add(AuditLog(
+    audit_writer.add(
         request_id=request_obj.id,
         user_id=user.id if user else None,
         action=action,
         old_status=old_status,
         new_status=new_status,
         note=note
-    ))
+    )
 
 
 @app.route("/request/<int:request_id>/audit")
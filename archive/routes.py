@@ -9,7 +9,7 @@ from flask import (
     url_for, flash, send_file, abort
 )
 from flask_login import login_required, current_user
-from sqlalchemy import or_, func
+from sqlalchemy import or_
 from sqlalchemy.orm import joinedload
 
 from extensions import db
@@ -23,6 +23,8 @@ from archive.permissions import (
 
 from archive.cache import get_cached_file, set_cached_file
 from archive.queries import archive_access_query
+from archive.services import get_archive_counters, get_share_maps, get_trash_retention_days
+from utils import loader_profiles
 from utils.events import emit_event
 
 from models import (
@@ -33,7 +35,6 @@ from models import (
     WorkflowRequest,
     RequestAttachment,
     WorkflowTemplate,
-    SystemSetting,
 )
 
 from workflow.engine import start_workflow_for_request
@@ -79,82 +80,6 @@ def allowed_file(filename):
     return "." in filename and filename.rsplit(".", 1)[1].lower() in ALLOWED_EXTENSIONS
 
 
-def get_archive_counters(user):
-    base = archive_access_query(user)
-
-    total = base.with_entities(func.count(ArchivedFile.id)).scalar()
-
-    mine = base.filter(
-        ArchivedFile.owner_id == user.id
-    ).with_entities(func.count(ArchivedFile.id)).scalar()
-
-    shared = (
-        db.session.query(func.count(FilePermission.file_id))
-        .filter(FilePermission.user_id == user.id)
-        .scalar()
-    )
-
-    return {
-        "total": total or 0,
-        "mine": mine or 0,
-        "shared": shared or 0
-    }
-
-
-def get_shared_count_map(files):
-    file_ids = [f.id for f in files]
-    if not file_ids:
-        return {}
-
-    rows = (
-        db.session.query(
-            FilePermission.file_id,
-            db.func.count(FilePermission.user_id)
-        )
-        .filter(FilePermission.file_id.in_(file_ids))
-        .group_by(FilePermission.file_id)
-        .all()
-    )
-
-    return {fid: count for fid, count in rows}
-
-def get_shared_by_map(files, current_user_id:int):
-    """For each file in list, if it is shared to current_user_id, return who shared it.
-    Returns dict: {file_id: sharer_email_or_label}
-    """
-    file_ids = [f.id for f in files]
-    if not file_ids:
-        return {}
-
-    # permissions for CURRENT USER only
-    rows = (
-        db.session.query(FilePermission.file_id, FilePermission.shared_by, User.email)
-        .join(User, User.id == FilePermission.shared_by, isouter=True)
-        .filter(
-            FilePermission.file_id.in_(file_ids),
-            FilePermission.user_id == int(current_user_id)
-        )
-        .all()
-    )
-
-    out = {}
-    for fid, shared_by, email in rows:
-        if shared_by:
-            out[int(fid)] = email or f"User#{shared_by}"
-        else:
-            out[int(fid)] = "غير معروف"
-    return out
-
-
-def get_trash_retention_days() -> int:
-    """Return recycle bin retention period in days (SystemSetting TRASH_RETENTION_DAYS)."""
-    setting = SystemSetting.query.filter_by(key="TRASH_RETENTION_DAYS").first()
-    try:
-        return int(setting.value) if setting and setting.value else 30
-    except Exception:
-        return 30
-
-
 
 # =========================
 # Sign PDF (flag only)
@@ -501,27 +426,18 @@ def my_files():
         .paginate(page=page, per_page=per_page, error_out=False)
     )
 
-    delegated_files = {
-        p.file_id
-        for p in FilePermission.query.filter(
-            FilePermission.user_id == current_user.id,
-            FilePermission.delegated_by.isnot(None)
-        )
-    }
-
     counters = get_archive_counters(current_user)
-    shared_count = get_shared_count_map(pagination.items)
-    shared_by_map = get_shared_by_map(pagination.items, current_user.id)
+    share_maps = get_share_maps(pagination.items, current_user.id)
 
     return render_template(
         "archive/my_files.html",
         files=pagination.items,
         pagination=pagination,
         q=q,
-        delegated_files=delegated_files,
+        delegated_files=share_maps["delegated"],
         counters=counters,
-        shared_count=shared_count,
-        shared_by_map=shared_by_map
+        shared_count=share_maps["shared_count"],
+        shared_by_map=share_maps["shared_by"]
     )
 
 
@@ -1230,6 +1146,7 @@ def shared_files():
 
     permissions = (
         FilePermission.query
+        .options(*loader_profiles.options(FilePermission, "list"))
         .join(ArchivedFile, ArchivedFile.id == FilePermission.file_id)
         .join(User, User.id == FilePermission.user_id)
         .order_by(FilePermission.id.desc())
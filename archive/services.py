@@ -1,12 +1,59 @@
 # archive/services.py
+"""Archive counters and per-page share aggregates.
 
-from datetime import datetime
+get_archive_counters(user) computes all five counters in ONE query
+(conditional sums over the non-deleted files, left-joined to the user's
+active shares) and caches the result per user:
+
+- the cache is keyed by user id plus what the rules depend on (department,
+  stored role, acting-as delegator), so a role or department change is a miss,
+  not a stale hit; User.has_role() (which queries Role) only runs on a miss;
+- any flush / bulk update / delete of ArchivedFile or FilePermission (upload,
+  delete, restore, purge, share, unshare) drops every entry
+  (utils.versioned_cache), again if that transaction rolls back, and after
+  commit touches instance/archive_counters.version so other worker processes
+  drop their entries too;
+- an entry also expires at the user's next share expiry, so expired shares
+  leave the counters without any write.
+
+get_share_maps(files, user_id) returns the share count / shared-by /
+delegated markers for a page of files in one grouped query.
+"""
+
+from datetime import datetime, timedelta
+
+from flask import g, has_request_context
+from sqlalchemy import and_, case, func, literal, or_, select
 
-from sqlalchemy import func, distinct
 from extensions import db
-from models import ArchivedFile, FilePermission
+from models import ArchivedFile, FilePermission, User
+from services import settings_service
 from archive.permissions import VIS_PUBLIC, VIS_DEPARTMENT
-from archive.queries import archive_access_query
+from utils.versioned_cache import VersionedCache
+
+STAMP_FILENAME = "archive_counters.version"
+STAMP_CHECK_SECONDS = 1.0
+CACHE_TTL = timedelta(minutes=10)
+CACHE_MAX_USERS = 5000
+
+_cache = {}  # user_id -> (key, stamp, valid_until, counters)
+_counters = VersionedCache(
+    "archive",
+    (ArchivedFile, FilePermission),
+    stamp_filename=STAMP_FILENAME,
+    stamp_check_seconds=STAMP_CHECK_SECONDS,
+    match_unmapped=False,
+    on_invalidate=_cache.clear,
+)
+
+
+def get_trash_retention_days() -> int:
+    """How many days deleted archive files remain in recycle bin before purge."""
+    value = settings_service.get("TRASH_RETENTION_DAYS")
+    try:
+        return int(value) if value is not None else 30
+    except Exception:
+        return 30
 
 
 def _active_permission_filter():
@@ -17,9 +64,98 @@ def _active_permission_filter():
     )
 
 
+# =========================
+# Invalidation
+# =========================
+def invalidate_counters():
+    """Drop every cached counter in this process."""
+    _counters.invalidate()
+
+
+# =========================
+# Counters
+# =========================
+def _compute_counters(user, is_admin: bool, is_head: bool):
+    """(counters, next share expiry or None) in one query."""
+    now = datetime.utcnow()
+    shared = (
+        select(FilePermission.file_id)
+        .where(
+            FilePermission.user_id == user.id,
+            or_(FilePermission.expires_at.is_(None), FilePermission.expires_at > now),
+        )
+        .group_by(FilePermission.file_id)
+        .subquery()
+    )
+    is_shared = shared.c.file_id.isnot(None)
+    mine = ArchivedFile.owner_id == user.id
+    public = ArchivedFile.visibility == VIS_PUBLIC
+
+    visible = [mine, public, is_shared]
+    department = None
+    if user.department_id:
+        same_dept = ArchivedFile.department_id == user.department_id
+        dept_visible = and_(ArchivedFile.visibility == VIS_DEPARTMENT, same_dept)
+        # dept head sees all dept files; others only department visibility
+        department = same_dept if is_head else dept_visible
+        visible.append(department)
+    accessible = None if is_admin else or_(*visible)
+
+    def count_if(cond):
+        if cond is None:
+            return func.count(ArchivedFile.id)
+        return func.coalesce(func.sum(case((cond, 1), else_=0)), 0)
+
+    next_expiry = (
+        select(func.min(FilePermission.expires_at))
+        .where(FilePermission.user_id == user.id, FilePermission.expires_at > now)
+        .scalar_subquery()
+    )
+    row = db.session.execute(
+        select(
+            count_if(accessible),
+            count_if(mine),
+            count_if(is_shared),
+            count_if(department) if department is not None else literal(0),
+            count_if(public),
+            next_expiry,
+        )
+        .select_from(ArchivedFile)
+        .outerjoin(shared, shared.c.file_id == ArchivedFile.id)
+        .where(
+            ArchivedFile.is_deleted.is_(False),
+            or_(ArchivedFile.is_final_deleted.is_(False), ArchivedFile.is_final_deleted.is_(None)),
+        )
+    ).one()
+
+    total, n_mine, n_shared, n_department, n_public, expiry = row
+    counters = {
+        "total": int(total or 0),
+        "mine": int(n_mine or 0),
+        "shared": int(n_shared or 0),
+        "department": int(n_department or 0),
+        "public": int(n_public or 0),
+    }
+    if isinstance(expiry, str):  # SQLite returns MIN() over DATETIME as text
+        try:
+            expiry = datetime.fromisoformat(expiry)
+        except ValueError:
+            expiry = None
+    return counters, expiry
+
+
+def _role_key(user):
+    """What has_role("ADMIN") / has_role("DEPT_HEAD") depend on, without querying."""
+    eff = getattr(g, "effective_user", None) if has_request_context() else None
+    eff_key = None
+    if eff is not None and getattr(eff, "id", None) not in (None, user.id):
+        eff_key = (eff.id, eff.role)
+    return (user.department_id, user.role, eff_key)
+
+
 def get_archive_counters(user):
     """
-    Returns counters used in archive UI.
+    Returns counters used in archive UI (cached per user, see module docstring).
     Keys (safe defaults):
       - total: total files user can access (permissions-aware)
       - mine: files uploaded/owned by user
@@ -27,74 +163,71 @@ def get_archive_counters(user):
       - department: files in user's department (depends on role/visibility rules)
       - public: public visible files (non-deleted)
     """
-
-    # total accessible (permissions-aware)
-    total = archive_access_query(user).count()
-
-    # mine
-    mine = (
-        ArchivedFile.query
-        .filter(
-            ArchivedFile.is_deleted.is_(False),
-            ArchivedFile.owner_id == user.id
-        )
-        .count()
-    )
-
-    # shared (distinct file_id) - exclude deleted by joining ArchivedFile
-    shared = (
-        db.session.query(func.count(distinct(FilePermission.file_id)))
-        .join(ArchivedFile, ArchivedFile.id == FilePermission.file_id)
-        .filter(
-            ArchivedFile.is_deleted.is_(False),
-            FilePermission.user_id == user.id,
-            _active_permission_filter(),
-        )
-        .scalar()
-    ) or 0
-
-    # public
-    public = (
-        ArchivedFile.query
-        .filter(
-            ArchivedFile.is_deleted.is_(False),
-            ArchivedFile.visibility == VIS_PUBLIC
+    key = _role_key(user)
+    stamp = _counters.stamp()
+    now = datetime.utcnow()
+
+    entry = _cache.get(user.id)
+    if entry is not None and entry[0] == key and entry[1] == stamp and now < entry[2]:
+        return dict(entry[3])
+
+    is_admin = bool(user.has_role("ADMIN"))
+    is_head = bool(user.has_role("DEPT_HEAD"))
+    counters, expiry = _compute_counters(user, is_admin, is_head)
+    valid_until = now + CACHE_TTL
+    if expiry is not None and expiry < valid_until:
+        valid_until = expiry
+    with _counters.lock:
+        # only cache what was computed against the current generation
+        if stamp == _counters.stamp():
+            if len(_cache) >= CACHE_MAX_USERS:
+                _cache.clear()
+            _cache[user.id] = (key, stamp, valid_until, counters)
+    return dict(counters)
+
+
+# =========================
+# Per-page share aggregates
+# =========================
+def get_share_maps(files, user_id: int):
+    """One grouped query for a page of files.
+
+    Returns {
+      "shared_count": {file_id: active non-delegated share count},
+      "shared_by": {file_id: who shared it with user_id (email / label)},
+      "delegated": {file_id, ...} delegated to user_id,
+    }
+    """
+    out = {"shared_count": {}, "shared_by": {}, "delegated": set()}
+    ids = [f.id for f in files or []]
+    if not ids:
+        return out
+
+    user_id = int(user_id)
+    to_me = FilePermission.user_id == user_id
+    rows = db.session.execute(
+        select(
+            FilePermission.file_id,
+            func.sum(case((and_(FilePermission.delegated_by.is_(None), _active_permission_filter()), 1), else_=0)),
+            func.max(case((to_me, 1), else_=0)),
+            func.max(case((to_me, FilePermission.shared_by))),
+            func.max(case((to_me, User.email))),
+            func.max(case((and_(to_me, FilePermission.delegated_by.isnot(None)), 1), else_=0)),
         )
-        .count()
-    )
+        .outerjoin(User, User.id == FilePermission.shared_by)
+        .where(FilePermission.file_id.in_(ids))
+        .group_by(FilePermission.file_id)
+    ).all()
 
-    # department
-    department = 0
-    if user.department_id:
-        if user.has_role("DEPT_HEAD"):
-            # dept head sees all dept files (non-deleted)
-            department = (
-                ArchivedFile.query
-                .filter(
-                    ArchivedFile.is_deleted.is_(False),
-                    ArchivedFile.department_id == user.department_id
-                )
-                .count()
-            )
-        else:
-            # normal users: only department visibility + same department
-            department = (
-                ArchivedFile.query
-                .filter(
-                    ArchivedFile.is_deleted.is_(False),
-                    ArchivedFile.visibility == VIS_DEPARTMENT,
-                    ArchivedFile.department_id == user.department_id
-                )
-                .count()
-            )
-
-    return {
-        "total": total,
-        "mine": mine,
-        "shared": shared,
-        "department": department,
-        "public": public,
-    }
+    for fid, active, mine, shared_by, email, delegated in rows:
+        fid = int(fid)
+        if active:
+            out["shared_count"][fid] = int(active)
+        if mine:
+            out["shared_by"][fid] = (email or f"User#{shared_by}") if shared_by else "غير معروف"
+        if delegated:
+            out["delegated"].add(fid)
+    return out
 
 
 def get_shared_count_map(files):
@@ -102,20 +235,4 @@ def get_shared_count_map(files):
     Returns dict: {file_id: active_share_count}
     Counts only non-delegated shares (delegated are handled separately in your route).
     """
-    if not files:
-        return {}
-
-    ids = [f.id for f in files]
-
-    rows = (
-        db.session.query(FilePermission.file_id, func.count(FilePermission.id))
-        .filter(
-            FilePermission.file_id.in_(ids),
-            FilePermission.delegated_by.is_(None),     # exclude delegated grants
-            _active_permission_filter(),
-        )
-        .group_by(FilePermission.file_id)
-        .all()
-    )
-
-    return {file_id: cnt for file_id, cnt in rows}
+    return get_share_maps(files, 0)["shared_count"]
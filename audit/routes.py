@@ -1,17 +1,18 @@
 import json
-import re
-from flask import render_template, request, send_file
+from flask import current_app, flash, redirect, render_template, request, send_file, url_for
 from flask_login import login_required, current_user
 from datetime import datetime, timedelta
-from sqlalchemy import or_, func, and_
+from sqlalchemy import or_, func, select
 from sqlalchemy.orm import aliased, joinedload
 
 from io import BytesIO
 from utils.excel import make_xlsx_bytes, make_xlsx_bytes_multi
+from utils import loader_profiles
 
 from . import audit_bp
 from models import (
     AuditLog,
+    AuditLogPartition,
     User,
     WorkflowRequest,
     RequestType,
@@ -22,12 +23,17 @@ from models import (
 )
 from extensions import db
 from permissions import roles_required
+from services import audit_fields, audit_partitions, audit_rollup, audit_writer, settings_service
+
+
+def _hide_messages() -> bool:
+    """MESSAGE_* audit entries are visible to SUPER_ADMIN only."""
+    return (getattr(current_user, "role", "") or "").strip().upper() != "SUPER_ADMIN"
 
 
 def _apply_message_visibility_filter(query):
     """Hide MESSAGE_* audit entries for non-SUPER_ADMIN."""
-    role = (getattr(current_user, "role", "") or "").strip().upper()
-    if role != "SUPER_ADMIN":
+    if _hide_messages():
         query = query.filter(~AuditLog.action.like("MESSAGE_%"))
     return query
 
@@ -123,48 +129,23 @@ def list_audit_logs():
 @login_required
 @roles_required("ADMIN")
 def audit_dashboard():
-    q = _apply_message_visibility_filter(AuditLog.query)
-
-    total_logs = q.count()
-
-    top_users = (
-        db.session.query(
-            User.email,
-            func.count(AuditLog.id)
-        )
-        .join(AuditLog, AuditLog.user_id == User.id)
-    )
-
-    # Hide message logs for non-super admin
-    if (getattr(current_user, "role", "") or "").strip().upper() != "SUPER_ADMIN":
-        top_users = top_users.filter(~AuditLog.action.like("MESSAGE_%"))
-
-    top_users = (
-        top_users
-        .group_by(User.email)
-        .order_by(func.count(AuditLog.id).desc())
-        .limit(5)
-        .all()
-    )
-
-    top_actions_q = db.session.query(
-        AuditLog.action,
-        func.count(AuditLog.id)
-    )
-    if (getattr(current_user, "role", "") or "").strip().upper() != "SUPER_ADMIN":
-        top_actions_q = top_actions_q.filter(~AuditLog.action.like("MESSAGE_%"))
-
-    top_actions = (
-        top_actions_q
-        .group_by(AuditLog.action)
-        .order_by(func.count(AuditLog.id).desc())
-        .limit(5)
-        .all()
+    # Aggregates come from the hourly/daily rollups (services/audit_rollup).
+    hide = _hide_messages()
+    now = datetime.utcnow()
+
+    total_logs = audit_rollup.total(hide_messages=hide)
+    last_24h = audit_rollup.total(
+        granularity="HOUR",
+        since=audit_rollup.bucket_start(now - timedelta(hours=23), "HOUR"),
+        hide_messages=hide,
     )
+    top_users = audit_rollup.top_users(5, hide_messages=hide)
+    top_actions = audit_rollup.top_actions(5, hide_messages=hide)
 
     return render_template(
         "audit/dashboard.html",
         total_logs=total_logs,
+        last_24h=last_24h,
         top_users=top_users,
         top_actions=top_actions
     )
@@ -175,36 +156,11 @@ def audit_dashboard():
 @roles_required("ADMIN")
 def audit_dashboard_export_excel():
     """Export Audit Dashboard aggregates to Excel."""
-    q = _apply_message_visibility_filter(AuditLog.query)
+    hide = _hide_messages()
 
-    total_logs = q.count()
-
-    top_users_q = (
-        db.session.query(User.email, func.count(AuditLog.id))
-        .join(AuditLog, AuditLog.user_id == User.id)
-    )
-    if (getattr(current_user, "role", "") or "").strip().upper() != "SUPER_ADMIN":
-        top_users_q = top_users_q.filter(~AuditLog.action.like("MESSAGE_%"))
-
-    top_users_raw = (
-        top_users_q
-        .group_by(User.email)
-        .order_by(func.count(AuditLog.id).desc())
-        .limit(50)
-        .all()
-    )
-
-    top_actions_q = db.session.query(AuditLog.action, func.count(AuditLog.id))
-    if (getattr(current_user, "role", "") or "").strip().upper() != "SUPER_ADMIN":
-        top_actions_q = top_actions_q.filter(~AuditLog.action.like("MESSAGE_%"))
-
-    top_actions_raw = (
-        top_actions_q
-        .group_by(AuditLog.action)
-        .order_by(func.count(AuditLog.id).desc())
-        .limit(50)
-        .all()
-    )
+    total_logs = audit_rollup.total(hide_messages=hide)
+    top_users_raw = audit_rollup.top_users(50, hide_messages=hide)
+    top_actions_raw = audit_rollup.top_actions(50, hide_messages=hide)
 
     top_users = [[email or "(no email)", int(cnt)] for email, cnt in top_users_raw]
     top_actions = [[(action or "-"), int(cnt)] for action, cnt in top_actions_raw]
@@ -241,18 +197,114 @@ def audit_dashboard_export_excel():
 
 
 
+def _timeline_window(days, date_from, date_to):
+    """(since, until) of the timeline filters (until exclusive)."""
+    since = until = None
+    if days:
+        since = datetime.utcnow() - timedelta(days=days)
+    if date_from:
+        d = datetime.strptime(date_from, "%Y-%m-%d")
+        since = max(since, d) if since else d
+    if date_to:
+        until = datetime.strptime(date_to, "%Y-%m-%d") + timedelta(days=1)
+    return since, until
+
+
+def _timeline_query(action, user_id, since, until, request_type_id, template_id, step_order):
+    """Hot timeline query on the normalized columns (no joins; see services/audit_fields)."""
+    q = _apply_message_visibility_filter(
+        AuditLog.query.options(*loader_profiles.options(AuditLog, "list"))
+    )
+    if action:
+        q = q.filter(AuditLog.action == action)
+    if user_id:
+        q = q.filter(AuditLog.user_id == user_id)
+    if since is not None:
+        q = q.filter(AuditLog.created_at >= since)
+    if until is not None:
+        q = q.filter(AuditLog.created_at < until)
+
+    # Request-based filters (نوع الطلب / المسار): semi-join on ref_request_id
+    if request_type_id or template_id:
+        req_ids = select(WorkflowRequest.id)
+        if request_type_id:
+            req_ids = req_ids.where(WorkflowRequest.request_type_id == request_type_id)
+        if template_id:
+            # NOTE: WorkflowInstance references the request via request_id (unique).
+            req_ids = req_ids.join(WorkflowInstance, WorkflowInstance.request_id == WorkflowRequest.id).where(
+                WorkflowInstance.template_id == template_id
+            )
+        q = q.filter(AuditLog.ref_request_id.in_(req_ids))
+
+    # Step filter (الخطوة): step_order is stamped from the step/task target or the note
+    if step_order:
+        q = q.filter(AuditLog.step_order == int(step_order))
+    return q
+
+
+def _timeline_cold_filters(since, until, action, user_id, request_type_id, template_id, step_order) -> dict:
+    """Timeline filters for archived partitions (joins resolved to id sets in the main DB).
+
+    Empty when the window does not reach an archived month.
+    """
+    if not audit_partitions.partitions_for_range(since, until):
+        return {}
+
+    cold = {"action": action, "user_id": user_id, "hide_messages": _hide_messages()}
+
+    if request_type_id or template_id:
+        rq = db.session.query(WorkflowRequest.id)
+        if request_type_id:
+            rq = rq.filter(WorkflowRequest.request_type_id == request_type_id)
+        if template_id:
+            rq = rq.join(WorkflowInstance, WorkflowInstance.request_id == WorkflowRequest.id).filter(
+                WorkflowInstance.template_id == template_id
+            )
+        cold["request_ids"] = {int(rid) for (rid,) in rq.all()}
+        cold["target_types"] = ["WorkflowRequest", "WORKFLOW_REQUEST", "WORKFLOWREQUEST"]
+
+    if step_order:
+        cold["step"] = {
+            "task_ids": [int(i) for (i,) in db.session.query(WorkflowStepTask.id).filter(WorkflowStepTask.step_order == int(step_order)).all()],
+            "step_ids": [int(i) for (i,) in db.session.query(WorkflowInstanceStep.id).filter(WorkflowInstanceStep.step_order == int(step_order)).all()],
+            "note_patterns": [f"%step={int(step_order)}%", f"%step {int(step_order)}%", f"%الخطوة {int(step_order)}%"],
+        }
+    return cold
+
+
+def _request_start_end_logs(request_ids, reqs, target_types):
+    """WORKFLOW_STARTED / WORKFLOW_COMPLETED entries of the given requests (oldest first).
+
+    Archived months are only searched from the earliest request creation on.
+    """
+    actions = ["WORKFLOW_STARTED", "WORKFLOW_COMPLETED"]
+    created = [r.created_at for r in reqs if getattr(r, "created_at", None)]
+    return audit_partitions.fetch_all(
+        AuditLog.query
+        .filter(AuditLog.ref_request_id.in_(request_ids))
+        .filter(AuditLog.action.in_(actions)),
+        since=min(created) if created else datetime.utcnow(),
+        newest_first=False,
+        actions=actions,
+        request_ids=request_ids,
+        target_types=target_types,
+    )
+
+
 @audit_bp.route("/timeline")
 @login_required
 @roles_required("ADMIN")
 def system_timeline():
-    """High-volume timeline with date range + pagination.
+    """High-volume timeline with date range + keyset pagination.
 
-    Default: last 7 days.
+    Default: last 7 days. Pages walk (created_at, id) with before/after
+    cursors; totals are estimated from the audit rollups.
     """
 
-    page = request.args.get("page", 1, type=int)
     per_page = request.args.get("per_page", 120, type=int)
     per_page = max(50, min(per_page, 500))
+    before = audit_partitions.decode_cursor(request.args.get("before"))
+    after = audit_partitions.decode_cursor(request.args.get("after")) if before is None else None
 
     action = (request.args.get("action") or "").strip() or None
     user_id = request.args.get("user_id", type=int)
@@ -265,141 +317,62 @@ def system_timeline():
     step_order = request.args.get("step_order", type=int)
 
     # For audit logs: request could be referenced either by request_id, or by target_type/target_id.
-    REQUEST_TARGET_TYPES = ["WorkflowRequest", "WORKFLOW_REQUEST", "WORKFLOWREQUEST"]
-
-    base = _apply_message_visibility_filter(
-        AuditLog.query.options(
-            joinedload(AuditLog.user),
-            joinedload(AuditLog.on_behalf_of_user),
-            joinedload(AuditLog.delegation),
-        )
-    )
-
-    if action:
-        base = base.filter(AuditLog.action == action)
-
-    if user_id:
-        base = base.filter(AuditLog.user_id == user_id)
+    REQUEST_TARGET_TYPES = list(audit_fields.REQUEST_TARGET_TYPES)
 
     # Default time window
     if not date_from and not date_to and not days:
         days = 7
 
-    if days:
-        base = base.filter(AuditLog.created_at >= datetime.utcnow() - timedelta(days=days))
+    since, until = _timeline_window(days, date_from, date_to)
+    base = _timeline_query(action, user_id, since, until, request_type_id, template_id, step_order)
 
-    if date_from:
-        base = base.filter(AuditLog.created_at >= datetime.strptime(date_from, "%Y-%m-%d"))
+    # Same filters for archived months (only built when the window reaches them)
+    cold = _timeline_cold_filters(since, until, action, user_id, request_type_id, template_id, step_order)
 
-    if date_to:
-        base = base.filter(
-            AuditLog.created_at < datetime.strptime(date_to, "%Y-%m-%d") + timedelta(days=1)
-        )
-
-    # Request-based filters (نوع الطلب / المسار)
-    if request_type_id or template_id:
-        req = aliased(WorkflowRequest)
-        inst = aliased(WorkflowInstance)
-
-        join_cond = or_(
-            AuditLog.request_id == req.id,
-            (AuditLog.target_type.in_(REQUEST_TARGET_TYPES) & (AuditLog.target_id == req.id)),
-        )
-
-        base = (
-            base.outerjoin(req, join_cond)
-                # NOTE: WorkflowRequest has no workflow_instance_id column.
-                # WorkflowInstance references the request via request_id (unique).
-                .outerjoin(inst, inst.request_id == req.id)
-        )
-
-        if request_type_id:
-            base = base.filter(req.request_type_id == request_type_id)
-        if template_id:
-            base = base.filter(inst.template_id == template_id)
-
-    # Step filter (الخطوة)
-    # We support step-based audit entries coming from:
-    # - WorkflowInstanceStep (target_type: WORKFLOW_STEP / WORKFLOW_INSTANCE_STEP)
-    # - WorkflowStepTask   (target_type: WORKFLOW_STEP_TASK / PARALLEL_TASK)
-    # - Any other entry that encodes step in note (e.g. attachments/escalations) using patterns like step=3 / Step 3 / الخطوة 3
-    if step_order:
-        stask = aliased(WorkflowStepTask)
-        istep = aliased(WorkflowInstanceStep)
-
-        base = base.outerjoin(
-            stask,
-            and_(
-                AuditLog.target_type.in_(["WORKFLOW_STEP_TASK", "PARALLEL_TASK"]),
-                AuditLog.target_id == stask.id,
-            )
-        ).outerjoin(
-            istep,
-            and_(
-                AuditLog.target_type.in_(["WORKFLOW_STEP", "WORKFLOW_INSTANCE_STEP"]),
-                AuditLog.target_id == istep.id,
-            )
-        )
-
-        note_l = func.lower(AuditLog.note)
-        patt_eq = f"%step={int(step_order)}%"
-        patt_space = f"%step {int(step_order)}%"  # matches 'Step 3' after lower()
-        patt_ar = f"%الخطوة {int(step_order)}%"
-
-        base = base.filter(
-            or_(
-                stask.step_order == int(step_order),
-                istep.step_order == int(step_order),
-                note_l.like(patt_eq),
-                note_l.like(patt_space),
-                note_l.like(patt_ar),
-            )
-        )
+    # Rollup-backed summary (request / step filters are not in the rollups)
+    hide = _hide_messages()
+    rollup_filters = {
+        "hide_messages": hide,
+        "action": action,
+        "user_ids": [user_id] if user_id else None,
+        "until": until,
+    }
+    exact_filters = not (request_type_id or template_id or step_order)
 
     # Summary by day (for quick navigation)
     try:
-        day_label = func.strftime('%Y-%m-%d', AuditLog.created_at)
-        day_counts = (
-            base.with_entities(day_label.label('day'), func.count(AuditLog.id))
-            .group_by('day')
-            .order_by(day_label.desc())
-            .limit(31)
-            .all()
-        )
+        if exact_filters:
+            day_start = audit_rollup.bucket_start(since, "DAY") if since else None
+            day_counts = audit_rollup.day_totals(31, since=day_start, **rollup_filters)
+        else:
+            day_counts = audit_partitions.day_counts(base, since, until, **cold)
     except Exception:
         day_counts = []
 
-    pagination = (
-        base.order_by(AuditLog.created_at.desc(), AuditLog.id.desc())
-        .paginate(page=page, per_page=per_page, error_out=False)
-    )
+    # Count estimate: hour buckets of the window (an upper bound with request / step filters)
+    try:
+        hour_start = audit_rollup.bucket_start(since, "HOUR") if since else None
+        total_estimate = audit_rollup.total(granularity="HOUR", since=hour_start, **rollup_filters)
+    except Exception:
+        total_estimate = None
+
+    pagination = audit_partitions.fetch_keyset(base, per_page, since, until, before=before, after=after, **cold)
 
     logs = list(pagination.items or [])
 
     users = User.query.order_by(User.email.asc()).all()
 
-    # Action dropdown: keep it light
-    actions_q = db.session.query(AuditLog.action).distinct().order_by(AuditLog.action)
-    actions_q = _apply_message_visibility_filter(actions_q)
-    actions = [a for (a,) in actions_q.limit(200).all()]
+    # Action dropdown: keep it light (from the rollups)
+    actions = audit_rollup.actions(200, hide_messages=hide)
 
     # Dropdown data
     request_types = RequestType.query.order_by(RequestType.name_ar.asc()).all()
     templates = WorkflowTemplate.query.order_by(WorkflowTemplate.name.asc()).all()
 
-    # Helper: effective request id
-    def _effective_req_id(l: AuditLog):
-        if getattr(l, 'request_id', None):
-            return int(l.request_id)
-        tt = (getattr(l, 'target_type', None) or '').strip()
-        if l.target_id and (tt in REQUEST_TARGET_TYPES):
-            try:
-                return int(l.target_id)
-            except Exception:
-                return None
-        return None
-
-    page_request_ids = {rid for l in logs for rid in [_effective_req_id(l)] if rid}
+    page_request_ids = {
+        rid for l in logs
+        for rid in [audit_fields.effective_request_id(l.request_id, l.target_type, l.target_id)] if rid
+    }
 
     # Existing requests (avoid broken links)
     existing_request_ids = set()
@@ -419,18 +392,7 @@ def system_timeline():
         )
 
         # start/end timestamps from audit logs (fast enough for current page)
-        se_logs = (
-            AuditLog.query
-            .filter(
-                or_(
-                    AuditLog.request_id.in_(page_request_ids),
-                    (AuditLog.target_type.in_(REQUEST_TARGET_TYPES) & AuditLog.target_id.in_(page_request_ids)),
-                )
-            )
-            .filter(AuditLog.action.in_(["WORKFLOW_STARTED", "WORKFLOW_COMPLETED"]))
-            .order_by(AuditLog.created_at.asc())
-            .all()
-        )
+        se_logs = _request_start_end_logs(page_request_ids, reqs, REQUEST_TARGET_TYPES)
         started = {}
         completed = {}
         for al in se_logs:
@@ -462,68 +424,21 @@ def system_timeline():
                 "completed_at": completed.get(int(r.id)),
             }
 
-    # -----------------
-    # Step number for each log (used in UI and step filter UX)
-    # -----------------
-    def _extract_step_from_note(note: str | None):
-        if not note:
-            return None
-        try:
-            s = str(note)
-        except Exception:
-            return None
-        # Common patterns: step=3, Step 3:, الخطوة 3
-        m = re.search(r"(?:\bstep\s*=\s*|\bStep\s+)(\d+)", s, flags=re.IGNORECASE)
-        if not m:
-            m = re.search(r"الخطوة\s*(\d+)", s)
-        if not m:
-            return None
-        try:
-            return int(m.group(1))
-        except Exception:
-            return None
-
+    # Step number for each log (stamped on insert; note fallback for older archive files)
     log_steps = {}
-    try:
-        task_ids = {
-            int(l.target_id) for l in logs
-            if l.target_id and ((getattr(l, 'target_type', None) or '').strip() in ['WORKFLOW_STEP_TASK', 'PARALLEL_TASK'])
-        }
-        step_ids = {
-            int(l.target_id) for l in logs
-            if l.target_id and ((getattr(l, 'target_type', None) or '').strip() in ['WORKFLOW_STEP', 'WORKFLOW_INSTANCE_STEP'])
-        }
-
-        task_step_map = {}
-        if task_ids:
-            for tid, so in db.session.query(WorkflowStepTask.id, WorkflowStepTask.step_order).filter(WorkflowStepTask.id.in_(task_ids)).all():
-                task_step_map[int(tid)] = int(so) if so is not None else None
-
-        inst_step_map = {}
-        if step_ids:
-            for sid, so in db.session.query(WorkflowInstanceStep.id, WorkflowInstanceStep.step_order).filter(WorkflowInstanceStep.id.in_(step_ids)).all():
-                inst_step_map[int(sid)] = int(so) if so is not None else None
-
-        for l in logs:
-            tt = ((getattr(l, 'target_type', None) or '').strip())
-            st = None
-            if tt in ['WORKFLOW_STEP_TASK', 'PARALLEL_TASK'] and l.target_id:
-                st = task_step_map.get(int(l.target_id))
-            elif tt in ['WORKFLOW_STEP', 'WORKFLOW_INSTANCE_STEP'] and l.target_id:
-                st = inst_step_map.get(int(l.target_id))
-
-            if st is None:
-                st = _extract_step_from_note(getattr(l, 'note', None))
-
-            if st is not None:
-                log_steps[int(l.id)] = int(st)
-    except Exception:
-        log_steps = {}
+    for l in logs:
+        st = getattr(l, 'step_order', None)
+        if st is None and getattr(l, 'is_archived', False):
+            st = audit_fields.step_from_note(getattr(l, 'note', None))
+        if st is not None:
+            log_steps[int(l.id)] = int(st)
 
     return render_template(
         "audit/timeline.html",
         logs=logs,
         pagination=pagination,
+        total_estimate=total_estimate,
+        total_is_upper_bound=not exact_filters,
         users=users,
         actions=actions,
         request_types=request_types,
@@ -567,7 +482,9 @@ def deleted_request_snapshot(request_id):
         except Exception:
             pass
 
-    del_log = (
+    # Hot rows first; archived partitions are searched when they hold the history
+    target_types = ["WorkflowRequest", "WORKFLOW_REQUEST"]
+    del_logs = audit_partitions.fetch_all(
         AuditLog.query
         .options(
             joinedload(AuditLog.user),
@@ -575,11 +492,14 @@ def deleted_request_snapshot(request_id):
             joinedload(AuditLog.delegation),
         )
         .filter(AuditLog.action == "REQUEST_DELETED")
-        .filter(AuditLog.target_type.in_(["WorkflowRequest","WORKFLOW_REQUEST"]))
-        .filter(AuditLog.target_id == request_id)
-        .order_by(AuditLog.created_at.desc(), AuditLog.id.desc())
-        .first()
+        .filter(AuditLog.target_type.in_(target_types))
+        .filter(AuditLog.target_id == request_id),
+        limit=1,
+        action="REQUEST_DELETED",
+        target_types=target_types,
+        target_id=request_id,
     )
+    del_log = del_logs[0] if del_logs else None
 
     snapshot = None
     if del_log and del_log.note and "SNAPSHOT_JSON:" in del_log.note:
@@ -589,17 +509,18 @@ def deleted_request_snapshot(request_id):
         except Exception:
             snapshot = None
 
-    logs = (
+    logs = audit_partitions.fetch_all(
         AuditLog.query
         .options(
             joinedload(AuditLog.user),
             joinedload(AuditLog.on_behalf_of_user),
             joinedload(AuditLog.delegation),
         )
-        .filter(AuditLog.target_type.in_(["WorkflowRequest","WORKFLOW_REQUEST"]))
-        .filter(AuditLog.target_id == request_id)
-        .order_by(AuditLog.created_at.asc(), AuditLog.id.asc())
-        .all()
+        .filter(AuditLog.target_type.in_(target_types))
+        .filter(AuditLog.target_id == request_id),
+        newest_first=False,
+        target_types=target_types,
+        target_id=request_id,
     )
 
     return render_template(
@@ -625,90 +546,19 @@ def system_timeline_export_excel():
     template_id = request.args.get("template_id", type=int)
     step_order = request.args.get("step_order", type=int)
 
-    REQUEST_TARGET_TYPES = ["WorkflowRequest", "WORKFLOW_REQUEST", "WORKFLOWREQUEST"]
-
-    q = _apply_message_visibility_filter(
-        AuditLog.query.options(
-            joinedload(AuditLog.user),
-            joinedload(AuditLog.on_behalf_of_user),
-            joinedload(AuditLog.delegation),
-        )
-    )
-
-    if action:
-        q = q.filter(AuditLog.action == action)
-    if user_id:
-        q = q.filter(AuditLog.user_id == user_id)
+    REQUEST_TARGET_TYPES = list(audit_fields.REQUEST_TARGET_TYPES)
 
     if not date_from and not date_to and not days:
         days = 7
-    if days:
-        q = q.filter(AuditLog.created_at >= datetime.utcnow() - timedelta(days=days))
-    if date_from:
-        q = q.filter(AuditLog.created_at >= datetime.strptime(date_from, "%Y-%m-%d"))
-    if date_to:
-        q = q.filter(AuditLog.created_at < datetime.strptime(date_to, "%Y-%m-%d") + timedelta(days=1))
-
-    if request_type_id or template_id:
-        req = aliased(WorkflowRequest)
-        inst = aliased(WorkflowInstance)
-        join_cond = or_(
-            AuditLog.request_id == req.id,
-            (AuditLog.target_type.in_(REQUEST_TARGET_TYPES) & (AuditLog.target_id == req.id)),
-        )
-        # NOTE: WorkflowRequest has no workflow_instance_id column.
-        q = q.outerjoin(req, join_cond).outerjoin(inst, inst.request_id == req.id)
-        if request_type_id:
-            q = q.filter(req.request_type_id == request_type_id)
-        if template_id:
-            q = q.filter(inst.template_id == template_id)
-
-    # Step filter (الخطوة)
-    if step_order:
-        stask = aliased(WorkflowStepTask)
-        istep = aliased(WorkflowInstanceStep)
-
-        q = q.outerjoin(
-            stask,
-            and_(
-                AuditLog.target_type.in_(["WORKFLOW_STEP_TASK", "PARALLEL_TASK"]),
-                AuditLog.target_id == stask.id,
-            )
-        ).outerjoin(
-            istep,
-            and_(
-                AuditLog.target_type.in_(["WORKFLOW_STEP", "WORKFLOW_INSTANCE_STEP"]),
-                AuditLog.target_id == istep.id,
-            )
-        )
-
-        note_l = func.lower(AuditLog.note)
-        patt_eq = f"%step={int(step_order)}%"
-        patt_space = f"%step {int(step_order)}%"
-        patt_ar = f"%الخطوة {int(step_order)}%"
-        q = q.filter(
-            or_(
-                stask.step_order == int(step_order),
-                istep.step_order == int(step_order),
-                note_l.like(patt_eq),
-                note_l.like(patt_space),
-                note_l.like(patt_ar),
-            )
-        )
+    since, until = _timeline_window(days, date_from, date_to)
+    q = _timeline_query(action, user_id, since, until, request_type_id, template_id, step_order)
 
-    logs = q.order_by(AuditLog.created_at.desc(), AuditLog.id.desc()).limit(20000).all()
+    cold = _timeline_cold_filters(since, until, action, user_id, request_type_id, template_id, step_order)
+    logs = audit_partitions.fetch_all(q, since, until, limit=20000, **cold)
 
     # Collect request ids
     def _effective_req_id(l: AuditLog):
-        if getattr(l, 'request_id', None):
-            return int(l.request_id)
-        tt = (getattr(l, 'target_type', None) or '').strip()
-        if l.target_id and (tt in REQUEST_TARGET_TYPES):
-            try:
-                return int(l.target_id)
-            except Exception:
-                return None
-        return None
+        return audit_fields.effective_request_id(l.request_id, l.target_type, l.target_id)
 
     req_ids = {rid for l in logs for rid in [_effective_req_id(l)] if rid}
 
@@ -716,18 +566,7 @@ def system_timeline_export_excel():
     if req_ids:
         reqs = WorkflowRequest.query.filter(WorkflowRequest.id.in_(req_ids)).all()
 
-        se_logs = (
-            AuditLog.query
-            .filter(
-                or_(
-                    AuditLog.request_id.in_(req_ids),
-                    (AuditLog.target_type.in_(REQUEST_TARGET_TYPES) & AuditLog.target_id.in_(req_ids)),
-                )
-            )
-            .filter(AuditLog.action.in_(["WORKFLOW_STARTED", "WORKFLOW_COMPLETED"]))
-            .order_by(AuditLog.created_at.asc())
-            .all()
-        )
+        se_logs = _request_start_end_logs(req_ids, reqs, REQUEST_TARGET_TYPES)
         started = {}
         completed = {}
         for al in se_logs:
@@ -757,55 +596,15 @@ def system_timeline_export_excel():
                 "completed_at": completed.get(int(r.id)),
             }
 
-    # Step number map for export (batch)
-    def _extract_step_from_note(note):
-        if not note:
-            return None
-        try:
-            s = str(note)
-        except Exception:
-            return None
-        m = re.search(r"(?:\\bstep\\s*=\\s*|\\bStep\\s+)(\\d+)", s, flags=re.IGNORECASE)
-        if not m:
-            m = re.search(r"الخطوة\\s*(\\d+)", s)
-        if not m:
-            return None
-        try:
-            return int(m.group(1))
-        except Exception:
-            return None
-
-    task_ids = {
-        int(l.target_id) for l in logs
-        if l.target_id and ((getattr(l, 'target_type', None) or '').strip() in ['WORKFLOW_STEP_TASK', 'PARALLEL_TASK'])
-    }
-    step_ids = {
-        int(l.target_id) for l in logs
-        if l.target_id and ((getattr(l, 'target_type', None) or '').strip() in ['WORKFLOW_STEP', 'WORKFLOW_INSTANCE_STEP'])
-    }
-    task_step_map = {}
-    if task_ids:
-        for tid, so in db.session.query(WorkflowStepTask.id, WorkflowStepTask.step_order).filter(WorkflowStepTask.id.in_(task_ids)).all():
-            task_step_map[int(tid)] = int(so) if so is not None else None
-    inst_step_map = {}
-    if step_ids:
-        for sid, so in db.session.query(WorkflowInstanceStep.id, WorkflowInstanceStep.step_order).filter(WorkflowInstanceStep.id.in_(step_ids)).all():
-            inst_step_map[int(sid)] = int(so) if so is not None else None
-
     rows = []
     for l in logs:
         rid = _effective_req_id(l)
         meta = request_meta.get(rid or -1, {})
 
-        # Resolve step number if possible
-        st = None
-        tt = ((getattr(l, 'target_type', None) or '').strip())
-        if tt in ['WORKFLOW_STEP_TASK', 'PARALLEL_TASK'] and l.target_id:
-            st = task_step_map.get(int(l.target_id))
-        elif tt in ['WORKFLOW_STEP', 'WORKFLOW_INSTANCE_STEP'] and l.target_id:
-            st = inst_step_map.get(int(l.target_id))
-        if st is None:
-            st = _extract_step_from_note(getattr(l, 'note', None))
+        # Step number (stamped on insert; note fallback for older archive files)
+        st = getattr(l, 'step_order', None)
+        if st is None and getattr(l, 'is_archived', False):
+            st = audit_fields.step_from_note(getattr(l, 'note', None))
 
         rows.append({
             "ID": l.id,
@@ -833,3 +632,97 @@ def system_timeline_export_excel():
         as_attachment=True,
         download_name=filename,
     )
+
+
+# -------------------------
+# Audit partitions (hot / cold storage)
+# -------------------------
+
+@audit_bp.route("/partitions")
+@login_required
+@roles_required("ADMIN")
+def audit_partitions_page():
+    partitions = AuditLogPartition.query.order_by(AuditLogPartition.month.desc()).all()
+    hot_rows = db.session.query(func.count(AuditLog.id)).scalar() or 0
+    return render_template(
+        "audit/partitions.html",
+        partitions=partitions,
+        hot_rows=int(hot_rows),
+        hot_cutoff=audit_partitions.hot_cutoff(),
+        hot_months=audit_partitions.hot_months(),
+        retention_months=audit_partitions.cold_retention_months(),
+        archivable=audit_partitions.archivable_months(),
+        writer=audit_writer.stats(),
+    )
+
+
+@audit_bp.route("/partitions/settings", methods=["POST"])
+@login_required
+@roles_required("ADMIN")
+def audit_partitions_settings():
+    hot = request.form.get("hot_months", type=int)
+    keep = request.form.get("retention_months", type=int)
+    if hot is None or hot < 1 or keep is None or keep < 0:
+        flash("قيم غير صحيحة.", "danger")
+        return redirect(url_for("audit.audit_partitions_page"))
+    settings_service.set_value("AUDIT_HOT_MONTHS", str(hot))
+    settings_service.set_value("AUDIT_COLD_RETENTION_MONTHS", str(keep))
+    db.session.commit()
+    flash("تم حفظ إعدادات تقسيم سجل التدقيق.", "success")
+    return redirect(url_for("audit.audit_partitions_page"))
+
+
+@audit_bp.route("/partitions/archive", methods=["POST"])
+@login_required
+@roles_required("ADMIN")
+def audit_partitions_archive():
+    try:
+        res = audit_partitions.run_maintenance()
+    except Exception:
+        db.session.rollback()
+        current_app.logger.exception("audit partition maintenance failed")
+        flash("تعذر نقل السجلات القديمة إلى الأرشيف.", "danger")
+        return redirect(url_for("audit.audit_partitions_page"))
+    moved = sum(res["archived"].values())
+    flash(
+        f"تم نقل {moved} سجل ({len(res['archived'])} شهر) إلى الأرشيف البارد، وحذف {len(res['dropped'])} شهر منتهي الاحتفاظ.",
+        "success",
+    )
+    return redirect(url_for("audit.audit_partitions_page"))
+
+
+@audit_bp.route("/partitions/<month>/download")
+@login_required
+@roles_required("ADMIN")
+def audit_partition_download(month):
+    part = AuditLogPartition.query.filter_by(month=month).first_or_404()
+    return send_file(
+        audit_partitions.partition_path(part),
+        mimetype="application/gzip",
+        as_attachment=True,
+        download_name=part.file_name,
+    )
+
+
+@audit_bp.route("/partitions/<month>/export.csv")
+@login_required
+@roles_required("ADMIN")
+def audit_partition_export_csv(month):
+    part = AuditLogPartition.query.filter_by(month=month).first_or_404()
+    return send_file(
+        BytesIO(audit_partitions.export_csv(part)),
+        mimetype="text/csv",
+        as_attachment=True,
+        download_name=f"audit_{part.month}.csv",
+    )
+
+
+@audit_bp.route("/partitions/<month>/drop", methods=["POST"])
+@login_required
+@roles_required("SUPER_ADMIN")
+def audit_partition_drop(month):
+    if audit_partitions.drop_partition(month):
+        flash(f"تم حذف أرشيف شهر {month}.", "success")
+    else:
+        flash("الأرشيف غير موجود.", "warning")
+    return redirect(url_for("audit.audit_partitions_page"))
@@ -0,0 +1,43 @@
+from sqlalchemy import select
+
+from extensions import db
+from models import EmployeeFile
+
+
+def employee_ids_select(
+    employee_id=None,
+    work_location_id=None,
+    appointment_type_id=None,
+    organization_id=None,
+    directorate_id=None,
+    department_id=None,
+    division_id=None,
+):
+    """SELECT employee_file.user_id matching the HR report filters.
+
+    Use it as a semi-join (`Model.user_id.in_(employee_ids_select(...))`)
+    instead of loading the ids into Python and binding them back as a giant
+    IN (...) list. No filters = every user that has an employee file.
+    """
+    stmt = select(EmployeeFile.user_id)
+    if employee_id:
+        stmt = stmt.where(EmployeeFile.user_id == employee_id)
+    if work_location_id:
+        stmt = stmt.where(EmployeeFile.work_location_lookup_id == work_location_id)
+    if appointment_type_id:
+        stmt = stmt.where(EmployeeFile.appointment_type_lookup_id == appointment_type_id)
+
+    if organization_id:
+        stmt = stmt.where(EmployeeFile.organization_id == organization_id)
+    if directorate_id:
+        stmt = stmt.where(EmployeeFile.directorate_id == directorate_id)
+    if department_id:
+        stmt = stmt.where(EmployeeFile.department_id == department_id)
+    if division_id:
+        stmt = stmt.where(EmployeeFile.division_id == division_id)
+    return stmt
+
+
+def any_employee(stmt) -> bool:
+    """True if the employee id select matches at least one row (EXISTS, no ids fetched)."""
+    return bool(db.session.execute(select(stmt.exists())).scalar())
@@ -1,7 +1,7 @@
-from datetime import datetime, timedelta
+from datetime import datetime
 from sqlalchemy import or_, cast, String
 from models import WorkflowRequest
-from models import SystemSetting
+from services import settings_service
 
 
 def apply_request_filters(query, args):
@@ -47,58 +47,23 @@ def apply_request_filters(query, args):
         ))
 
     if args.get("sla_state"):
-        sla_days = get_sla_days()
-        esc_days = get_escalation_days()
+        from services import sla_service
 
-        now = datetime.utcnow()
-        sla_deadline = now - timedelta(days=sla_days)
-        esc_deadline = now - timedelta(days=sla_days + esc_days)
-
-        # فقط الطلبات غير النهائية
-        query = query.filter(
-            WorkflowRequest.status.notin_(["APPROVED", "REJECTED"])
-        )
-
-        if args["sla_state"] == "ON_TRACK":
-            query = query.filter(
-                WorkflowRequest.created_at >= sla_deadline
-            )
-
-        elif args["sla_state"] == "BREACHED":
-            query = query.filter(
-                WorkflowRequest.created_at < sla_deadline,
-                WorkflowRequest.created_at >= esc_deadline
-            )
-
-        elif args["sla_state"] == "ESCALATED":
-            query = query.filter(
-                WorkflowRequest.created_at < esc_deadline
-            )
+        # فقط الطلبات غير النهائية + مقارنة المواعيد المخزنة (sla_due_at / escalation_due_at)
+        query = query.filter(*sla_service.sla_state_clauses(args["sla_state"]))
 
     return query
 
 def get_sla_days():
-    setting = SystemSetting.query.filter_by(key="SLA_DAYS").first()
-    return int(setting.value) if setting else 3
+    value = settings_service.get("SLA_DAYS")
+    return int(value) if value is not None else 3
 
 
 def get_escalation_days():
-    setting = SystemSetting.query.filter_by(key="ESCALATION_DAYS").first()
-    return int(setting.value) if setting else 2
+    value = settings_service.get("ESCALATION_DAYS")
+    return int(value) if value is not None else 2
 
 def get_sla_state(request_obj):
-    sla_days = get_sla_days()
-    esc_days = get_escalation_days()
-
-    if request_obj.status in ["APPROVED", "REJECTED"]:
-        return None
-
-    now = datetime.utcnow()
-    age = now - request_obj.created_at
+    from services import sla_service
 
-    if age <= timedelta(days=sla_days):
-        return "ON_TRACK"
-    elif age <= timedelta(days=sla_days + esc_days):
-        return "BREACHED"
-    else:
-        return "ESCALATED"
\ No newline at end of file
+    return sla_service.sla_state(request_obj)
\ No newline at end of file
@@ -0,0 +1,33 @@
+import os
+import sys
+
+# ➕ إضافة جذر المشروع إلى PYTHONPATH
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, BASE_DIR)
+
+from app import app
+from extensions import db
+from services import audit_partitions
+
+
+def run_audit_partitions():
+    """Move audit months past AUDIT_HOT_MONTHS to cold files and apply retention (run monthly).
+
+    Usage:
+      python jobs/audit_partitions.py
+    """
+    with app.app_context():
+        try:
+            res = audit_partitions.run_maintenance()
+        except Exception:
+            db.session.rollback()
+            raise
+        for month, n in res["archived"].items():
+            print(f"archived {month}: {n} row(s)")
+        for month in res["dropped"]:
+            print(f"dropped {month}")
+        return res
+
+
+if __name__ == "__main__":
+    run_audit_partitions()
@@ -1,7 +1,8 @@
-from datetime import datetime, timedelta
+from datetime import datetime
 from app import create_app
 from extensions import db
-from models import WorkflowRequest, SystemSetting, AuditLog
+from models import WorkflowRequest, AuditLog
+from services import settings_service, sla_service
 
 FINAL_STATUSES = ["APPROVED", "REJECTED"]
 
@@ -14,8 +15,8 @@ SYSTEM_USER_ID = None
 
 
 def get_setting(key, default):
-    setting = SystemSetting.query.filter_by(key=key).first()
-    return int(setting.value) if setting else default
+    value = settings_service.get(key)
+    return int(value) if value is not None else default
 
 
 def run_escalation():
@@ -27,15 +28,13 @@ def run_escalation():
         ESCALATION_DAYS = get_setting("ESCALATION_DAYS", 2)
 
         now = datetime.utcnow()
-        escalation_threshold = now - timedelta(
-            days=SLA_DAYS + ESCALATION_DAYS
-        )
+        sla_service.ensure_deadlines_current()
 
         escalated_requests = (
             WorkflowRequest.query
             .filter(
                 WorkflowRequest.status.notin_(FINAL_STATUSES),
-                WorkflowRequest.created_at <= escalation_threshold,
+                WorkflowRequest.escalation_due_at <= now,
                 WorkflowRequest.is_escalated == False
             )
             .all()
@@ -0,0 +1,32 @@
+import os
+import sys
+
+# ➕ إضافة جذر المشروع إلى PYTHONPATH
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, BASE_DIR)
+
+from app import app
+from extensions import db
+from services.inventory_ledger import build_monthly_snapshots
+
+
+def run_inventory_snapshots(upto_period=None):
+    """Write missing month-end inventory balance snapshots (run monthly, e.g. on the 1st).
+
+    Usage:
+      python jobs/inv_balance_snapshots.py            # up to the last completed month
+      python jobs/inv_balance_snapshots.py 2025-12    # up to a given period (YYYY-MM)
+    """
+    with app.app_context():
+        try:
+            written = build_monthly_snapshots(upto_period)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        print(f"snapshots written: {written} period(s)")
+        return written
+
+
+if __name__ == "__main__":
+    run_inventory_snapshots(sys.argv[1] if len(sys.argv) > 1 else None)
@@ -0,0 +1,42 @@
+import os
+import sys
+
+# ➕ إضافة جذر المشروع إلى PYTHONPATH
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, BASE_DIR)
+
+from app import app
+from extensions import db
+from services.inventory_ledger import rebuild_ledger, verify_ledger
+
+
+def rebuild_inventory_ledger(verify_only: bool = False):
+    """Rebuild inv_stock_movement/inv_balance from vouchers and verify against the full recomputation.
+
+    Usage:
+      python jobs/rebuild_inv_ledger.py            # rebuild + verify (commit only if no mismatches)
+      python jobs/rebuild_inv_ledger.py --verify   # verify current balances only
+    """
+    with app.app_context():
+        if verify_only:
+            mismatches = verify_ledger()
+        else:
+            result = rebuild_ledger(verify=True)
+            mismatches = result["mismatches"]
+            print(f"movements={result['movements']} balances={result['balances']}")
+            if mismatches:
+                db.session.rollback()
+            else:
+                db.session.commit()
+
+        for m in mismatches[:50]:
+            print(
+                f"MISMATCH warehouse={m['warehouse_id']} item={m['item_id']} "
+                f"expected={m['expected']} actual={m['actual']}"
+            )
+        print("OK" if not mismatches else f"{len(mismatches)} mismatch(es)")
+        return 0 if not mismatches else 1
+
+
+if __name__ == "__main__":
+    sys.exit(rebuild_inventory_ledger(verify_only="--verify" in sys.argv[1:]))
@@ -2,16 +2,19 @@ from datetime import datetime
 import re
 
 from sqlalchemy import or_
+from sqlalchemy.orm import contains_eager
 
 from flask import render_template, request, redirect, url_for, flash, abort
 from flask_login import login_required, current_user
 
 from extensions import db
+from services import audit_writer
+from utils import loader_profiles
 from utils.events import emit_event
 from . import messages_bp
 from models import (
     User, Department, Directorate,
-    Message, MessageRecipient, AuditLog
+    Message, MessageRecipient
 )
 
 
@@ -28,14 +31,12 @@ def _audit_message(action, msg, note_extra=None, recipients=None):
             f"Message#{msg.id} | From={msg.sender_id} | To={msg.target_kind}:{msg.target_id} | "
             f"{rtxt}Subject={subj}\n\nBODY:\n{body}{extra}"
         )
-        db.session.add(
-            AuditLog(
-                action=action,
-                user_id=current_user.id,
-                target_type="Message",
-                target_id=msg.id,
-                note=note
-            )
+        audit_writer.add(
+            action=action,
+            user_id=current_user.id,
+            target_type="Message",
+            target_id=msg.id,
+            note=note
         )
     except Exception:
         # Never block normal flow if auditing fails.
@@ -51,6 +52,10 @@ def inbox():
     q = (
         db.session.query(MessageRecipient)
         .join(MessageRecipient.message)
+        .options(
+            contains_eager(MessageRecipient.message).joinedload(Message.sender),
+            contains_eager(MessageRecipient.message).lazyload(Message.recipients),
+        )
         .filter(
             MessageRecipient.recipient_user_id == current_user.id,
             MessageRecipient.is_deleted.is_(False)
@@ -86,6 +91,7 @@ def sent():
 
     q = (
         Message.query
+        .options(*loader_profiles.options(Message, "list"))
         .filter(
             Message.sender_id == current_user.id,
             Message.sender_deleted.is_(False)
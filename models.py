@@ -77,7 +77,7 @@ class CommitteeAssignee(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
 
     committee = db.relationship("Committee", back_populates="assignees")
-    user = db.relationship("User", foreign_keys=[user_id], lazy="joined")
+    user = db.relationship("User", foreign_keys=[user_id], lazy="select")
 
     __table_args__ = (
         db.CheckConstraint("kind IN ('USER','ROLE')", name="ck_committee_assignee_kind"),
@@ -498,9 +498,9 @@ class Delegation(db.Model):
 
     note = db.Column(db.Text, nullable=True)
 
-    from_user = db.relationship("User", foreign_keys=[from_user_id], lazy="joined")
-    to_user = db.relationship("User", foreign_keys=[to_user_id], lazy="joined")
-    created_by = db.relationship("User", foreign_keys=[created_by_id], lazy="joined")
+    from_user = db.relationship("User", foreign_keys=[from_user_id], lazy="select")
+    to_user = db.relationship("User", foreign_keys=[to_user_id], lazy="select")
+    created_by = db.relationship("User", foreign_keys=[created_by_id], lazy="select")
     @property
     def is_effective_now(self) -> bool:
         if not self.is_active:
@@ -531,6 +531,10 @@ class WorkflowRequest(db.Model):
     is_escalated = db.Column(db.Boolean, default=False)
     escalated_at = db.Column(db.DateTime, nullable=True)
 
+    # SLA deadlines (stamped on insert, recomputed when SLA settings change: services/sla_service.py)
+    sla_due_at = db.Column(db.DateTime, nullable=True)
+    escalation_due_at = db.Column(db.DateTime, nullable=True)
+
     current_role = db.Column(db.String(50), default="dept_head")
 
     # Runtime instance (مسار منفّذ فعلياً)
@@ -547,6 +551,11 @@ class WorkflowRequest(db.Model):
         cascade="all, delete-orphan"
     )
 
+    __table_args__ = (
+        db.Index("ix_workflow_request_status_sla_due", "status", "sla_due_at"),
+        db.Index("ix_workflow_request_status_esc_due", "status", "escalation_due_at"),
+    )
+
 
 class Approval(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -590,14 +599,79 @@ class AuditLog(db.Model):
     )
 
     user = db.relationship("User", foreign_keys=[user_id])
-    on_behalf_of_user = db.relationship("User", foreign_keys=[on_behalf_of_id], lazy="joined")
-    delegation = db.relationship("Delegation", foreign_keys=[delegation_id], lazy="joined")
+    on_behalf_of_user = db.relationship("User", foreign_keys=[on_behalf_of_id], lazy="select")
+    delegation = db.relationship("Delegation", foreign_keys=[delegation_id], lazy="select")
     request = db.relationship("WorkflowRequest")
 
     # target reference (موجود عندك)
     target_type = db.Column(db.String(50))
     target_id = db.Column(db.Integer)
 
+    # Normalized on insert (services/audit_fields.py): the request the entry
+    # belongs to (request_id or a WorkflowRequest target; no FK, survives
+    # request deletion) and the workflow step it refers to.
+    ref_request_id = db.Column(db.Integer, nullable=True)
+    step_order = db.Column(db.Integer, nullable=True)
+
+    # Timeline keyset pagination: (created_at, id) per common filter
+    __table_args__ = (
+        db.Index("ix_audit_log_created_id", "created_at", "id"),
+        db.Index("ix_audit_log_user_created_id", "user_id", "created_at", "id"),
+        db.Index("ix_audit_log_action_created_id", "action", "created_at", "id"),
+        db.Index("ix_audit_log_ref_request_created_id", "ref_request_id", "created_at", "id"),
+        db.Index("ix_audit_log_step_created_id", "step_order", "created_at", "id"),
+        db.Index("ix_audit_log_target", "target_type", "target_id"),
+    )
+
+
+class AuditLogRollup(db.Model):
+    """Pre-aggregated AuditLog counts per HOUR / DAY bucket.
+
+    One row per (granularity, bucket_start, action, user_id, module, target_type).
+    user_id 0 / target_type "" stand for NULL so the unique key can be upserted.
+    Maintained by services/audit_rollup.py on AuditLog insert.
+    """
+    __tablename__ = "audit_log_rollup"
+
+    id = db.Column(db.Integer, primary_key=True)
+    granularity = db.Column(db.String(4), nullable=False)  # HOUR / DAY
+    bucket_start = db.Column(db.DateTime, nullable=False)
+    action = db.Column(db.String(100), nullable=False)
+    user_id = db.Column(db.Integer, nullable=False, default=0)
+    module = db.Column(db.String(20), nullable=False, default="OTHER")
+    target_type = db.Column(db.String(50), nullable=False, default="")
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        db.UniqueConstraint(
+            "granularity", "bucket_start", "action", "user_id", "module", "target_type",
+            name="uq_audit_log_rollup_key",
+        ),
+        db.Index("ix_audit_log_rollup_gran_action", "granularity", "action"),
+        db.Index("ix_audit_log_rollup_gran_user", "granularity", "user_id"),
+        db.Index("ix_audit_log_rollup_gran_module_bucket", "granularity", "module", "bucket_start"),
+    )
+
+
+class AuditLogPartition(db.Model):
+    """A month of AuditLog moved to a compressed cold archive file.
+
+    The rows live in instance/audit_archive/<file_name> (gzip'd SQLite with an
+    audit_log table of the same columns) and are no longer in audit_log.
+    See services/audit_partitions.py.
+    """
+    __tablename__ = "audit_log_partition"
+
+    id = db.Column(db.Integer, primary_key=True)
+    month = db.Column(db.String(7), nullable=False, unique=True, index=True)  # YYYY-MM
+    file_name = db.Column(db.String(255), nullable=False)
+    row_count = db.Column(db.Integer, nullable=False, default=0)
+    min_id = db.Column(db.Integer, nullable=True)
+    max_id = db.Column(db.Integer, nullable=True)
+    size_bytes = db.Column(db.Integer, nullable=False, default=0)
+    sha256 = db.Column(db.String(64), nullable=False)
+    archived_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
 
 class SystemSetting(db.Model):
     __tablename__ = "system_setting"
@@ -652,7 +726,7 @@ class ArchivedFile(db.Model):
         "User",
         foreign_keys=[final_deleted_by],
         backref="final_deleted_archived_files",
-        lazy="joined"
+        lazy="select"
     )
 
     owner_id = db.Column(
@@ -740,7 +814,7 @@ class FilePermission(db.Model):
             lazy="selectin",
             foreign_keys="FilePermission.user_id",
         ),
-        lazy="joined",
+        lazy="select",
     )
 
     can_download = db.Column(db.Boolean, default=True)
@@ -751,10 +825,16 @@ class FilePermission(db.Model):
     shared_by_user = db.relationship(
         "User",
         foreign_keys=[shared_by],
-        lazy="joined"
+        lazy="select"
     )
     expires_at = db.Column(db.DateTime, nullable=True)
 
+    __table_args__ = (
+        # archive counters / access query: a user's active shares; per-page share maps
+        db.Index("ix_file_permission_user_expires", "user_id", "expires_at", "file_id"),
+        db.Index("ix_file_permission_file", "file_id"),
+    )
+
 
 # ======================
 # Notifications
@@ -820,7 +900,7 @@ class Message(db.Model):
     sender_deleted = db.Column(db.Boolean, default=False, nullable=False)
     sender_deleted_at = db.Column(db.DateTime, nullable=True)
 
-    sender = db.relationship("User", lazy="joined")
+    sender = db.relationship("User", lazy="select")
 
 
 class MessageRecipient(db.Model):
@@ -843,7 +923,7 @@ class MessageRecipient(db.Model):
     deleted_at = db.Column(db.DateTime, nullable=True)
 
     message = db.relationship("Message", backref=db.backref("recipients", lazy="selectin"))
-    recipient = db.relationship("User", lazy="joined")
+    recipient = db.relationship("User", lazy="select")
 
 
 # ======================
@@ -889,8 +969,8 @@ class RequestEscalation(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
     request = db.relationship("WorkflowRequest", backref="escalations")
-    from_user = db.relationship("User", foreign_keys=[from_user_id], lazy="joined")
-    to_user = db.relationship("User", foreign_keys=[to_user_id], lazy="joined")
+    from_user = db.relationship("User", foreign_keys=[from_user_id], lazy="select")
+    to_user = db.relationship("User", foreign_keys=[to_user_id], lazy="select")
 
     def __repr__(self):
         return f"<RequestEscalation #{self.id} req={self.request_id} step={getattr(self,'step_order',None)} {self.category}>"
@@ -930,7 +1010,7 @@ class WorkflowTemplateStep(db.Model):
     approver_committee_id = db.Column(db.Integer, db.ForeignKey('committees.id'), nullable=True)
     committee_delivery_mode = db.Column(db.String(30), nullable=True)  # Committee_ALL / Committee_CHAIR / Committee_SECRETARY
 
-    committee = db.relationship('Committee', foreign_keys=[approver_committee_id], lazy='joined')
+    committee = db.relationship('Committee', foreign_keys=[approver_committee_id], lazy='select')
 
     # SLA override for this step (optional)
     sla_days = db.Column(db.Integer, nullable=True)
@@ -968,7 +1048,7 @@ class WorkflowTemplateParallelAssignee(db.Model):
 
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
 
-    user = db.relationship('User', foreign_keys=[approver_user_id], lazy='joined')
+    user = db.relationship('User', foreign_keys=[approver_user_id], lazy='select')
 
     __table_args__ = (
         db.Index('ix_wf_par_assignee_step', 'template_id', 'step_order'),
@@ -1006,7 +1086,7 @@ class WorkflowInstance(db.Model):
 
     # For PARALLEL_SYNC bypass authority: who executed the previous step (effective user id)
     last_step_actor_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=True)
-    last_step_actor = db.relationship("User", foreign_keys=[last_step_actor_id], lazy="joined")
+    last_step_actor = db.relationship("User", foreign_keys=[last_step_actor_id], lazy="select")
 
     steps = db.relationship(
         "WorkflowInstanceStep",
@@ -1055,6 +1135,10 @@ class WorkflowInstanceStep(db.Model):
     # PARALLEL_SYNC: ensure notifications are sent once when the step becomes active
     parallel_notified_at = db.Column(db.DateTime, nullable=True)
 
+    __table_args__ = (
+        db.Index("ix_wis_status_due", "status", "due_at"),
+    )
+
 
 class WorkflowStepTask(db.Model):
     """Runtime tasks for PARALLEL_SYNC steps.
@@ -1089,8 +1173,8 @@ class WorkflowStepTask(db.Model):
 
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
 
-    assignee = db.relationship("User", foreign_keys=[assignee_user_id], lazy="joined")
-    bypassed_by = db.relationship("User", foreign_keys=[bypassed_by_id], lazy="joined")
+    assignee = db.relationship("User", foreign_keys=[assignee_user_id], lazy="select")
+    bypassed_by = db.relationship("User", foreign_keys=[bypassed_by_id], lazy="select")
     instance = db.relationship(
         "WorkflowInstance",
         foreign_keys=[instance_id],
@@ -1292,12 +1376,12 @@ class WorkflowRoutingRule(db.Model):
     is_active = db.Column(db.Boolean, default=True, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
 
-    request_type = db.relationship("RequestType", lazy="joined")
-    organization = db.relationship("Organization", lazy="joined")
-    directorate = db.relationship("Directorate", lazy="joined")
-    department = db.relationship("Department", lazy="joined")
-    org_node = db.relationship("OrgNode", lazy="joined")
-    template = db.relationship("WorkflowTemplate", lazy="joined")
+    request_type = db.relationship("RequestType", lazy="select")
+    organization = db.relationship("Organization", lazy="select")
+    directorate = db.relationship("Directorate", lazy="select")
+    department = db.relationship("Department", lazy="select")
+    org_node = db.relationship("OrgNode", lazy="select")
+    template = db.relationship("WorkflowTemplate", lazy="select")
 
     __table_args__ = (
         db.Index(
@@ -1540,7 +1624,7 @@ class OrgNode(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
 
-    type = db.relationship("OrgNodeType", lazy="joined")
+    type = db.relationship("OrgNodeType", lazy="select")
     parent = db.relationship("OrgNode", remote_side=[id], backref=db.backref("children", lazy="select"))
 
     __table_args__ = (
@@ -1561,10 +1645,10 @@ class OrgNodeManager(db.Model):
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
     updated_by_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=True)
 
-    node = db.relationship("OrgNode", lazy="joined")
-    manager_user = db.relationship("User", foreign_keys=[manager_user_id], lazy="joined")
-    deputy_user = db.relationship("User", foreign_keys=[deputy_user_id], lazy="joined")
-    updated_by = db.relationship("User", foreign_keys=[updated_by_id], lazy="joined")
+    node = db.relationship("OrgNode", lazy="select")
+    manager_user = db.relationship("User", foreign_keys=[manager_user_id], lazy="select")
+    deputy_user = db.relationship("User", foreign_keys=[deputy_user_id], lazy="select")
+    updated_by = db.relationship("User", foreign_keys=[updated_by_id], lazy="select")
 
 
 class OrgNodeAssignment(db.Model):
@@ -1582,9 +1666,9 @@ class OrgNodeAssignment(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     created_by_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=True)
 
-    user = db.relationship("User", foreign_keys=[user_id], lazy="joined")
-    node = db.relationship("OrgNode", lazy="joined")
-    created_by = db.relationship("User", foreign_keys=[created_by_id], lazy="joined")
+    user = db.relationship("User", foreign_keys=[user_id], lazy="select")
+    node = db.relationship("OrgNode", lazy="select")
+    created_by = db.relationship("User", foreign_keys=[created_by_id], lazy="select")
 
     __table_args__ = (
         db.UniqueConstraint("user_id", "node_id", name="uq_org_node_assign_user_node"),
@@ -1610,9 +1694,9 @@ class OrgUnitManager(db.Model):
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     updated_by_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=True)
 
-    manager_user = db.relationship("User", foreign_keys=[manager_user_id], lazy="joined")
-    deputy_user = db.relationship("User", foreign_keys=[deputy_user_id], lazy="joined")
-    updated_by = db.relationship("User", foreign_keys=[updated_by_id], lazy="joined")
+    manager_user = db.relationship("User", foreign_keys=[manager_user_id], lazy="select")
+    deputy_user = db.relationship("User", foreign_keys=[deputy_user_id], lazy="select")
+    updated_by = db.relationship("User", foreign_keys=[updated_by_id], lazy="select")
 
     __table_args__ = (
         db.UniqueConstraint("unit_type", "unit_id", name="uq_org_unit_manager_type_id"),
@@ -1647,8 +1731,8 @@ class OrgUnitAssignment(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     created_by_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=True)
 
-    user = db.relationship("User", foreign_keys=[user_id], lazy="joined")
-    created_by = db.relationship("User", foreign_keys=[created_by_id], lazy="joined")
+    user = db.relationship("User", foreign_keys=[user_id], lazy="select")
+    created_by = db.relationship("User", foreign_keys=[created_by_id], lazy="select")
     __table_args__ = (
         db.UniqueConstraint("user_id", "unit_type", "unit_id", name="uq_org_unit_assignment_user_unit"),
         db.CheckConstraint("unit_type IN ('ORGANIZATION','DIRECTORATE','DEPARTMENT','SECTION','DIVISION','TEAM')", name="ck_org_unit_assignment_type"),
@@ -1767,15 +1851,26 @@ class EmployeeFile(db.Model):
     updated_by_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=True)
 
     user = db.relationship("User", foreign_keys=[user_id], back_populates="employee_file")
-    updated_by = db.relationship("User", foreign_keys=[updated_by_id], lazy="joined")
+    updated_by = db.relationship("User", foreign_keys=[updated_by_id], lazy="select")
 
     # Convenience relationships
-    organization = db.relationship('Organization', foreign_keys=[organization_id], lazy='joined')
-    directorate = db.relationship('Directorate', foreign_keys=[directorate_id], lazy='joined')
-    department = db.relationship('Department', foreign_keys=[department_id], lazy='joined')
-    division = db.relationship('Division', foreign_keys=[division_id], lazy='joined')
+    organization = db.relationship('Organization', foreign_keys=[organization_id], lazy='select')
+    directorate = db.relationship('Directorate', foreign_keys=[directorate_id], lazy='select')
+    department = db.relationship('Department', foreign_keys=[department_id], lazy='select')
+    division = db.relationship('Division', foreign_keys=[division_id], lazy='select')
 
-    direct_manager = db.relationship('User', foreign_keys=[direct_manager_user_id], lazy='joined')
+    direct_manager = db.relationship('User', foreign_keys=[direct_manager_user_id], lazy='select')
+
+    # HR report filters (filters/employee_filters.py): (filter column, user_id)
+    # so the employee id semi-join is answered from the index alone.
+    __table_args__ = (
+        db.Index("ix_employee_file_work_location_user", "work_location_lookup_id", "user_id"),
+        db.Index("ix_employee_file_appointment_type_user", "appointment_type_lookup_id", "user_id"),
+        db.Index("ix_employee_file_org_user", "organization_id", "user_id"),
+        db.Index("ix_employee_file_directorate_user", "directorate_id", "user_id"),
+        db.Index("ix_employee_file_department_user", "department_id", "user_id"),
+        db.Index("ix_employee_file_division_user", "division_id", "user_id"),
+    )
 
 
 
@@ -1810,11 +1905,11 @@ class EmployeeAttachment(db.Model):
     uploaded_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     uploaded_by_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=True)
 
-    user = db.relationship("User", foreign_keys=[user_id], lazy="joined")
-    uploaded_by = db.relationship("User", foreign_keys=[uploaded_by_id], lazy="joined")
-    published_by = db.relationship("User", foreign_keys=[published_by_id], lazy="joined")
+    user = db.relationship("User", foreign_keys=[user_id], lazy="select")
+    uploaded_by = db.relationship("User", foreign_keys=[uploaded_by_id], lazy="select")
+    published_by = db.relationship("User", foreign_keys=[published_by_id], lazy="select")
 
-    attachment_type_lookup = db.relationship("HRLookupItem", foreign_keys=[attachment_type_lookup_id], lazy="joined")
+    attachment_type_lookup = db.relationship("HRLookupItem", foreign_keys=[attachment_type_lookup_id], lazy="select")
 
     @property
     def payslip_period_label(self) -> str:
@@ -1845,10 +1940,10 @@ class EmployeeDependent(db.Model):
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     updated_by_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)
 
-    user = db.relationship('User', foreign_keys=[user_id], lazy='joined')
-    relation_lookup = db.relationship('HRLookupItem', foreign_keys=[relation_lookup_id], lazy='joined')
-    gender_lookup = db.relationship('HRLookupItem', foreign_keys=[gender_lookup_id], lazy='joined')
-    updated_by = db.relationship('User', foreign_keys=[updated_by_id], lazy='joined')
+    user = db.relationship('User', foreign_keys=[user_id], lazy='select')
+    relation_lookup = db.relationship('HRLookupItem', foreign_keys=[relation_lookup_id], lazy='select')
+    gender_lookup = db.relationship('HRLookupItem', foreign_keys=[gender_lookup_id], lazy='select')
+    updated_by = db.relationship('User', foreign_keys=[updated_by_id], lazy='select')
 
 
 class EmployeeQualification(db.Model):
@@ -1871,13 +1966,13 @@ class EmployeeQualification(db.Model):
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     updated_by_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)
 
-    user = db.relationship('User', foreign_keys=[user_id], lazy='joined')
-    degree_lookup = db.relationship('HRLookupItem', foreign_keys=[degree_lookup_id], lazy='joined')
-    specialization_lookup = db.relationship('HRLookupItem', foreign_keys=[specialization_lookup_id], lazy='joined')
-    grade_lookup = db.relationship('HRLookupItem', foreign_keys=[grade_lookup_id], lazy='joined')
-    university_lookup = db.relationship('HRLookupItem', foreign_keys=[university_lookup_id], lazy='joined')
-    country_lookup = db.relationship('HRLookupItem', foreign_keys=[country_lookup_id], lazy='joined')
-    updated_by = db.relationship('User', foreign_keys=[updated_by_id], lazy='joined')
+    user = db.relationship('User', foreign_keys=[user_id], lazy='select')
+    degree_lookup = db.relationship('HRLookupItem', foreign_keys=[degree_lookup_id], lazy='select')
+    specialization_lookup = db.relationship('HRLookupItem', foreign_keys=[specialization_lookup_id], lazy='select')
+    grade_lookup = db.relationship('HRLookupItem', foreign_keys=[grade_lookup_id], lazy='select')
+    university_lookup = db.relationship('HRLookupItem', foreign_keys=[university_lookup_id], lazy='select')
+    country_lookup = db.relationship('HRLookupItem', foreign_keys=[country_lookup_id], lazy='select')
+    updated_by = db.relationship('User', foreign_keys=[updated_by_id], lazy='select')
 
 
 class EmployeeSecondment(db.Model):
@@ -1906,18 +2001,18 @@ class EmployeeSecondment(db.Model):
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     updated_by_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)
 
-    user = db.relationship('User', foreign_keys=[user_id], lazy='joined')
-    organization = db.relationship('Organization', foreign_keys=[organization_id], lazy='joined')
-    directorate = db.relationship('Directorate', foreign_keys=[directorate_id], lazy='joined')
-    department = db.relationship('Department', foreign_keys=[department_id], lazy='joined')
-    division = db.relationship('Division', foreign_keys=[division_id], lazy='joined')
-    direct_manager = db.relationship('User', foreign_keys=[direct_manager_user_id], lazy='joined')
+    user = db.relationship('User', foreign_keys=[user_id], lazy='select')
+    organization = db.relationship('Organization', foreign_keys=[organization_id], lazy='select')
+    directorate = db.relationship('Directorate', foreign_keys=[directorate_id], lazy='select')
+    department = db.relationship('Department', foreign_keys=[department_id], lazy='select')
+    division = db.relationship('Division', foreign_keys=[division_id], lazy='select')
+    direct_manager = db.relationship('User', foreign_keys=[direct_manager_user_id], lazy='select')
 
-    work_governorate_lookup = db.relationship('HRLookupItem', foreign_keys=[work_governorate_lookup_id], lazy='joined')
-    work_location_lookup = db.relationship('HRLookupItem', foreign_keys=[work_location_lookup_id], lazy='joined')
-    admin_title_lookup = db.relationship('HRLookupItem', foreign_keys=[admin_title_lookup_id], lazy='joined')
+    work_governorate_lookup = db.relationship('HRLookupItem', foreign_keys=[work_governorate_lookup_id], lazy='select')
+    work_location_lookup = db.relationship('HRLookupItem', foreign_keys=[work_location_lookup_id], lazy='select')
+    admin_title_lookup = db.relationship('HRLookupItem', foreign_keys=[admin_title_lookup_id], lazy='select')
 
-    updated_by = db.relationship('User', foreign_keys=[updated_by_id], lazy='joined')
+    updated_by = db.relationship('User', foreign_keys=[updated_by_id], lazy='select')
 
 
 # =========================================================
@@ -1938,7 +2033,7 @@ class HRSSWorkflowDefinition(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     created_by_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=True)
 
-    created_by = db.relationship("User", foreign_keys=[created_by_id], lazy="joined")
+    created_by = db.relationship("User", foreign_keys=[created_by_id], lazy="select")
 class HRSSWorkflowStepDefinition(db.Model):
     """A step inside a definition. Approver can be a role or a specific user."""
     __tablename__ = "hr_ss_workflow_step_definition"
@@ -1954,7 +2049,7 @@ class HRSSWorkflowStepDefinition(db.Model):
     is_active = db.Column(db.Boolean, default=True, nullable=False)
 
     definition = db.relationship("HRSSWorkflowDefinition", backref=db.backref("steps", lazy="selectin"))
-    approver_user = db.relationship("User", foreign_keys=[approver_user_id], lazy="joined")
+    approver_user = db.relationship("User", foreign_keys=[approver_user_id], lazy="select")
 
     __table_args__ = (
         db.UniqueConstraint("definition_id", "step_no", name="uq_hr_ss_step_no"),
@@ -1991,7 +2086,7 @@ class HRSSRequest(db.Model):
     submitted_at = db.Column(db.DateTime, nullable=True)
     closed_at = db.Column(db.DateTime, nullable=True)
 
-    requester = db.relationship("User", foreign_keys=[requester_id], lazy="joined")
+    requester = db.relationship("User", foreign_keys=[requester_id], lazy="select")
 
     def payload(self) -> dict:
         try:
@@ -2017,8 +2112,8 @@ class HRSSRequestApproval(db.Model):
     acted_at = db.Column(db.DateTime, nullable=True)
 
     request = db.relationship("HRSSRequest", backref=db.backref("approvals", lazy="selectin"))
-    approver_user = db.relationship("User", foreign_keys=[approver_user_id], lazy="joined")
-    acted_by = db.relationship("User", foreign_keys=[acted_by_id], lazy="joined")
+    approver_user = db.relationship("User", foreign_keys=[approver_user_id], lazy="select")
+    acted_by = db.relationship("User", foreign_keys=[acted_by_id], lazy="select")
 
     __table_args__ = (
         db.UniqueConstraint("request_id", "step_no", name="uq_hr_ss_req_step"),
@@ -2044,8 +2139,8 @@ class HRSSRequestAttachment(db.Model):
 
 
     request = db.relationship("HRSSRequest", backref=db.backref("attachments", lazy="selectin"))
-    uploaded_by = db.relationship("User", foreign_keys=[uploaded_by_id], lazy="joined")
-    published_by = db.relationship("User", foreign_keys=[published_by_id], lazy="joined")
+    uploaded_by = db.relationship("User", foreign_keys=[uploaded_by_id], lazy="select")
+    published_by = db.relationship("User", foreign_keys=[published_by_id], lazy="select")
 
 
 # =========================================================
@@ -2074,11 +2169,11 @@ class HRDisciplinaryCase(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     closed_at = db.Column(db.DateTime, nullable=True)
 
-    employee = db.relationship("User", foreign_keys=[employee_id], lazy="joined")
-    created_by = db.relationship("User", foreign_keys=[created_by_id], lazy="joined")
-    work_governorate = db.relationship("HRLookupItem", foreign_keys=[work_governorate_lookup_id], lazy="joined")
-    work_location = db.relationship("HRLookupItem", foreign_keys=[work_location_lookup_id], lazy="joined")
-    assigned_to = db.relationship("User", foreign_keys=[assigned_to_id], lazy="joined")
+    employee = db.relationship("User", foreign_keys=[employee_id], lazy="select")
+    created_by = db.relationship("User", foreign_keys=[created_by_id], lazy="select")
+    work_governorate = db.relationship("HRLookupItem", foreign_keys=[work_governorate_lookup_id], lazy="select")
+    work_location = db.relationship("HRLookupItem", foreign_keys=[work_location_lookup_id], lazy="select")
+    assigned_to = db.relationship("User", foreign_keys=[assigned_to_id], lazy="select")
 
 
 class HRDisciplinaryAction(db.Model):
@@ -2093,7 +2188,7 @@ class HRDisciplinaryAction(db.Model):
     created_by_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=True)
 
     case = db.relationship("HRDisciplinaryCase", backref=db.backref("actions", lazy="selectin"))
-    created_by = db.relationship("User", foreign_keys=[created_by_id], lazy="joined")
+    created_by = db.relationship("User", foreign_keys=[created_by_id], lazy="select")
 class HRDisciplinaryAttachment(db.Model):
     __tablename__ = "hr_disciplinary_attachment"
 
@@ -2109,8 +2204,8 @@ class HRDisciplinaryAttachment(db.Model):
     published_by_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=True)
 
     case = db.relationship("HRDisciplinaryCase", backref=db.backref("attachments", lazy="selectin"))
-    uploaded_by = db.relationship("User", foreign_keys=[uploaded_by_id], lazy="joined")
-    published_by = db.relationship("User", foreign_keys=[published_by_id], lazy="joined")
+    uploaded_by = db.relationship("User", foreign_keys=[uploaded_by_id], lazy="select")
+    published_by = db.relationship("User", foreign_keys=[published_by_id], lazy="select")
 
 
 # =========================================================
@@ -2131,7 +2226,7 @@ class HRDoc(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     created_by_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=True)
 
-    created_by = db.relationship("User", foreign_keys=[created_by_id], lazy="joined")
+    created_by = db.relationship("User", foreign_keys=[created_by_id], lazy="select")
 class HRDocVersion(db.Model):
     __tablename__ = "hr_doc_version"
 
@@ -2151,8 +2246,8 @@ class HRDocVersion(db.Model):
     created_by_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=True)
 
     doc = db.relationship("HRDoc", backref=db.backref("versions", lazy="selectin"))
-    approved_by = db.relationship("User", foreign_keys=[approved_by_id], lazy="joined")
-    created_by = db.relationship("User", foreign_keys=[created_by_id], lazy="joined")
+    approved_by = db.relationship("User", foreign_keys=[approved_by_id], lazy="select")
+    created_by = db.relationship("User", foreign_keys=[created_by_id], lazy="select")
     __table_args__ = (
         db.UniqueConstraint("doc_id", "version_no", name="uq_hr_doc_version"),
     )
@@ -2189,7 +2284,7 @@ class WorkSchedule(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     created_by_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=True)
 
-    created_by = db.relationship("User", foreign_keys=[created_by_id], lazy="joined")
+    created_by = db.relationship("User", foreign_keys=[created_by_id], lazy="select")
 class WorkScheduleDay(db.Model):
     """Per-day configuration for SHIFT schedules."""
     __tablename__ = "work_schedule_day"
@@ -2223,9 +2318,9 @@ class EmployeeScheduleAssignment(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     created_by_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=True)
 
-    user = db.relationship("User", foreign_keys=[user_id], lazy="joined")
-    schedule = db.relationship("WorkSchedule", foreign_keys=[schedule_id], lazy="joined")
-    created_by = db.relationship("User", foreign_keys=[created_by_id], lazy="joined")
+    user = db.relationship("User", foreign_keys=[user_id], lazy="select")
+    schedule = db.relationship("WorkSchedule", foreign_keys=[schedule_id], lazy="select")
+    created_by = db.relationship("User", foreign_keys=[created_by_id], lazy="select")
     __table_args__ = (
         db.Index("ix_emp_schedule_user_active", "user_id", "is_active"),
     )
@@ -2257,7 +2352,7 @@ class WorkPolicy(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     created_by_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=True)
 
-    created_by = db.relationship("User", foreign_keys=[created_by_id], lazy="joined")
+    created_by = db.relationship("User", foreign_keys=[created_by_id], lazy="select")
 class WorkAssignment(db.Model):
     """Assign a schedule template + policy to a target (user/role/department) within a date range."""
     __tablename__ = "work_assignment"
@@ -2280,11 +2375,11 @@ class WorkAssignment(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     created_by_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=True)
 
-    schedule = db.relationship("WorkSchedule", foreign_keys=[schedule_id], lazy="joined")
-    policy = db.relationship("WorkPolicy", foreign_keys=[policy_id], lazy="joined")
-    user = db.relationship("User", foreign_keys=[target_user_id], lazy="joined")
-    department = db.relationship("Department", foreign_keys=[target_department_id], lazy="joined")
-    created_by = db.relationship("User", foreign_keys=[created_by_id], lazy="joined")
+    schedule = db.relationship("WorkSchedule", foreign_keys=[schedule_id], lazy="select")
+    policy = db.relationship("WorkPolicy", foreign_keys=[policy_id], lazy="select")
+    user = db.relationship("User", foreign_keys=[target_user_id], lazy="select")
+    department = db.relationship("Department", foreign_keys=[target_department_id], lazy="select")
+    created_by = db.relationship("User", foreign_keys=[created_by_id], lazy="select")
     __table_args__ = (
         db.Index("ix_work_assignment_active", "is_active", "target_type"),
     )
@@ -2305,7 +2400,7 @@ class HRPermissionType(db.Model):
 
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     created_by_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=True)
-    created_by = db.relationship("User", foreign_keys=[created_by_id], lazy="joined")
+    created_by = db.relationship("User", foreign_keys=[created_by_id], lazy="select")
 class HRLeaveType(db.Model):
     """Leave types (إجازات)."""
     __tablename__ = "hr_leave_type"
@@ -2332,7 +2427,7 @@ class HRLeaveType(db.Model):
 
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     created_by_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=True)
-    created_by = db.relationship("User", foreign_keys=[created_by_id], lazy="joined")
+    created_by = db.relationship("User", foreign_keys=[created_by_id], lazy="select")
 class HRLeaveGradeEntitlement(db.Model):
     """Per-grade annual entitlement (allowed days) per leave type.
 
@@ -2416,13 +2511,13 @@ class HRLeaveRequest(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
 
-    user = db.relationship("User", foreign_keys=[user_id], lazy="joined")
-    leave_type = db.relationship("HRLeaveType", foreign_keys=[leave_type_id], lazy="joined")
-    approver_user = db.relationship("User", foreign_keys=[approver_user_id], lazy="joined")
-    decided_by = db.relationship("User", foreign_keys=[decided_by_id], lazy="joined")
-    cancelled_by_user = db.relationship("User", foreign_keys=[cancelled_by_id], lazy="joined")
-    created_by = db.relationship('User', foreign_keys=[created_by_id], lazy='joined')
-    admin_status = db.relationship('HRStatusDef', foreign_keys=[admin_status_id], lazy='joined')
+    user = db.relationship("User", foreign_keys=[user_id], lazy="select")
+    leave_type = db.relationship("HRLeaveType", foreign_keys=[leave_type_id], lazy="select")
+    approver_user = db.relationship("User", foreign_keys=[approver_user_id], lazy="select")
+    decided_by = db.relationship("User", foreign_keys=[decided_by_id], lazy="select")
+    cancelled_by_user = db.relationship("User", foreign_keys=[cancelled_by_id], lazy="select")
+    created_by = db.relationship('User', foreign_keys=[created_by_id], lazy='select')
+    admin_status = db.relationship('HRStatusDef', foreign_keys=[admin_status_id], lazy='select')
 
     attachments = db.relationship("HRLeaveAttachment", back_populates="request", cascade="all, delete-orphan", lazy="selectin")
 
@@ -2452,8 +2547,8 @@ class HRLeaveAttachment(db.Model):
     uploaded_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     uploaded_by_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True, index=True)
 
-    request = db.relationship('HRLeaveRequest', back_populates='attachments', lazy='joined')
-    uploaded_by = db.relationship('User', foreign_keys=[uploaded_by_id], lazy='joined')
+    request = db.relationship('HRLeaveRequest', back_populates='attachments', lazy='select')
+    uploaded_by = db.relationship('User', foreign_keys=[uploaded_by_id], lazy='select')
 
     __table_args__ = (
         db.Index('ix_hr_leave_att_req', 'request_id'),
@@ -2525,12 +2620,12 @@ class HRPermissionRequest(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
 
-    user = db.relationship("User", foreign_keys=[user_id], lazy="joined")
-    permission_type = db.relationship("HRPermissionType", foreign_keys=[permission_type_id], lazy="joined")
-    approver_user = db.relationship("User", foreign_keys=[approver_user_id], lazy="joined")
-    decided_by = db.relationship("User", foreign_keys=[decided_by_id], lazy="joined")
-    cancelled_by_user = db.relationship("User", foreign_keys=[cancelled_by_id], lazy="joined")
-    created_by = db.relationship("User", foreign_keys=[created_by_id], lazy="joined")
+    user = db.relationship("User", foreign_keys=[user_id], lazy="select")
+    permission_type = db.relationship("HRPermissionType", foreign_keys=[permission_type_id], lazy="select")
+    approver_user = db.relationship("User", foreign_keys=[approver_user_id], lazy="select")
+    decided_by = db.relationship("User", foreign_keys=[decided_by_id], lazy="select")
+    cancelled_by_user = db.relationship("User", foreign_keys=[cancelled_by_id], lazy="select")
+    created_by = db.relationship("User", foreign_keys=[created_by_id], lazy="select")
     __table_args__ = (
         db.Index("ix_hr_perm_req_user_status", "user_id", "status"),
         db.Index("ix_hr_perm_req_approver_status", "approver_user_id", "status"),
@@ -2556,8 +2651,8 @@ class HRMonthlyPermissionAllowance(db.Model):
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     updated_by_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=True, index=True)
 
-    user = db.relationship("User", foreign_keys=[user_id], lazy="joined")
-    updated_by = db.relationship("User", foreign_keys=[updated_by_id], lazy="joined")
+    user = db.relationship("User", foreign_keys=[user_id], lazy="select")
+    updated_by = db.relationship("User", foreign_keys=[updated_by_id], lazy="select")
 
     __table_args__ = (
         db.UniqueConstraint("user_id", "year", "month", name="uq_hr_perm_allow_user_year_month"),
@@ -2593,8 +2688,8 @@ class AttendanceDailySummary(db.Model):
     status = db.Column(db.String(20), default="OK", nullable=False)  # OK/INCOMPLETE/ABSENT
     computed_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
 
-    user = db.relationship("User", foreign_keys=[user_id], lazy="joined")
-    schedule = db.relationship("WorkSchedule", foreign_keys=[schedule_id], lazy="joined")
+    user = db.relationship("User", foreign_keys=[user_id], lazy="select")
+    schedule = db.relationship("WorkSchedule", foreign_keys=[schedule_id], lazy="select")
 
     __table_args__ = (
         db.UniqueConstraint("user_id", "day", name="uq_att_daily_user_day"),
@@ -2623,7 +2718,7 @@ class AttendanceImportBatch(db.Model):
 
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
 
-    imported_by = db.relationship("User", foreign_keys=[imported_by_id], lazy="joined")
+    imported_by = db.relationship("User", foreign_keys=[imported_by_id], lazy="select")
 
     events = db.relationship(
         "AttendanceEvent",
@@ -2654,8 +2749,8 @@ class AttendanceEvent(db.Model):
     raw_line = db.Column(db.String(64), nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
 
-    user = db.relationship("User", foreign_keys=[user_id], lazy="joined")
-    batch = db.relationship("AttendanceImportBatch", foreign_keys=[batch_id], back_populates="events", lazy="joined")
+    user = db.relationship("User", foreign_keys=[user_id], lazy="select")
+    batch = db.relationship("AttendanceImportBatch", foreign_keys=[batch_id], back_populates="events", lazy="select")
 
     __table_args__ = (
         # Prevent duplicates across sync/import
@@ -2718,8 +2813,8 @@ class HRAttendanceSpecialCase(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False, index=True)
     created_by_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=True, index=True)
 
-    user = db.relationship("User", foreign_keys=[user_id], lazy="joined")
-    created_by = db.relationship("User", foreign_keys=[created_by_id], lazy="joined")
+    user = db.relationship("User", foreign_keys=[user_id], lazy="select")
+    created_by = db.relationship("User", foreign_keys=[created_by_id], lazy="select")
     __table_args__ = (
         db.Index("ix_hr_att_special_user_day", "user_id", "day"),
     )
@@ -2748,9 +2843,9 @@ class HRAttendanceClosing(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False, index=True)
     created_by_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=True, index=True)
 
-    created_by = db.relationship("User", foreign_keys=[created_by_id], lazy="joined")
-    work_governorate = db.relationship("HRLookupItem", foreign_keys=[work_governorate_lookup_id], lazy="joined")
-    work_location = db.relationship("HRLookupItem", foreign_keys=[work_location_lookup_id], lazy="joined")
+    created_by = db.relationship("User", foreign_keys=[created_by_id], lazy="select")
+    work_governorate = db.relationship("HRLookupItem", foreign_keys=[work_governorate_lookup_id], lazy="select")
+    work_location = db.relationship("HRLookupItem", foreign_keys=[work_location_lookup_id], lazy="select")
 
 class HRAttendanceDeductionConfig(db.Model):
     """Settings for attendance-based deductions (إعدادات الخصم)."""
@@ -2784,7 +2879,7 @@ class HRAttendanceDeductionConfig(db.Model):
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False, index=True)
     updated_by_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=True, index=True)
 
-    updated_by = db.relationship("User", foreign_keys=[updated_by_id], lazy="joined")
+    updated_by = db.relationship("User", foreign_keys=[updated_by_id], lazy="select")
 
 
 class HRAttendanceDeductionRun(db.Model):
@@ -2805,7 +2900,7 @@ class HRAttendanceDeductionRun(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False, index=True)
     created_by_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=True, index=True)
 
-    created_by = db.relationship("User", foreign_keys=[created_by_id], lazy="joined")
+    created_by = db.relationship("User", foreign_keys=[created_by_id], lazy="select")
 class HRAttendanceDeductionItem(db.Model):
     """Per-employee deduction totals linked to a run."""
 
@@ -2825,7 +2920,7 @@ class HRAttendanceDeductionItem(db.Model):
     note = db.Column(db.Text, nullable=True)
 
     run = db.relationship("HRAttendanceDeductionRun", backref=db.backref("items", lazy="selectin", cascade="all, delete-orphan"))
-    user = db.relationship("User", foreign_keys=[user_id], lazy="joined")
+    user = db.relationship("User", foreign_keys=[user_id], lazy="select")
 
     __table_args__ = (
         db.UniqueConstraint("run_id", "user_id", name="uq_hr_att_deduct_run_user"),
@@ -2855,9 +2950,9 @@ class HROfficialMission(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False, index=True)
     created_by_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=True, index=True)
 
-    user = db.relationship("User", foreign_keys=[user_id], lazy="joined")
-    created_by = db.relationship("User", foreign_keys=[created_by_id], lazy="joined")
-    status_def = db.relationship('HRStatusDef', foreign_keys=[status_def_id], lazy='joined')
+    user = db.relationship("User", foreign_keys=[user_id], lazy="select")
+    created_by = db.relationship("User", foreign_keys=[created_by_id], lazy="select")
+    status_def = db.relationship('HRStatusDef', foreign_keys=[status_def_id], lazy='select')
     attachments = db.relationship('HROfficialMissionAttachment', back_populates='mission', cascade='all, delete-orphan', lazy='selectin')
 class HROfficialOccasion(db.Model):
     """Official occasions (holidays/events)."""
@@ -2876,7 +2971,7 @@ class HROfficialOccasion(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False, index=True)
     created_by_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=True, index=True)
 
-    created_by = db.relationship("User", foreign_keys=[created_by_id], lazy="joined")
+    created_by = db.relationship("User", foreign_keys=[created_by_id], lazy="select")
 class HRRoom(db.Model):
     __tablename__ = "hr_room"
 
@@ -2906,8 +3001,8 @@ class HRRoomBooking(db.Model):
 
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False, index=True)
 
-    room = db.relationship("HRRoom", foreign_keys=[room_id], lazy="joined")
-    booked_by = db.relationship("User", foreign_keys=[booked_by_id], lazy="joined")
+    room = db.relationship("HRRoom", foreign_keys=[room_id], lazy="select")
+    booked_by = db.relationship("User", foreign_keys=[booked_by_id], lazy="select")
 
 # ======================
 # Portal Store (Repository)
@@ -2923,7 +3018,7 @@ class StoreCategory(db.Model):
     is_active = db.Column(db.Boolean, default=True, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
 
-    parent = db.relationship("StoreCategory", remote_side=[id], lazy="joined")
+    parent = db.relationship("StoreCategory", remote_side=[id], lazy="select")
 
     __table_args__ = (
         db.Index("ix_store_category_active", "is_active"),
@@ -2955,9 +3050,9 @@ class StoreFile(db.Model):
     deleted_at = db.Column(db.DateTime, nullable=True)
     deleted_by = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=True)
 
-    category = db.relationship("StoreCategory", foreign_keys=[category_id], lazy="joined")
-    uploader = db.relationship("User", foreign_keys=[uploader_id], lazy="joined")
-    deleted_by_user = db.relationship("User", foreign_keys=[deleted_by], lazy="joined")
+    category = db.relationship("StoreCategory", foreign_keys=[category_id], lazy="select")
+    uploader = db.relationship("User", foreign_keys=[uploader_id], lazy="select")
+    deleted_by_user = db.relationship("User", foreign_keys=[deleted_by], lazy="select")
 
     @property
     def display_name(self) -> str:
@@ -2994,9 +3089,9 @@ class StoreFilePermission(db.Model):
     shared_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     expires_at = db.Column(db.DateTime, nullable=True)
 
-    file = db.relationship("StoreFile", foreign_keys=[file_id], lazy="joined")
-    user = db.relationship("User", foreign_keys=[user_id], lazy="joined")
-    shared_by_user = db.relationship("User", foreign_keys=[shared_by], lazy="joined")
+    file = db.relationship("StoreFile", foreign_keys=[file_id], lazy="select")
+    user = db.relationship("User", foreign_keys=[user_id], lazy="select")
+    shared_by_user = db.relationship("User", foreign_keys=[shared_by], lazy="select")
 
     __table_args__ = (
         db.Index("ix_store_file_perm_file_user", "file_id", "user_id"),
@@ -3052,7 +3147,7 @@ class InvItem(db.Model):
     is_active = db.Column(db.Boolean, default=True, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
 
-    category = db.relationship("InvItemCategory", foreign_keys=[category_id], lazy="joined")
+    category = db.relationship("InvItemCategory", foreign_keys=[category_id], lazy="select")
 
     @property
     def label(self) -> str:
@@ -3083,9 +3178,9 @@ class InvIssueVoucher(db.Model):
     created_by_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=True, index=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False, index=True)
 
-    from_warehouse = db.relationship("InvWarehouse", foreign_keys=[from_warehouse_id], lazy="joined")
-    to_warehouse = db.relationship("InvWarehouse", foreign_keys=[to_warehouse_id], lazy="joined")
-    created_by = db.relationship("User", foreign_keys=[created_by_id], lazy="joined")
+    from_warehouse = db.relationship("InvWarehouse", foreign_keys=[from_warehouse_id], lazy="select")
+    to_warehouse = db.relationship("InvWarehouse", foreign_keys=[to_warehouse_id], lazy="select")
+    created_by = db.relationship("User", foreign_keys=[created_by_id], lazy="select")
 
     __table_args__ = (
         db.Index("ix_inv_issue_voucher_date_no", "voucher_date", "voucher_no"),
@@ -3107,8 +3202,8 @@ class InvIssueVoucherLine(db.Model):
 
     details = db.Column(db.Text, nullable=True)
 
-    voucher = db.relationship("InvIssueVoucher", foreign_keys=[voucher_id], lazy="joined")
-    item = db.relationship("InvItem", foreign_keys=[item_id], lazy="joined")
+    voucher = db.relationship("InvIssueVoucher", foreign_keys=[voucher_id], lazy="select")
+    item = db.relationship("InvItem", foreign_keys=[item_id], lazy="select")
 
 
 class InvIssueVoucherAttachment(db.Model):
@@ -3124,8 +3219,8 @@ class InvIssueVoucherAttachment(db.Model):
     uploaded_by_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=True, index=True)
     uploaded_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False, index=True)
 
-    voucher = db.relationship("InvIssueVoucher", foreign_keys=[voucher_id], lazy="joined")
-    uploaded_by = db.relationship("User", foreign_keys=[uploaded_by_id], lazy="joined")
+    voucher = db.relationship("InvIssueVoucher", foreign_keys=[voucher_id], lazy="select")
+    uploaded_by = db.relationship("User", foreign_keys=[uploaded_by_id], lazy="select")
 
 
 
@@ -3150,8 +3245,8 @@ class InvInboundVoucher(db.Model):
     created_by_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=True, index=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False, index=True)
 
-    to_warehouse = db.relationship("InvWarehouse", foreign_keys=[to_warehouse_id], lazy="joined")
-    created_by = db.relationship("User", foreign_keys=[created_by_id], lazy="joined")
+    to_warehouse = db.relationship("InvWarehouse", foreign_keys=[to_warehouse_id], lazy="select")
+    created_by = db.relationship("User", foreign_keys=[created_by_id], lazy="select")
 
     __table_args__ = (
         db.Index("ix_inv_inbound_voucher_date_no", "voucher_date", "voucher_no"),
@@ -3173,8 +3268,8 @@ class InvInboundVoucherLine(db.Model):
 
     details = db.Column(db.Text, nullable=True)
 
-    voucher = db.relationship("InvInboundVoucher", foreign_keys=[voucher_id], lazy="joined")
-    item = db.relationship("InvItem", foreign_keys=[item_id], lazy="joined")
+    voucher = db.relationship("InvInboundVoucher", foreign_keys=[voucher_id], lazy="select")
+    item = db.relationship("InvItem", foreign_keys=[item_id], lazy="select")
 
 
 class InvInboundVoucherAttachment(db.Model):
@@ -3190,8 +3285,8 @@ class InvInboundVoucherAttachment(db.Model):
     uploaded_by_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=True, index=True)
     uploaded_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False, index=True)
 
-    voucher = db.relationship("InvInboundVoucher", foreign_keys=[voucher_id], lazy="joined")
-    uploaded_by = db.relationship("User", foreign_keys=[uploaded_by_id], lazy="joined")
+    voucher = db.relationship("InvInboundVoucher", foreign_keys=[voucher_id], lazy="select")
+    uploaded_by = db.relationship("User", foreign_keys=[uploaded_by_id], lazy="select")
 
 
 # ----------------------
@@ -3213,8 +3308,8 @@ class InvScrapVoucher(db.Model):
     created_by_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=True, index=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False, index=True)
 
-    from_warehouse = db.relationship("InvWarehouse", foreign_keys=[from_warehouse_id], lazy="joined")
-    created_by = db.relationship("User", foreign_keys=[created_by_id], lazy="joined")
+    from_warehouse = db.relationship("InvWarehouse", foreign_keys=[from_warehouse_id], lazy="select")
+    created_by = db.relationship("User", foreign_keys=[created_by_id], lazy="select")
 
     __table_args__ = (
         db.Index("ix_inv_scrap_voucher_date_no", "voucher_date", "voucher_no"),
@@ -3234,8 +3329,8 @@ class InvScrapVoucherLine(db.Model):
     warranty_end = db.Column(db.String(10), nullable=True)
     details = db.Column(db.Text, nullable=True)
 
-    voucher = db.relationship("InvScrapVoucher", foreign_keys=[voucher_id], lazy="joined")
-    item = db.relationship("InvItem", foreign_keys=[item_id], lazy="joined")
+    voucher = db.relationship("InvScrapVoucher", foreign_keys=[voucher_id], lazy="select")
+    item = db.relationship("InvItem", foreign_keys=[item_id], lazy="select")
 
 
 class InvScrapVoucherAttachment(db.Model):
@@ -3251,8 +3346,8 @@ class InvScrapVoucherAttachment(db.Model):
     uploaded_by_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=True, index=True)
     uploaded_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False, index=True)
 
-    voucher = db.relationship("InvScrapVoucher", foreign_keys=[voucher_id], lazy="joined")
-    uploaded_by = db.relationship("User", foreign_keys=[uploaded_by_id], lazy="joined")
+    voucher = db.relationship("InvScrapVoucher", foreign_keys=[voucher_id], lazy="select")
+    uploaded_by = db.relationship("User", foreign_keys=[uploaded_by_id], lazy="select")
 
 
 # ----------------------
@@ -3276,8 +3371,8 @@ class InvReturnVoucher(db.Model):
     created_by_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=True, index=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False, index=True)
 
-    to_warehouse = db.relationship("InvWarehouse", foreign_keys=[to_warehouse_id], lazy="joined")
-    created_by = db.relationship("User", foreign_keys=[created_by_id], lazy="joined")
+    to_warehouse = db.relationship("InvWarehouse", foreign_keys=[to_warehouse_id], lazy="select")
+    created_by = db.relationship("User", foreign_keys=[created_by_id], lazy="select")
 
     __table_args__ = (
         db.Index("ix_inv_return_voucher_date_no", "voucher_date", "voucher_no"),
@@ -3297,8 +3392,8 @@ class InvReturnVoucherLine(db.Model):
     warranty_end = db.Column(db.String(10), nullable=True)
     details = db.Column(db.Text, nullable=True)
 
-    voucher = db.relationship("InvReturnVoucher", foreign_keys=[voucher_id], lazy="joined")
-    item = db.relationship("InvItem", foreign_keys=[item_id], lazy="joined")
+    voucher = db.relationship("InvReturnVoucher", foreign_keys=[voucher_id], lazy="select")
+    item = db.relationship("InvItem", foreign_keys=[item_id], lazy="select")
 
 
 class InvReturnVoucherAttachment(db.Model):
@@ -3314,8 +3409,8 @@ class InvReturnVoucherAttachment(db.Model):
     uploaded_by_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=True, index=True)
     uploaded_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False, index=True)
 
-    voucher = db.relationship("InvReturnVoucher", foreign_keys=[voucher_id], lazy="joined")
-    uploaded_by = db.relationship("User", foreign_keys=[uploaded_by_id], lazy="joined")
+    voucher = db.relationship("InvReturnVoucher", foreign_keys=[voucher_id], lazy="select")
+    uploaded_by = db.relationship("User", foreign_keys=[uploaded_by_id], lazy="select")
 
 
 class InvRequest(db.Model):
@@ -3337,9 +3432,9 @@ class InvRequest(db.Model):
 
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False, index=True)
 
-    department = db.relationship("Department", foreign_keys=[department_id], lazy="joined")
-    work_location = db.relationship("HRLookupItem", foreign_keys=[work_location_lookup_id], lazy="joined")
-    entered_by = db.relationship("User", foreign_keys=[entered_by_id], lazy="joined")
+    department = db.relationship("Department", foreign_keys=[department_id], lazy="select")
+    work_location = db.relationship("HRLookupItem", foreign_keys=[work_location_lookup_id], lazy="select")
+    entered_by = db.relationship("User", foreign_keys=[entered_by_id], lazy="select")
 
     __table_args__ = (
         db.Index("ix_inv_request_date", "request_date"),
@@ -3395,7 +3490,7 @@ class InvRoom(db.Model):
     is_active = db.Column(db.Boolean, default=True, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
 
-    unit = db.relationship("InvUnit", foreign_keys=[unit_id], lazy="joined")
+    unit = db.relationship("InvUnit", foreign_keys=[unit_id], lazy="select")
 
     __table_args__ = (
         db.Index("ix_inv_room_name_code", "name", "code"),
@@ -3427,8 +3522,8 @@ class InvStocktakeVoucher(db.Model):
     created_by_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=True, index=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False, index=True)
 
-    warehouse = db.relationship("InvWarehouse", foreign_keys=[warehouse_id], lazy="joined")
-    created_by = db.relationship("User", foreign_keys=[created_by_id], lazy="joined")
+    warehouse = db.relationship("InvWarehouse", foreign_keys=[warehouse_id], lazy="select")
+    created_by = db.relationship("User", foreign_keys=[created_by_id], lazy="select")
 
     __table_args__ = (
         db.Index("ix_inv_stocktake_voucher_date_no", "voucher_date", "voucher_no"),
@@ -3448,8 +3543,8 @@ class InvStocktakeVoucherLine(db.Model):
     warranty_end = db.Column(db.String(10), nullable=True)
     details = db.Column(db.Text, nullable=True)
 
-    voucher = db.relationship("InvStocktakeVoucher", foreign_keys=[voucher_id], lazy="joined")
-    item = db.relationship("InvItem", foreign_keys=[item_id], lazy="joined")
+    voucher = db.relationship("InvStocktakeVoucher", foreign_keys=[voucher_id], lazy="select")
+    item = db.relationship("InvItem", foreign_keys=[item_id], lazy="select")
 
 
 class InvStocktakeVoucherAttachment(db.Model):
@@ -3465,8 +3560,8 @@ class InvStocktakeVoucherAttachment(db.Model):
     uploaded_by_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=True, index=True)
     uploaded_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False, index=True)
 
-    voucher = db.relationship("InvStocktakeVoucher", foreign_keys=[voucher_id], lazy="joined")
-    uploaded_by = db.relationship("User", foreign_keys=[uploaded_by_id], lazy="joined")
+    voucher = db.relationship("InvStocktakeVoucher", foreign_keys=[voucher_id], lazy="select")
+    uploaded_by = db.relationship("User", foreign_keys=[uploaded_by_id], lazy="select")
 
 
 # ----------------------
@@ -3491,9 +3586,9 @@ class InvCustodyVoucher(db.Model):
     created_by_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=True, index=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False, index=True)
 
-    holder_user = db.relationship("User", foreign_keys=[holder_user_id], lazy="joined")
-    holder_room = db.relationship("InvRoom", foreign_keys=[holder_room_id], lazy="joined")
-    created_by = db.relationship("User", foreign_keys=[created_by_id], lazy="joined")
+    holder_user = db.relationship("User", foreign_keys=[holder_user_id], lazy="select")
+    holder_room = db.relationship("InvRoom", foreign_keys=[holder_room_id], lazy="select")
+    created_by = db.relationship("User", foreign_keys=[created_by_id], lazy="select")
 
     __table_args__ = (
         db.Index("ix_inv_custody_voucher_date_no", "voucher_date", "voucher_no"),
@@ -3513,8 +3608,8 @@ class InvCustodyVoucherLine(db.Model):
     warranty_end = db.Column(db.String(10), nullable=True)
     details = db.Column(db.Text, nullable=True)
 
-    voucher = db.relationship("InvCustodyVoucher", foreign_keys=[voucher_id], lazy="joined")
-    item = db.relationship("InvItem", foreign_keys=[item_id], lazy="joined")
+    voucher = db.relationship("InvCustodyVoucher", foreign_keys=[voucher_id], lazy="select")
+    item = db.relationship("InvItem", foreign_keys=[item_id], lazy="select")
 
 
 class InvCustodyVoucherAttachment(db.Model):
@@ -3530,8 +3625,8 @@ class InvCustodyVoucherAttachment(db.Model):
     uploaded_by_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=True, index=True)
     uploaded_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False, index=True)
 
-    voucher = db.relationship("InvCustodyVoucher", foreign_keys=[voucher_id], lazy="joined")
-    uploaded_by = db.relationship("User", foreign_keys=[uploaded_by_id], lazy="joined")
+    voucher = db.relationship("InvCustodyVoucher", foreign_keys=[voucher_id], lazy="select")
+    uploaded_by = db.relationship("User", foreign_keys=[uploaded_by_id], lazy="select")
 
 
 # ----------------------
@@ -3548,8 +3643,8 @@ class InvRoomRequester(db.Model):
     is_active = db.Column(db.Boolean, default=True, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
 
-    user = db.relationship("User", foreign_keys=[user_id], lazy="joined")
-    room = db.relationship("InvRoom", foreign_keys=[room_id], lazy="joined")
+    user = db.relationship("User", foreign_keys=[user_id], lazy="select")
+    room = db.relationship("InvRoom", foreign_keys=[room_id], lazy="select")
 
     __table_args__ = (
         db.Index("ix_inv_room_requester_user_room", "user_id", "room_id"),
@@ -3571,13 +3666,106 @@ class InvWarehousePermission(db.Model):
 
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
 
-    user = db.relationship("User", foreign_keys=[user_id], lazy="joined")
-    warehouse = db.relationship("InvWarehouse", foreign_keys=[warehouse_id], lazy="joined")
+    user = db.relationship("User", foreign_keys=[user_id], lazy="select")
+    warehouse = db.relationship("InvWarehouse", foreign_keys=[warehouse_id], lazy="select")
 
     __table_args__ = (
         db.UniqueConstraint("user_id", "warehouse_id", name="uq_inv_wh_perm_user_wh"),
     )
 
+
+# ----------------------
+# Inventory: Stock ledger + maintained balances
+# ----------------------
+
+class InvStockMovement(db.Model):
+    """One stock movement per (voucher line, warehouse).
+
+    Written by services/inventory_ledger.py in the same transaction as the voucher.
+
+    - INBOUND / RETURN / TRANSFER_IN: qty > 0
+    - ISSUE / SCRAP: qty < 0
+    - STOCKTAKE: qty is the counted quantity (baseline), not a delta
+    """
+
+    __tablename__ = "inv_stock_movement"
+
+    id = db.Column(db.Integer, primary_key=True)
+
+    warehouse_id = db.Column(db.Integer, db.ForeignKey("inv_warehouse.id"), nullable=False)
+    item_id = db.Column(db.Integer, db.ForeignKey("inv_item.id"), nullable=False)
+    movement_date = db.Column(db.String(10), nullable=False)  # YYYY-MM-DD (voucher_date)
+
+    kind = db.Column(db.String(20), nullable=False)
+    qty = db.Column(db.Float, nullable=False, default=0.0)
+
+    # Source voucher: INBOUND / RETURN / ISSUE / SCRAP / STOCKTAKE
+    voucher_type = db.Column(db.String(20), nullable=False)
+    voucher_id = db.Column(db.Integer, nullable=False)
+    voucher_no = db.Column(db.String(80), nullable=True)
+    line_id = db.Column(db.Integer, nullable=True)
+
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    __table_args__ = (
+        db.Index("ix_inv_stock_mv_wh_item_date", "warehouse_id", "item_id", "movement_date", "id"),
+        db.Index("ix_inv_stock_mv_item_date", "item_id", "movement_date", "id"),
+        db.Index("ix_inv_stock_mv_voucher", "voucher_type", "voucher_id"),
+    )
+
+
+class InvBalance(db.Model):
+    """Current balance per (warehouse, item), maintained from InvStockMovement.
+
+    baseline_* hold the latest stocktake for the pair (by voucher_date, voucher_id);
+    movements dated on/before the baseline date do not affect qty.
+    """
+
+    __tablename__ = "inv_balance"
+
+    warehouse_id = db.Column(db.Integer, db.ForeignKey("inv_warehouse.id"), primary_key=True)
+    item_id = db.Column(db.Integer, db.ForeignKey("inv_item.id"), primary_key=True)
+
+    qty = db.Column(db.Float, nullable=False, default=0.0)
+
+    baseline_date = db.Column(db.String(10), nullable=True)
+    baseline_voucher_id = db.Column(db.Integer, nullable=True)
+    baseline_qty = db.Column(db.Float, nullable=True)
+
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
+
+    __table_args__ = (
+        db.Index("ix_inv_balance_item", "item_id", "warehouse_id"),
+    )
+
+
+class InvBalanceSnapshot(db.Model):
+    """Month-end balances for one warehouse (compact: one row per (period, warehouse)).
+
+    data is JSON {"<item_id>": qty} for non-zero balances as of the last day of `period`.
+    flows is JSON {"<voucher_type>": {"qty": moved qty, "vouchers": count}} for the ledger
+    rows dated in `period` (yearly reports sum these instead of scanning vouchers).
+    Produced by jobs/inv_balance_snapshots.py; rows for a period and later are dropped
+    whenever a voucher dated in/before that period is posted.
+    """
+
+    __tablename__ = "inv_balance_snapshot"
+
+    id = db.Column(db.Integer, primary_key=True)
+    period = db.Column(db.String(7), nullable=False)  # YYYY-MM
+    warehouse_id = db.Column(db.Integer, db.ForeignKey("inv_warehouse.id"), nullable=False)
+
+    data = db.Column(db.Text, nullable=False, default="{}")
+    item_count = db.Column(db.Integer, nullable=False, default=0)
+    total_qty = db.Column(db.Float, nullable=False, default=0.0)
+    flows = db.Column(db.Text, nullable=True)
+
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    __table_args__ = (
+        db.UniqueConstraint("period", "warehouse_id", name="uq_inv_balance_snapshot_period_wh"),
+    )
+
 # ======================
 # Portal: Access Requests (Request permission within Portal)
 # ======================
@@ -3616,9 +3804,9 @@ class PortalAccessRequest(db.Model):
     assigned_to_user_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=True, index=True)
     assigned_role = db.Column(db.String(50), nullable=True, index=True)
 
-    user = db.relationship("User", foreign_keys=[user_id], lazy="joined")
-    decided_by = db.relationship("User", foreign_keys=[decided_by_id], lazy="joined")
-    assigned_to = db.relationship("User", foreign_keys=[assigned_to_user_id], lazy="joined")
+    user = db.relationship("User", foreign_keys=[user_id], lazy="select")
+    decided_by = db.relationship("User", foreign_keys=[decided_by_id], lazy="select")
+    assigned_to = db.relationship("User", foreign_keys=[assigned_to_user_id], lazy="select")
 
     __table_args__ = (
         db.Index("ix_portal_access_req_user_status", "user_id", "status"),
@@ -3657,7 +3845,7 @@ class PortalCircular(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     created_by_user_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=True)
 
-    created_by = db.relationship("User", foreign_keys=[created_by_user_id], lazy="joined")
+    created_by = db.relationship("User", foreign_keys=[created_by_user_id], lazy="select")
 # ======================
 # Portal: Saved Filters
 # ======================
@@ -3682,7 +3870,7 @@ class SavedFilter(db.Model):
 
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False, index=True)
 
-    owner = db.relationship("User", foreign_keys=[owner_id], lazy="joined")
+    owner = db.relationship("User", foreign_keys=[owner_id], lazy="select")
 
     __table_args__ = (
         db.UniqueConstraint("owner_id", "scope", "name", name="uq_saved_filter_owner_scope_name"),
@@ -3709,7 +3897,7 @@ class CorrCategory(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     created_by_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=True, index=True)
 
-    created_by = db.relationship("User", foreign_keys=[created_by_id], lazy="joined")
+    created_by = db.relationship("User", foreign_keys=[created_by_id], lazy="select")
     @property
     def label(self) -> str:
         return (self.name_ar or self.name_en or self.code or "").strip() or self.code
@@ -3733,7 +3921,7 @@ class CorrParty(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     created_by_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=True, index=True)
 
-    created_by = db.relationship("User", foreign_keys=[created_by_id], lazy="joined")
+    created_by = db.relationship("User", foreign_keys=[created_by_id], lazy="select")
     __table_args__ = (
         db.CheckConstraint("kind IN ('SENDER','RECIPIENT','BOTH')", name="ck_corr_party_kind"),
         db.Index("ix_corr_party_active_kind", "is_active", "kind"),
@@ -3767,7 +3955,7 @@ class InboundMail(db.Model):
     created_by_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=True, index=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False, index=True)
 
-    created_by = db.relationship("User", foreign_keys=[created_by_id], lazy="joined")
+    created_by = db.relationship("User", foreign_keys=[created_by_id], lazy="select")
     def __repr__(self) -> str:
         return f"<InboundMail id={self.id} ref={self.ref_no!r}>"
 
@@ -3794,7 +3982,7 @@ class OutboundMail(db.Model):
     created_by_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=True, index=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False, index=True)
 
-    created_by = db.relationship("User", foreign_keys=[created_by_id], lazy="joined")
+    created_by = db.relationship("User", foreign_keys=[created_by_id], lazy="select")
     def __repr__(self) -> str:
         return f"<OutboundMail id={self.id} ref={self.ref_no!r}>"
 
@@ -3816,20 +4004,20 @@ class CorrAttachment(db.Model):
     published_by_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=True, index=True)
     uploaded_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False, index=True)
 
-    uploaded_by = db.relationship("User", foreign_keys=[uploaded_by_id], lazy="joined")
-    published_by = db.relationship("User", foreign_keys=[published_by_id], lazy="joined")
+    uploaded_by = db.relationship("User", foreign_keys=[uploaded_by_id], lazy="select")
+    published_by = db.relationship("User", foreign_keys=[published_by_id], lazy="select")
 
     inbound = db.relationship(
         "InboundMail",
         foreign_keys=[inbound_id],
         backref=db.backref("attachments", lazy="dynamic", cascade="all, delete-orphan"),
-        lazy="joined",
+        lazy="select",
     )
     outbound = db.relationship(
         "OutboundMail",
         foreign_keys=[outbound_id],
         backref=db.backref("attachments", lazy="dynamic", cascade="all, delete-orphan"),
-        lazy="joined",
+        lazy="select",
     )
 
     __table_args__ = (
@@ -3886,7 +4074,7 @@ class HRPerformanceForm(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     created_by_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)
 
-    created_by = db.relationship('User', foreign_keys=[created_by_id], lazy='joined')
+    created_by = db.relationship('User', foreign_keys=[created_by_id], lazy='select')
 
 
 class HRPerformanceSection(db.Model):
@@ -3952,8 +4140,8 @@ class HRPerformanceCycle(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     created_by_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)
 
-    form = db.relationship('HRPerformanceForm', foreign_keys=[form_id], lazy='joined')
-    created_by = db.relationship('User', foreign_keys=[created_by_id], lazy='joined')
+    form = db.relationship('HRPerformanceForm', foreign_keys=[form_id], lazy='select')
+    created_by = db.relationship('User', foreign_keys=[created_by_id], lazy='select')
 
     __table_args__ = (
         db.CheckConstraint("status IN ('DRAFT','ACTIVE','CLOSED')", name='ck_hr_perf_cycle_status'),
@@ -3986,10 +4174,10 @@ class HRPerformanceAssignment(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     created_by_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)
 
-    cycle = db.relationship('HRPerformanceCycle', foreign_keys=[cycle_id], lazy='joined')
-    evaluatee = db.relationship('User', foreign_keys=[evaluatee_user_id], lazy='joined')
-    evaluator = db.relationship('User', foreign_keys=[evaluator_user_id], lazy='joined')
-    created_by = db.relationship('User', foreign_keys=[created_by_id], lazy='joined')
+    cycle = db.relationship('HRPerformanceCycle', foreign_keys=[cycle_id], lazy='select')
+    evaluatee = db.relationship('User', foreign_keys=[evaluatee_user_id], lazy='select')
+    evaluator = db.relationship('User', foreign_keys=[evaluator_user_id], lazy='select')
+    created_by = db.relationship('User', foreign_keys=[created_by_id], lazy='select')
 
     __table_args__ = (
         db.UniqueConstraint('cycle_id','evaluatee_user_id','evaluator_user_id','evaluator_type', name='uq_hr_perf_assign_unique'),
@@ -4037,9 +4225,9 @@ class TransportVehicle(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     created_by_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=True)
 
-    created_by = db.relationship("User", foreign_keys=[created_by_id], lazy="joined")
-    fuel_type_lookup = db.relationship("HRLookupItem", foreign_keys=[fuel_type_lookup_id], lazy="joined")
-    work_location_lookup = db.relationship("HRLookupItem", foreign_keys=[work_location_lookup_id], lazy="joined")
+    created_by = db.relationship("User", foreign_keys=[created_by_id], lazy="select")
+    fuel_type_lookup = db.relationship("HRLookupItem", foreign_keys=[fuel_type_lookup_id], lazy="select")
+    work_location_lookup = db.relationship("HRLookupItem", foreign_keys=[work_location_lookup_id], lazy="select")
     __table_args__ = (
         db.CheckConstraint("status IN ('ACTIVE','INACTIVE','MAINTENANCE')", name="ck_transport_vehicle_status"),
     )
@@ -4064,8 +4252,8 @@ class TransportDriver(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     created_by_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=True)
 
-    user = db.relationship("User", foreign_keys=[user_id], lazy="joined")
-    created_by = db.relationship("User", foreign_keys=[created_by_id], lazy="joined")
+    user = db.relationship("User", foreign_keys=[user_id], lazy="select")
+    created_by = db.relationship("User", foreign_keys=[created_by_id], lazy="select")
     __table_args__ = (
         db.CheckConstraint("status IN ('ACTIVE','INACTIVE')", name="ck_transport_driver_status"),
     )
@@ -4086,7 +4274,7 @@ class TransportZone(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     created_by_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=True)
 
-    created_by = db.relationship("User", foreign_keys=[created_by_id], lazy="joined")
+    created_by = db.relationship("User", foreign_keys=[created_by_id], lazy="select")
 class TransportPermit(db.Model):
     __tablename__ = "transport_permit"
 
@@ -4129,15 +4317,15 @@ class TransportPermit(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
 
-    requester = db.relationship("User", foreign_keys=[requester_user_id], lazy="joined")
-    approver = db.relationship("User", foreign_keys=[approver_user_id], lazy="joined")
-    deleted_by = db.relationship("User", foreign_keys=[deleted_by_id], lazy="joined")
+    requester = db.relationship("User", foreign_keys=[requester_user_id], lazy="select")
+    approver = db.relationship("User", foreign_keys=[approver_user_id], lazy="select")
+    deleted_by = db.relationship("User", foreign_keys=[deleted_by_id], lazy="select")
 
-    vehicle = db.relationship("TransportVehicle", foreign_keys=[vehicle_id], lazy="joined")
-    driver = db.relationship("TransportDriver", foreign_keys=[driver_id], lazy="joined")
+    vehicle = db.relationship("TransportVehicle", foreign_keys=[vehicle_id], lazy="select")
+    driver = db.relationship("TransportDriver", foreign_keys=[driver_id], lazy="select")
 
-    origin_zone = db.relationship("TransportZone", foreign_keys=[origin_zone_id], lazy="joined")
-    dest_zone = db.relationship("TransportZone", foreign_keys=[dest_zone_id], lazy="joined")
+    origin_zone = db.relationship("TransportZone", foreign_keys=[origin_zone_id], lazy="select")
+    dest_zone = db.relationship("TransportZone", foreign_keys=[dest_zone_id], lazy="select")
 
     __table_args__ = (
         db.CheckConstraint("status IN ('DRAFT','SUBMITTED','APPROVED','REJECTED','CANCELLED','COMPLETED')", name="ck_transport_permit_status"),
@@ -4175,11 +4363,11 @@ class TransportTrip(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     created_by_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=True)
 
-    permit = db.relationship("TransportPermit", foreign_keys=[permit_id], lazy="joined")
-    vehicle = db.relationship("TransportVehicle", foreign_keys=[vehicle_id], lazy="joined")
-    driver = db.relationship("TransportDriver", foreign_keys=[driver_id], lazy="joined")
-    created_by = db.relationship("User", foreign_keys=[created_by_id], lazy="joined")
-    deleted_by = db.relationship("User", foreign_keys=[deleted_by_id], lazy="joined")
+    permit = db.relationship("TransportPermit", foreign_keys=[permit_id], lazy="select")
+    vehicle = db.relationship("TransportVehicle", foreign_keys=[vehicle_id], lazy="select")
+    driver = db.relationship("TransportDriver", foreign_keys=[driver_id], lazy="select")
+    created_by = db.relationship("User", foreign_keys=[created_by_id], lazy="select")
+    deleted_by = db.relationship("User", foreign_keys=[deleted_by_id], lazy="select")
     __table_args__ = (
         db.Index("ix_transport_trip_vehicle_date", "vehicle_id", "started_at"),
     )
@@ -4203,13 +4391,52 @@ class TransportTripPoint(db.Model):
 
     raw_json = db.Column(db.Text, nullable=True)
 
-    trip = db.relationship("TransportTrip", foreign_keys=[trip_id], lazy="joined")
+    trip = db.relationship("TransportTrip", foreign_keys=[trip_id], lazy="select")
 
     __table_args__ = (
-        db.Index("ix_transport_trip_point_trip_seq", "trip_id", "seq"),
+        # one point per (trip, seq); ingestion inserts with ON CONFLICT DO NOTHING (services/tracking_ingest.py)
+        db.Index("ux_transport_trip_point_trip_seq", "trip_id", "seq", unique=True),
     )
 
 
+class TransportTripTrack(db.Model):
+    """Compacted GPS track of a closed trip (services/trip_tracks.py).
+
+    Once a trip is closed its TransportTripPoint rows are packed into one
+    blob (delta-encoded time / lat / lng / speed arrays, zlib) and deleted.
+    `simplified` holds the Douglas-Peucker reduced line used for display.
+    Times are milliseconds since base_at.
+    """
+
+    __tablename__ = "transport_trip_track"
+
+    id = db.Column(db.Integer, primary_key=True)
+
+    trip_id = db.Column(db.Integer, db.ForeignKey("transport_trip.id"), nullable=False, unique=True, index=True)
+
+    base_at = db.Column(db.DateTime, nullable=False)
+    first_at = db.Column(db.DateTime, nullable=True)
+    last_at = db.Column(db.DateTime, nullable=True)
+
+    point_count = db.Column(db.Integer, nullable=False, default=0)
+    data = db.Column(db.LargeBinary, nullable=False)
+
+    simplified_count = db.Column(db.Integer, nullable=False, default=0)
+    simplified = db.Column(db.LargeBinary, nullable=False)
+    simplify_tolerance_m = db.Column(db.Float, nullable=True)
+
+    gps_distance_km = db.Column(db.Float, nullable=True)
+    max_speed = db.Column(db.Float, nullable=True)
+
+    # Odometer cross-check (set at compaction, refreshed when the odometer is edited)
+    odometer_distance_km = db.Column(db.Float, nullable=True)
+    odometer_check = db.Column(db.String(20), nullable=True)  # OK / MISMATCH / NO_ODOMETER
+
+    compacted_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    trip = db.relationship("TransportTrip", foreign_keys=[trip_id], lazy="select")
+
+
 class TransportDriverTask(db.Model):
     __tablename__ = "transport_driver_task"
 
@@ -4230,10 +4457,10 @@ class TransportDriverTask(db.Model):
 
     completed_at = db.Column(db.DateTime, nullable=True)
 
-    driver = db.relationship("TransportDriver", foreign_keys=[driver_id], lazy="joined")
-    permit = db.relationship("TransportPermit", foreign_keys=[permit_id], lazy="joined")
-    trip = db.relationship("TransportTrip", foreign_keys=[trip_id], lazy="joined")
-    created_by = db.relationship("User", foreign_keys=[created_by_id], lazy="joined")
+    driver = db.relationship("TransportDriver", foreign_keys=[driver_id], lazy="select")
+    permit = db.relationship("TransportPermit", foreign_keys=[permit_id], lazy="select")
+    trip = db.relationship("TransportTrip", foreign_keys=[trip_id], lazy="select")
+    created_by = db.relationship("User", foreign_keys=[created_by_id], lazy="select")
     __table_args__ = (
         db.CheckConstraint("status IN ('PENDING','IN_PROGRESS','DONE','CANCELLED')", name="ck_transport_task_status"),
     )
@@ -4258,7 +4485,7 @@ class TransportDestination(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     created_by_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=True)
 
-    created_by = db.relationship("User", foreign_keys=[created_by_id], lazy="joined")
+    created_by = db.relationship("User", foreign_keys=[created_by_id], lazy="select")
 
 
 class TransportTripDestination(db.Model):
@@ -4271,8 +4498,8 @@ class TransportTripDestination(db.Model):
     seq = db.Column(db.Integer, nullable=False, default=0)
     note = db.Column(db.Text, nullable=True)
 
-    trip = db.relationship("TransportTrip", foreign_keys=[trip_id], lazy="joined")
-    destination = db.relationship("TransportDestination", foreign_keys=[destination_id], lazy="joined")
+    trip = db.relationship("TransportTrip", foreign_keys=[trip_id], lazy="select")
+    destination = db.relationship("TransportDestination", foreign_keys=[destination_id], lazy="select")
 
     __table_args__ = (
         db.Index("ix_transport_trip_dest_trip_seq", "trip_id", "seq"),
@@ -4297,9 +4524,9 @@ class TransportVehicleAttachment(db.Model):
     uploaded_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     uploaded_by_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=True, index=True)
 
-    vehicle = db.relationship("TransportVehicle", foreign_keys=[vehicle_id], lazy="joined")
-    uploaded_by = db.relationship("User", foreign_keys=[uploaded_by_id], lazy="joined")
-    attachment_type_lookup = db.relationship("HRLookupItem", foreign_keys=[attachment_type_lookup_id], lazy="joined")
+    vehicle = db.relationship("TransportVehicle", foreign_keys=[vehicle_id], lazy="select")
+    uploaded_by = db.relationship("User", foreign_keys=[uploaded_by_id], lazy="select")
+    attachment_type_lookup = db.relationship("HRLookupItem", foreign_keys=[attachment_type_lookup_id], lazy="select")
 
 
 class TransportMaintenance(db.Model):
@@ -4317,9 +4544,9 @@ class TransportMaintenance(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     created_by_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=True, index=True)
 
-    vehicle = db.relationship("TransportVehicle", foreign_keys=[vehicle_id], lazy="joined")
-    created_by = db.relationship("User", foreign_keys=[created_by_id], lazy="joined")
-    garage_lookup = db.relationship("HRLookupItem", foreign_keys=[garage_lookup_id], lazy="joined")
+    vehicle = db.relationship("TransportVehicle", foreign_keys=[vehicle_id], lazy="select")
+    created_by = db.relationship("User", foreign_keys=[created_by_id], lazy="select")
+    garage_lookup = db.relationship("HRLookupItem", foreign_keys=[garage_lookup_id], lazy="select")
 
 
 class TransportMaintenanceItem(db.Model):
@@ -4335,8 +4562,8 @@ class TransportMaintenanceItem(db.Model):
 
     note = db.Column(db.Text, nullable=True)
 
-    maintenance = db.relationship("TransportMaintenance", foreign_keys=[maintenance_id], lazy="joined")
-    maintenance_type_lookup = db.relationship("HRLookupItem", foreign_keys=[maintenance_type_lookup_id], lazy="joined")
+    maintenance = db.relationship("TransportMaintenance", foreign_keys=[maintenance_id], lazy="select")
+    maintenance_type_lookup = db.relationship("HRLookupItem", foreign_keys=[maintenance_type_lookup_id], lazy="select")
 
     __table_args__ = (
         db.Index("ix_transport_maint_item_maint", "maintenance_id"),
@@ -4357,8 +4584,8 @@ class TransportMaintenanceAttachment(db.Model):
     uploaded_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     uploaded_by_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=True, index=True)
 
-    maintenance = db.relationship("TransportMaintenance", foreign_keys=[maintenance_id], lazy="joined")
-    uploaded_by = db.relationship("User", foreign_keys=[uploaded_by_id], lazy="joined")
+    maintenance = db.relationship("TransportMaintenance", foreign_keys=[maintenance_id], lazy="select")
+    uploaded_by = db.relationship("User", foreign_keys=[uploaded_by_id], lazy="select")
 
 
 class TransportFuelFill(db.Model):
@@ -4382,10 +4609,43 @@ class TransportFuelFill(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     created_by_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=True, index=True)
 
-    vehicle = db.relationship("TransportVehicle", foreign_keys=[vehicle_id], lazy="joined")
-    created_by = db.relationship("User", foreign_keys=[created_by_id], lazy="joined")
-    payment_method_lookup = db.relationship("HRLookupItem", foreign_keys=[payment_method_lookup_id], lazy="joined")
-    station_lookup = db.relationship("HRLookupItem", foreign_keys=[station_lookup_id], lazy="joined")
+    vehicle = db.relationship("TransportVehicle", foreign_keys=[vehicle_id], lazy="select")
+    created_by = db.relationship("User", foreign_keys=[created_by_id], lazy="select")
+    payment_method_lookup = db.relationship("HRLookupItem", foreign_keys=[payment_method_lookup_id], lazy="select")
+    station_lookup = db.relationship("HRLookupItem", foreign_keys=[station_lookup_id], lazy="select")
+
+
+class TransportFleetMonth(db.Model):
+    """Per (vehicle, month) fleet aggregates for the analytics dashboards.
+
+    month is YYYY-MM (trip started_at, fuel fill_day, maintenance invoice_day;
+    created_at when the day is empty). Maintained by services/fleet_analytics.py
+    whenever trips, fuel fills or maintenance rows are flushed.
+    """
+    __tablename__ = "transport_fleet_month"
+    id = db.Column(db.Integer, primary_key=True)
+
+    vehicle_id = db.Column(db.Integer, db.ForeignKey("transport_vehicle.id"), nullable=False, index=True)
+    month = db.Column(db.String(7), nullable=False)
+
+    trips = db.Column(db.Integer, nullable=False, default=0)
+    distance_km = db.Column(db.Float, nullable=False, default=0.0)
+
+    fuel_fills = db.Column(db.Integer, nullable=False, default=0)
+    fuel_liters = db.Column(db.Float, nullable=False, default=0.0)
+    fuel_amount = db.Column(db.Float, nullable=False, default=0.0)
+
+    maintenance_count = db.Column(db.Integer, nullable=False, default=0)
+    maintenance_cost = db.Column(db.Float, nullable=False, default=0.0)
+
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    vehicle = db.relationship("TransportVehicle", foreign_keys=[vehicle_id], lazy="select")
+
+    __table_args__ = (
+        db.UniqueConstraint("vehicle_id", "month", name="uq_transport_fleet_month_key"),
+        db.Index("ix_transport_fleet_month_month", "month"),
+    )
 
 
 class TransportFuelFillAttachment(db.Model):
@@ -4402,8 +4662,8 @@ class TransportFuelFillAttachment(db.Model):
     uploaded_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     uploaded_by_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=True, index=True)
 
-    fuel_fill = db.relationship("TransportFuelFill", foreign_keys=[fuel_fill_id], lazy="joined")
-    uploaded_by = db.relationship("User", foreign_keys=[uploaded_by_id], lazy="joined")
+    fuel_fill = db.relationship("TransportFuelFill", foreign_keys=[fuel_fill_id], lazy="select")
+    uploaded_by = db.relationship("User", foreign_keys=[uploaded_by_id], lazy="select")
 
 
 
@@ -4421,7 +4681,7 @@ class HRStatusDef(db.Model):
 
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     created_by_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=True, index=True)
-    created_by = db.relationship("User", foreign_keys=[created_by_id], lazy="joined")
+    created_by = db.relationship("User", foreign_keys=[created_by_id], lazy="select")
 
     __table_args__ = (
         db.Index("ux_hr_status_def_entity_code", "entity", "code", unique=True),
@@ -4441,8 +4701,8 @@ class HROfficialMissionAttachment(db.Model):
     uploaded_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     uploaded_by_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=True, index=True)
 
-    mission = db.relationship("HROfficialMission", back_populates="attachments", lazy="joined")
-    uploaded_by = db.relationship("User", foreign_keys=[uploaded_by_id], lazy="joined")
+    mission = db.relationship("HROfficialMission", back_populates="attachments", lazy="select")
+    uploaded_by = db.relationship("User", foreign_keys=[uploaded_by_id], lazy="select")
 
 
 class HROfficialOccasionType(db.Model):
@@ -4456,7 +4716,7 @@ class HROfficialOccasionType(db.Model):
 
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     created_by_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=True, index=True)
-    created_by = db.relationship("User", foreign_keys=[created_by_id], lazy="joined")
+    created_by = db.relationship("User", foreign_keys=[created_by_id], lazy="select")
 
 
 class HROfficialOccasionRange(db.Model):
@@ -4479,11 +4739,11 @@ class HROfficialOccasionRange(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     created_by_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=True, index=True)
 
-    type = db.relationship("HROfficialOccasionType", foreign_keys=[type_id], lazy="joined")
-    created_by = db.relationship("User", foreign_keys=[created_by_id], lazy="joined")
+    type = db.relationship("HROfficialOccasionType", foreign_keys=[type_id], lazy="select")
+    created_by = db.relationship("User", foreign_keys=[created_by_id], lazy="select")
 
-    work_governorate_lookup = db.relationship("HRLookupItem", foreign_keys=[work_governorate_lookup_id], lazy="joined")
-    work_location_lookup = db.relationship("HRLookupItem", foreign_keys=[work_location_lookup_id], lazy="joined")
+    work_governorate_lookup = db.relationship("HRLookupItem", foreign_keys=[work_governorate_lookup_id], lazy="select")
+    work_location_lookup = db.relationship("HRLookupItem", foreign_keys=[work_location_lookup_id], lazy="select")
 
 
 # ======================
@@ -4509,8 +4769,8 @@ class HRTrainingCourse(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     created_by_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True, index=True)
 
-    category_lookup = db.relationship('HRLookupItem', foreign_keys=[category_lookup_id], lazy='joined')
-    created_by = db.relationship('User', foreign_keys=[created_by_id], lazy='joined')
+    category_lookup = db.relationship('HRLookupItem', foreign_keys=[category_lookup_id], lazy='select')
+    created_by = db.relationship('User', foreign_keys=[created_by_id], lazy='select')
 
 
 class HRTrainingProgram(db.Model):
@@ -4560,13 +4820,13 @@ class HRTrainingProgram(db.Model):
     created_by_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True, index=True)
     updated_by_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True, index=True)
 
-    course = db.relationship('HRTrainingCourse', foreign_keys=[course_id], lazy='joined')
+    course = db.relationship('HRTrainingCourse', foreign_keys=[course_id], lazy='select')
 
-    country_lookup = db.relationship('HRLookupItem', foreign_keys=[country_lookup_id], lazy='joined')
-    sponsor_lookup = db.relationship('HRLookupItem', foreign_keys=[sponsor_lookup_id], lazy='joined')
+    country_lookup = db.relationship('HRLookupItem', foreign_keys=[country_lookup_id], lazy='select')
+    sponsor_lookup = db.relationship('HRLookupItem', foreign_keys=[sponsor_lookup_id], lazy='select')
 
-    created_by = db.relationship('User', foreign_keys=[created_by_id], lazy='joined')
-    updated_by = db.relationship('User', foreign_keys=[updated_by_id], lazy='joined')
+    created_by = db.relationship('User', foreign_keys=[created_by_id], lazy='select')
+    updated_by = db.relationship('User', foreign_keys=[updated_by_id], lazy='select')
 
     conditions = db.relationship('HRTrainingCondition', back_populates='program', cascade='all, delete-orphan', lazy='selectin')
     attachments = db.relationship('HRTrainingAttachment', back_populates='program', cascade='all, delete-orphan', lazy='selectin')
@@ -4589,8 +4849,8 @@ class HRTrainingCondition(db.Model):
 
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
 
-    program = db.relationship('HRTrainingProgram', back_populates='conditions', lazy='joined')
-    field_lookup = db.relationship('HRLookupItem', foreign_keys=[field_lookup_id], lazy='joined')
+    program = db.relationship('HRTrainingProgram', back_populates='conditions', lazy='select')
+    field_lookup = db.relationship('HRLookupItem', foreign_keys=[field_lookup_id], lazy='select')
 
 
 class HRTrainingAttachment(db.Model):
@@ -4608,8 +4868,8 @@ class HRTrainingAttachment(db.Model):
     uploaded_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     uploaded_by_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True, index=True)
 
-    program = db.relationship('HRTrainingProgram', back_populates='attachments', lazy='joined')
-    uploaded_by = db.relationship('User', foreign_keys=[uploaded_by_id], lazy='joined')
+    program = db.relationship('HRTrainingProgram', back_populates='attachments', lazy='select')
+    uploaded_by = db.relationship('User', foreign_keys=[uploaded_by_id], lazy='select')
 
 
 class HRTrainingEnrollment(db.Model):
@@ -4626,8 +4886,8 @@ class HRTrainingEnrollment(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
 
-    program = db.relationship('HRTrainingProgram', back_populates='enrollments', lazy='joined')
-    user = db.relationship('User', foreign_keys=[user_id], lazy='joined')
+    program = db.relationship('HRTrainingProgram', back_populates='enrollments', lazy='select')
+    user = db.relationship('User', foreign_keys=[user_id], lazy='select')
 
     __table_args__ = (
         db.UniqueConstraint('program_id', 'user_id', name='uq_hr_training_enrollment_program_user'),
@@ -4675,10 +4935,91 @@ class EmployeeEvaluationRun(db.Model):
     created_by_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=True, index=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False, index=True)
 
-    user = db.relationship("User", foreign_keys=[user_id], lazy="joined")
-    created_by = db.relationship("User", foreign_keys=[created_by_id], lazy="joined")
+    user = db.relationship("User", foreign_keys=[user_id], lazy="select")
+    created_by = db.relationship("User", foreign_keys=[created_by_id], lazy="select")
 
     __table_args__ = (
         db.UniqueConstraint("user_id", "period_type", "year", "month", name="uq_eval_user_period"),
         db.Index("ix_eval_period", "period_type", "year", "month"),
-    )
\ No newline at end of file
+    )
+
+
+class ReportJob(db.Model):
+    """Background report run (services/report_jobs.py).
+
+    params_hash identifies report_key + normalized parameters; a DONE job whose
+    result file has not expired is reused for identical submissions.
+    Status: QUEUED / RUNNING / DONE / FAILED / EXPIRED.
+    """
+
+    __tablename__ = "report_job"
+
+    id = db.Column(db.Integer, primary_key=True)
+
+    report_key = db.Column(db.String(80), nullable=False, index=True)
+    params_json = db.Column(db.Text, nullable=False, default="{}")
+    params_hash = db.Column(db.String(64), nullable=False)
+
+    status = db.Column(db.String(20), nullable=False, default="QUEUED", index=True)
+    error = db.Column(db.Text, nullable=True)
+
+    row_count = db.Column(db.Integer, nullable=True)
+    result_file = db.Column(db.String(255), nullable=True)  # under instance/report_results
+    result_bytes = db.Column(db.Integer, nullable=True)
+
+    requested_by_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=True, index=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False, index=True)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    expires_at = db.Column(db.DateTime, nullable=True)
+
+    requested_by = db.relationship("User", foreign_keys=[requested_by_id], lazy="select")
+
+    __table_args__ = (
+        db.Index("ix_report_job_hash_status", "params_hash", "status"),
+    )
+
+
+class PayslipImportBatch(db.Model):
+    """Bulk payslip import (services/payslip_import.py).
+
+    Uploaded PDFs / ZIPs / combined PDFs are kept under
+    instance/payslip_imports/<source_dir> until the batch is DONE (a FAILED
+    batch keeps them so it can be retried).
+    Status: QUEUED / RUNNING / DONE / FAILED; stage: SCAN (pages / files) -> SAVE (employees).
+    """
+
+    __tablename__ = "payslip_import_batch"
+
+    id = db.Column(db.Integer, primary_key=True)
+
+    payslip_year = db.Column(db.Integer, nullable=False)
+    payslip_month = db.Column(db.Integer, nullable=False)
+
+    source_dir = db.Column(db.String(64), nullable=False)
+    source_names = db.Column(db.Text, nullable=True)  # uploaded file names, one per line
+    # pages without an employee number belong to the previous page's employee (multi-page slips)
+    continue_pages = db.Column(db.Boolean, default=False, nullable=False)
+
+    status = db.Column(db.String(20), nullable=False, default="QUEUED", index=True)
+    stage = db.Column(db.String(20), nullable=True)
+    total_items = db.Column(db.Integer, default=0, nullable=False)
+    processed_items = db.Column(db.Integer, default=0, nullable=False)
+
+    saved = db.Column(db.Integer, default=0, nullable=False)
+    skipped = db.Column(db.Integer, default=0, nullable=False)
+
+    # Short notes (first N lines) + fatal error
+    errors = db.Column(db.Text, nullable=True)
+    error = db.Column(db.Text, nullable=True)
+
+    imported_by_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=True, index=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False, index=True)
+    started_at = db.Column(db.DateTime, nullable=True)
+    heartbeat_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+    imported_by = db.relationship("User", foreign_keys=[imported_by_id], lazy="select")
+
+    def __repr__(self) -> str:
+        return f"<PayslipImportBatch id={self.id} {self.payslip_year}-{self.payslip_month:02d} {self.status}>"
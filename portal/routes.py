@@ -16,10 +16,11 @@ from io import BytesIO
 
 from flask import (
     render_template, request, redirect, url_for, flash, abort, current_app,
-    send_file, send_from_directory, has_request_context
+    send_file, send_from_directory, has_request_context, jsonify
 )
 
 from utils.portal_search import apply_search_all_columns
+from filters.employee_filters import any_employee, employee_ids_select
 
 from reportlab.pdfbase import pdfmetrics
 from reportlab.pdfbase.ttfonts import TTFont
@@ -49,6 +50,15 @@ require_permissions = perm_required
 
 from utils.events import emit_event
 from utils.org_dynamic import build_org_node_picker_tree
+from utils import loader_profiles
+from services import audit_rollup
+from services import audit_writer
+from services import inventory_ledger as inv_ledger
+from services import payslip_import
+from services import perf_cycle_generator
+from services import report_jobs
+from services import settings_service
+from services import training_eligibility
 from models import (
     User,
     EmployeeFile,
@@ -166,6 +176,8 @@ from models import (
     InvCustodyVoucherAttachment,
     InvRoomRequester,
     InvWarehousePermission,
+    ReportJob,
+    PayslipImportBatch,
 )
 
 # -------------------------
@@ -1793,7 +1805,7 @@ def admin_access_requests():
     q = (request.args.get("q") or "").strip()
     mine = (request.args.get("mine") or "").strip() == "1"
 
-    qry = PortalAccessRequest.query.join(User, PortalAccessRequest.user_id == User.id)
+    qry = PortalAccessRequest.query.options(*loader_profiles.options(PortalAccessRequest, "list")).join(User, PortalAccessRequest.user_id == User.id)
     if status != "ALL":
         qry = qry.filter(PortalAccessRequest.status == status)
     if service and service in defs:
@@ -2615,23 +2627,18 @@ def _hr_lookup_options(category: str):
 
 
 def _filtered_user_ids(employee_id=None, work_location_id=None, appointment_type_id=None, organization_id=None, directorate_id=None, department_id=None, division_id=None):
-    q = EmployeeFile.query
-    if employee_id:
-        q = q.filter(EmployeeFile.user_id == employee_id)
-    if work_location_id:
-        q = q.filter(EmployeeFile.work_location_lookup_id == work_location_id)
-    if appointment_type_id:
-        q = q.filter(EmployeeFile.appointment_type_lookup_id == appointment_type_id)
-
-    if organization_id:
-        q = q.filter(EmployeeFile.organization_id == organization_id)
-    if directorate_id:
-        q = q.filter(EmployeeFile.directorate_id == directorate_id)
-    if department_id:
-        q = q.filter(EmployeeFile.department_id == department_id)
-    if division_id:
-        q = q.filter(EmployeeFile.division_id == division_id)
-    return [r.user_id for r in q.with_entities(EmployeeFile.user_id).all()]
+    # Materialized list, only for reports that iterate the employees in Python.
+    # Everything else should semi-join employee_ids_select() instead.
+    stmt = employee_ids_select(
+        employee_id=employee_id,
+        work_location_id=work_location_id,
+        appointment_type_id=appointment_type_id,
+        organization_id=organization_id,
+        directorate_id=directorate_id,
+        department_id=department_id,
+        division_id=division_id,
+    )
+    return list(db.session.execute(stmt).scalars())
 
 
 def _cmp_ok(value: float, op: str, threshold: float):
@@ -2662,17 +2669,106 @@ def _export_xlsx(filename: str, headers: list[str], rows: list[list]):
     return send_file(bio, mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', as_attachment=True, download_name=filename)
 
 
-@portal_bp.route('/hr/reports/employees/promotions', methods=['GET'])
+def _int_param(params, key):
+    v = str(params.get(key) or '').strip()
+    return int(v) if v.isdigit() else None
+
+
+def _submit_report_job(report_key: str, params=None):
+    """Queue (or reuse) the background run of a registered report and show its status page."""
+    job = report_jobs.submit(report_key, request.args if params is None else params, user_id=current_user.id)
+    return redirect(url_for('portal.hr_report_job', job_id=job.id))
+
+
+def _report_job_or_404(job_id: int):
+    job = db.session.get(ReportJob, job_id)
+    spec = report_jobs.get_report(job.report_key) if job else None
+    if not job or not spec:
+        abort(404)
+    if spec.get('perm') and not current_user.has_perm(spec['perm']):
+        abort(403)
+    return job, spec
+
+
+def _report_job_dict(job, spec):
+    return {
+        'id': job.id,
+        'report': spec['title'],
+        'status': job.status,
+        'rows': job.row_count,
+        'bytes': job.result_bytes,
+        'error': job.error,
+        'created_at': job.created_at.isoformat(timespec='seconds') if job.created_at else None,
+        'finished_at': job.finished_at.isoformat(timespec='seconds') if job.finished_at else None,
+        'expires_at': job.expires_at.isoformat(timespec='seconds') if job.expires_at else None,
+    }
+
+
+@portal_bp.route('/hr/reports/jobs', methods=['GET'])
 @login_required
 @_perm(HR_REPORTS_VIEW)
-def hr_report_promotions():
-    from_date = _parse_yyyy_mm_dd(request.args.get('from') or request.args.get('from_date'))
-    to_date = _parse_yyyy_mm_dd(request.args.get('to') or request.args.get('to_date'))
-    work_location_id = (request.args.get('work_location_id') or '').strip()
-    work_location_id = int(work_location_id) if work_location_id.isdigit() else None
+def hr_report_jobs():
+    jobs = (
+        ReportJob.query
+        .filter(ReportJob.requested_by_id == current_user.id)
+        .order_by(ReportJob.id.desc())
+        .limit(50)
+        .all()
+    )
+    rows = []
+    for job in jobs:
+        spec = report_jobs.get_report(job.report_key)
+        if spec:
+            rows.append({'job': job, 'title': spec['title'], 'params': json.loads(job.params_json or '{}')})
+    return render_template('portal/hr/report_jobs.html', rows=rows, queue_depth=report_jobs.queue_depth())
 
-    years = 4  # default policy
-    q = EmployeeFile.query.join(User, User.id == EmployeeFile.user_id)
+
+@portal_bp.route('/hr/reports/jobs/<int:job_id>', methods=['GET'])
+@login_required
+@_perm(HR_REPORTS_VIEW)
+def hr_report_job(job_id):
+    job, spec = _report_job_or_404(job_id)
+    return render_template(
+        'portal/hr/report_job.html',
+        job=job,
+        title=spec['title'],
+        params=json.loads(job.params_json or '{}'),
+    )
+
+
+@portal_bp.route('/hr/reports/jobs/<int:job_id>.json', methods=['GET'])
+@login_required
+@_perm(HR_REPORTS_VIEW)
+def hr_report_job_status(job_id):
+    job, spec = _report_job_or_404(job_id)
+    return jsonify(_report_job_dict(job, spec))
+
+
+@portal_bp.route('/hr/reports/jobs/<int:job_id>/download', methods=['GET'])
+@login_required
+@_perm(HR_REPORTS_VIEW)
+def hr_report_job_download(job_id):
+    job, spec = _report_job_or_404(job_id)
+    result = report_jobs.load_result(job)
+    if result is None:
+        flash('نتيجة التقرير غير متاحة (لم تكتمل أو انتهت صلاحيتها). أعد طلب التصدير.', 'warning')
+        return redirect(url_for('portal.hr_report_job', job_id=job.id))
+
+    fmt = (request.args.get('format') or 'xlsx').lower()
+    if fmt == 'csv':
+        resp = current_app.response_class(report_jobs.csv_chunks(result), mimetype='text/csv; charset=utf-8')
+        resp.headers['Content-Disposition'] = f'attachment; filename={spec["filename"]}.csv'
+        return resp
+    return send_file(
+        report_jobs.xlsx_file(result),
+        mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+        as_attachment=True,
+        download_name=f'{spec["filename"]}.xlsx',
+    )
+
+
+def _hr_promotions_rows(from_date, to_date, work_location_id, years=4):
+    q = EmployeeFile.query.options(*loader_profiles.options(EmployeeFile, 'list')).join(User, User.id == EmployeeFile.user_id)
     if work_location_id:
         q = q.filter(EmployeeFile.work_location_lookup_id == work_location_id)
     q = q.order_by(func.coalesce(EmployeeFile.full_name_quad, User.name, User.email).asc())
@@ -2693,29 +2789,50 @@ def hr_report_promotions():
             'base_date': base,
             'due_date': due,
         })
+    return rows_view
 
-    work_locations = _hr_lookup_options('WORK_LOCATION')
-    work_location_map = {x.id: x.name for x in (work_locations or [])}
 
+def _job_hr_promotions(params):
+    rows_view = _hr_promotions_rows(
+        _parse_yyyy_mm_dd(params.get('from') or params.get('from_date')),
+        _parse_yyyy_mm_dd(params.get('to') or params.get('to_date')),
+        _int_param(params, 'work_location_id'),
+    )
+    loc_map = {x.id: x.name for x in (_hr_lookup_options('WORK_LOCATION') or [])}
+    headers = ['الرقم الوظيفي', 'الموظف', 'موقع العمل', 'تاريخ آخر ترقية/تعيين', 'تاريخ الاستحقاق']
+    xrows = []
+    for r in rows_view:
+        xrows.append([
+            r['ef'].employee_no or '',
+            (r['ef'].full_name_quad or r['user'].full_name or r['user'].name or r['user'].email),
+            loc_map.get(r['ef'].work_location_lookup_id, ''),
+            r['base_date'].strftime('%Y-%m-%d'),
+            r['due_date'].strftime('%Y-%m-%d'),
+        ])
+    return headers, xrows
+
+
+report_jobs.register('hr_promotions', 'الترقيات المستحقة', _job_hr_promotions, filename='hr_promotions_due', perm=HR_REPORTS_EXPORT)
+
+
+@portal_bp.route('/hr/reports/employees/promotions', methods=['GET'])
+@login_required
+@_perm(HR_REPORTS_VIEW)
+def hr_report_promotions():
     if (request.args.get('export') or '').lower() == 'xlsx':
         if not current_user.has_perm(HR_REPORTS_EXPORT):
             abort(403)
-        headers = ['الرقم الوظيفي', 'الموظف', 'موقع العمل', 'تاريخ آخر ترقية/تعيين', 'تاريخ الاستحقاق']
-        xrows = []
-        for r in rows_view:
-            loc = ''
-            try:
-                loc = next((x.name for x in work_locations if x.id == r['ef'].work_location_lookup_id), '')
-            except Exception:
-                loc = ''
-            xrows.append([
-                r['ef'].employee_no or '',
-                (r['ef'].full_name_quad or r['user'].full_name or r['user'].name or r['user'].email),
-                loc,
-                r['base_date'].strftime('%Y-%m-%d'),
-                r['due_date'].strftime('%Y-%m-%d'),
-            ])
-        return _export_xlsx('hr_promotions_due.xlsx', headers, xrows)
+        return _submit_report_job('hr_promotions')
+
+    from_date = _parse_yyyy_mm_dd(request.args.get('from') or request.args.get('from_date'))
+    to_date = _parse_yyyy_mm_dd(request.args.get('to') or request.args.get('to_date'))
+    work_location_id = (request.args.get('work_location_id') or '').strip()
+    work_location_id = int(work_location_id) if work_location_id.isdigit() else None
+
+    rows_view = _hr_promotions_rows(from_date, to_date, work_location_id)
+
+    work_locations = _hr_lookup_options('WORK_LOCATION')
+    work_location_map = {x.id: x.name for x in (work_locations or [])}
 
     return render_template(
         'portal/hr/reports_promotions.html',
@@ -2729,17 +2846,8 @@ def hr_report_promotions():
     )
 
 
-@portal_bp.route('/hr/reports/employees/retirement', methods=['GET'])
-@login_required
-@_perm(HR_REPORTS_VIEW)
-def hr_report_retirement():
-    from_date = _parse_yyyy_mm_dd(request.args.get('from') or request.args.get('from_date'))
-    to_date = _parse_yyyy_mm_dd(request.args.get('to') or request.args.get('to_date'))
-    work_location_id = (request.args.get('work_location_id') or '').strip()
-    work_location_id = int(work_location_id) if work_location_id.isdigit() else None
-
-    retirement_age = 60
-    q = EmployeeFile.query.join(User, User.id == EmployeeFile.user_id)
+def _hr_retirement_rows(from_date, to_date, work_location_id, retirement_age=60):
+    q = EmployeeFile.query.options(*loader_profiles.options(EmployeeFile, 'list')).join(User, User.id == EmployeeFile.user_id)
     if work_location_id:
         q = q.filter(EmployeeFile.work_location_lookup_id == work_location_id)
     q = q.order_by(func.coalesce(EmployeeFile.full_name_quad, User.name, User.email).asc())
@@ -2755,29 +2863,50 @@ def hr_report_retirement():
         if to_date and ret_date > to_date:
             continue
         rows_view.append({'user': ef.user, 'ef': ef, 'birth_date': bd, 'retirement_date': ret_date})
+    return rows_view
 
-    work_locations = _hr_lookup_options('WORK_LOCATION')
-    work_location_map = {x.id: x.name for x in (work_locations or [])}
 
+def _job_hr_retirement(params):
+    rows_view = _hr_retirement_rows(
+        _parse_yyyy_mm_dd(params.get('from') or params.get('from_date')),
+        _parse_yyyy_mm_dd(params.get('to') or params.get('to_date')),
+        _int_param(params, 'work_location_id'),
+    )
+    loc_map = {x.id: x.name for x in (_hr_lookup_options('WORK_LOCATION') or [])}
+    headers = ['الرقم الوظيفي', 'الموظف', 'موقع العمل', 'تاريخ الميلاد', 'تاريخ التقاعد المتوقع']
+    xrows = []
+    for r in rows_view:
+        xrows.append([
+            r['ef'].employee_no or '',
+            (r['ef'].full_name_quad or r['user'].full_name or r['user'].name or r['user'].email),
+            loc_map.get(r['ef'].work_location_lookup_id, ''),
+            r['birth_date'].strftime('%Y-%m-%d'),
+            r['retirement_date'].strftime('%Y-%m-%d'),
+        ])
+    return headers, xrows
+
+
+report_jobs.register('hr_retirement', 'التقاعد', _job_hr_retirement, filename='hr_retirement', perm=HR_REPORTS_EXPORT)
+
+
+@portal_bp.route('/hr/reports/employees/retirement', methods=['GET'])
+@login_required
+@_perm(HR_REPORTS_VIEW)
+def hr_report_retirement():
     if (request.args.get('export') or '').lower() == 'xlsx':
         if not current_user.has_perm(HR_REPORTS_EXPORT):
             abort(403)
-        headers = ['الرقم الوظيفي', 'الموظف', 'موقع العمل', 'تاريخ الميلاد', 'تاريخ التقاعد المتوقع']
-        xrows = []
-        for r in rows_view:
-            loc = ''
-            try:
-                loc = next((x.name for x in work_locations if x.id == r['ef'].work_location_lookup_id), '')
-            except Exception:
-                loc = ''
-            xrows.append([
-                r['ef'].employee_no or '',
-                (r['ef'].full_name_quad or r['user'].full_name or r['user'].name or r['user'].email),
-                loc,
-                r['birth_date'].strftime('%Y-%m-%d'),
-                r['retirement_date'].strftime('%Y-%m-%d'),
-            ])
-        return _export_xlsx('hr_retirement.xlsx', headers, xrows)
+        return _submit_report_job('hr_retirement')
+
+    from_date = _parse_yyyy_mm_dd(request.args.get('from') or request.args.get('from_date'))
+    to_date = _parse_yyyy_mm_dd(request.args.get('to') or request.args.get('to_date'))
+    work_location_id = (request.args.get('work_location_id') or '').strip()
+    work_location_id = int(work_location_id) if work_location_id.isdigit() else None
+
+    rows_view = _hr_retirement_rows(from_date, to_date, work_location_id)
+
+    work_locations = _hr_lookup_options('WORK_LOCATION')
+    work_location_map = {x.id: x.name for x in (work_locations or [])}
 
     return render_template(
         'portal/hr/reports_retirement.html',
@@ -2802,13 +2931,9 @@ def hr_report_last_login():
     from_date = _parse_yyyy_mm_dd(request.args.get('from') or request.args.get('from_date'))
     to_date = _parse_yyyy_mm_dd(request.args.get('to') or request.args.get('to_date'))
 
-    user_ids = _filtered_user_ids(employee_id=employee_id, work_location_id=work_location_id)
-    q = User.query
-    if user_ids:
-        q = q.filter(User.id.in_(user_ids))
-    else:
-        # if filters produce no ids, show none
-        q = q.filter(text('1=0'))
+    # filters matching no employee file show none (empty semi-join)
+    user_ids = employee_ids_select(employee_id=employee_id, work_location_id=work_location_id)
+    q = User.query.filter(User.id.in_(user_ids))
 
     q = q.filter(User.last_login_success_at.isnot(None)).order_by(User.last_login_success_at.desc())
     if from_date:
@@ -2885,8 +3010,8 @@ def hr_report_attendance_permissions():
     work_locations = _hr_lookup_options('WORK_LOCATION')
     appointment_types = _hr_lookup_options('APPOINTMENT_TYPE')
 
-    user_ids = _filtered_user_ids(employee_id=employee_id, work_location_id=work_location_id, appointment_type_id=appointment_type_id)
-    if not user_ids:
+    user_ids = employee_ids_select(employee_id=employee_id, work_location_id=work_location_id, appointment_type_id=appointment_type_id)
+    if not any_employee(user_ids):
         rows_view = []
     else:
         rows_view = []
@@ -3039,8 +3164,8 @@ def hr_report_delay():
     users = _list_hr_users()
     work_locations = _hr_lookup_options('WORK_LOCATION')
 
-    user_ids = _filtered_user_ids(employee_id=employee_id, work_location_id=work_location_id)
-    if not user_ids:
+    user_ids = employee_ids_select(employee_id=employee_id, work_location_id=work_location_id)
+    if not any_employee(user_ids):
         rows_view = []
     else:
         q = AttendanceDailySummary.query.filter(AttendanceDailySummary.user_id.in_(user_ids))
@@ -3131,8 +3256,8 @@ def hr_report_employee_attendance():
 
     rows_view = []
     if employee_id:
-        user_ids = _filtered_user_ids(employee_id=employee_id, work_location_id=work_location_id)
-        if user_ids:
+        user_ids = employee_ids_select(employee_id=employee_id, work_location_id=work_location_id)
+        if any_employee(user_ids):
             q = AttendanceDailySummary.query.filter(AttendanceDailySummary.user_id == employee_id)
             if from_date:
                 q = q.filter(AttendanceDailySummary.day >= from_date.strftime('%Y-%m-%d'))
@@ -3219,7 +3344,7 @@ def hr_report_employees_attendance():
     depts = Department.query.filter(Department.is_active.is_(True)).order_by(Department.name_ar.asc()).all()
     divs = Division.query.filter(Division.is_active.is_(True)).order_by(Division.name_ar.asc()).all()
 
-    user_ids = _filtered_user_ids(
+    user_ids = employee_ids_select(
         work_location_id=work_location_id,
         appointment_type_id=appointment_type_id,
         organization_id=organization_id,
@@ -3229,7 +3354,7 @@ def hr_report_employees_attendance():
     )
 
     rows = []
-    if user_ids:
+    if any_employee(user_ids):
         q = AttendanceDailySummary.query.filter(AttendanceDailySummary.user_id.in_(user_ids))
         if from_date:
             q = q.filter(AttendanceDailySummary.day >= from_date.strftime('%Y-%m-%d'))
@@ -3313,51 +3438,10 @@ def hr_report_employees_attendance():
     )
 
 
-@portal_bp.route('/hr/reports/attendance/summary', methods=['GET'])
-@login_required
-@_perm(HR_REPORTS_VIEW)
-def hr_report_attendance_summary():
-    """تقرير دوام تجميعي: (اختياري) الموظف + موقع العمل + الهيكل التنظيمي + نطاق التاريخ."""
-
-    employee_id = (request.args.get('user_id') or '').strip()
-    employee_id = int(employee_id) if employee_id.isdigit() else None
-
-    work_location_id = (request.args.get('work_location_id') or '').strip()
-    work_location_id = int(work_location_id) if work_location_id.isdigit() else None
-
-    organization_id = (request.args.get('organization_id') or '').strip()
-    organization_id = int(organization_id) if organization_id.isdigit() else None
-
-    directorate_id = (request.args.get('directorate_id') or '').strip()
-    directorate_id = int(directorate_id) if directorate_id.isdigit() else None
-
-    department_id = (request.args.get('department_id') or '').strip()
-    department_id = int(department_id) if department_id.isdigit() else None
-
-    division_id = (request.args.get('division_id') or '').strip()
-    division_id = int(division_id) if division_id.isdigit() else None
-
-    from_date = _parse_yyyy_mm_dd(request.args.get('from') or request.args.get('from_date'))
-    to_date = _parse_yyyy_mm_dd(request.args.get('to') or request.args.get('to_date'))
-
-    if (not from_date) and (not to_date):
-        try:
-            today = date.today()
-            from_date = date(today.year, today.month, 1)
-            to_date = today
-        except Exception:
-            pass
-
-    users = _list_hr_users()
-    work_locations = _hr_lookup_options('WORK_LOCATION')
-    loc_map = {x.id: x.name for x in (work_locations or [])}
-
-    orgs = Organization.query.filter(Organization.is_active.is_(True)).order_by(Organization.name_ar.asc()).all()
-    dirs = Directorate.query.filter(Directorate.is_active.is_(True)).order_by(Directorate.name_ar.asc()).all()
-    depts = Department.query.filter(Department.is_active.is_(True)).order_by(Department.name_ar.asc()).all()
-    divs = Division.query.filter(Division.is_active.is_(True)).order_by(Division.name_ar.asc()).all()
+def _hr_attendance_summary_rows(employee_id, work_location_id, organization_id, directorate_id, department_id, division_id, from_date, to_date):
+    loc_map = {x.id: x.name for x in (_hr_lookup_options('WORK_LOCATION') or [])}
 
-    user_ids = _filtered_user_ids(
+    user_ids = employee_ids_select(
         employee_id=employee_id,
         work_location_id=work_location_id,
         organization_id=organization_id,
@@ -3367,7 +3451,7 @@ def hr_report_attendance_summary():
     )
 
     rows = []
-    if user_ids:
+    if any_employee(user_ids):
         q = AttendanceDailySummary.query.filter(AttendanceDailySummary.user_id.in_(user_ids))
         if from_date:
             q = q.filter(AttendanceDailySummary.day >= from_date.strftime('%Y-%m-%d'))
@@ -3418,32 +3502,104 @@ def hr_report_attendance_summary():
             })
 
         rows.sort(key=lambda r: (r.get('name') or ''), reverse=False)
+    return rows
+
+
+def _job_hr_attendance_summary(params):
+    from_date = _parse_yyyy_mm_dd(params.get('from') or params.get('from_date'))
+    to_date = _parse_yyyy_mm_dd(params.get('to') or params.get('to_date'))
+    rows = _hr_attendance_summary_rows(
+        _int_param(params, 'user_id'),
+        _int_param(params, 'work_location_id'),
+        _int_param(params, 'organization_id'),
+        _int_param(params, 'directorate_id'),
+        _int_param(params, 'department_id'),
+        _int_param(params, 'division_id'),
+        from_date,
+        to_date,
+    )
+    headers = ['من تاريخ', 'إلى تاريخ', 'الرقم الوظيفي', 'الموظف', 'موقع العمل', 'الإدارة العامة', 'الدائرة', 'القسم', 'الشعبة', 'عدد الأيام', 'غياب', 'غير مكتمل', 'ساعات الدوام', 'دقائق تأخير', 'دقائق خروج مبكر', 'دقائق إضافي']
+    xrows = []
+    for r in rows:
+        xrows.append([
+            from_date.strftime('%Y-%m-%d') if from_date else '',
+            to_date.strftime('%Y-%m-%d') if to_date else '',
+            r.get('employee_no') or '',
+            r.get('name') or '',
+            r.get('work_location') or '',
+            r.get('organization') or '',
+            r.get('directorate') or '',
+            r.get('department') or '',
+            r.get('division') or '',
+            r.get('days') or 0,
+            r.get('absent') or 0,
+            r.get('incomplete') or 0,
+            round(float(r.get('work_minutes') or 0) / 60.0, 2),
+            r.get('late_minutes') or 0,
+            r.get('early_minutes') or 0,
+            r.get('overtime_minutes') or 0,
+        ])
+    return headers, xrows
+
+
+report_jobs.register('hr_attendance_summary', 'تقرير دوام تجميعي', _job_hr_attendance_summary, filename='hr_attendance_summary', perm=HR_REPORTS_EXPORT)
+
+
+@portal_bp.route('/hr/reports/attendance/summary', methods=['GET'])
+@login_required
+@_perm(HR_REPORTS_VIEW)
+def hr_report_attendance_summary():
+    """تقرير دوام تجميعي: (اختياري) الموظف + موقع العمل + الهيكل التنظيمي + نطاق التاريخ."""
+
+    employee_id = (request.args.get('user_id') or '').strip()
+    employee_id = int(employee_id) if employee_id.isdigit() else None
+
+    work_location_id = (request.args.get('work_location_id') or '').strip()
+    work_location_id = int(work_location_id) if work_location_id.isdigit() else None
+
+    organization_id = (request.args.get('organization_id') or '').strip()
+    organization_id = int(organization_id) if organization_id.isdigit() else None
+
+    directorate_id = (request.args.get('directorate_id') or '').strip()
+    directorate_id = int(directorate_id) if directorate_id.isdigit() else None
+
+    department_id = (request.args.get('department_id') or '').strip()
+    department_id = int(department_id) if department_id.isdigit() else None
+
+    division_id = (request.args.get('division_id') or '').strip()
+    division_id = int(division_id) if division_id.isdigit() else None
+
+    from_date = _parse_yyyy_mm_dd(request.args.get('from') or request.args.get('from_date'))
+    to_date = _parse_yyyy_mm_dd(request.args.get('to') or request.args.get('to_date'))
+
+    if (not from_date) and (not to_date):
+        try:
+            today = date.today()
+            from_date = date(today.year, today.month, 1)
+            to_date = today
+        except Exception:
+            pass
 
     if (request.args.get('export') or '').lower() == 'xlsx':
         if not current_user.has_perm(HR_REPORTS_EXPORT):
             abort(403)
-        headers = ['من تاريخ', 'إلى تاريخ', 'الرقم الوظيفي', 'الموظف', 'موقع العمل', 'الإدارة العامة', 'الدائرة', 'القسم', 'الشعبة', 'عدد الأيام', 'غياب', 'غير مكتمل', 'ساعات الدوام', 'دقائق تأخير', 'دقائق خروج مبكر', 'دقائق إضافي']
-        xrows = []
-        for r in rows:
-            xrows.append([
-                from_date.strftime('%Y-%m-%d') if from_date else '',
-                to_date.strftime('%Y-%m-%d') if to_date else '',
-                r.get('employee_no') or '',
-                r.get('name') or '',
-                r.get('work_location') or '',
-                r.get('organization') or '',
-                r.get('directorate') or '',
-                r.get('department') or '',
-                r.get('division') or '',
-                r.get('days') or 0,
-                r.get('absent') or 0,
-                r.get('incomplete') or 0,
-                round(float(r.get('work_minutes') or 0) / 60.0, 2),
-                r.get('late_minutes') or 0,
-                r.get('early_minutes') or 0,
-                r.get('overtime_minutes') or 0,
-            ])
-        return _export_xlsx('hr_attendance_summary.xlsx', headers, xrows)
+        # resolved period, so "no dates" is cached per month
+        params = report_jobs.normalize_params(request.args)
+        params.pop('from_date', None)
+        params.pop('to_date', None)
+        params['from'] = from_date.strftime('%Y-%m-%d') if from_date else ''
+        params['to'] = to_date.strftime('%Y-%m-%d') if to_date else ''
+        return _submit_report_job('hr_attendance_summary', params)
+
+    users = _list_hr_users()
+    work_locations = _hr_lookup_options('WORK_LOCATION')
+
+    orgs = Organization.query.filter(Organization.is_active.is_(True)).order_by(Organization.name_ar.asc()).all()
+    dirs = Directorate.query.filter(Directorate.is_active.is_(True)).order_by(Directorate.name_ar.asc()).all()
+    depts = Department.query.filter(Department.is_active.is_(True)).order_by(Department.name_ar.asc()).all()
+    divs = Division.query.filter(Division.is_active.is_(True)).order_by(Division.name_ar.asc()).all()
+
+    rows = _hr_attendance_summary_rows(employee_id, work_location_id, organization_id, directorate_id, department_id, division_id, from_date, to_date)
 
     return render_template(
         'portal/hr/reports_attendance_summary.html',
@@ -3484,10 +3640,10 @@ def hr_report_absence():
 
     loc_map = {x.id: x.name for x in (work_locations or [])}
 
-    user_ids = _filtered_user_ids(employee_id=employee_id, work_location_id=work_location_id)
+    user_ids = employee_ids_select(employee_id=employee_id, work_location_id=work_location_id)
     rows_view = []
 
-    if user_ids:
+    if any_employee(user_ids):
         q = AttendanceDailySummary.query.filter(AttendanceDailySummary.user_id.in_(user_ids))
         if from_date:
             q = q.filter(AttendanceDailySummary.day >= from_date.strftime('%Y-%m-%d'))
@@ -3557,10 +3713,10 @@ def hr_report_fingerprints():
     work_locations = _hr_lookup_options('WORK_LOCATION')
 
     # Candidate users from employee file filters
-    user_ids = _filtered_user_ids(employee_id=employee_id, work_location_id=work_location_id)
+    user_ids = employee_ids_select(employee_id=employee_id, work_location_id=work_location_id)
 
     events = []
-    if user_ids:
+    if any_employee(user_ids):
         q = AttendanceEvent.query.filter(AttendanceEvent.user_id.in_(user_ids))
         if from_date:
             dt_from = datetime.fromisoformat(from_date.strftime('%Y-%m-%d') + 'T00:00:00')
@@ -3715,9 +3871,9 @@ def hr_report_permissions_fingerprint():
             can_export=current_user.has_perm(HR_REPORTS_EXPORT),
         )
 
-    user_ids = _filtered_user_ids(employee_id=employee_id, work_location_id=work_location_id)
+    user_ids = employee_ids_select(employee_id=employee_id, work_location_id=work_location_id)
 
-    if not user_ids:
+    if not any_employee(user_ids):
         # nothing
         pass
     else:
@@ -4020,7 +4176,7 @@ def hr_report_attendance_daily():
     else:
         end_day = date(start_day.year, start_day.month + 1, 1) - timedelta(days=1)
 
-    user_ids = _filtered_user_ids(
+    user_ids = employee_ids_select(
         work_location_id=work_location_id,
         organization_id=organization_id,
         directorate_id=directorate_id,
@@ -4030,7 +4186,7 @@ def hr_report_attendance_daily():
 
     # build summary per employee
     rows = []
-    if user_ids:
+    if any_employee(user_ids):
         q = AttendanceDailySummary.query.filter(AttendanceDailySummary.user_id.in_(user_ids))
         q = q.filter(AttendanceDailySummary.day >= start_day.strftime('%Y-%m-%d'))
         q = q.filter(AttendanceDailySummary.day <= end_day.strftime('%Y-%m-%d'))
@@ -4271,10 +4427,10 @@ def hr_report_negative_movements():
     work_locations = _hr_lookup_options('WORK_LOCATION')
     loc_map = {x.id: x.name for x in (work_locations or [])}
 
-    user_ids = _filtered_user_ids(work_location_id=work_location_id)
+    user_ids = employee_ids_select(work_location_id=work_location_id)
 
     rows = []
-    if user_ids:
+    if any_employee(user_ids):
         q = AttendanceDailySummary.query.filter(AttendanceDailySummary.user_id.in_(user_ids))
         if from_date:
             q = q.filter(AttendanceDailySummary.day >= from_date.strftime('%Y-%m-%d'))
@@ -4386,9 +4542,9 @@ def hr_report_diwan():
     if selected_user_id:
         user_ids = [selected_user_id]
     else:
-        user_ids = _filtered_user_ids(work_location_id=work_location_id, appointment_type_id=appointment_type_id)
+        user_ids = employee_ids_select(work_location_id=work_location_id, appointment_type_id=appointment_type_id)
     rows_view = []
-    if user_ids:
+    if selected_user_id or any_employee(user_ids):
         q = AttendanceDailySummary.query.filter(AttendanceDailySummary.user_id.in_(user_ids))            .filter(AttendanceDailySummary.day >= start.strftime('%Y-%m-%d'))            .filter(AttendanceDailySummary.day <= end.strftime('%Y-%m-%d'))
 
         # Aggregate in python (sqlite safe)
@@ -4469,7 +4625,7 @@ def hr_report_diwan():
         except Exception:
             employee_ids = []
         if not employee_ids:
-            employee_ids = list(user_ids or [])
+            employee_ids = [selected_user_id] if selected_user_id else list(db.session.execute(user_ids).scalars())
 
         # Lookup maps for grade/title
         try:
@@ -5520,7 +5676,7 @@ def hr_att_mass_closing():
         return redirect(url_for('portal.hr_att_mass_closing'))
 
     # GET: list the latest closings
-    rows = HRAttendanceClosing.query.order_by(HRAttendanceClosing.created_at.desc()).limit(200).all()
+    rows = HRAttendanceClosing.query.options(*loader_profiles.options(HRAttendanceClosing, 'list')).order_by(HRAttendanceClosing.created_at.desc()).limit(200).all()
     return render_template(
         'portal/hr/att_closing.html',
         rows=rows,
@@ -5844,7 +6000,7 @@ def hr_deductions_log():
     month = (request.args.get('month') or '').strip()
     status = (request.args.get('status') or '').strip().upper()
 
-    q = HRAttendanceDeductionRun.query
+    q = HRAttendanceDeductionRun.query.options(*loader_profiles.options(HRAttendanceDeductionRun, 'list'))
     if year.isdigit():
         q = q.filter(HRAttendanceDeductionRun.year == int(year))
     if month.isdigit():
@@ -5939,7 +6095,7 @@ def hr_monthly_schedule_new():
 @login_required
 @_perm_any(HR_MASTERDATA_MANAGE, HR_REQUESTS_VIEW_ALL, HR_READ)
 def hr_monthly_schedule_log():
-    rows = WorkAssignment.query.order_by(WorkAssignment.id.desc()).limit(200).all()
+    rows = WorkAssignment.query.options(*loader_profiles.options(WorkAssignment, 'list')).order_by(WorkAssignment.id.desc()).limit(200).all()
     return render_template('portal/hr/monthly_schedule_log.html', rows=rows)
 
 
@@ -5947,7 +6103,7 @@ def hr_monthly_schedule_log():
 @login_required
 @_perm_any(HR_READ, HR_REQUESTS_VIEW_ALL, HR_MASTERDATA_MANAGE)
 def hr_official_missions():
-    missions = HROfficialMission.query.order_by(HROfficialMission.start_day.desc()).limit(200).all()
+    missions = HROfficialMission.query.options(*loader_profiles.options(HROfficialMission, 'list')).order_by(HROfficialMission.start_day.desc()).limit(200).all()
     return render_template('portal/hr/missions_log.html', missions=missions, can_manage=_hr_can_manage())
 
 
@@ -5957,12 +6113,7 @@ def hr_official_missions():
 def hr_weekly_holidays():
     """العطل الأسبوعية: حفظ إعداد على شكل bitmask في SystemSetting."""
     key = 'HR_WEEKLY_HOLIDAYS_MASK'
-    row = SystemSetting.query.filter_by(key=key).first()
-    mask = 0
-    try:
-        mask = int((row.value or '0').strip()) if row else 0
-    except Exception:
-        mask = 0
+    mask = _weekly_mask()
 
     if request.method == 'POST':
         if not _hr_can_manage():
@@ -5971,11 +6122,7 @@ def hr_weekly_holidays():
         for i in range(7):
             if (request.form.get(f'd{i}') or '') == '1':
                 new_mask |= (1 << i)
-        if not row:
-            row = SystemSetting(key=key, value=str(new_mask))
-            db.session.add(row)
-        else:
-            row.value = str(new_mask)
+        settings_service.set_value(key, str(new_mask))
         db.session.commit()
         flash('تم حفظ العطل الأسبوعية.', 'success')
         return redirect(url_for('portal.hr_weekly_holidays'))
@@ -6381,6 +6528,7 @@ def hr_my_permissions():
         # Base query (we join User/EmployeeFile once to support manager scope + search + work location filters)
         q = (
             HRPermissionRequest.query
+            .options(*loader_profiles.options(HRPermissionRequest, 'list'))
             .join(User, User.id == HRPermissionRequest.user_id)
             .outerjoin(EmployeeFile, EmployeeFile.user_id == User.id)
         )
@@ -6480,6 +6628,7 @@ def hr_my_permissions():
     if can_requests:
         reqs = (
             HRPermissionRequest.query
+            .options(*loader_profiles.options(HRPermissionRequest, "list"))
             .filter(HRPermissionRequest.user_id == current_user.id)
             .order_by(HRPermissionRequest.created_at.desc())
             .limit(50)
@@ -7268,8 +7417,14 @@ def hr_approvals():
             q = q.filter_by(status=status)
         return q
 
-    leave_reqs = _base(HRLeaveRequest.query).order_by(HRLeaveRequest.created_at.desc()).limit(200).all()
-    perm_reqs = _base(HRPermissionRequest.query).order_by(HRPermissionRequest.created_at.desc()).limit(200).all()
+    leave_reqs = (
+        _base(HRLeaveRequest.query.options(*loader_profiles.options(HRLeaveRequest, "list")))
+        .order_by(HRLeaveRequest.created_at.desc()).limit(200).all()
+    )
+    perm_reqs = (
+        _base(HRPermissionRequest.query.options(*loader_profiles.options(HRPermissionRequest, "list")))
+        .order_by(HRPermissionRequest.created_at.desc()).limit(200).all()
+    )
 
     return render_template(
         "portal/hr/approvals.html",
@@ -7823,8 +7978,9 @@ def hr_payslips_bulk_upload():
     """HR Admin: bulk upload payslips for a given month.
 
     Rules:
-      - Upload multiple PDF files.
-      - Each filename must be the employee number (employee_no) e.g. 12345.pdf
+      - Upload PDF files named by employee number (e.g. 12345.pdf), a ZIP of
+        such files, or payroll's combined PDF (split by the employee number on each page).
+      - Files are processed in the background (services/payslip_import.py).
       - Payslips are saved as DRAFTS (do NOT send automatically).
       - HR can publish/send later from: HR → "إرسال قسائم الرواتب".
     """
@@ -7845,11 +8001,19 @@ def hr_payslips_bulk_upload():
     if not (1 <= default_month <= 12):
         default_month = int(now.month)
 
-    results = {
-        "saved": 0,
-        "skipped": 0,
-        "errors": [],
-    }
+    def _render(year, month):
+        batches = (
+            PayslipImportBatch.query
+            .order_by(PayslipImportBatch.id.desc())
+            .limit(10)
+            .all()
+        )
+        return render_template(
+            "portal/hr/payslips_bulk_upload.html",
+            default_year=year,
+            default_month=month,
+            batches=batches,
+        )
 
     if request.method == "POST":
         y = (request.form.get("year") or "").strip()
@@ -7860,160 +8024,97 @@ def hr_payslips_bulk_upload():
             month = int(m)
         except Exception:
             flash("الرجاء اختيار سنة/شهر صحيحين.", "danger")
-            return render_template(
-                "portal/hr/payslips_bulk_upload.html",
-                default_year=default_year,
-                default_month=default_month,
-                results=results,
-            )
+            return _render(default_year, default_month)
 
         if not (2000 <= year <= 2100) or not (1 <= month <= 12):
             flash("السنة/الشهر غير صالحين.", "danger")
-            return render_template(
-                "portal/hr/payslips_bulk_upload.html",
-                default_year=default_year,
-                default_month=default_month,
-                results=results,
-            )
+            return _render(default_year, default_month)
 
-        files = request.files.getlist("files") or []
+        files = [f for f in (request.files.getlist("files") or []) if f and getattr(f, "filename", "")]
         if not files:
-            flash("اختر ملفات PDF لقسائم الرواتب.", "warning")
-            return render_template(
-                "portal/hr/payslips_bulk_upload.html",
-                default_year=year,
-                default_month=month,
-                results=results,
-            )
+            flash("اختر ملفات PDF أو ملف ZIP لقسائم الرواتب.", "warning")
+            return _render(year, month)
 
-        def _norm_emp_no(filename: str) -> str:
-            name = Path(filename or "").name
-            stem = (Path(name).stem or "").strip()
-            try:
-                stem = "".join(ch for ch in stem if unicodedata.category(ch) != "Cf")
-            except Exception:
-                pass
-            stem = stem.strip()
-            stem = re.split(r"[\s_\-]+", stem)[0].strip()
-            mm = re.search(r"(\d+)", stem)
-            if mm:
-                return mm.group(1)
-            return stem
-
-        for f in files:
-            if not f or not getattr(f, "filename", ""):
-                continue
-
-            original = Path(f.filename).name
-            ext = _clean_suffix(original)
-            if ext != ".pdf":
-                results["skipped"] += 1
-                results["errors"].append(f"{original}: يجب أن يكون الملف PDF.")
-                continue
-
-            emp_no = _norm_emp_no(original)
-            if not emp_no:
-                results["skipped"] += 1
-                results["errors"].append(f"{original}: لم أستطع استخراج الرقم الوظيفي من اسم الملف.")
-                continue
-
-            emp = (
-                EmployeeFile.query
-                .filter(func.trim(EmployeeFile.employee_no) == emp_no)
-                .first()
+        try:
+            batch = payslip_import.submit(
+                files,
+                year,
+                month,
+                user_id=current_user.id,
+                continue_pages=bool(request.form.get("continue_pages")),
             )
-            if not emp:
-                results["skipped"] += 1
-                results["errors"].append(f"{original}: لا يوجد موظف برقم وظيفي ({emp_no}).")
-                continue
-
-            user_id = int(emp.user_id)
-
-            stored = f"{uuid.uuid4().hex}{ext}"
-            dirp = _employee_upload_dir(user_id)
-            try:
-                f.save(dirp / stored)
-            except Exception as e:
-                results["skipped"] += 1
-                results["errors"].append(f"{original}: تعذر حفظ الملف ({str(e)}).")
-                continue
-
-            att = EmployeeAttachment.query.filter_by(
-                user_id=user_id,
-                attachment_type="PAYSLIP",
-                payslip_year=year,
-                payslip_month=month,
-            ).first()
-
-            if att:
-                try:
-                    old_fp = dirp / (att.stored_name or "")
-                    if old_fp.exists():
-                        old_fp.unlink()
-                except Exception:
-                    pass
-                att.original_name = original
-                att.stored_name = stored
-                att.note = None
-                att.uploaded_by_id = current_user.id
-                att.uploaded_at = datetime.utcnow()
-            else:
-                att = EmployeeAttachment(
-                    user_id=user_id,
-                    attachment_type="PAYSLIP",
-                    original_name=original,
-                    stored_name=stored,
-                    note=None,
-                    payslip_year=year,
-                    payslip_month=month,
-                    uploaded_by_id=current_user.id,
-                    uploaded_at=datetime.utcnow(),
-                )
-                db.session.add(att)
-
-            # Draft by default (not visible to employee until sent)
-            try:
-                att.is_published = False
-                att.published_at = None
-                att.published_by_id = None
-            except Exception:
-                pass
-
-            results["saved"] += 1
+        except Exception:
+            db.session.rollback()
+            current_app.logger.exception("payslip import submit failed")
+            flash("تعذر حفظ الملفات المرفوعة.", "danger")
+            return _render(year, month)
+        if batch is None:
+            flash("اختر ملفات PDF أو ملف ZIP لقسائم الرواتب.", "warning")
+            return _render(year, month)
 
         try:
             _portal_audit(
                 action="HR_PAYSLIPS_BULK_UPLOAD",
-                note=f"رفع مسودات قسائم رواتب شهر {year:04d}-{month:02d} (تم حفظ {results['saved']})",
+                note=f"رفع مسودات قسائم رواتب شهر {year:04d}-{month:02d} (دفعة #{batch.id}، {len(files)} ملف)",
                 target_type="PAYSLIP",
                 target_id=0,
             )
-        except Exception:
-            pass
-
-        try:
             db.session.commit()
-            flash(
-                f"تمت العملية: حفظ {results['saved']} مسودة، تخطي {results['skipped']}.",
-                "success",
-            )
         except Exception:
             db.session.rollback()
-            flash("حدث خطأ أثناء الحفظ في قاعدة البيانات.", "danger")
 
-        return render_template(
-            "portal/hr/payslips_bulk_upload.html",
-            default_year=year,
-            default_month=month,
-            results=results,
-        )
+        return redirect(url_for("portal.hr_payslips_import", batch_id=batch.id))
 
-    return render_template(
-        "portal/hr/payslips_bulk_upload.html",
-        default_year=default_year,
-        default_month=default_month,
-        results=results,
-    )
+    return _render(default_year, default_month)
+
+
+def _payslip_import_dict(batch: PayslipImportBatch) -> dict:
+    return {
+        "id": batch.id,
+        "status": batch.status,
+        "stage": batch.stage,
+        "total": batch.total_items or 0,
+        "processed": batch.processed_items or 0,
+        "saved": batch.saved or 0,
+        "skipped": batch.skipped or 0,
+        "errors": (batch.errors or "").splitlines(),
+        "error": batch.error,
+        "finished_at": batch.finished_at.isoformat(timespec="seconds") if batch.finished_at else None,
+    }
+
+
+@portal_bp.route("/hr/payslips/imports/<int:batch_id>")
+@login_required
+@_perm(HR_EMP_ATTACH)
+def hr_payslips_import(batch_id: int):
+    """HR Admin: progress / result of one bulk payslip import."""
+    batch = PayslipImportBatch.query.get_or_404(batch_id)
+    return render_template("portal/hr/payslips_import.html", batch=batch, info=_payslip_import_dict(batch))
+
+
+@portal_bp.route("/hr/payslips/imports/<int:batch_id>.json")
+@login_required
+@_perm(HR_EMP_ATTACH)
+def hr_payslips_import_status(batch_id: int):
+    batch = PayslipImportBatch.query.get_or_404(batch_id)
+    return jsonify(_payslip_import_dict(batch))
+
+
+@portal_bp.route("/hr/payslips/imports/<int:batch_id>/retry", methods=["POST"])
+@login_required
+@_perm(HR_EMP_ATTACH)
+def hr_payslips_import_retry(batch_id: int):
+    """HR Admin: queue a FAILED bulk payslip import again."""
+    PayslipImportBatch.query.get_or_404(batch_id)
+    try:
+        ok = payslip_import.retry(batch_id)
+    except Exception:
+        db.session.rollback()
+        current_app.logger.exception("payslip import retry failed")
+        ok = False
+    if not ok:
+        flash("تعذرت إعادة المحاولة (الدفعة ليست فاشلة أو لم تعد ملفاتها متوفرة).", "warning")
+    return redirect(url_for("portal.hr_payslips_import", batch_id=batch_id))
 
 
 @portal_bp.route("/hr/payslips/send", methods=["GET", "POST"])
@@ -8275,7 +8376,7 @@ def store_home():
             current_folder = None
 
     # Build query
-    qry = StoreFile.query.filter(StoreFile.is_deleted == False)  # noqa: E712
+    qry = StoreFile.query.options(*loader_profiles.options(StoreFile, "list")).filter(StoreFile.is_deleted == False)  # noqa: E712
 
     if view == "shared":
         sq = _store_shared_query_for_user().subquery()
@@ -8882,7 +8983,7 @@ def _portal_audit(
     if base_user_id is None:
         return
 
-    db.session.add(AuditLog(
+    audit_writer.add(
         action=action,
         note=note,
         user_id=base_user_id,
@@ -8891,7 +8992,7 @@ def _portal_audit(
         target_type=target_type,
         target_id=target_id,
         created_at=datetime.utcnow(),
-    ))
+    )
 
 
 @portal_bp.route("/hr/employees")
@@ -10902,7 +11003,7 @@ def hr_org_structure():
         else:
             raise
 
-    mgr_rows = OrgUnitManager.query.all()
+    mgr_rows = OrgUnitManager.query.options(*loader_profiles.options(OrgUnitManager, 'list')).all()
     mgr_map = {(m.unit_type, m.unit_id): m for m in mgr_rows}
 
     try:
@@ -11521,7 +11622,7 @@ def hr_org_structure_export(fmt: str):
     except Exception:
         teams = []
 
-    mgr_rows = OrgUnitManager.query.all()
+    mgr_rows = OrgUnitManager.query.options(*loader_profiles.options(OrgUnitManager, 'list')).all()
     mgr_map = {(m.unit_type, m.unit_id): m for m in mgr_rows}
     org_assignments = _safe_query_org_assignments()
 
@@ -11744,8 +11845,7 @@ def _legacy_org_locked() -> bool:
 
 
 def _setting_get(key: str, default: str | None = None) -> str | None:
-    row = SystemSetting.query.filter_by(key=key).first()
-    return (row.value if row else default)
+    return settings_service.get(key, default)
 
 
 def _setting_get_int(key: str, default: int = 0) -> int:
@@ -11753,25 +11853,11 @@ def _setting_get_int(key: str, default: int = 0) -> int:
 
     Returns `default` when the setting is missing, empty, or not a valid integer.
     """
-    v = _setting_get(key, None)
-    if v is None:
-        return default
-    try:
-        v = str(v).strip()
-        if v == "":
-            return default
-        return int(float(v))
-    except Exception:
-        return default
+    return settings_service.get_int(key, default)
 
 
 def _setting_set(key: str, value: str | None):
-    row = SystemSetting.query.filter_by(key=key).first()
-    if not row:
-        row = SystemSetting(key=key, value=(value or ""))
-        db.session.add(row)
-    else:
-        row.value = (value or "")
+    settings_service.set_value(key, (value or ""))
 
 
 def _parse_hhmm(s: str | None):
@@ -13185,6 +13271,7 @@ def _check_pending_leave_requests(send_notifications: bool = True) -> dict:
     pending = []
     try:
         q = (HRLeaveRequest.query
+             .options(*loader_profiles.options(HRLeaveRequest, 'list'))
              .filter(HRLeaveRequest.status == 'SUBMITTED')
              .filter(HRLeaveRequest.submitted_at.isnot(None))
              .filter(HRLeaveRequest.submitted_at <= cutoff)
@@ -13241,6 +13328,12 @@ def _check_pending_leave_requests(send_notifications: bool = True) -> dict:
     except Exception:
         db.session.rollback()
 
+    # The commit expired the rows; reload them in one query for the caller.
+    try:
+        pending = q.all()
+    except Exception:
+        pass
+
     return {'threshold_days': days_thr, 'pending': pending, 'notified': notified}
 
 
@@ -13754,52 +13847,54 @@ def hr_alerts():
     )
 
 
+def _hr_leaves_report_query(from_day, to_day):
+    q = HRLeaveRequest.query
+    if from_day:
+        q = q.filter(HRLeaveRequest.start_date >= from_day)
+    if to_day:
+        q = q.filter(HRLeaveRequest.start_date <= to_day)
+    return q.order_by(HRLeaveRequest.id.desc())
+
+
+def _job_hr_leaves_report(params):
+    q = _hr_leaves_report_query((params.get('from') or '').strip(), (params.get('to') or '').strip())
+    q = q.options(*loader_profiles.options(HRLeaveRequest, 'export'))
+    headers = ['id', 'employee', 'leave_type', 'start_date', 'end_date', 'days', 'status', 'submitted_at', 'approver']
+    xrows = []
+    for r in q.all():
+        u = r.user
+        emp = (u.full_name or u.name or u.email) if u else ''
+        lt = r.leave_type.code if r.leave_type else ''
+        a = r.approver_user
+        approver = (a.full_name or a.name or a.email) if a else ''
+        xrows.append([r.id, emp, lt, r.start_date, r.end_date, r.days, r.status, r.submitted_at, approver])
+    return headers, xrows
+
+
+report_jobs.register('hr_leaves_report', 'تقرير الإجازات', _job_hr_leaves_report, filename='hr_leaves_report')
+
+
 @portal_bp.route('/hr/leaves/report', methods=['GET'])
 
 @login_required
 @_perm(HR_REPORTS_VIEW)
 def hr_leaves_report():
     """Leave requests report (with pending check trigger)."""
+    # Export: full report (no row cap) as a background job
+    if (request.args.get('export') or '').lower() == 'csv':
+        return _submit_report_job('hr_leaves_report')
+
     pending_info = _check_pending_leave_requests(send_notifications=True)
 
     # Filters
     from_day = (request.args.get('from') or '').strip()
     to_day = (request.args.get('to') or '').strip()
 
-    q = HRLeaveRequest.query
-    if from_day:
-        q = q.filter(HRLeaveRequest.start_date >= from_day)
-    if to_day:
-        q = q.filter(HRLeaveRequest.start_date <= to_day)
-
-    q = q.order_by(HRLeaveRequest.id.desc())
-    rows = q.limit(500).all()
-
-    # Optional export
-    if (request.args.get('export') or '').lower() == 'csv':
-        out = io.StringIO()
-        w = csv.writer(out)
-        w.writerow(['id', 'employee', 'leave_type', 'start_date', 'end_date', 'days', 'status', 'submitted_at', 'approver'])
-        for r in rows:
-            emp = ''
-            try:
-                emp = r.user.full_name or r.user.name or r.user.email
-            except Exception:
-                emp = ''
-            lt = ''
-            try:
-                lt = r.leave_type.code
-            except Exception:
-                lt = ''
-            approver = ''
-            try:
-                a = User.query.get(r.approver_user_id) if r.approver_user_id else None
-                approver = (a.full_name or a.name or a.email) if a else ''
-            except Exception:
-                approver = ''
-            w.writerow([r.id, emp, lt, r.start_date, r.end_date, r.days, r.status, r.submitted_at, approver])
-        data = out.getvalue().encode('utf-8-sig')
-        return send_file(BytesIO(data), mimetype='text/csv', as_attachment=True, download_name='hr_leaves_report.csv')
+    rows = (
+        _hr_leaves_report_query(from_day, to_day)
+        .options(*loader_profiles.options(HRLeaveRequest, 'list'))
+        .limit(500).all()
+    )
 
     return render_template('portal/hr/leaves_report.html', rows=rows, pending_info=pending_info, from_day=from_day, to_day=to_day)
 
@@ -14372,7 +14467,7 @@ def hr_attendance_daily():
     day_to = (request.args.get('day_to') or '').strip()
     user_id = (request.args.get('user_id') or '').strip()
 
-    qry = AttendanceDailySummary.query
+    qry = AttendanceDailySummary.query.options(*loader_profiles.options(AttendanceDailySummary, 'list'))
 
     if day_from:
         qry = qry.filter(AttendanceDailySummary.day >= day_from)
@@ -14445,7 +14540,7 @@ def hr_attendance_daily_export_xlsx():
     day_to = (request.args.get('day_to') or '').strip()
     user_id = (request.args.get('user_id') or '').strip()
 
-    qry = AttendanceDailySummary.query
+    qry = AttendanceDailySummary.query.options(*loader_profiles.options(AttendanceDailySummary, 'export'))
     if day_from:
         qry = qry.filter(AttendanceDailySummary.day >= day_from)
     if day_to:
@@ -18614,7 +18709,7 @@ def _seed_hr_doc_categories_if_empty():
 @login_required
 @_perm(HR_DOCS_READ)
 def hr_docs_home():
-    docs = HRDoc.query.filter_by(is_published=True).order_by(HRDoc.category.asc(), HRDoc.title_ar.asc()).all()
+    docs = HRDoc.query.options(*loader_profiles.options(HRDoc, "list")).filter_by(is_published=True).order_by(HRDoc.category.asc(), HRDoc.title_ar.asc()).all()
     # attach current version
     rows = []
     for d in docs:
@@ -18741,7 +18836,7 @@ def hr_docs_upload_version():
 @login_required
 @_perm(HR_DISCIPLINE_READ)
 def hr_discipline_home():
-    rows = HRDisciplinaryCase.query.order_by(HRDisciplinaryCase.created_at.desc()).all()
+    rows = HRDisciplinaryCase.query.options(*loader_profiles.options(HRDisciplinaryCase, "list")).order_by(HRDisciplinaryCase.created_at.desc()).all()
     return render_template("portal/hr/discipline_index.html", rows=rows)
 
 
@@ -19533,7 +19628,7 @@ def portal_admin_hr_perf_cycles():
         return redirect(url_for('portal.portal_admin_hr_perf_cycles'))
 
     forms = HRPerformanceForm.query.filter(HRPerformanceForm.is_active.is_(True)).order_by(HRPerformanceForm.id.desc()).all()
-    cycles = HRPerformanceCycle.query.order_by(HRPerformanceCycle.id.desc()).all()
+    cycles = HRPerformanceCycle.query.options(*loader_profiles.options(HRPerformanceCycle, "list")).order_by(HRPerformanceCycle.id.desc()).all()
     return render_template("portal/admin/hr_perf_cycles.html", forms=forms, cycles=cycles)
 
 
@@ -19557,6 +19652,7 @@ def portal_admin_hr_perf_cycle_detail(cycle_id: int):
         cycle=c,
         assignments=assignments,
         stats=stats,
+        gen_job=perf_cycle_generator.job_status(c.id),
     )
 
 
@@ -19580,7 +19676,7 @@ def portal_admin_hr_perf_cycle_set_status(cycle_id: int):
 @login_required
 @_perm(HR_PERF_MANAGE)
 def portal_admin_hr_perf_cycle_generate(cycle_id: int):
-    """Generate 360 assignments for all users (best-effort).
+    """Generate 360 assignments for all users (best-effort, background job).
 
     Creates:
       - SELF per user
@@ -19593,81 +19689,24 @@ def portal_admin_hr_perf_cycle_generate(cycle_id: int):
         flash("الدورة مغلقة.", "warning")
         return redirect(url_for('portal.portal_admin_hr_perf_cycle_detail', cycle_id=c.id))
 
-    peer_count = int(c.peer_count or 0)
-    created = 0
-
-    users = User.query.order_by(User.id.asc()).all()
-    existing = set()
-    for a in HRPerformanceAssignment.query.filter_by(cycle_id=c.id).all():
-        existing.add((a.evaluatee_user_id, a.evaluator_user_id, a.evaluator_type))
-
-    for u in users:
-        if not u or not getattr(u, 'id', None):
-            continue
-        uid = int(u.id)
-
-        # SELF
-        key = (uid, uid, 'SELF')
-        if key not in existing:
-            db.session.add(HRPerformanceAssignment(
-                cycle_id=c.id,
-                evaluatee_user_id=uid,
-                evaluator_user_id=uid,
-                evaluator_type='SELF',
-                status='PENDING',
-                created_by_id=current_user.id,
-            ))
-            existing.add(key)
-            created += 1
-
-        # MANAGER
-        mgr = _find_direct_manager_for_user(uid)
-        if mgr and getattr(mgr, 'id', None):
-            mid = int(mgr.id)
-            key = (uid, mid, 'MANAGER')
-            if key not in existing:
-                db.session.add(HRPerformanceAssignment(
-                    cycle_id=c.id,
-                    evaluatee_user_id=uid,
-                    evaluator_user_id=mid,
-                    evaluator_type='MANAGER',
-                    status='PENDING',
-                    created_by_id=current_user.id,
-                ))
-                existing.add(key)
-                created += 1
-
-        # PEERS
-        exclude = {uid}
-        if mgr and getattr(mgr, 'id', None):
-            exclude.add(int(mgr.id))
-        peers = _pick_peer_candidates(uid, peer_count, exclude_ids=exclude)
-        for p in peers:
-            pid = int(p.id)
-            key = (uid, pid, 'PEER')
-            if key in existing:
-                continue
-            db.session.add(HRPerformanceAssignment(
-                cycle_id=c.id,
-                evaluatee_user_id=uid,
-                evaluator_user_id=pid,
-                evaluator_type='PEER',
-                status='PENDING',
-                created_by_id=current_user.id,
-            ))
-            existing.add(key)
-            created += 1
+    # Runs in the background (large orgs would time out the request).
+    started = perf_cycle_generator.start_generation_job(
+        current_app._get_current_object(), c.id, created_by_id=current_user.id
+    )
+    if started:
+        flash("بدأ توليد التكليفات في الخلفية. ستظهر النتائج عند الانتهاء.", "info")
+    else:
+        flash("عملية توليد التكليفات قيد التنفيذ بالفعل لهذه الدورة.", "warning")
 
-    _portal_audit("HR_PERF_ASSIGNMENTS_GENERATE", note=f"cycle={c.id},created={created}", target_type='hr_perf_cycle', target_id=c.id)
+    return redirect(url_for('portal.portal_admin_hr_perf_cycle_detail', cycle_id=c.id))
 
-    try:
-        db.session.commit()
-        flash(f"تم توليد التكليفات. (الجديد: {created})", "success")
-    except Exception:
-        db.session.rollback()
-        flash("تعذر توليد التكليفات.", "danger")
 
-    return redirect(url_for('portal.portal_admin_hr_perf_cycle_detail', cycle_id=c.id))
+@portal_bp.route("/admin/hr/performance/cycles/<int:cycle_id>/generate/status")
+@login_required
+@_perm(HR_PERF_MANAGE)
+def portal_admin_hr_perf_cycle_generate_status(cycle_id: int):
+    job = perf_cycle_generator.job_status(cycle_id)
+    return jsonify({"ok": True, "job": job})
 
 
 @portal_bp.route("/admin/hr/performance/cycles/<int:cycle_id>/export.csv")
@@ -19830,20 +19869,7 @@ def portal_admin_hr_reports_dashboard():
 # -------------------------
 
 def _audit_guess_module(action: str | None, target_type: str | None) -> str:
-    a = (action or "").upper()
-    t = (target_type or "").upper()
-
-    if a.startswith("HR_") or t.startswith("HR_") or t in ("EMPLOYEE_FILE", "EMPLOYEE_ATTACHMENT", "LEAVE_REQUEST", "MISSION_REQUEST", "PERMISSION_REQUEST"):
-        return "HR"
-    if a.startswith("INV_") or a.startswith("STORE_") or t.startswith("INV_") or t.startswith("STORE_"):
-        return "STORE"
-    if a.startswith("TRANSPORT_") or t.startswith("TRANSPORT_"):
-        return "TRANSPORT"
-    if a.startswith("CORR_") or t.startswith("CORR_") or t in ("INBOUND_MAIL", "OUTBOUND_MAIL"):
-        return "CORR"
-    if a.startswith("PORTAL_") or a.startswith("ACCESS_") or t in ("PORTAL_ACCESS_REQUEST", "ROLE", "USER"):
-        return "PERMS"
-    return "OTHER"
+    return audit_rollup.guess_module(action, target_type)
 
 
 def _audit_target_url_label(r):
@@ -19936,6 +19962,17 @@ def _audit_target_url_label(r):
 
     return (None, None)
 
+def _audit_rollup_filters(q_action: str, q_user: str, q_from: str, q_to: str) -> dict:
+    """Compliance filters (action contains / user / date range) as audit_rollup query filters."""
+    since, until = audit_rollup.day_range(q_from, q_to)
+    return {
+        "since": since,
+        "until": until,
+        "action_like": q_action or None,
+        "user_ids": audit_rollup.matching_user_ids(q_user) if q_user else None,
+    }
+
+
 @portal_bp.route("/admin/compliance", methods=["GET"])
 @login_required
 @_perm_any(PORTAL_AUDIT_READ, PORTAL_ADMIN_PERMISSIONS_MANAGE)
@@ -19962,7 +19999,8 @@ def portal_admin_compliance():
 
     logs = qry.order_by(AuditLog.id.desc()).limit(500).all()
 
-    # Users for filter
+    # Totals per module come from the daily rollups (raw rows above are the drill-down)
+    module_counts = audit_rollup.module_counts(**_audit_rollup_filters(q_action, q_user, q_from, q_to))
 
     # enrich rows (target links/labels)
     for r in logs:
@@ -19983,7 +20021,7 @@ def portal_admin_compliance():
         .all()
     )
 
-    return render_template('portal/admin/compliance.html', logs=logs, users=users, q_action=q_action, q_user=q_user, q_from=q_from, q_to=q_to)
+    return render_template('portal/admin/compliance.html', logs=logs, users=users, module_counts=module_counts, q_action=q_action, q_user=q_user, q_from=q_from, q_to=q_to)
 
 @portal_bp.route("/admin/timeline", methods=["GET"])
 @login_required
@@ -20052,6 +20090,8 @@ def portal_admin_timeline():
         except Exception:
             pass
 
+    module_counts = audit_rollup.module_counts(**_audit_rollup_filters(q_action, q_user, q_from, q_to))
+
     from types import SimpleNamespace
     modules = [
         SimpleNamespace(key='ALL', label='الكل', icon='bi-grid'),
@@ -20065,6 +20105,7 @@ def portal_admin_timeline():
     return render_template(
         'portal/admin/timeline.html',
         modules=modules,
+        module_counts=module_counts,
         selected_module=selected_module,
         logs=logs,
         q=q,
@@ -20122,14 +20163,35 @@ def portal_admin_compliance_export_csv():
     return send_file(BytesIO(data), mimetype='text/csv', as_attachment=True, download_name='portal_compliance.csv')
 
 
+@portal_bp.route("/admin/compliance/summary.csv")
+@login_required
+@_perm_any(PORTAL_AUDIT_READ, PORTAL_REPORTS_EXPORT, PORTAL_ADMIN_PERMISSIONS_MANAGE)
+def portal_admin_compliance_summary_csv():
+    """Daily counts per module/action for the compliance filters (from the rollups)."""
+    q_action = (request.args.get('action') or '').strip().upper()
+    q_user = (request.args.get('user') or '').strip()
+    q_from = (request.args.get('from') or '').strip()  # YYYY-MM-DD
+    q_to = (request.args.get('to') or '').strip()
+
+    rows = audit_rollup.daily_breakdown(**_audit_rollup_filters(q_action, q_user, q_from, q_to))
+
+    buf = io.StringIO()
+    w = csv.writer(buf)
+    w.writerow(["day", "module", "action", "count"])
+    for day, module, action, cnt in rows:
+        w.writerow([day.strftime('%Y-%m-%d') if day else '', module, action, cnt])
+
+    data = buf.getvalue().encode('utf-8-sig')
+    return send_file(BytesIO(data), mimetype='text/csv', as_attachment=True, download_name='portal_compliance_summary.csv')
+
+
 # HR_LEAVES_MISSIONS_EVENTS_PATCH_V1
 
 # ===== Helpers =====
 def _weekly_mask() -> int:
-    key = 'HR_WEEKLY_HOLIDAYS_MASK'
-    row = SystemSetting.query.filter_by(key=key).first()
+    value = settings_service.get('HR_WEEKLY_HOLIDAYS_MASK')
     try:
-        return int((row.value or '0').strip()) if row else 0
+        return int((value or '0').strip())
     except Exception:
         return 0
 
@@ -20240,7 +20302,7 @@ def _save_mission_attachment(mission_id: int, f):
 @_perm_any(HR_READ, HR_REQUESTS_VIEW_ALL, HR_MASTERDATA_MANAGE)
 def hr_leaves_admin_log():
     from models import EmployeeFile
-    q = HRLeaveRequest.query
+    q = HRLeaveRequest.query.options(*loader_profiles.options(HRLeaveRequest, 'list'))
     user_id = (request.args.get('user_id') or '').strip()
     leave_type_id = (request.args.get('leave_type_id') or '').strip()
     admin_status_id = (request.args.get('admin_status_id') or '').strip()
@@ -20643,7 +20705,7 @@ def hr_official_mission_delete(mission_id: int):
 @_perm_any(HR_READ, HR_REQUESTS_VIEW_ALL, HR_MASTERDATA_MANAGE)
 def hr_official_occasions():
     from models import HROfficialOccasionRange
-    rows = HROfficialOccasionRange.query.order_by(HROfficialOccasionRange.start_day.desc()).limit(300).all()
+    rows = HROfficialOccasionRange.query.options(*loader_profiles.options(HROfficialOccasionRange, 'list')).order_by(HROfficialOccasionRange.start_day.desc()).limit(300).all()
     return render_template('portal/hr/occasions_log.html', rows=rows, can_manage=_hr_can_manage())
 
 @portal_bp.route('/hr/occasions/new', methods=['GET','POST'])
@@ -20961,14 +21023,76 @@ def hr_report_leave_employee_balances():
     )
 
 
+def _hr_salary_deductions_query(user_id, work_location_id, from_date, to_date):
+    user_ids = employee_ids_select(employee_id=user_id, work_location_id=work_location_id)
+
+    # Month key boundaries (YYYYMM)
+    from_key = (from_date.year * 100 + from_date.month) if from_date else None
+    to_key = (to_date.year * 100 + to_date.month) if to_date else None
+
+    q = (HRAttendanceDeductionItem.query
+         .join(HRAttendanceDeductionRun, HRAttendanceDeductionRun.id == HRAttendanceDeductionItem.run_id)
+         .filter(HRAttendanceDeductionItem.user_id.in_(user_ids)))
+
+    if from_key is not None:
+        q = q.filter((HRAttendanceDeductionRun.year * 100 + HRAttendanceDeductionRun.month) >= int(from_key))
+    if to_key is not None:
+        q = q.filter((HRAttendanceDeductionRun.year * 100 + HRAttendanceDeductionRun.month) <= int(to_key))
+
+    return q.order_by(HRAttendanceDeductionRun.year.desc(), HRAttendanceDeductionRun.month.desc(), HRAttendanceDeductionItem.amount.desc())
+
+
+def _job_hr_salary_deductions(params):
+    q = _hr_salary_deductions_query(
+        _int_param(params, 'user_id'),
+        _int_param(params, 'work_location_id'),
+        _parse_yyyy_mm_dd(params.get('from') or params.get('from_date')),
+        _parse_yyyy_mm_dd(params.get('to') or params.get('to_date')),
+    )
+    q = q.options(*loader_profiles.options(HRAttendanceDeductionItem, 'export'))
+    loc_map = {x.id: x.name for x in (_hr_lookup_options('WORK_LOCATION') or [])}
+    headers = ['الشهر', 'الموظف', 'الرقم الوظيفي', 'موقع العمل', 'دقائق التأخير', 'دقائق الخروج المبكر', 'أيام الغياب', 'أيام الخصم', 'الحالة', 'ملاحظات']
+    xrows = []
+    for it in q.all():
+        run = getattr(it, 'run', None)
+        u = getattr(it, 'user', None)
+        ef = getattr(u, 'employee_file', None) if u else None
+        name = (getattr(ef, 'full_name_quad', None) or getattr(u, 'full_name', None) or getattr(u, 'name', None) or getattr(u, 'email', None) or '') if u else ''
+        emp_no = getattr(ef, 'employee_no', '') if ef else ''
+        loc = loc_map.get(getattr(ef, 'work_location_lookup_id', None), '') if ef else ''
+        month_lbl = ''
+        if run:
+            month_lbl = f"{int(getattr(run,'year',0) or 0):04d}-{int(getattr(run,'month',0) or 0):02d}"
+        xrows.append([
+            month_lbl,
+            name,
+            emp_no,
+            loc,
+            int(getattr(it, 'late_minutes', 0) or 0),
+            int(getattr(it, 'early_leave_minutes', 0) or 0),
+            int(getattr(it, 'absent_days', 0) or 0),
+            float(getattr(it, 'amount', 0) or 0),
+            getattr(run, 'status', '') if run else '',
+            getattr(it, 'note', '') or '',
+        ])
+    return headers, xrows
+
+
+report_jobs.register('hr_salary_deductions', 'تقرير الخصم من الراتب', _job_hr_salary_deductions, filename='salary_deductions', perm=HR_REPORTS_EXPORT)
+
+
 @portal_bp.route('/hr/reports/leaves/salary-deductions', methods=['GET'])
 @login_required
 @_perm(HR_REPORTS_VIEW)
 def hr_report_salary_deductions():
     """تقرير الخصم من الراتب: يعتمد على نتائج تنفيذ الخصم (hr_att_deduction_run/items)."""
+    if (request.args.get('export') or '').lower() == 'xlsx':
+        if not current_user.has_perm(HR_REPORTS_EXPORT):
+            abort(403)
+        return _submit_report_job('hr_salary_deductions')
+
     users = _list_hr_users()
     work_locations = _hr_lookup_options('WORK_LOCATION')
-    loc_map = {x.id: x.name for x in (work_locations or [])}
 
     user_id_raw = (request.args.get('user_id') or '').strip()
     work_location_id_raw = (request.args.get('work_location_id') or '').strip()
@@ -20978,56 +21102,7 @@ def hr_report_salary_deductions():
     user_id = int(user_id_raw) if user_id_raw.isdigit() else None
     work_location_id = int(work_location_id_raw) if work_location_id_raw.isdigit() else None
 
-    user_ids = _filtered_user_ids(employee_id=user_id, work_location_id=work_location_id)
-    if not user_ids and any([user_id, work_location_id]):
-        user_ids = []
-
-    # Month key boundaries (YYYYMM)
-    from_key = (from_date.year * 100 + from_date.month) if from_date else None
-    to_key = (to_date.year * 100 + to_date.month) if to_date else None
-
-    rows = []
-    if user_ids:
-        q = (HRAttendanceDeductionItem.query
-             .join(HRAttendanceDeductionRun, HRAttendanceDeductionRun.id == HRAttendanceDeductionItem.run_id)
-             .filter(HRAttendanceDeductionItem.user_id.in_(user_ids)))
-
-        if from_key is not None:
-            q = q.filter((HRAttendanceDeductionRun.year * 100 + HRAttendanceDeductionRun.month) >= int(from_key))
-        if to_key is not None:
-            q = q.filter((HRAttendanceDeductionRun.year * 100 + HRAttendanceDeductionRun.month) <= int(to_key))
-
-        q = q.order_by(HRAttendanceDeductionRun.year.desc(), HRAttendanceDeductionRun.month.desc(), HRAttendanceDeductionItem.amount.desc())
-        rows = q.limit(5000).all()
-
-    if (request.args.get('export') or '').lower() == 'xlsx':
-        if not current_user.has_perm(HR_REPORTS_EXPORT):
-            abort(403)
-        headers = ['الشهر', 'الموظف', 'الرقم الوظيفي', 'موقع العمل', 'دقائق التأخير', 'دقائق الخروج المبكر', 'أيام الغياب', 'أيام الخصم', 'الحالة', 'ملاحظات']
-        xrows = []
-        for it in rows:
-            run = getattr(it, 'run', None)
-            u = getattr(it, 'user', None)
-            ef = getattr(u, 'employee_file', None) if u else None
-            name = (getattr(ef, 'full_name_quad', None) or getattr(u, 'full_name', None) or getattr(u, 'name', None) or getattr(u, 'email', None) or '') if u else ''
-            emp_no = getattr(ef, 'employee_no', '') if ef else ''
-            loc = loc_map.get(getattr(ef, 'work_location_lookup_id', None), '') if ef else ''
-            month_lbl = ''
-            if run:
-                month_lbl = f"{int(getattr(run,'year',0) or 0):04d}-{int(getattr(run,'month',0) or 0):02d}"
-            xrows.append([
-                month_lbl,
-                name,
-                emp_no,
-                loc,
-                int(getattr(it, 'late_minutes', 0) or 0),
-                int(getattr(it, 'early_leave_minutes', 0) or 0),
-                int(getattr(it, 'absent_days', 0) or 0),
-                float(getattr(it, 'amount', 0) or 0),
-                getattr(run, 'status', '') if run else '',
-                getattr(it, 'note', '') or '',
-            ])
-        return _export_xlsx('salary_deductions.xlsx', headers, xrows)
+    rows = _hr_salary_deductions_query(user_id, work_location_id, from_date, to_date).limit(5000).all()
 
     return render_template(
         'portal/hr/reports_salary_deductions.html',
@@ -21226,7 +21301,7 @@ def inventory_requests_log():
     status = request.args.get("status") or ""
     manager_approval = request.args.get("manager_approval") or ""
 
-    qry = InvRequest.query
+    qry = InvRequest.query.options(*loader_profiles.options(InvRequest, 'list'))
 
     if department_id:
         try:
@@ -21387,6 +21462,9 @@ def inventory_issue_voucher_new():
             flash("يرجى إضافة صنف واحد على الأقل.", "warning")
             return redirect(url_for("portal.inventory_issue_voucher_new"))
 
+        # Stock ledger + balances (same transaction as the voucher)
+        inv_ledger.post_voucher("ISSUE", v.id)
+
         # Attachments
         # Audit + commit voucher/lines first (protect from attachments failure)
         try:
@@ -21475,7 +21553,7 @@ def inventory_issue_voucher_list():
     contains = (request.args.get("contains") or "").strip()
     issue_kind = (request.args.get("issue_kind") or "").strip().upper()
 
-    qry = InvIssueVoucher.query
+    qry = InvIssueVoucher.query.options(*loader_profiles.options(InvIssueVoucher, 'list'))
 
     if voucher_no:
         qry = qry.filter(InvIssueVoucher.voucher_no.ilike(f"%{voucher_no}%"))
@@ -21653,6 +21731,9 @@ def inventory_inbound_voucher_new():
             flash("يرجى إضافة صنف واحد على الأقل.", "warning")
             return redirect(url_for("portal.inventory_inbound_voucher_new"))
 
+        # Stock ledger + balances (same transaction as the voucher)
+        inv_ledger.post_voucher("INBOUND", v.id)
+
         # Audit + commit voucher/lines first (protect from attachments failure)
         try:
             db.session.add(AuditLog(
@@ -21732,7 +21813,7 @@ def inventory_inbound_voucher_list():
     to_warehouse_id = request.args.get("to_warehouse_id") or ""
     contains = (request.args.get("contains") or "").strip()
 
-    qry = InvInboundVoucher.query
+    qry = InvInboundVoucher.query.options(*loader_profiles.options(InvInboundVoucher, 'list'))
 
     if voucher_no:
         qry = qry.filter(InvInboundVoucher.voucher_no.ilike(f"%{voucher_no}%"))
@@ -21894,6 +21975,9 @@ def inventory_scrap_voucher_new():
             flash("يرجى إضافة صنف واحد على الأقل.", "warning")
             return redirect(url_for("portal.inventory_scrap_voucher_new"))
 
+        # Stock ledger + balances (same transaction as the voucher)
+        inv_ledger.post_voucher("SCRAP", v.id)
+
         # Audit + commit voucher/lines first (protect from attachments failure)
         try:
             db.session.add(AuditLog(
@@ -21973,7 +22057,7 @@ def inventory_scrap_voucher_list():
     from_warehouse_id = request.args.get("from_warehouse_id") or ""
     contains = (request.args.get("contains") or "").strip()
 
-    qry = InvScrapVoucher.query
+    qry = InvScrapVoucher.query.options(*loader_profiles.options(InvScrapVoucher, 'list'))
 
     if voucher_no:
         qry = qry.filter(InvScrapVoucher.voucher_no.ilike(f"%{voucher_no}%"))
@@ -22144,6 +22228,9 @@ def inventory_return_voucher_new():
             flash("يرجى إضافة صنف واحد على الأقل.", "warning")
             return redirect(url_for("portal.inventory_return_voucher_new"))
 
+        # Stock ledger + balances (same transaction as the voucher)
+        inv_ledger.post_voucher("RETURN", v.id)
+
         # Audit + commit voucher/lines first (protect from attachments failure)
         try:
             db.session.add(AuditLog(
@@ -22225,7 +22312,7 @@ def inventory_return_voucher_list():
     to_warehouse_id = request.args.get("to_warehouse_id") or ""
     contains = (request.args.get("contains") or "").strip()
 
-    qry = InvReturnVoucher.query
+    qry = InvReturnVoucher.query.options(*loader_profiles.options(InvReturnVoucher, 'list'))
 
     if voucher_no:
         qry = qry.filter(InvReturnVoucher.voucher_no.ilike(f"%{voucher_no}%"))
@@ -22546,6 +22633,9 @@ def inventory_stocktake_voucher_new():
             flash("يرجى إضافة صنف واحد على الأقل.", "warning")
             return redirect(url_for("portal.inventory_stocktake_voucher_new"))
 
+        # Stock ledger + balances (same transaction as the voucher)
+        inv_ledger.post_voucher("STOCKTAKE", v.id)
+
         # Audit + commit voucher/lines first (protect from attachments failure)
         try:
             db.session.add(AuditLog(
@@ -22624,7 +22714,7 @@ def inventory_stocktake_voucher_list():
     to_date = request.args.get("to_date") or ""
     warehouse_id = request.args.get("warehouse_id") or ""
 
-    qry = InvStocktakeVoucher.query
+    qry = InvStocktakeVoucher.query.options(*loader_profiles.options(InvStocktakeVoucher, 'list'))
     if voucher_no:
         qry = qry.filter(InvStocktakeVoucher.voucher_no.ilike(f"%{voucher_no}%"))
     if from_date:
@@ -22870,7 +22960,7 @@ def inventory_custody_voucher_list():
     holder_user_id = request.args.get("holder_user_id") or ""
     holder_room_id = request.args.get("holder_room_id") or ""
 
-    qry = InvCustodyVoucher.query
+    qry = InvCustodyVoucher.query.options(*loader_profiles.options(InvCustodyVoucher, 'list'))
     if voucher_no:
         qry = qry.filter(InvCustodyVoucher.voucher_no.ilike(f"%{voucher_no}%"))
     if from_date:
@@ -22957,7 +23047,7 @@ def inventory_custody_overview():
     rooms = InvRoom.query.filter(InvRoom.is_active == True).order_by(InvRoom.name.asc()).all()  # noqa: E712
     users = User.query.order_by(func.coalesce(User.name, User.email).asc(), User.id.asc()).all()
 
-    vouchers_q = InvCustodyVoucher.query
+    vouchers_q = InvCustodyVoucher.query.options(*loader_profiles.options(InvCustodyVoucher, 'list'))
     if holder_kind in ("EMPLOYEE", "ROOM"):
         vouchers_q = vouchers_q.filter(InvCustodyVoucher.holder_kind == holder_kind)
     if holder_user_id and holder_user_id.isdigit():
@@ -22980,7 +23070,10 @@ def inventory_custody_overview():
         )
 
     v_ids = [v.id for v in vouchers]
-    lines = InvCustodyVoucherLine.query.filter(InvCustodyVoucherLine.voucher_id.in_(v_ids)).all()
+    lines = (
+        InvCustodyVoucherLine.query.options(*loader_profiles.options(InvCustodyVoucherLine, 'list'))
+        .filter(InvCustodyVoucherLine.voucher_id.in_(v_ids)).all()
+    )
 
     # choose last entry per (holder_kind, holder_id, item_id)
     last = {}
@@ -23040,7 +23133,10 @@ def inventory_custody_items():
         return render_template("portal/inventory/custody_items.html", rows=[])
 
     v_ids = [v.id for v in vouchers]
-    lines = InvCustodyVoucherLine.query.filter(InvCustodyVoucherLine.voucher_id.in_(v_ids)).all()
+    lines = (
+        InvCustodyVoucherLine.query.options(*loader_profiles.options(InvCustodyVoucherLine, 'list'))
+        .filter(InvCustodyVoucherLine.voucher_id.in_(v_ids)).all()
+    )
 
     last = {}
     v_by_id = {v.id: v for v in vouchers}
@@ -23072,124 +23168,12 @@ def inventory_custody_items():
 # ==========================================================
 
 def _inv_build_balances():
-    """Compute current balances per (warehouse_id, item_id).
+    """Current balances per (warehouse_id, item_id), read from the maintained inv_balance table.
 
-    Rules:
-    - Inbound/Return: +
-    - Issue (ROOM): - from warehouse
-    - Issue (WAREHOUSE transfer): - from warehouse AND + to warehouse
-    - Scrap: -
-    - Stocktake: treated as a baseline per (warehouse,item): take latest stocktake qty, then apply movements after it.
+    The stock ledger (services/inventory_ledger.py) is posted by every voucher write; see
+    compute_balances_from_vouchers() there for the full recomputation used to verify it.
     """
-    balances: dict[tuple[int, int], float] = {}
-
-    # 1) Stocktake baseline per (warehouse,item)
-    baseline_date: dict[tuple[int, int], str] = {}
-    baseline_qty: dict[tuple[int, int], float] = {}
-
-    st_rows = (
-        db.session.query(
-            InvStocktakeVoucher.warehouse_id,
-            InvStocktakeVoucherLine.item_id,
-            InvStocktakeVoucher.voucher_date,
-            InvStocktakeVoucher.id,
-            func.sum(InvStocktakeVoucherLine.qty),
-        )
-        .join(InvStocktakeVoucherLine, InvStocktakeVoucherLine.voucher_id == InvStocktakeVoucher.id)
-        .group_by(
-            InvStocktakeVoucher.warehouse_id,
-            InvStocktakeVoucherLine.item_id,
-            InvStocktakeVoucher.voucher_date,
-            InvStocktakeVoucher.id,
-        )
-        .all()
-    )
-    # keep (date, id) for baseline selection
-    baseline_key: dict[tuple[int, int], tuple[str, int]] = {}
-    for wh_id, item_id, v_date, v_id, s in st_rows:
-        if not wh_id or not item_id or not v_date:
-            continue
-        k = (int(wh_id), int(item_id))
-        cand = (str(v_date), int(v_id))
-        prev = baseline_key.get(k)
-        if prev is None or cand > prev:
-            baseline_key[k] = cand
-            baseline_date[k] = str(v_date)
-            baseline_qty[k] = float(s or 0)
-
-    for k, qty in baseline_qty.items():
-        balances[k] = float(qty or 0)
-
-    def _after_baseline(wh_id: int, item_id: int, v_date: str) -> bool:
-        bd = baseline_date.get((wh_id, item_id))
-        return (not bd) or (v_date and v_date > bd)
-
-    def _add(wh_id: int, item_id: int, v_date: str, delta: float):
-        if not wh_id or not item_id or not v_date:
-            return
-        wh_id = int(wh_id)
-        item_id = int(item_id)
-        if not _after_baseline(wh_id, item_id, str(v_date)):
-            return
-        balances[(wh_id, item_id)] = balances.get((wh_id, item_id), 0.0) + float(delta or 0)
-
-    # 2) Inbound (+)
-    inbound_rows = (
-        db.session.query(InvInboundVoucher.to_warehouse_id, InvInboundVoucherLine.item_id, InvInboundVoucher.voucher_date, func.sum(InvInboundVoucherLine.qty))
-        .join(InvInboundVoucherLine, InvInboundVoucherLine.voucher_id == InvInboundVoucher.id)
-        .group_by(InvInboundVoucher.to_warehouse_id, InvInboundVoucherLine.item_id, InvInboundVoucher.voucher_date)
-        .all()
-    )
-    for wh_id, item_id, v_date, s in inbound_rows:
-        _add(wh_id, item_id, v_date, float(s or 0))
-
-    # 3) Return (+)
-    return_rows = (
-        db.session.query(InvReturnVoucher.to_warehouse_id, InvReturnVoucherLine.item_id, InvReturnVoucher.voucher_date, func.sum(InvReturnVoucherLine.qty))
-        .join(InvReturnVoucherLine, InvReturnVoucherLine.voucher_id == InvReturnVoucher.id)
-        .group_by(InvReturnVoucher.to_warehouse_id, InvReturnVoucherLine.item_id, InvReturnVoucher.voucher_date)
-        .all()
-    )
-    for wh_id, item_id, v_date, s in return_rows:
-        _add(wh_id, item_id, v_date, float(s or 0))
-
-    # 4) Issue (ROOM: -, WAREHOUSE transfer: -/+)
-    issue_rows = (
-        db.session.query(
-            InvIssueVoucher.issue_kind,
-            InvIssueVoucher.from_warehouse_id,
-            InvIssueVoucher.to_warehouse_id,
-            InvIssueVoucher.voucher_date,
-            InvIssueVoucherLine.item_id,
-            func.sum(InvIssueVoucherLine.qty),
-        )
-        .join(InvIssueVoucherLine, InvIssueVoucherLine.voucher_id == InvIssueVoucher.id)
-        .group_by(
-            InvIssueVoucher.issue_kind,
-            InvIssueVoucher.from_warehouse_id,
-            InvIssueVoucher.to_warehouse_id,
-            InvIssueVoucher.voucher_date,
-            InvIssueVoucherLine.item_id,
-        )
-        .all()
-    )
-    for kind, from_wh, to_wh, v_date, item_id, s in issue_rows:
-        qty = float(s or 0)
-        _add(from_wh, item_id, v_date, -qty)
-        if (kind or "").upper() == "WAREHOUSE" and to_wh:
-            _add(to_wh, item_id, v_date, qty)
-
-    # 5) Scrap (-)
-    scrap_rows = (
-        db.session.query(InvScrapVoucher.from_warehouse_id, InvScrapVoucherLine.item_id, InvScrapVoucher.voucher_date, func.sum(InvScrapVoucherLine.qty))
-        .join(InvScrapVoucherLine, InvScrapVoucherLine.voucher_id == InvScrapVoucher.id)
-        .group_by(InvScrapVoucher.from_warehouse_id, InvScrapVoucherLine.item_id, InvScrapVoucher.voucher_date)
-        .all()
-    )
-    for wh_id, item_id, v_date, s in scrap_rows:
-        _add(wh_id, item_id, v_date, -float(s or 0))
-
-    return balances
+    return inv_ledger.balances_map()
 
 
 @portal_bp.route("/inventory/reports/warehouses")
@@ -23197,20 +23181,12 @@ def _inv_build_balances():
 @_perm_any(STORE_READ, STORE_MANAGE)
 def inventory_report_warehouses():
     warehouses = InvWarehouse.query.filter(InvWarehouse.is_active == True).order_by(InvWarehouse.name.asc()).all()  # noqa: E712
-    balances = _inv_build_balances()
+    totals = inv_ledger.warehouse_totals()
 
     rows = []
     for w in warehouses:
-        total_qty = 0.0
-        item_count = 0
-        for (wh_id, _item_id), qty in balances.items():
-            if wh_id != w.id:
-                continue
-            if abs(qty) < 1e-9:
-                continue
-            item_count += 1
-            total_qty += float(qty or 0)
-        rows.append({"warehouse": w, "item_count": item_count, "total_qty": total_qty})
+        t = totals.get(w.id) or {}
+        rows.append({"warehouse": w, "item_count": t.get("item_count", 0), "total_qty": t.get("total_qty", 0.0)})
 
     return render_template("portal/inventory/report_warehouses.html", rows=rows)
 
@@ -23220,11 +23196,7 @@ def inventory_report_warehouses():
 @_perm_any(STORE_READ, STORE_MANAGE)
 def inventory_report_items_all():
     items = InvItem.query.filter(InvItem.is_active == True).order_by(InvItem.name.asc()).all()  # noqa: E712
-    balances = _inv_build_balances()
-
-    agg = {}
-    for (wh_id, item_id), qty in balances.items():
-        agg[item_id] = agg.get(item_id, 0.0) + float(qty or 0)
+    agg = inv_ledger.item_totals()
 
     rows = []
     for it in items:
@@ -23247,64 +23219,33 @@ def inventory_report_item_card():
 
     movements = []
     sel_item = None
+    opening_qty = None
+    closing_qty = None
 
     if item_id and item_id.isdigit():
         iid = int(item_id)
         sel_item = InvItem.query.get(iid)
+        wh_filter = int(warehouse_id) if warehouse_id.isdigit() else None
+
+        # Indexed range scan over the stock ledger (item_id, movement_date)
+        movements = inv_ledger.item_card_movements(
+            iid,
+            warehouse_id=wh_filter,
+            from_date=from_date,
+            to_date=to_date,
+        )
 
-        # inbound
-        q = db.session.query(InvInboundVoucher.voucher_date, InvInboundVoucher.voucher_no, InvInboundVoucher.to_warehouse_id, InvInboundVoucherLine.qty)
-        q = q.join(InvInboundVoucherLine, InvInboundVoucherLine.voucher_id == InvInboundVoucher.id)
-        q = q.filter(InvInboundVoucherLine.item_id == iid)
-        if warehouse_id and warehouse_id.isdigit():
-            q = q.filter(InvInboundVoucher.to_warehouse_id == int(warehouse_id))
+        # Opening/closing balances from month-end snapshots (+ delta replay)
         if from_date:
-            q = q.filter(InvInboundVoucher.voucher_date >= from_date)
-        if to_date:
-            q = q.filter(InvInboundVoucher.voucher_date <= to_date)
-        for d, no, wh, qty in q.all():
-            movements.append({"date": d, "type": "إدخال", "voucher_no": no, "warehouse_id": wh, "qty": float(qty or 0)})
-
-        # return
-        q = db.session.query(InvReturnVoucher.voucher_date, InvReturnVoucher.voucher_no, InvReturnVoucher.to_warehouse_id, InvReturnVoucherLine.qty)
-        q = q.join(InvReturnVoucherLine, InvReturnVoucherLine.voucher_id == InvReturnVoucher.id)
-        q = q.filter(InvReturnVoucherLine.item_id == iid)
-        if warehouse_id and warehouse_id.isdigit():
-            q = q.filter(InvReturnVoucher.to_warehouse_id == int(warehouse_id))
-        if from_date:
-            q = q.filter(InvReturnVoucher.voucher_date >= from_date)
-        if to_date:
-            q = q.filter(InvReturnVoucher.voucher_date <= to_date)
-        for d, no, wh, qty in q.all():
-            movements.append({"date": d, "type": "إرجاع", "voucher_no": no, "warehouse_id": wh, "qty": float(qty or 0)})
-
-        # issue (negative)
-        q = db.session.query(InvIssueVoucher.voucher_date, InvIssueVoucher.voucher_no, InvIssueVoucher.from_warehouse_id, InvIssueVoucherLine.qty)
-        q = q.join(InvIssueVoucherLine, InvIssueVoucherLine.voucher_id == InvIssueVoucher.id)
-        q = q.filter(InvIssueVoucherLine.item_id == iid)
-        if warehouse_id and warehouse_id.isdigit():
-            q = q.filter(InvIssueVoucher.from_warehouse_id == int(warehouse_id))
-        if from_date:
-            q = q.filter(InvIssueVoucher.voucher_date >= from_date)
-        if to_date:
-            q = q.filter(InvIssueVoucher.voucher_date <= to_date)
-        for d, no, wh, qty in q.all():
-            movements.append({"date": d, "type": "صرف", "voucher_no": no, "warehouse_id": wh, "qty": -float(qty or 0)})
-
-        # scrap (negative)
-        q = db.session.query(InvScrapVoucher.voucher_date, InvScrapVoucher.voucher_no, InvScrapVoucher.from_warehouse_id, InvScrapVoucherLine.qty)
-        q = q.join(InvScrapVoucherLine, InvScrapVoucherLine.voucher_id == InvScrapVoucher.id)
-        q = q.filter(InvScrapVoucherLine.item_id == iid)
-        if warehouse_id and warehouse_id.isdigit():
-            q = q.filter(InvScrapVoucher.from_warehouse_id == int(warehouse_id))
-        if from_date:
-            q = q.filter(InvScrapVoucher.voucher_date >= from_date)
+            try:
+                day_before = (datetime.strptime(from_date, "%Y-%m-%d").date() - timedelta(days=1)).isoformat()
+                opening_qty = sum(inv_ledger.balances_as_of(day_before, warehouse_id=wh_filter, item_id=iid).values())
+            except ValueError:
+                opening_qty = None
         if to_date:
-            q = q.filter(InvScrapVoucher.voucher_date <= to_date)
-        for d, no, wh, qty in q.all():
-            movements.append({"date": d, "type": "إتلاف", "voucher_no": no, "warehouse_id": wh, "qty": -float(qty or 0)})
-
-        movements.sort(key=lambda m: (m["date"], m["voucher_no"]))
+            closing_qty = sum(inv_ledger.balances_as_of(to_date, warehouse_id=wh_filter, item_id=iid).values())
+        else:
+            closing_qty = inv_ledger.item_balance(iid, warehouse_id=wh_filter)
 
     selected = {
         "item_id": int(item_id) if item_id.isdigit() else None,
@@ -23324,6 +23265,8 @@ def inventory_report_item_card():
         selected=selected,
         item=sel_item,
         movements=movements,
+        opening_qty=opening_qty,
+        closing_qty=closing_qty,
     )
 
 
@@ -23333,26 +23276,13 @@ def inventory_report_item_card():
 def inventory_report_yearly_vouchers():
     year = (request.args.get("year") or "").strip()
 
-    def _year_of(d):
-        return (d or "")[:4]
-
-    counts = {}
-
-    for cls, label in [(InvIssueVoucher, "صرف"), (InvInboundVoucher, "إدخال"), (InvReturnVoucher, "إرجاع"), (InvScrapVoucher, "إتلاف"), (InvStocktakeVoucher, "جرد")]:
-        rows = db.session.query(cls.voucher_date, func.count(cls.id)).group_by(cls.voucher_date).all()
-        for d, c in rows:
-            y = _year_of(d)
-            if not y:
-                continue
-            if year and y != year:
-                continue
-            counts.setdefault(y, {})
-            counts[y][label] = counts[y].get(label, 0) + int(c or 0)
+    # Per-month flow totals stored with the balance snapshots (+ ledger rows after the last one)
+    flows = inv_ledger.yearly_flows(year)
 
-    years = sorted(counts.keys())
     rows_out = []
-    for y in years:
-        rows_out.append({"year": y, "data": counts[y]})
+    for y in sorted(flows.keys()):
+        data = {inv_ledger.KIND_LABELS_AR.get(vt, vt): f["vouchers"] for vt, f in flows[y].items()}
+        rows_out.append({"year": y, "data": data})
 
     return render_template("portal/inventory/report_yearly_vouchers.html", rows=rows_out, selected_year=year)
 
@@ -23363,70 +23293,15 @@ def inventory_report_yearly_vouchers():
 def inventory_report_yearly_qty():
     year = (request.args.get("year") or "").strip()
 
-    def _year_of(d):
-        return (d or "")[:4]
-
-    sums = {}
-
-    # inbound
-    rows = db.session.query(InvInboundVoucher.voucher_date, func.sum(InvInboundVoucherLine.qty)).join(InvInboundVoucherLine, InvInboundVoucherLine.voucher_id == InvInboundVoucher.id).group_by(InvInboundVoucher.voucher_date).all()
-    for d, s in rows:
-        y = _year_of(d)
-        if not y:
-            continue
-        if year and y != year:
-            continue
-        sums.setdefault(y, {})
-        sums[y]["إدخال"] = sums[y].get("إدخال", 0.0) + float(s or 0)
-
-    # return
-    rows = db.session.query(InvReturnVoucher.voucher_date, func.sum(InvReturnVoucherLine.qty)).join(InvReturnVoucherLine, InvReturnVoucherLine.voucher_id == InvReturnVoucher.id).group_by(InvReturnVoucher.voucher_date).all()
-    for d, s in rows:
-        y = _year_of(d)
-        if not y:
-            continue
-        if year and y != year:
-            continue
-        sums.setdefault(y, {})
-        sums[y]["إرجاع"] = sums[y].get("إرجاع", 0.0) + float(s or 0)
-
-    # issue
-    rows = db.session.query(InvIssueVoucher.voucher_date, func.sum(InvIssueVoucherLine.qty)).join(InvIssueVoucherLine, InvIssueVoucherLine.voucher_id == InvIssueVoucher.id).group_by(InvIssueVoucher.voucher_date).all()
-    for d, s in rows:
-        y = _year_of(d)
-        if not y:
-            continue
-        if year and y != year:
-            continue
-        sums.setdefault(y, {})
-        sums[y]["صرف"] = sums[y].get("صرف", 0.0) + float(s or 0)
-
-    # scrap
-    rows = db.session.query(InvScrapVoucher.voucher_date, func.sum(InvScrapVoucherLine.qty)).join(InvScrapVoucherLine, InvScrapVoucherLine.voucher_id == InvScrapVoucher.id).group_by(InvScrapVoucher.voucher_date).all()
-    for d, s in rows:
-        y = _year_of(d)
-        if not y:
-            continue
-        if year and y != year:
-            continue
-        sums.setdefault(y, {})
-        sums[y]["إتلاف"] = sums[y].get("إتلاف", 0.0) + float(s or 0)
-
-    # stocktake (qty recorded, informational)
-    rows = db.session.query(InvStocktakeVoucher.voucher_date, func.sum(InvStocktakeVoucherLine.qty)).join(InvStocktakeVoucherLine, InvStocktakeVoucherLine.voucher_id == InvStocktakeVoucher.id).group_by(InvStocktakeVoucher.voucher_date).all()
-    for d, s in rows:
-        y = _year_of(d)
-        if not y:
-            continue
-        if year and y != year:
-            continue
-        sums.setdefault(y, {})
-        sums[y]["جرد"] = sums[y].get("جرد", 0.0) + float(s or 0)
+    # Per-month flow totals stored with the balance snapshots (+ ledger rows after the last one)
+    flows = inv_ledger.yearly_flows(year)
 
-    years = sorted(sums.keys())
     rows_out = []
-    for y in years:
-        rows_out.append({"year": y, "data": sums[y]})
+    for y in sorted(flows.keys()):
+        data = {inv_ledger.KIND_LABELS_AR.get(vt, vt): f["qty"] for vt, f in flows[y].items()}
+        # Closing balance: nearest month-end snapshot (December) + delta replay
+        closing = inv_ledger.balances_as_of(f"{y}-12-31")
+        rows_out.append({"year": y, "data": data, "closing_qty": sum(closing.values())})
 
     return render_template("portal/inventory/report_yearly_qty.html", rows=rows_out, selected_year=year)
 
@@ -23442,7 +23317,14 @@ def inventory_report_issue_log():
     warehouse_id = request.args.get("warehouse_id") or ""
     contains = (request.args.get("contains") or "").strip()
 
-    qry = db.session.query(InvIssueVoucher, InvIssueVoucherLine).join(InvIssueVoucherLine, InvIssueVoucherLine.voucher_id == InvIssueVoucher.id)
+    qry = (
+        db.session.query(InvIssueVoucher, InvIssueVoucherLine)
+        .join(InvIssueVoucherLine, InvIssueVoucherLine.voucher_id == InvIssueVoucher.id)
+        .options(
+            *loader_profiles.options(InvIssueVoucher, 'list'),
+            *loader_profiles.options(InvIssueVoucherLine, 'list'),
+        )
+    )
 
     if from_date:
         qry = qry.filter(InvIssueVoucher.voucher_date >= from_date)
@@ -23804,27 +23686,13 @@ def _training_can_manage() -> bool:
 
 def _ss_get_bool(key: str, default: bool = False) -> bool:
     try:
-        row = SystemSetting.query.filter_by(key=key).first()
-        if not row or row.value is None:
-            return default
-        v = str(row.value).strip().lower()
-        if v in ("1", "true", "yes", "on", "نعم", "فعال", "enable", "enabled"):
-            return True
-        if v in ("0", "false", "no", "off", "لا", "غير فعال", "disable", "disabled"):
-            return False
-        return default
+        return settings_service.get_bool(key, default)
     except Exception:
         return default
 
 
 def _ss_set_bool(key: str, val: bool):
-    v = "1" if val else "0"
-    row = SystemSetting.query.filter_by(key=key).first()
-    if not row:
-        row = SystemSetting(key=key, value=v)
-        db.session.add(row)
-    else:
-        row.value = v
+    settings_service.set_value(key, "1" if val else "0")
 
 
 def _training_effective_bool(program: HRTrainingProgram, field_name: str, sys_key: str, default: bool = False) -> bool:
@@ -23940,22 +23808,14 @@ def _training_notify_published(p: HRTrainingProgram, actor_id: int | None = None
             if getattr(p, "publish_conditions_only", False):
                 conds = HRTrainingCondition.query.filter_by(program_id=p.id).all()
                 if conds:
-                    # preload employee files
-                    efs = EmployeeFile.query.filter(EmployeeFile.user_id.in_(user_ids)).all()
-                    ef_map = {int(ef.user_id): ef for ef in efs if getattr(ef, 'user_id', None) is not None}
-
-                    qual_cache = {}
-                    eligible = []
-                    for uid in user_ids:
-                        ef = ef_map.get(uid)
-                        ok = True
-                        for cond in conds:
-                            if not _training_eval_condition_strict(ef, cond, qual_cache=qual_cache):
-                                ok = False
-                                break
-                        if ok:
-                            eligible.append(uid)
-                    user_ids = eligible
+                    # one query: same recipients, narrowed by the compiled conditions
+                    stmt = (
+                        training_eligibility.eligible_users_select(conds, strict=True)
+                        .where(role_upper != "ADMIN")
+                        .where(~role_upper.like("SUPER%"))
+                        .order_by(User.id)
+                    )
+                    user_ids = [int(uid) for uid in db.session.execute(stmt).scalars() if uid]
 
                 if not user_ids:
                     return
@@ -24358,7 +24218,7 @@ def hr_training_log():
     year = request.args.get("year")
     employee_id = request.args.get("employee_id")
 
-    q = HRTrainingProgram.query
+    q = HRTrainingProgram.query.options(*loader_profiles.options(HRTrainingProgram, "list"))
 
     if course_id and str(course_id).isdigit():
         q = q.filter(HRTrainingProgram.course_id == int(course_id))
@@ -24411,11 +24271,6 @@ def hr_training_log():
 
         # If program is published by conditions only, hide it from employees who do not match.
         eligible_open = set()
-        try:
-            ef_me = EmployeeFile.query.filter_by(user_id=current_user.id).first()
-        except Exception:
-            ef_me = None
-
         cond_map = {}
         try:
             cond_prog_ids = [pp.id for pp in programs if open_map.get(pp.id) and getattr(pp, 'publish_conditions_only', False)]
@@ -24425,15 +24280,7 @@ def hr_training_log():
                     cond_map.setdefault(int(c.program_id), []).append(c)
 
             if cond_map:
-                qual_cache = {}
-                for pid, conds in cond_map.items():
-                    ok = True
-                    for cond in conds:
-                        if not _training_eval_condition_strict(ef_me, cond, qual_cache=qual_cache):
-                            ok = False
-                            break
-                    if ok:
-                        eligible_open.add(int(pid))
+                eligible_open = training_eligibility.eligible_program_ids(db.session, current_user.id, cond_map, strict=True)
         except Exception:
             eligible_open = set()
 
@@ -24889,13 +24736,8 @@ def hr_training_program_enrollments(program_id: int):
 
             # apply conditions (admin nomination) if enabled
             if _training_effective_bool(p, "apply_conditions_in_program", SS_TRAINING_APPLY_COND_ADMIN, False):
-                ef = EmployeeFile.query.filter_by(user_id=u.id).first()
-                ok = True
-                for cond in HRTrainingCondition.query.filter_by(program_id=p.id).all():
-                    if not _training_eval_condition(ef, cond):
-                        ok = False
-                        break
-                if not ok:
+                conds = HRTrainingCondition.query.filter_by(program_id=p.id).all()
+                if not training_eligibility.is_eligible(db.session, u.id, conds, strict=False):
                     flash("لا تنطبق شروط الانتساب على هذا الموظف.", "danger")
                     return redirect(url_for("portal.hr_training_program_enrollments", program_id=p.id))
 
@@ -24936,10 +24778,16 @@ def hr_training_program_enrollments(program_id: int):
 
     rows = HRTrainingEnrollment.query.filter_by(program_id=p.id).order_by(HRTrainingEnrollment.created_at.desc()).all()
 
-    # Employees lookup (for faster selection in the form)
+    # Employees lookup (for faster selection in the form).
+    # When admin nominations must meet the conditions, only eligible employees are offered.
     try:
+        q = User.query
+        if _training_effective_bool(p, "apply_conditions_in_program", SS_TRAINING_APPLY_COND_ADMIN, False):
+            conds = HRTrainingCondition.query.filter_by(program_id=p.id).all()
+            if conds:
+                q = q.filter(User.id.in_(training_eligibility.eligible_users_select(conds, strict=False)))
         employees = (
-            User.query
+            q
             .order_by(func.coalesce(User.name, User.email).asc(), User.id.asc())
             .limit(500)
             .all()
@@ -24985,25 +24833,9 @@ def hr_training_program_apply(program_id: int):
         cond_required = _training_effective_bool(p, "apply_conditions_on_portal", SS_TRAINING_APPLY_COND_PORTAL, False)
 
     if cond_required:
-        ef = EmployeeFile.query.filter_by(user_id=current_user.id).first()
-        ok = True
-        qual_cache = {}
-        for cond in HRTrainingCondition.query.filter_by(program_id=p.id).all():
-            try:
-                if getattr(p, "publish_conditions_only", False):
-                    if not _training_eval_condition_strict(ef, cond, qual_cache=qual_cache):
-                        ok = False
-                        break
-                else:
-                    if not _training_eval_condition(ef, cond):
-                        ok = False
-                        break
-            except Exception:
-                # fallback to existing behavior
-                if not _training_eval_condition(ef, cond):
-                    ok = False
-                    break
-        if not ok:
+        conds = HRTrainingCondition.query.filter_by(program_id=p.id).all()
+        strict = bool(getattr(p, "publish_conditions_only", False))
+        if not training_eligibility.is_eligible(db.session, current_user.id, conds, strict=strict):
             flash("لا تنطبق شروط الانتساب عليك.", "danger")
             return redirect(url_for("portal.hr_training_log"))
 
@@ -6,7 +6,8 @@ from datetime import datetime
 from sqlalchemy import func
 
 from extensions import db
-from models import SystemSetting, User
+from models import User
+from services import settings_service
 
 
 _started = False
@@ -14,21 +15,12 @@ _lock = threading.Lock()
 
 
 def _setting_get(key: str, default=None):
-    row = SystemSetting.query.filter_by(key=key).first()
-    if row and row.value is not None and row.value != "":
-        return row.value
-    return default
+    return settings_service.get_str(key, default)
 
 
 def _setting_set(key: str, value: str | None):
     """Upsert a SystemSetting (no auto-commit)."""
-    row = SystemSetting.query.filter_by(key=key).first()
-    if not row:
-        row = SystemSetting(key=key, value=(value or ""))
-        db.session.add(row)
-    else:
-        row.value = (value or "")
-    return row
+    return settings_service.set_value(key, (value or ""))
 
 
 def _setting_get_int(key: str, default: int) -> int:
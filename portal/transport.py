@@ -1,9 +1,10 @@
 from __future__ import annotations
 
-from datetime import datetime
+from datetime import datetime, timedelta
 from typing import Optional
 
-from flask import render_template, request, redirect, url_for, flash
+import msgspec
+from flask import render_template, request, redirect, url_for, flash, jsonify
 from flask_login import login_required, current_user
 
 from . import portal_bp
@@ -15,6 +16,7 @@ from models import (
     TransportZone,
     TransportPermit,
     TransportTrip,
+    TransportTripTrack,
     TransportDriverTask,
     TransportDestination,
     TransportTripDestination,
@@ -22,9 +24,9 @@ from models import (
     TransportMaintenanceItem,
     TransportFuelFill,
     HRLookupItem,
-    SystemSetting,
-    AuditLog,
 )
+from services import audit_writer, fleet_analytics, settings_service, tracking_ingest, trip_tracks
+from utils import loader_profiles
 
 
 # -------------------------
@@ -63,9 +65,9 @@ def _to_float(val: str) -> Optional[float]:
 
 def _get_setting(key: str, default: str = "") -> str:
     try:
-        row = SystemSetting.query.filter_by(key=key).first()
-        if row and row.value is not None:
-            return str(row.value)
+        value = settings_service.get(key)
+        if value is not None:
+            return str(value)
     except Exception:
         pass
     return default
@@ -75,23 +77,18 @@ def _set_setting(key: str, value: str | None) -> None:
     key = (key or "").strip()
     if not key:
         return
-    row = SystemSetting.query.filter_by(key=key).first()
-    if not row:
-        row = SystemSetting(key=key, value=value)
-        db.session.add(row)
-    else:
-        row.value = value
+    settings_service.set_value(key, value)
 
 
 def _audit(action: str, note: str, target_type: str = "TRANSPORT", target_id: int | None = None) -> None:
     try:
-        db.session.add(AuditLog(
+        audit_writer.add(
             user_id=current_user.id,
             action=action,
             note=note,
             target_type=target_type,
             target_id=target_id,
-        ))
+        )
     except Exception:
         pass
 
@@ -110,24 +107,59 @@ def transport_home():
         "trips_month": 0,
         "tasks_open": 0,
     }
+    month = fleet_analytics.month_key(datetime.now())
+    fleet = None
+    flagged = 0
     try:
-        stats["vehicles"] = TransportVehicle.query.count()
-        stats["drivers"] = TransportDriver.query.count()
-        stats["permits_pending"] = TransportPermit.query.filter(TransportPermit.status == "SUBMITTED").count()
-
-        now = datetime.now()
-        month_start = datetime(now.year, now.month, 1)
-        if now.month == 12:
-            next_month = datetime(now.year + 1, 1, 1)
-        else:
-            next_month = datetime(now.year, now.month + 1, 1)
-        stats["trips_month"] = TransportTrip.query.filter(TransportTrip.started_at >= month_start, TransportTrip.started_at < next_month).count()
-
-        stats["tasks_open"] = TransportDriverTask.query.filter(TransportDriverTask.status.in_(["PENDING", "IN_PROGRESS"])).count()
+        # one round trip for the counters; this month's trips come from the fleet cube
+        row = db.session.execute(db.select(
+            db.select(db.func.count(TransportVehicle.id)).scalar_subquery(),
+            db.select(db.func.count(TransportDriver.id)).scalar_subquery(),
+            db.select(db.func.count(TransportPermit.id)).where(TransportPermit.status == "SUBMITTED").scalar_subquery(),
+            db.select(db.func.count(TransportDriverTask.id))
+            .where(TransportDriverTask.status.in_(["PENDING", "IN_PROGRESS"]))
+            .scalar_subquery(),
+        )).one()
+        stats["vehicles"], stats["drivers"], stats["permits_pending"], stats["tasks_open"] = (int(x or 0) for x in row)
+
+        fleet = fleet_analytics.totals(month, month)
+        stats["trips_month"] = int(fleet["trips"] or 0)
+        flagged = len(fleet_analytics.anomalies(month, month))
     except Exception:
-        pass
+        db.session.rollback()
+
+    return render_template("portal/transport/index.html", stats=stats, fleet=fleet, flagged=flagged, month=month)
 
-    return render_template("portal/transport/index.html", stats=stats)
+
+@portal_bp.route("/transport/analytics")
+@login_required
+@perm_required("TRANSPORT_READ")
+def transport_analytics():
+    """Fleet analytics (km / litre, cost per km, maintenance per vehicle) from the fleet cube."""
+    this_month = fleet_analytics.month_key(datetime.now())
+
+    def _month_arg(name: str, default: str) -> str:
+        v = (request.args.get(name) or "").strip()[:7]
+        try:
+            datetime.strptime(v, "%Y-%m")
+            return v
+        except ValueError:
+            return default
+
+    last = _month_arg("to", this_month)
+    first = _month_arg("from", fleet_analytics.shift_month(last, -5))
+    if first > last:
+        first, last = last, first
+
+    return render_template(
+        "portal/transport/analytics.html",
+        first=first,
+        last=last,
+        totals=fleet_analytics.totals(first, last),
+        months=fleet_analytics.by_month(first, last),
+        vehicles=fleet_analytics.by_vehicle(first, last),
+        anomalies=fleet_analytics.anomalies(first, last),
+    )
 
 
 # -------------------------
@@ -465,7 +497,7 @@ def transport_permits():
     q = (request.args.get("q") or "").strip()
     status = (request.args.get("status") or "").strip().upper()
 
-    query = TransportPermit.query
+    query = TransportPermit.query.options(*loader_profiles.options(TransportPermit, "list"))
     if status in ("DRAFT", "SUBMITTED", "APPROVED", "REJECTED", "CANCELLED", "COMPLETED"):
         query = query.filter(TransportPermit.status == status)
     if q:
@@ -536,7 +568,7 @@ def transport_permit_new():
 @login_required
 @perm_required("TRANSPORT_READ")
 def transport_permit_view(permit_id: int):
-    row = TransportPermit.query.get_or_404(permit_id)
+    row = TransportPermit.query.options(*loader_profiles.options(TransportPermit, "detail")).get_or_404(permit_id)
     can_approve = current_user.has_perm("TRANSPORT_APPROVE") and row.status == "SUBMITTED"
     can_update = current_user.has_perm("TRANSPORT_UPDATE") and row.status in ("DRAFT", "SUBMITTED")
     return render_template("portal/transport/permit_view.html", item=row, can_approve=can_approve, can_update=can_update)
@@ -593,7 +625,11 @@ def transport_permit_reject(permit_id: int):
 def transport_trips():
     q = (request.args.get("q") or "").strip()
 
-    query = TransportTrip.query.filter(TransportTrip.is_deleted == False)  # noqa: E712
+    query = (
+        TransportTrip.query
+        .options(*loader_profiles.options(TransportTrip, "list"))
+        .filter(TransportTrip.is_deleted == False)  # noqa: E712
+    )
     if q:
         like = f"%{q}%"
         query = query.filter((TransportTrip.note.ilike(like)) | (TransportTrip.id.cast(db.String).ilike(like)))
@@ -732,6 +768,9 @@ def transport_trip_edit(trip_id: int):
         row.distance_km = distance_km
         row.note = note
 
+        # Compacted GPS track: re-check against the (possibly edited) odometer
+        trip_tracks.refresh_odometer_check(row)
+
         # Update vehicle odometer if provided
         try:
             v = TransportVehicle.query.get(vehicle_id)
@@ -757,6 +796,34 @@ def transport_trip_edit(trip_id: int):
     return render_template("portal/transport/trip_form.html", item=row, vehicles=vehicles, drivers=drivers, permits=permits)
 
 
+@portal_bp.route("/transport/trips/<int:trip_id>/track")
+@login_required
+@perm_required("TRANSPORT_READ")
+def transport_trip_track(trip_id: int):
+    row = TransportTrip.query.options(*loader_profiles.options(TransportTrip, "detail")).get_or_404(trip_id)
+    track = TransportTripTrack.query.filter_by(trip_id=trip_id).first()
+    (times, lats, lngs, speeds), base_at = trip_tracks.load_track(row, simplified=True)
+
+    width, height = 800, 480
+    svg = trip_tracks.svg_points(lats, lngs, width, height)
+
+    live_km = None
+    if track is None and len(lats) > 1:
+        live_km = trip_tracks.path_km(times, lats, lngs, max_kmh=trip_tracks.DEFAULT_MAX_KMH)
+
+    return render_template(
+        "portal/transport/trip_track.html",
+        item=row,
+        track=track,
+        shown_count=len(lats),
+        first_at=(base_at + timedelta(milliseconds=times[0])) if times else None,
+        last_at=(base_at + timedelta(milliseconds=times[-1])) if times else None,
+        live_km=live_km,
+        svg=svg,
+        svg_size=(width, height),
+    )
+
+
 @portal_bp.route("/transport/trips/<int:trip_id>/delete", methods=["POST"])
 @login_required
 @perm_required("TRANSPORT_DELETE")
@@ -785,7 +852,7 @@ def transport_tasks():
     q = (request.args.get("q") or "").strip()
     status = (request.args.get("status") or "").strip().upper()
 
-    query = TransportDriverTask.query
+    query = TransportDriverTask.query.options(*loader_profiles.options(TransportDriverTask, "list"))
     if status in ("PENDING", "IN_PROGRESS", "DONE", "CANCELLED"):
         query = query.filter(TransportDriverTask.status == status)
     if q:
@@ -1053,7 +1120,7 @@ def transport_maintenance_list():
     q = (request.args.get("q") or "").strip()
     vehicle_id = (request.args.get("vehicle_id") or "").strip()
 
-    qry = TransportMaintenance.query
+    qry = TransportMaintenance.query.options(*loader_profiles.options(TransportMaintenance, "list"))
     if vehicle_id:
         try:
             vid = int(vehicle_id)
@@ -1127,8 +1194,8 @@ def transport_maintenance_new():
 @login_required
 @perm_required("TRANSPORT_READ")
 def transport_maintenance_view(maint_id: int):
-    row = TransportMaintenance.query.get_or_404(maint_id)
-    items = TransportMaintenanceItem.query.filter(TransportMaintenanceItem.maintenance_id == maint_id).order_by(TransportMaintenanceItem.id.asc()).all()
+    row = TransportMaintenance.query.options(*loader_profiles.options(TransportMaintenance, "detail")).get_or_404(maint_id)
+    items = TransportMaintenanceItem.query.options(*loader_profiles.options(TransportMaintenanceItem, "list")).filter(TransportMaintenanceItem.maintenance_id == maint_id).order_by(TransportMaintenanceItem.id.asc()).all()
     can_edit = current_user.has_perm("TRANSPORT_UPDATE")
     can_delete = current_user.has_perm("TRANSPORT_DELETE")
     maint_types = _lookup_items(TRANSPORT_LOOKUP_MAINT_TYPE)
@@ -1245,7 +1312,7 @@ def transport_fuel_list():
     q = (request.args.get("q") or "").strip()
     vehicle_id = (request.args.get("vehicle_id") or "").strip()
 
-    qry = TransportFuelFill.query
+    qry = TransportFuelFill.query.options(*loader_profiles.options(TransportFuelFill, "list"))
     if vehicle_id:
         try:
             vid = int(vehicle_id)
@@ -1425,6 +1492,7 @@ def transport_tracking_settings():
         "base_url": "TRANSPORT_TRACKING_BASE_URL",
         "token": "TRANSPORT_TRACKING_TOKEN",
         "sync_sec": "TRANSPORT_TRACKING_SYNC_SECONDS",
+        "push_token": "TRANSPORT_TRACKING_PUSH_TOKEN",
     }
 
     if request.method == "POST":
@@ -1437,12 +1505,14 @@ def transport_tracking_settings():
         base_url = (request.form.get("base_url") or "").strip() or ""
         token = (request.form.get("token") or "").strip() or ""
         sync_sec = (request.form.get("sync_sec") or "").strip() or "60"
+        push_token = (request.form.get("push_token") or "").strip()
 
         _set_setting(keys["enabled"], enabled)
         _set_setting(keys["provider"], provider)
         _set_setting(keys["base_url"], base_url)
         _set_setting(keys["token"], token[:255])  # SystemSetting.value is 255 by default
         _set_setting(keys["sync_sec"], sync_sec)
+        _set_setting(keys["push_token"], push_token[:255])
 
         # Per-vehicle tracking config
         try:
@@ -1465,6 +1535,9 @@ def transport_tracking_settings():
         "base_url": _get_setting(keys["base_url"], ""),
         "token": _get_setting(keys["token"], ""),
         "sync_sec": _get_setting(keys["sync_sec"], "60"),
+        "push_token": _get_setting(keys["push_token"], ""),
+        "last_sync_at": _get_setting("TRANSPORT_TRACKING_LAST_SYNC_AT", ""),
+        "last_error": _get_setting("TRANSPORT_TRACKING_LAST_ERROR", ""),
     }
     vehicles = TransportVehicle.query.order_by(TransportVehicle.plate_no.asc()).all()
 
@@ -1473,4 +1546,38 @@ def transport_tracking_settings():
         settings=settings,
         vehicles=vehicles,
         can_manage=can_manage,
+        ingest=tracking_ingest.stats(),
     )
+
+
+# -------------------------
+# Tracking: device push (services/tracking_ingest.py)
+# -------------------------
+@portal_bp.route("/transport/tracking/push", methods=["POST"])
+def transport_tracking_push():
+    """Devices / gateways push GPS points (no session; Authorization: Bearer <push token>).
+
+    Body: {"device_uid": "...", "points": [{"ts": ..., "lat": ..., "lng": ...}, ...]}
+    or a list of points that each carry their device_uid.
+    202 = spooled to disk and queued, 429 = buffer full (retry after Retry-After seconds).
+    """
+    if not tracking_ingest.push_token_ok(request.headers.get("Authorization")):
+        return jsonify({"error": "unauthorized"}), 401
+    if not settings_service.get_bool("TRANSPORT_TRACKING_ENABLED", False):
+        return jsonify({"error": "tracking disabled"}), 503
+
+    try:
+        payload = msgspec.json.decode(request.get_data(cache=False))
+    except msgspec.DecodeError:
+        return jsonify({"error": "invalid JSON"}), 400
+
+    points, invalid = tracking_ingest.parse_payload(payload)
+    if len(points) > tracking_ingest.MAX_PUSH_POINTS:
+        return jsonify({"error": f"too many points (max {tracking_ingest.MAX_PUSH_POINTS})"}), 413
+
+    if not tracking_ingest.offer(points):
+        resp = jsonify({"error": "busy", "accepted": 0})
+        resp.status_code = 429
+        resp.headers["Retry-After"] = "5"
+        return resp
+    return jsonify({"accepted": len(points), "invalid": invalid}), 202
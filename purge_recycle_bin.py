@@ -14,15 +14,8 @@ from datetime import datetime, timedelta
 
 from app import app
 from extensions import db
-from models import ArchivedFile, FilePermission, RequestAttachment, AuditLog, SystemSetting
-
-
-def get_trash_retention_days() -> int:
-    setting = SystemSetting.query.filter_by(key="TRASH_RETENTION_DAYS").first()
-    try:
-        return int(setting.value) if setting and setting.value else 30
-    except Exception:
-        return 30
+from models import ArchivedFile, FilePermission, RequestAttachment, AuditLog
+from archive.services import get_trash_retention_days
 
 
 def purge_expired() -> tuple[int, int]:
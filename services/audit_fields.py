@@ -0,0 +1,135 @@
+# services/audit_fields.py
+"""Normalized AuditLog columns stamped at write time.
+
+- ref_request_id: the request the entry belongs to, from request_id or a
+  WorkflowRequest / WORKFLOW_REQUEST target. Unlike request_id it is not a
+  foreign key, so it is kept when a request is deleted (request_id is then
+  detached to target_type/target_id).
+- step_order: the workflow step of the entry, from the target
+  (WorkflowStepTask / WorkflowInstanceStep) or from the note
+  ("step=3", "Step 3", "الخطوة 3").
+
+The system timeline filters on these columns instead of joining through
+requests / instances / steps and pattern-matching notes. Rows written before
+the columns existed are filled once by ensure_backfilled() (progress kept in
+AUDIT_FIELDS_BACKFILL_ID as "<last id>:<max id>", then DONE).
+"""
+
+import re
+
+from sqlalchemy import event, func, select, update
+
+from extensions import db
+from models import AuditLog, WorkflowInstanceStep, WorkflowStepTask
+from services import settings_service
+
+REQUEST_TARGET_TYPES = ("WorkflowRequest", "WORKFLOW_REQUEST", "WORKFLOWREQUEST")
+TASK_TARGET_TYPES = ("WORKFLOW_STEP_TASK", "PARALLEL_TASK")
+STEP_TARGET_TYPES = ("WORKFLOW_STEP", "WORKFLOW_INSTANCE_STEP")
+
+BACKFILL_KEY = "AUDIT_FIELDS_BACKFILL_ID"
+BACKFILL_CHUNK = 2000
+
+_STEP_NOTE_RE = re.compile(r"(?:\bstep\s*=\s*|\bStep\s+)(\d+)", re.IGNORECASE)
+_STEP_NOTE_AR_RE = re.compile(r"الخطوة\s*(\d+)")
+
+
+def step_from_note(note) -> int | None:
+    """Step number encoded in a note (step=3 / Step 3: / الخطوة 3)."""
+    if not note:
+        return None
+    s = str(note)
+    m = _STEP_NOTE_RE.search(s) or _STEP_NOTE_AR_RE.search(s)
+    return int(m.group(1)) if m else None
+
+
+def effective_request_id(request_id, target_type, target_id) -> int | None:
+    if request_id:
+        return int(request_id)
+    if target_id and (target_type or "").strip() in REQUEST_TARGET_TYPES:
+        try:
+            return int(target_id)
+        except (TypeError, ValueError):
+            return None
+    return None
+
+
+def _step_from_target(connection, target_type, target_id) -> int | None:
+    tt = (target_type or "").strip()
+    if not target_id:
+        return None
+    if tt in TASK_TARGET_TYPES:
+        col, id_col = WorkflowStepTask.step_order, WorkflowStepTask.id
+    elif tt in STEP_TARGET_TYPES:
+        col, id_col = WorkflowInstanceStep.step_order, WorkflowInstanceStep.id
+    else:
+        return None
+    v = connection.execute(select(col).where(id_col == int(target_id))).scalar()
+    return int(v) if v is not None else None
+
+
+@event.listens_for(AuditLog, "before_insert")
+def _stamp_audit_fields(mapper, connection, target):
+    if target.ref_request_id is None:
+        target.ref_request_id = effective_request_id(target.request_id, target.target_type, target.target_id)
+    if target.step_order is None:
+        st = _step_from_target(connection, target.target_type, target.target_id)
+        target.step_order = st if st is not None else step_from_note(target.note)
+
+
+def ensure_backfilled() -> int:
+    """Stamp ref_request_id / step_order on rows older than the columns (commits per chunk).
+
+    Rows inserted after the hook was in place are already stamped, so the
+    backfill stops at the max id seen on its first run and is then marked DONE.
+    """
+    state = (settings_service.get_str(BACKFILL_KEY) or "").strip()
+    if state == "DONE":
+        return 0
+    done, _, upto = state.partition(":")
+    done = int(done) if done.isdigit() else 0
+    upto = int(upto) if upto.isdigit() else (db.session.query(func.max(AuditLog.id)).scalar() or 0)
+    n = 0
+    while True:
+        rows = (
+            db.session.query(AuditLog.id, AuditLog.request_id, AuditLog.target_type, AuditLog.target_id, AuditLog.note)
+            .filter(AuditLog.id > done, AuditLog.id <= upto)
+            .order_by(AuditLog.id)
+            .limit(BACKFILL_CHUNK)
+            .all()
+        )
+        if not rows:
+            settings_service.set_value(BACKFILL_KEY, "DONE")
+            db.session.commit()
+            break
+
+        task_ids = {int(r.target_id) for r in rows if r.target_id and (r.target_type or "").strip() in TASK_TARGET_TYPES}
+        step_ids = {int(r.target_id) for r in rows if r.target_id and (r.target_type or "").strip() in STEP_TARGET_TYPES}
+        task_steps = dict(
+            db.session.query(WorkflowStepTask.id, WorkflowStepTask.step_order).filter(WorkflowStepTask.id.in_(task_ids)).all()
+        ) if task_ids else {}
+        inst_steps = dict(
+            db.session.query(WorkflowInstanceStep.id, WorkflowInstanceStep.step_order).filter(WorkflowInstanceStep.id.in_(step_ids)).all()
+        ) if step_ids else {}
+
+        params = []
+        for r in rows:
+            tt = (r.target_type or "").strip()
+            st = None
+            if r.target_id and tt in TASK_TARGET_TYPES:
+                st = task_steps.get(int(r.target_id))
+            elif r.target_id and tt in STEP_TARGET_TYPES:
+                st = inst_steps.get(int(r.target_id))
+            if st is None:
+                st = step_from_note(r.note)
+            rid = effective_request_id(r.request_id, r.target_type, r.target_id)
+            if st is not None or rid is not None:
+                params.append({"id": r.id, "ref_request_id": rid, "step_order": st})
+        if params:
+            db.session.execute(update(AuditLog), params)
+
+        done = rows[-1].id
+        n += len(rows)
+        settings_service.set_value(BACKFILL_KEY, f"{done}:{upto}")
+        db.session.commit()
+    return n
@@ -0,0 +1,603 @@
+# services/audit_partitions.py
+"""Month partitions for AuditLog: hot months in audit_log, older months in cold files.
+
+The last AUDIT_HOT_MONTHS months (current month included) stay in the main DB.
+Older months are moved, one file per month, to
+
+    instance/audit_archive/audit_<YYYY-MM>.sqlite.gz
+
+a gzip'd SQLite file with an audit_log table of the same columns (indexed on
+created_at, user_id, request_id and target). Each file is registered in
+audit_log_partition (row count, id range, sha256). Re-archiving a month that
+already has a file merges the new rows into it.
+
+Reads go through fetch_keyset() / fetch_all() / day_counts(): the hot ORM query
+runs as before and cold partitions are only opened when the requested date
+range overlaps an archived month. Cold files are decompressed once into
+instance/audit_archive/cache/<sha256>.sqlite and opened read-only. Cold rows
+come back as ArchivedAuditLog objects (same attributes as AuditLog, users
+resolved from the main DB).
+
+Retention (AUDIT_COLD_RETENTION_MONTHS, 0 = keep forever) drops whole cold
+partitions; export works per partition (CSV or the raw file). The rollups in
+audit_log_rollup are left untouched, so dashboard totals still include
+archived and pruned months.
+"""
+
+import csv
+import gzip
+import hashlib
+import io
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import DateTime, delete, func, select, tuple_
+
+from extensions import db
+from models import AuditLog, AuditLogPartition, Delegation, User
+from services import settings_service
+
+DEFAULT_HOT_MONTHS = 12
+COPY_CHUNK = 2000
+GZIP_LEVEL = 6
+TS_FORMAT = "%Y-%m-%d %H:%M:%S.%f"
+
+_TABLE = AuditLog.__table__
+_COLUMNS = tuple(c.name for c in _TABLE.columns)
+_DT_COLUMNS = frozenset(c.name for c in _TABLE.columns if isinstance(c.type, DateTime))
+
+_COLD_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS audit_log ("
+    + ", ".join(
+        f"{c} INTEGER PRIMARY KEY" if c == "id" else f"{c} {'INTEGER' if c.endswith('_id') or c == 'step_order' else 'TEXT'}"
+        for c in _COLUMNS
+    )
+    + ")",
+    "CREATE INDEX IF NOT EXISTS ix_cold_created ON audit_log (created_at, id)",
+    "CREATE INDEX IF NOT EXISTS ix_cold_user ON audit_log (user_id)",
+    "CREATE INDEX IF NOT EXISTS ix_cold_request ON audit_log (request_id)",
+    "CREATE INDEX IF NOT EXISTS ix_cold_target ON audit_log (target_type, target_id)",
+)
+
+
+# -------------------------
+# Months / settings
+# -------------------------
+
+def month_key(ts: datetime) -> str:
+    return ts.strftime("%Y-%m")
+
+
+def add_months(ts: datetime, n: int) -> datetime:
+    idx = ts.year * 12 + (ts.month - 1) + n
+    return datetime(idx // 12, idx % 12 + 1, 1)
+
+
+def month_bounds(month: str) -> tuple[datetime, datetime]:
+    start = datetime.strptime(month, "%Y-%m")
+    return start, add_months(start, 1)
+
+
+def hot_months() -> int:
+    return max(1, settings_service.get_int("AUDIT_HOT_MONTHS", DEFAULT_HOT_MONTHS))
+
+
+def cold_retention_months() -> int:
+    return max(0, settings_service.get_int("AUDIT_COLD_RETENTION_MONTHS", 0))
+
+
+def hot_cutoff(now: datetime | None = None) -> datetime:
+    """First instant kept in audit_log (start of the oldest hot month)."""
+    now = now or datetime.utcnow()
+    return add_months(datetime(now.year, now.month, 1), -(hot_months() - 1))
+
+
+# -------------------------
+# Files
+# -------------------------
+
+def archive_dir() -> str:
+    d = os.path.join(current_app.instance_path, "audit_archive")
+    os.makedirs(os.path.join(d, "cache"), exist_ok=True)
+    return d
+
+
+def partition_path(part: AuditLogPartition) -> str:
+    return os.path.join(archive_dir(), os.path.basename(part.file_name))
+
+
+def _compress(src: str, dest: str) -> tuple[str, int]:
+    """gzip src into dest (atomic replace). Returns (sha256, size)."""
+    tmp = dest + ".part"
+    with open(src, "rb") as fin, gzip.open(tmp, "wb", compresslevel=GZIP_LEVEL) as fout:
+        shutil.copyfileobj(fin, fout, 1024 * 1024)
+    h = hashlib.sha256()
+    with open(tmp, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    size = os.path.getsize(tmp)
+    os.replace(tmp, dest)
+    return h.hexdigest(), size
+
+
+def _decompress(src: str, dest: str) -> None:
+    tmp = dest + ".part"
+    with gzip.open(src, "rb") as fin, open(tmp, "wb") as fout:
+        shutil.copyfileobj(fin, fout, 1024 * 1024)
+    os.replace(tmp, dest)
+
+
+def _cached_db(part: AuditLogPartition) -> str:
+    """Decompressed copy of a partition (keyed by file hash)."""
+    path = os.path.join(archive_dir(), "cache", f"{part.sha256}.sqlite")
+    if not os.path.exists(path):
+        _decompress(partition_path(part), path)
+    return path
+
+
+def _connect_cold(part: AuditLogPartition) -> sqlite3.Connection:
+    conn = sqlite3.connect(f"file:{_cached_db(part)}?mode=ro", uri=True)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def _clean_cache() -> None:
+    keep = {f"{sha}.sqlite" for (sha,) in db.session.query(AuditLogPartition.sha256).all()}
+    cache = os.path.join(archive_dir(), "cache")
+    for fn in os.listdir(cache):
+        if fn not in keep:
+            try:
+                os.remove(os.path.join(cache, fn))
+            except OSError:
+                pass
+
+
+def _to_cold(row) -> tuple:
+    return tuple(
+        (row[c].strftime(TS_FORMAT) if (c in _DT_COLUMNS and row[c] is not None) else row[c])
+        for c in _COLUMNS
+    )
+
+
+# -------------------------
+# Archive / retention
+# -------------------------
+
+def archivable_months(now: datetime | None = None) -> list[str]:
+    """Months that still have rows in audit_log but are older than the hot window."""
+    month = func.strftime("%Y-%m", AuditLog.created_at)
+    return [
+        m for (m,) in (
+            db.session.query(month)
+            .filter(AuditLog.created_at < hot_cutoff(now))
+            .group_by(month)
+            .order_by(month)
+            .all()
+        ) if m
+    ]
+
+
+def archive_month(month: str) -> int:
+    """Move one month of audit_log into its cold partition (commits). Returns rows moved."""
+    start, end = month_bounds(month)
+    ids = [
+        i for (i,) in db.session.query(AuditLog.id)
+        .filter(AuditLog.created_at >= start, AuditLog.created_at < end)
+        .order_by(AuditLog.id)
+        .all()
+    ]
+    if not ids:
+        return 0
+
+    part = AuditLogPartition.query.filter_by(month=month).first()
+    d = archive_dir()
+    fd, tmp = tempfile.mkstemp(dir=d, suffix=".sqlite")
+    os.close(fd)
+    try:
+        if part is not None:
+            _decompress(partition_path(part), tmp)
+        conn = sqlite3.connect(tmp)
+        try:
+            for stmt in _COLD_SCHEMA:
+                conn.execute(stmt)
+            have = {r[1] for r in conn.execute("PRAGMA table_info(audit_log)")}
+            for c in _COLUMNS:
+                if c not in have:
+                    conn.execute(f"ALTER TABLE audit_log ADD COLUMN {c} {'INTEGER' if c.endswith('_id') or c == 'step_order' else 'TEXT'}")
+            insert = (
+                f"INSERT OR IGNORE INTO audit_log ({', '.join(_COLUMNS)}) "
+                f"VALUES ({', '.join('?' for _ in _COLUMNS)})"
+            )
+            for i in range(0, len(ids), COPY_CHUNK):
+                chunk = ids[i:i + COPY_CHUNK]
+                rows = db.session.execute(select(_TABLE).where(_TABLE.c.id.in_(chunk))).mappings().all()
+                conn.executemany(insert, [_to_cold(r) for r in rows])
+            conn.commit()
+
+            copied = conn.execute(
+                "SELECT COUNT(*) FROM audit_log WHERE id IN (SELECT value FROM json_each(?))",
+                (json.dumps(ids),),
+            ).fetchone()[0]
+            if copied != len(ids):
+                raise RuntimeError(f"audit partition {month}: copied {copied} of {len(ids)} rows")
+            total, min_id, max_id = conn.execute("SELECT COUNT(*), MIN(id), MAX(id) FROM audit_log").fetchone()
+        finally:
+            conn.close()
+
+        file_name = f"audit_{month}.sqlite.gz"
+        sha, size = _compress(tmp, os.path.join(d, file_name))
+    finally:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+
+    # The file is in place before the hot rows go away: a failure from here on
+    # leaves duplicates (harmless, merged on the next run), never a gap.
+    for i in range(0, len(ids), COPY_CHUNK):
+        db.session.execute(delete(AuditLog).where(AuditLog.id.in_(ids[i:i + COPY_CHUNK])))
+
+    if part is None:
+        part = AuditLogPartition(month=month)
+        db.session.add(part)
+    part.file_name = file_name
+    part.row_count = int(total)
+    part.min_id = min_id
+    part.max_id = max_id
+    part.size_bytes = size
+    part.sha256 = sha
+    part.archived_at = datetime.utcnow()
+    db.session.commit()
+    _clean_cache()
+    return len(ids)
+
+
+def drop_partition(month: str) -> bool:
+    """Delete a cold partition (file + registry row) (commits)."""
+    part = AuditLogPartition.query.filter_by(month=month).first()
+    if part is None:
+        return False
+    path = partition_path(part)
+    db.session.delete(part)
+    db.session.commit()
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+    _clean_cache()
+    return True
+
+
+def prune_cold(keep_months: int | None = None, now: datetime | None = None) -> list[str]:
+    """Drop cold partitions older than hot window + keep_months (0 = keep all)."""
+    keep = cold_retention_months() if keep_months is None else keep_months
+    if keep <= 0:
+        return []
+    oldest_kept = month_key(add_months(hot_cutoff(now), -keep))
+    dropped = []
+    for (month,) in (
+        db.session.query(AuditLogPartition.month)
+        .filter(AuditLogPartition.month < oldest_kept)
+        .order_by(AuditLogPartition.month)
+        .all()
+    ):
+        if drop_partition(month):
+            dropped.append(month)
+    return dropped
+
+
+def run_maintenance(now: datetime | None = None) -> dict:
+    """Archive every month past the hot window, then apply cold retention."""
+    moved = {}
+    for month in archivable_months(now):
+        moved[month] = archive_month(month)
+    return {"archived": moved, "dropped": prune_cold(now=now)}
+
+
+# -------------------------
+# Export
+# -------------------------
+
+def export_csv(part: AuditLogPartition) -> bytes:
+    buf = io.StringIO()
+    w = csv.writer(buf)
+    w.writerow(_COLUMNS)
+    conn = _connect_cold(part)
+    try:
+        for row in conn.execute(f"SELECT {', '.join(_COLUMNS)} FROM audit_log ORDER BY created_at, id"):
+            w.writerow(["" if v is None else v for v in row])
+    finally:
+        conn.close()
+    return buf.getvalue().encode("utf-8-sig")
+
+
+# -------------------------
+# Reads (hot + cold fan-out)
+# -------------------------
+
+class ArchivedAuditLog:
+    """Read-only AuditLog row from a cold partition."""
+
+    is_archived = True
+
+    def __init__(self, row, partition: str):
+        present = set(row.keys())
+        for c in _COLUMNS:
+            v = row[c] if c in present else None
+            if c in _DT_COLUMNS and isinstance(v, str):
+                v = datetime.fromisoformat(v)
+            setattr(self, c, v)
+        self.partition = partition
+        self.user = None
+        self.on_behalf_of_user = None
+        self.delegation = None
+        self.request = None
+
+
+class KeysetPage:
+    """One page of a (created_at, id) keyset walk, newest first.
+
+    next_cursor continues to older rows, prev_cursor back to newer ones.
+    """
+
+    def __init__(self, items: list, has_next: bool, has_prev: bool):
+        self.items = items
+        self.has_next = has_next and bool(items)
+        self.has_prev = has_prev and bool(items)
+        self.next_cursor = encode_cursor(items[-1]) if self.has_next else None
+        self.prev_cursor = encode_cursor(items[0]) if self.has_prev else None
+
+
+def encode_cursor(row) -> str:
+    return f"{row.created_at.strftime(TS_FORMAT)}_{int(row.id)}"
+
+
+def decode_cursor(value: str | None):
+    """(created_at, id) from encode_cursor(), or None when missing / malformed."""
+    if not value:
+        return None
+    ts, _, rid = str(value).rpartition("_")
+    try:
+        return datetime.strptime(ts, TS_FORMAT), int(rid)
+    except ValueError:
+        return None
+
+
+def partitions_for_range(since: datetime | None, until: datetime | None) -> list:
+    """Cold partitions overlapping [since, until), newest first."""
+    q = AuditLogPartition.query
+    if until is not None:
+        q = q.filter(AuditLogPartition.month <= month_key(until))
+    if since is not None:
+        q = q.filter(AuditLogPartition.month >= month_key(since))
+    return q.order_by(AuditLogPartition.month.desc()).all()
+
+
+def _cold_where(
+    since=None,
+    until=None,
+    action=None,
+    actions=None,
+    user_id=None,
+    hide_messages=False,
+    request_ids=None,
+    target_types=None,
+    target_id=None,
+    target_ids=None,
+    step=None,
+) -> tuple[str, list]:
+    """WHERE clause for a cold partition.
+
+    request_ids matches request_id or (target_type in target_types and target_id).
+    step = {"task_ids", "step_ids", "note_patterns"} (the timeline step filter).
+    """
+    conds, params = [], []
+    if since is not None:
+        conds.append("created_at >= ?")
+        params.append(since.strftime(TS_FORMAT))
+    if until is not None:
+        conds.append("created_at < ?")
+        params.append(until.strftime(TS_FORMAT))
+    if action:
+        conds.append("action = ?")
+        params.append(action)
+    if actions is not None:
+        conds.append("action IN (SELECT value FROM json_each(?))")
+        params.append(json.dumps(list(actions)))
+    if user_id:
+        conds.append("user_id = ?")
+        params.append(int(user_id))
+    if hide_messages:
+        conds.append("action NOT LIKE 'MESSAGE_%'")
+    types_json = json.dumps(list(target_types or []))
+    if request_ids is not None:
+        conds.append(
+            "(request_id IN (SELECT value FROM json_each(?)) OR "
+            "(target_type IN (SELECT value FROM json_each(?)) AND target_id IN (SELECT value FROM json_each(?))))"
+        )
+        ids_json = json.dumps(sorted(int(i) for i in request_ids))
+        params += [ids_json, types_json, ids_json]
+    elif target_types is not None:
+        conds.append("target_type IN (SELECT value FROM json_each(?))")
+        params.append(types_json)
+        if target_id is not None:
+            conds.append("target_id = ?")
+            params.append(int(target_id))
+        if target_ids is not None:
+            conds.append("target_id IN (SELECT value FROM json_each(?))")
+            params.append(json.dumps(sorted(int(i) for i in target_ids)))
+    if step is not None:
+        ors = [
+            "(target_type IN ('WORKFLOW_STEP_TASK', 'PARALLEL_TASK') AND target_id IN (SELECT value FROM json_each(?)))",
+            "(target_type IN ('WORKFLOW_STEP', 'WORKFLOW_INSTANCE_STEP') AND target_id IN (SELECT value FROM json_each(?)))",
+        ]
+        params += [json.dumps(sorted(step.get("task_ids") or [])), json.dumps(sorted(step.get("step_ids") or []))]
+        for patt in step.get("note_patterns") or []:
+            ors.append("lower(note) LIKE ?")
+            params.append(patt)
+        conds.append("(" + " OR ".join(ors) + ")")
+    return (" WHERE " + " AND ".join(conds)) if conds else "", params
+
+
+def _resolve_users(rows: list) -> list:
+    """Attach users / delegations to the ArchivedAuditLog rows (hot rows are left alone)."""
+    cold = [r for r in rows if isinstance(r, ArchivedAuditLog)]
+    if not cold:
+        return rows
+    _attach_users(cold)
+    return rows
+
+
+def _attach_users(rows: list) -> None:
+    user_ids = {i for r in rows for i in (r.user_id, r.on_behalf_of_id) if i}
+    users = {u.id: u for u in User.query.filter(User.id.in_(user_ids)).all()} if user_ids else {}
+    del_ids = {r.delegation_id for r in rows if r.delegation_id}
+    dels = {d.id: d for d in Delegation.query.filter(Delegation.id.in_(del_ids)).all()} if del_ids else {}
+    for r in rows:
+        r.user = users.get(r.user_id)
+        r.on_behalf_of_user = users.get(r.on_behalf_of_id)
+        r.delegation = dels.get(r.delegation_id)
+
+
+def _cold_select(part, where: str, params: list, order: str, limit: int | None = None, offset: int = 0) -> list:
+    sql = f"SELECT * FROM audit_log{where} ORDER BY {order}"
+    if limit is not None:
+        sql += f" LIMIT {int(limit)} OFFSET {int(offset)}"
+    conn = _connect_cold(part)
+    try:
+        return [ArchivedAuditLog(r, part.month) for r in conn.execute(sql, params)]
+    finally:
+        conn.close()
+
+
+def _cold_count(part, where: str, params: list) -> int:
+    conn = _connect_cold(part)
+    try:
+        return int(conn.execute(f"SELECT COUNT(*) FROM audit_log{where}", params).fetchone()[0])
+    finally:
+        conn.close()
+
+
+def fetch_keyset(hot_query, per_page: int, since=None, until=None, before=None, after=None, **cold_filters) -> KeysetPage:
+    """Newest-first page over audit_log (hot_query) + cold partitions in range.
+
+    before / after are decoded cursors: rows strictly older than `before`
+    (next page) or strictly newer than `after` (previous page); neither gives
+    the newest page. Each page is an index range scan on (created_at, id), so
+    its cost does not depend on how deep the walk is. hot_query must already
+    carry the same filters as cold_filters.
+    """
+    key = tuple_(AuditLog.created_at, AuditLog.id)
+    want = per_page + 1
+
+    if after is not None:
+        ts, rid = after
+        hot = (
+            hot_query.filter(AuditLog.created_at >= ts, key > tuple_(ts, rid))
+            .order_by(AuditLog.created_at.asc(), AuditLog.id.asc())
+        )
+        parts = partitions_for_range(max(since, ts) if since else ts, until)
+        parts.reverse()
+        where, params = _cold_where(since=since, until=until, **cold_filters) if parts else ("", [])
+        where, params = _and_cursor(where, params, ">", after)
+        rows = []
+        # Cold months are older than every hot row: walk them first
+        for part in parts:
+            if len(rows) >= want:
+                break
+            rows += _cold_select(part, where, params, "created_at ASC, id ASC", want - len(rows))
+        if len(rows) < want:
+            rows += hot.limit(want - len(rows)).all()
+        has_prev = len(rows) > per_page
+        items = list(reversed(rows[:per_page]))
+        return KeysetPage(_resolve_users(items), has_next=True, has_prev=has_prev)
+
+    hot = hot_query
+    if before is not None:
+        ts, rid = before
+        hot = hot.filter(AuditLog.created_at <= ts, key < tuple_(ts, rid))
+    rows = hot.order_by(AuditLog.created_at.desc(), AuditLog.id.desc()).limit(want).all()
+    if len(rows) < want:
+        upper = until
+        if before is not None:
+            upper = min(until, before[0]) if until else before[0]
+        parts = partitions_for_range(since, upper)
+        if parts:
+            where, params = _cold_where(since=since, until=until, **cold_filters)
+            where, params = _and_cursor(where, params, "<", before)
+            for part in parts:
+                if len(rows) >= want:
+                    break
+                rows += _cold_select(part, where, params, "created_at DESC, id DESC", want - len(rows))
+    items = rows[:per_page]
+    return KeysetPage(_resolve_users(items), has_next=len(rows) > per_page, has_prev=before is not None)
+
+
+def _and_cursor(where: str, params: list, op: str, cursor) -> tuple[str, list]:
+    if cursor is None:
+        return where, params
+    cond = f"(created_at, id) {op} (?, ?)"
+    return (f"{where} AND {cond}" if where else f" WHERE {cond}"), params + [cursor[0].strftime(TS_FORMAT), int(cursor[1])]
+
+
+def fetch_all(hot_query, since=None, until=None, limit: int | None = None, newest_first: bool = True, **cold_filters) -> list:
+    """All matching rows from audit_log + cold partitions in range (capped by limit)."""
+    direction = "desc" if newest_first else "asc"
+    parts = partitions_for_range(since, until)
+    if not newest_first:
+        parts.reverse()
+    where, params = _cold_where(since=since, until=until, **cold_filters) if parts else ("", [])
+
+    def hot(n):
+        q = hot_query.order_by(getattr(AuditLog.created_at, direction)(), getattr(AuditLog.id, direction)())
+        return (q.limit(n) if n is not None else q).all()
+
+    def cold(n):
+        out = []
+        for part in parts:
+            need = None if n is None else n - len(out)
+            if need is not None and need <= 0:
+                break
+            out += _cold_select(part, where, params, f"created_at {direction.upper()}, id {direction.upper()}", need)
+        return _resolve_users(out)
+
+    # Cold months are older than every hot row
+    first, second = (hot, cold) if newest_first else (cold, hot)
+    rows = first(limit)
+    if limit is None or len(rows) < limit:
+        rows += second(None if limit is None else limit - len(rows))
+    return rows
+
+
+def day_counts(hot_query, since=None, until=None, limit: int = 31, **cold_filters) -> list:
+    """[(YYYY-MM-DD, count)] newest first over hot + cold rows."""
+    day_label = func.strftime("%Y-%m-%d", AuditLog.created_at)
+    counts = dict(
+        hot_query.with_entities(day_label.label("day"), func.count(AuditLog.id))
+        .group_by("day")
+        .order_by(day_label.desc())
+        .limit(limit)
+        .all()
+    )
+    parts = partitions_for_range(since, until)
+    if parts and len(counts) < limit:
+        where, params = _cold_where(since=since, until=until, **cold_filters)
+        for part in parts:
+            if len(counts) >= limit:
+                break
+            conn = _connect_cold(part)
+            try:
+                for day, n in conn.execute(
+                    f"SELECT substr(created_at, 1, 10) AS day, COUNT(*) FROM audit_log{where} "
+                    f"GROUP BY day ORDER BY day DESC",
+                    params,
+                ):
+                    counts[day] = counts.get(day, 0) + int(n)
+            finally:
+                conn.close()
+    return sorted(counts.items(), key=lambda kv: kv[0], reverse=True)[:limit]
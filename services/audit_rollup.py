@@ -0,0 +1,331 @@
+# services/audit_rollup.py
+"""Hourly / daily AuditLog rollups for dashboards and compliance summaries.
+
+audit_log_rollup holds one counter per
+(granularity, bucket_start, action, user_id, module, target_type) with
+granularity HOUR or DAY. Every AuditLog flushed through the ORM bumps its HOUR
+and DAY counters in the same transaction (upsert), deleted rows decrement them,
+so a rollback leaves both tables consistent.
+
+Dashboards read totals / top users / top actions / per-module counts from the
+rollups (a few hundred rows per day instead of the whole log). Raw audit_log
+rows are only read for drill-down lists.
+
+Rows written outside the unit of work (Core inserts, raw SQL) are not seen by
+the hook; ensure_rollups_current() reconciles on startup by comparing the
+DAY total with COUNT(*) of audit_log and rebuilding when they differ. Months
+moved to cold partitions (services/audit_partitions) keep their counters and
+are left out of that comparison.
+"""
+
+from collections import Counter
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, event, func, or_
+from sqlalchemy.orm import Session
+
+from extensions import db
+from models import AuditLog, AuditLogPartition, AuditLogRollup, User
+
+GRANULARITIES = ("HOUR", "DAY")
+MODULES = ("HR", "STORE", "TRANSPORT", "CORR", "PERMS", "OTHER")
+
+_KEY_COLS = ("granularity", "bucket_start", "action", "user_id", "module", "target_type")
+
+_HR_TARGETS = ("EMPLOYEE_FILE", "EMPLOYEE_ATTACHMENT", "LEAVE_REQUEST", "MISSION_REQUEST", "PERMISSION_REQUEST")
+
+
+def guess_module(action: str | None, target_type: str | None) -> str:
+    """Portal module of an audit entry (from the action / target_type prefix)."""
+    a = (action or "").upper()
+    t = (target_type or "").upper()
+
+    if a.startswith("HR_") or t.startswith("HR_") or t in _HR_TARGETS:
+        return "HR"
+    if a.startswith("INV_") or a.startswith("STORE_") or t.startswith("INV_") or t.startswith("STORE_"):
+        return "STORE"
+    if a.startswith("TRANSPORT_") or t.startswith("TRANSPORT_"):
+        return "TRANSPORT"
+    if a.startswith("CORR_") or t.startswith("CORR_") or t in ("INBOUND_MAIL", "OUTBOUND_MAIL"):
+        return "CORR"
+    if a.startswith("PORTAL_") or a.startswith("ACCESS_") or t in ("PORTAL_ACCESS_REQUEST", "ROLE", "USER"):
+        return "PERMS"
+    return "OTHER"
+
+
+def bucket_start(ts: datetime, granularity: str) -> datetime:
+    if granularity == "HOUR":
+        return ts.replace(minute=0, second=0, microsecond=0)
+    return ts.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def _keys(action, user_id, target_type, created_at):
+    action = action or ""
+    target_type = target_type or ""
+    module = guess_module(action, target_type)
+    ts = created_at or datetime.utcnow()
+    return [
+        (g, bucket_start(ts, g), action, int(user_id or 0), module, target_type)
+        for g in GRANULARITIES
+    ]
+
+
+def _upsert(connection, counts: Counter) -> None:
+    """Add counts (key tuple -> delta) to the rollup table."""
+    if not counts:
+        return
+    table = AuditLogRollup.__table__
+    if connection.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+
+    stmt = dialect_insert(table)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=list(_KEY_COLS),
+        set_={"count": table.c.count + stmt.excluded.count},
+    )
+    connection.execute(stmt, [dict(zip(_KEY_COLS, k), count=n) for k, n in counts.items()])
+
+
+# -------------------------
+# Incremental maintenance
+# -------------------------
+
+@event.listens_for(Session, "after_flush")
+def _rollup_after_flush(session, flush_context):
+    counts = Counter()
+    for obj in session.new:
+        if isinstance(obj, AuditLog):
+            for k in _keys(obj.action, obj.user_id, obj.target_type, obj.created_at):
+                counts[k] += 1
+    for obj in session.deleted:
+        if isinstance(obj, AuditLog):
+            for k in _keys(obj.action, obj.user_id, obj.target_type, obj.created_at):
+                counts[k] -= 1
+    if counts:
+        _upsert(session.connection(), counts)
+
+
+# -------------------------
+# Backfill / reconcile
+# -------------------------
+
+def _live_since() -> datetime | None:
+    """Start of the range still in audit_log (after the newest archived month)."""
+    newest = db.session.query(func.max(AuditLogPartition.month)).scalar()
+    if not newest:
+        return None
+    start = datetime.strptime(newest, "%Y-%m")
+    return datetime(start.year + start.month // 12, start.month % 12 + 1, 1)
+
+
+def rebuild_rollups(since: datetime | None = None) -> int:
+    """Recompute rollup rows from audit_log (no commit). Returns audit rows counted.
+
+    With `since`, only buckets from `since` on are rebuilt (older months live in
+    cold partitions and keep their counters).
+    """
+    stale = delete(AuditLogRollup)
+    if since is not None:
+        stale = stale.where(AuditLogRollup.bucket_start >= since)
+    db.session.execute(stale)
+
+    hour = func.strftime("%Y-%m-%d %H", AuditLog.created_at)
+    q = db.session.query(
+        hour,
+        AuditLog.action,
+        func.coalesce(AuditLog.user_id, 0),
+        func.coalesce(AuditLog.target_type, ""),
+        func.count(AuditLog.id),
+    )
+    if since is not None:
+        q = q.filter(AuditLog.created_at >= since)
+    rows = q.group_by(hour, AuditLog.action, AuditLog.user_id, AuditLog.target_type).all()
+
+    counts = Counter()
+    total = 0
+    for hour_s, action, user_id, target_type, n in rows:
+        ts = datetime.strptime(hour_s, "%Y-%m-%d %H") if hour_s else None
+        for k in _keys(action, user_id, target_type, ts):
+            counts[k] += int(n)
+        total += int(n)
+
+    keys = list(counts.items())
+    for i in range(0, len(keys), 1000):
+        _upsert(db.session.connection(), Counter(dict(keys[i:i + 1000])))
+    return total
+
+
+def ensure_rollups_current() -> bool:
+    """Rebuild when the DAY rollup total no longer matches audit_log (commits).
+
+    Archived months (audit_log_partition) are outside the comparison.
+    """
+    since = _live_since()
+    raw_q = db.session.query(func.count(AuditLog.id))
+    rolled_q = (
+        db.session.query(func.coalesce(func.sum(AuditLogRollup.count), 0))
+        .filter(AuditLogRollup.granularity == "DAY")
+    )
+    if since is not None:
+        raw_q = raw_q.filter(AuditLog.created_at >= since)
+        rolled_q = rolled_q.filter(AuditLogRollup.bucket_start >= since)
+    if int(raw_q.scalar() or 0) == int(rolled_q.scalar() or 0):
+        return False
+    rebuild_rollups(since)
+    db.session.commit()
+    return True
+
+
+# -------------------------
+# Reads
+# -------------------------
+
+def rollup_query(
+    *columns,
+    granularity: str = "DAY",
+    since: datetime | None = None,
+    until: datetime | None = None,
+    hide_messages: bool = False,
+    action: str | None = None,
+    action_like: str | None = None,
+    user_ids=None,
+):
+    """Query over one granularity of the rollups, with the usual dashboard filters.
+
+    `since` / `until` are compared with bucket_start (until is exclusive), so
+    pass bucket-aligned bounds for exact counts.
+    """
+    q = db.session.query(*columns).select_from(AuditLogRollup).filter(AuditLogRollup.granularity == granularity)
+    if since is not None:
+        q = q.filter(AuditLogRollup.bucket_start >= since)
+    if until is not None:
+        q = q.filter(AuditLogRollup.bucket_start < until)
+    if hide_messages:
+        q = q.filter(~AuditLogRollup.action.like("MESSAGE_%"))
+    if action:
+        q = q.filter(AuditLogRollup.action == action)
+    if action_like:
+        q = q.filter(AuditLogRollup.action.ilike(f"%{action_like}%"))
+    if user_ids is not None:
+        q = q.filter(AuditLogRollup.user_id.in_(user_ids))
+    return q
+
+
+def total(**filters) -> int:
+    return int(rollup_query(func.coalesce(func.sum(AuditLogRollup.count), 0), **filters).scalar() or 0)
+
+
+def top_users(limit: int = 5, **filters) -> list:
+    """[(email, count)] by descending count (entries without a user are skipped)."""
+    cnt = func.sum(AuditLogRollup.count)
+    return [
+        (email, int(n))
+        for email, n in (
+            rollup_query(User.email, cnt, **filters)
+            .join(User, User.id == AuditLogRollup.user_id)
+            .group_by(User.email)
+            .having(cnt > 0)
+            .order_by(cnt.desc())
+            .limit(limit)
+            .all()
+        )
+    ]
+
+
+def top_actions(limit: int = 5, **filters) -> list:
+    """[(action, count)] by descending count."""
+    cnt = func.sum(AuditLogRollup.count)
+    return [
+        (action, int(n))
+        for action, n in (
+            rollup_query(AuditLogRollup.action, cnt, **filters)
+            .group_by(AuditLogRollup.action)
+            .having(cnt > 0)
+            .order_by(cnt.desc())
+            .limit(limit)
+            .all()
+        )
+    ]
+
+
+def module_counts(**filters) -> dict:
+    """{module: count} for every module in MODULES (plus ALL)."""
+    out = {m: 0 for m in MODULES}
+    for module, n in (
+        rollup_query(AuditLogRollup.module, func.sum(AuditLogRollup.count), **filters)
+        .group_by(AuditLogRollup.module)
+        .all()
+    ):
+        out[module or "OTHER"] = int(n or 0)
+    out["ALL"] = sum(out.values())
+    return out
+
+
+def daily_breakdown(**filters) -> list:
+    """[(day, module, action, count)] ordered by day DESC then count DESC."""
+    cnt = func.sum(AuditLogRollup.count)
+    return [
+        (day, module, action, int(n))
+        for day, module, action, n in (
+            rollup_query(AuditLogRollup.bucket_start, AuditLogRollup.module, AuditLogRollup.action, cnt, **filters)
+            .group_by(AuditLogRollup.bucket_start, AuditLogRollup.module, AuditLogRollup.action)
+            .having(cnt > 0)
+            .order_by(AuditLogRollup.bucket_start.desc(), cnt.desc())
+            .all()
+        )
+    ]
+
+
+def day_totals(limit: int = 31, **filters) -> list:
+    """[(YYYY-MM-DD, count)] newest first (DAY buckets)."""
+    cnt = func.sum(AuditLogRollup.count)
+    return [
+        (day.strftime("%Y-%m-%d"), int(n))
+        for day, n in (
+            rollup_query(AuditLogRollup.bucket_start, cnt, **filters)
+            .group_by(AuditLogRollup.bucket_start)
+            .having(cnt > 0)
+            .order_by(AuditLogRollup.bucket_start.desc())
+            .limit(limit)
+            .all()
+        )
+    ]
+
+
+def actions(limit: int = 200, **filters) -> list:
+    """Distinct actions seen in the rollups (alphabetical)."""
+    return [
+        a for (a,) in (
+            rollup_query(AuditLogRollup.action, **filters)
+            .distinct()
+            .order_by(AuditLogRollup.action)
+            .limit(limit)
+            .all()
+        )
+    ]
+
+
+def day_range(date_from: str | None, date_to: str | None):
+    """(since, until) DAY bounds for YYYY-MM-DD filter values (until exclusive)."""
+    since = until = None
+    try:
+        if date_from:
+            since = datetime.strptime(date_from, "%Y-%m-%d")
+    except ValueError:
+        since = None
+    try:
+        if date_to:
+            until = datetime.strptime(date_to, "%Y-%m-%d") + timedelta(days=1)
+    except ValueError:
+        until = None
+    return since, until
+
+
+def matching_user_ids(term: str) -> list:
+    """Ids of users whose email / name contains `term` (rollup user filter)."""
+    like = f"%{term}%"
+    return [
+        uid for (uid,) in db.session.query(User.id).filter(or_(User.email.ilike(like), User.name.ilike(like))).all()
+    ]
@@ -0,0 +1,399 @@
+# services/audit_writer.py
+"""Asynchronous, batched AuditLog writer.
+
+Audit helpers call add(**columns) instead of db.session.add(AuditLog(...)).
+The entry is held on the caller's session and only handed to the writer when
+that session commits (dropped on rollback or close; a savepoint rollback drops
+the entries added since that savepoint began), so audits still follow the
+business transaction but no longer extend it: the request commits without the
+audit INSERTs and the writer thread inserts them later in its own short
+transactions, AUDIT_WRITER_BATCH_SIZE rows at a time or every
+AUDIT_WRITER_FLUSH_MS.
+
+Entries are inserted through the ORM, so the before_insert stamping
+(audit_fields) and the after_flush rollups (audit_rollup) still apply.
+
+Durability: when the bounded queue (AUDIT_WRITER_QUEUE_MAX) is full, when a
+batch cannot be written, and on interpreter exit, pending entries are appended
+to instance/audit_spool/spool.jsonl; the writer replays the spool when idle
+and at startup. Rows that fail on their own are moved to rejected.jsonl.
+A hard kill can still lose the entries of the in-flight queue.
+
+When the writer is not running (scripts, jobs with AUDIT_ASYNC_WRITES=0,
+tests) add() falls back to an inline db.session.add(AuditLog(...)).
+stats() returns queue depth and counters for the admin page.
+"""
+
+import atexit
+import json
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy import event
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+
+from extensions import db
+from models import AuditLog
+from services import settings_service
+
+DEFAULT_BATCH_SIZE = 200
+DEFAULT_FLUSH_MS = 250
+DEFAULT_QUEUE_MAX = 10000
+SPOOL_DIRNAME = "audit_spool"
+SPOOL_FILENAME = "spool.jsonl"
+REJECTED_FILENAME = "rejected.jsonl"
+SESSION_KEY = "audit_writer_pending"
+MARKS_KEY = "audit_writer_savepoints"  # nested transaction -> len(pending) when it began
+
+_COLUMNS = frozenset(c.key for c in AuditLog.__table__.columns if c.key != "id")
+_STOP = object()
+
+_lock = threading.Lock()
+_spool_lock = threading.Lock()
+_queue: queue.Queue | None = None
+_thread: threading.Thread | None = None
+_app = None
+_batch_size = DEFAULT_BATCH_SIZE
+_flush_seconds = DEFAULT_FLUSH_MS / 1000.0
+_stats = {
+    "enqueued": 0,
+    "written": 0,
+    "batches": 0,
+    "spooled": 0,
+    "replayed": 0,
+    "rejected": 0,
+    "failed_batches": 0,
+    "queue_full": 0,
+    "max_depth": 0,
+    "last_batch_rows": 0,
+    "last_batch_ms": 0.0,
+    "last_flush_at": None,
+    "last_error": None,
+}
+
+
+def _count(**kw):
+    with _lock:
+        for k, v in kw.items():
+            _stats[k] += v
+
+
+def _note(**kw):
+    with _lock:
+        _stats.update(kw)
+
+
+def is_running() -> bool:
+    return _thread is not None and _thread.is_alive()
+
+
+def stats() -> dict:
+    with _lock:
+        out = dict(_stats)
+    out["running"] = is_running()
+    out["depth"] = _queue.qsize() if _queue is not None else 0
+    out["capacity"] = _queue.maxsize if _queue is not None else 0
+    out["batch_size"] = _batch_size
+    out["flush_ms"] = int(_flush_seconds * 1000)
+    out["spool_rows"] = _spool_rows()
+    return out
+
+
+# -------------------------
+# Producer side
+# -------------------------
+
+def add(**fields) -> None:
+    """Record an AuditLog entry with the current transaction (written after commit)."""
+    fields = {k: v for k, v in fields.items() if k in _COLUMNS}
+    if not fields.get("created_at"):
+        fields["created_at"] = datetime.utcnow()
+    if not is_running():
+        db.session.add(AuditLog(**fields))
+        return
+    session = db.session()
+    if not session.in_transaction():
+        session.begin()
+    session.info.setdefault(SESSION_KEY, []).append(fields)
+
+
+@event.listens_for(Session, "after_commit")
+def _hand_over_after_commit(session):
+    # after_commit also fires when a SAVEPOINT is released; wait for the real commit.
+    if session.in_nested_transaction():
+        return
+    pending = session.info.pop(SESSION_KEY, None)
+    if pending:
+        enqueue(pending)
+
+
+@event.listens_for(Session, "after_transaction_create")
+def _mark_savepoint(session, transaction):
+    if transaction.nested:
+        pending = session.info.get(SESSION_KEY) or ()
+        session.info.setdefault(MARKS_KEY, {})[transaction] = len(pending)
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _drop_after_savepoint_rollback(session, previous_transaction):
+    # Entries added inside a rolled-back SAVEPOINT must not outlive it.
+    if not previous_transaction.nested:
+        return
+    mark = (session.info.get(MARKS_KEY) or {}).pop(previous_transaction, None)
+    pending = session.info.get(SESSION_KEY)
+    if mark is not None and pending:
+        del pending[mark:]
+
+
+@event.listens_for(Session, "after_transaction_end")
+def _drop_after_transaction_end(session, transaction):
+    # after_commit has already taken the entries; anything left was rolled back / closed
+    if transaction.parent is None and not transaction.nested:
+        session.info.pop(SESSION_KEY, None)
+        session.info.pop(MARKS_KEY, None)
+
+
+def enqueue(entries: list[dict]) -> None:
+    """Queue committed entries; spool them when the queue is full (backpressure)."""
+    q = _queue
+    if q is None or not is_running():
+        _spool(entries)
+        return
+    overflow = []
+    for i, e in enumerate(entries):
+        try:
+            q.put_nowait(e)
+        except queue.Full:
+            overflow = entries[i:]
+            break
+    _count(enqueued=len(entries) - len(overflow))
+    depth = q.qsize()
+    with _lock:
+        if depth > _stats["max_depth"]:
+            _stats["max_depth"] = depth
+    if overflow:
+        _count(queue_full=1)
+        _spool(overflow)
+
+
+# -------------------------
+# Spool file
+# -------------------------
+
+def _spool_dir() -> str | None:
+    if _app is None:
+        return None
+    d = os.path.join(_app.instance_path, SPOOL_DIRNAME)
+    os.makedirs(d, exist_ok=True)
+    return d
+
+
+def _encode(entry: dict) -> str:
+    return json.dumps(
+        {k: (v.isoformat() if isinstance(v, datetime) else v) for k, v in entry.items()},
+        ensure_ascii=False,
+    )
+
+
+def _decode(line: str) -> dict | None:
+    try:
+        d = json.loads(line)
+    except ValueError:
+        return None
+    if not isinstance(d, dict):
+        return None
+    d = {k: v for k, v in d.items() if k in _COLUMNS}
+    if d.get("created_at"):
+        try:
+            d["created_at"] = datetime.fromisoformat(d["created_at"])
+        except (TypeError, ValueError):
+            d["created_at"] = datetime.utcnow()
+    return d
+
+
+def _append(filename: str, entries: list[dict]) -> bool:
+    d = _spool_dir()
+    if not d or not entries:
+        return False
+    with _spool_lock:
+        with open(os.path.join(d, filename), "a", encoding="utf-8") as f:
+            for e in entries:
+                f.write(_encode(e) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+    return True
+
+
+def _spool(entries: list[dict]) -> None:
+    if _append(SPOOL_FILENAME, entries):
+        _count(spooled=len(entries))
+
+
+def _spool_rows() -> int:
+    d = _spool_dir()
+    if not d:
+        return 0
+    try:
+        with _spool_lock, open(os.path.join(d, SPOOL_FILENAME), "rb") as f:
+            return sum(1 for _ in f)
+    except OSError:
+        return 0
+
+
+def replay_spool() -> int:
+    """Insert spooled entries (must run inside an app context). Returns rows written."""
+    d = _spool_dir()
+    if not d:
+        return 0
+    path = os.path.join(d, SPOOL_FILENAME)
+    work = os.path.join(d, f"replay-{os.getpid()}.jsonl")
+    with _spool_lock:
+        if not os.path.exists(work):
+            if not os.path.exists(path):
+                return 0
+            os.replace(path, work)
+    with open(work, encoding="utf-8") as f:
+        entries = [e for e in (_decode(line) for line in f if line.strip()) if e]
+    n = 0
+    for i in range(0, len(entries), _batch_size):
+        n += _write_batch(entries[i:i + _batch_size])
+    os.remove(work)
+    _count(replayed=n)
+    return n
+
+
+# -------------------------
+# Writer thread
+# -------------------------
+
+def _write_batch(entries: list[dict]) -> int:
+    if not entries:
+        return 0
+    started = time.perf_counter()
+    try:
+        db.session.add_all([AuditLog(**e) for e in entries])
+        db.session.commit()
+        written = len(entries)
+    except Exception as e:
+        db.session.rollback()
+        _count(failed_batches=1)
+        _note(last_error=str(e) or e.__class__.__name__)
+        written = _write_one_by_one(entries)
+    _count(written=written, batches=1)
+    _note(
+        last_batch_rows=len(entries),
+        last_batch_ms=round((time.perf_counter() - started) * 1000, 1),
+        last_flush_at=datetime.utcnow().isoformat(timespec="seconds"),
+    )
+    return written
+
+
+def _write_one_by_one(entries: list[dict]) -> int:
+    """Retry a failed batch row by row: broken rows are rejected, the rest spooled if the DB is unavailable."""
+    written, rejected = 0, []
+    for i, e in enumerate(entries):
+        try:
+            db.session.add(AuditLog(**e))
+            db.session.commit()
+            written += 1
+        except OperationalError:
+            db.session.rollback()
+            _spool(entries[i:])
+            break
+        except Exception:
+            db.session.rollback()
+            rejected.append(e)
+    if _append(REJECTED_FILENAME, rejected):
+        _count(rejected=len(rejected))
+    return written
+
+
+def _drain(q: queue.Queue, first, limit: int, deadline: float) -> tuple[list[dict], bool]:
+    batch, stop = [], False
+    item = first
+    while True:
+        if item is _STOP:
+            stop = True
+            break
+        batch.append(item)
+        if len(batch) >= limit:
+            break
+        timeout = deadline - time.monotonic()
+        try:
+            item = q.get(timeout=timeout) if timeout > 0 else q.get_nowait()
+        except queue.Empty:
+            break
+    return batch, stop
+
+
+def _run(app, q: queue.Queue):
+    with app.app_context():
+        try:
+            replay_spool()
+        except Exception as e:
+            db.session.rollback()
+            _note(last_error=str(e) or e.__class__.__name__)
+        while True:
+            try:
+                first = q.get(timeout=max(_flush_seconds * 20, 5.0))
+            except queue.Empty:
+                try:
+                    replay_spool()
+                except Exception as e:
+                    db.session.rollback()
+                    _note(last_error=str(e) or e.__class__.__name__)
+                continue
+            batch, stop = _drain(q, first, _batch_size, time.monotonic() + _flush_seconds)
+            try:
+                _write_batch(batch)
+            finally:
+                db.session.remove()
+            if stop:
+                break
+
+
+def init_app(app) -> bool:
+    """Start the writer thread for this process (AUDIT_ASYNC_WRITES=0 keeps inline writes)."""
+    global _app, _queue, _thread, _batch_size, _flush_seconds
+    if os.getenv("AUDIT_ASYNC_WRITES", "1").strip() == "0" or is_running():
+        return False
+    _app = app
+    with app.app_context():
+        _batch_size = max(1, settings_service.get_int("AUDIT_WRITER_BATCH_SIZE", DEFAULT_BATCH_SIZE))
+        _flush_seconds = max(10, settings_service.get_int("AUDIT_WRITER_FLUSH_MS", DEFAULT_FLUSH_MS)) / 1000.0
+        maxsize = max(_batch_size, settings_service.get_int("AUDIT_WRITER_QUEUE_MAX", DEFAULT_QUEUE_MAX))
+    _queue = queue.Queue(maxsize=maxsize)
+    _thread = threading.Thread(target=_run, args=(app, _queue), daemon=True, name="audit-writer")
+    _thread.start()
+    return True
+
+
+def shutdown(timeout: float = 10.0) -> None:
+    """Flush the queue and stop the writer; whatever is left goes to the spool."""
+    global _thread
+    q, t = _queue, _thread
+    if q is None or t is None:
+        return
+    if t.is_alive():
+        try:
+            q.put(_STOP, timeout=timeout)
+        except queue.Full:
+            pass
+        t.join(timeout)
+    _thread = None
+    left = []
+    while True:
+        try:
+            item = q.get_nowait()
+        except queue.Empty:
+            break
+        if item is not _STOP:
+            left.append(item)
+    _spool(left)
+
+
+atexit.register(shutdown)
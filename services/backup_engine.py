@@ -0,0 +1,503 @@
+# services/backup_engine.py
+"""Incremental, content-addressed backups (DB + archive + uploads).
+
+Layout under instance/backups/repo/:
+  blobs/<aa>/<sha256>   file contents stored as-is (PDFs/images are not recompressed)
+  runs/<run_id>.json    manifest: db blob + {relative path: {sha, size, mtime_ns}}
+
+A run only reads files whose (size, mtime) changed since the last complete
+run; everything else reuses the previous hash. New/changed contents are
+copied once into blobs/ (identical contents are stored once). The SQLite DB
+is copied with the sqlite3 backup API in page steps.
+
+Runs are executed in a background thread with progress (job_status()).
+Old runs are pruned by BACKUP_RETENTION_RUNS and unreferenced blobs are
+garbage-collected (skipped while a run is in progress: its manifest has no
+file map yet, so blobs it just wrote or reused look unreferenced). restore_run() brings the DB and files back to a run
+(point in time); the DB step is delegated to the caller's restore function.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import uuid
+import zipfile
+from datetime import datetime
+
+from services import settings_service
+
+DEFAULT_RETENTION_RUNS = 14
+DB_BACKUP_PAGES = 1024
+COPY_CHUNK = 1024 * 1024
+DB_ARCNAME = "db/workflow.db"
+# A RUNNING manifest older than this is a run that died (crash / restart).
+STALE_RUN_HOURS = 24
+
+_jobs_lock = threading.Lock()
+_JOB: dict | None = None
+
+
+# -------------------------
+# Paths
+# -------------------------
+
+def repo_dir(app) -> str:
+    d = os.path.join(app.instance_path, "backups", "repo")
+    os.makedirs(os.path.join(d, "blobs"), exist_ok=True)
+    os.makedirs(os.path.join(d, "runs"), exist_ok=True)
+    return d
+
+
+def default_sources(app) -> dict[str, str]:
+    """Archive prefix -> directory (same layout as the ZIP backups)."""
+    return {
+        "storage/archive": os.path.join(app.root_path, "storage", "archive"),
+        "instance/uploads": os.path.join(app.instance_path, "uploads"),
+        "static/uploads": os.path.join(app.root_path, "static", "uploads"),
+    }
+
+
+def blob_path(repo: str, sha: str) -> str:
+    return os.path.join(repo, "blobs", sha[:2], sha)
+
+
+def _run_path(repo: str, run_id: str) -> str:
+    return os.path.join(repo, "runs", f"{os.path.basename(run_id)}.json")
+
+
+# -------------------------
+# Manifests
+# -------------------------
+
+def list_runs(app) -> list[dict]:
+    """Run summaries (newest first), without the file maps."""
+    repo = repo_dir(app)
+    out = []
+    for fn in os.listdir(os.path.join(repo, "runs")):
+        if not fn.endswith(".json"):
+            continue
+        try:
+            m = load_manifest(repo, fn[:-5])
+        except Exception:
+            continue
+        m.pop("files", None)
+        out.append(m)
+    out.sort(key=lambda m: m.get("run_id") or "", reverse=True)
+    return out
+
+
+def load_manifest(repo: str, run_id: str) -> dict:
+    with open(_run_path(repo, run_id), "r", encoding="utf-8") as fh:
+        return json.load(fh)
+
+
+def _write_manifest(repo: str, manifest: dict) -> None:
+    path = _run_path(repo, manifest["run_id"])
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as fh:
+        json.dump(manifest, fh, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+def _latest_complete(repo: str) -> dict | None:
+    runs_dir = os.path.join(repo, "runs")
+    for fn in sorted(os.listdir(runs_dir), reverse=True):
+        if not fn.endswith(".json"):
+            continue
+        try:
+            m = load_manifest(repo, fn[:-5])
+        except Exception:
+            continue
+        if m.get("status") == "COMPLETE":
+            return m
+    return None
+
+
+# -------------------------
+# Blob store
+# -------------------------
+
+def _store_file(repo: str, src: str) -> tuple[str, int, bool]:
+    """Hash `src` while copying it into a temp blob; keep it only if new."""
+    tmp = os.path.join(repo, "blobs", f".tmp-{uuid.uuid4().hex}")
+    h = hashlib.sha256()
+    size = 0
+    try:
+        with open(src, "rb") as fin, open(tmp, "wb") as fout:
+            while True:
+                chunk = fin.read(COPY_CHUNK)
+                if not chunk:
+                    break
+                h.update(chunk)
+                fout.write(chunk)
+                size += len(chunk)
+        sha = h.hexdigest()
+        dest = blob_path(repo, sha)
+        if os.path.exists(dest):
+            return sha, size, False
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        os.replace(tmp, dest)
+        return sha, size, True
+    finally:
+        if os.path.exists(tmp):
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+
+
+def snapshot_sqlite(src_db_path: str, snapshot_path: str, progress=None) -> None:
+    """Consistent copy of a live SQLite DB via the backup API, in page steps."""
+    os.makedirs(os.path.dirname(snapshot_path), exist_ok=True)
+    if not os.path.exists(src_db_path):
+        sqlite3.connect(snapshot_path).close()
+        return
+
+    def _cb(status, remaining, total):
+        if progress:
+            progress(total - remaining, total)
+
+    src = sqlite3.connect(src_db_path)
+    try:
+        try:
+            src.execute("PRAGMA wal_checkpoint(PASSIVE);")
+        except Exception:
+            pass
+        dst = sqlite3.connect(snapshot_path)
+        try:
+            src.backup(dst, pages=DB_BACKUP_PAGES, progress=_cb)
+            dst.commit()
+        finally:
+            dst.close()
+    finally:
+        src.close()
+
+
+# -------------------------
+# Backup run
+# -------------------------
+
+def run_backup(app, db_path: str, sources: dict[str, str] | None = None, progress=None) -> dict:
+    """Create one incremental run. Returns the manifest (without changing the live data)."""
+    repo = repo_dir(app)
+    sources = sources or default_sources(app)
+    prev = _latest_complete(repo)
+    prev_files = (prev or {}).get("files") or {}
+
+    def _report(stage, done=0, total=0):
+        if progress:
+            progress(stage, done, total)
+
+    # Sortable by time (microseconds) so "latest" never depends on the random suffix.
+    run_id = datetime.utcnow().strftime("%Y%m%d_%H%M%S_%f") + "_" + uuid.uuid4().hex[:4]
+    manifest = {
+        "run_id": run_id,
+        "created_at_utc": datetime.utcnow().isoformat() + "Z",
+        "status": "RUNNING",
+        "parent": (prev or {}).get("run_id"),
+        "db": None,
+        "files": {},
+        "stats": {},
+    }
+    _write_manifest(repo, manifest)
+
+    try:
+        # 1) DB snapshot (paged), stored as a blob
+        _report("DB")
+        tmp_db = os.path.join(repo, f".db-{run_id}.sqlite")
+        try:
+            snapshot_sqlite(db_path, tmp_db, progress=lambda d, t: _report("DB", d, t))
+            sha, size, _new = _store_file(repo, tmp_db)
+        finally:
+            if os.path.exists(tmp_db):
+                os.remove(tmp_db)
+        manifest["db"] = {"sha": sha, "size": size}
+
+        # 2) Scan sources
+        _report("SCAN")
+        entries = []
+        for prefix, base in sources.items():
+            if not os.path.isdir(base):
+                continue
+            for root, _dirs, files in os.walk(base):
+                for fn in files:
+                    full = os.path.join(root, fn)
+                    rel = os.path.relpath(full, base).replace(os.sep, "/")
+                    entries.append((f"{prefix}/{rel}", full))
+
+        # 3) Files: reuse hashes for unchanged (size, mtime), store the rest
+        new_blobs = reused = new_bytes = 0
+        total = len(entries)
+        files = {}
+        for n, (arc, full) in enumerate(entries, start=1):
+            try:
+                st = os.stat(full)
+            except OSError:
+                continue
+            old = prev_files.get(arc)
+            if (
+                old
+                and old.get("size") == st.st_size
+                and old.get("mtime_ns") == st.st_mtime_ns
+                and os.path.exists(blob_path(repo, old["sha"]))
+            ):
+                files[arc] = old
+                reused += 1
+            else:
+                sha, size, is_new = _store_file(repo, full)
+                files[arc] = {"sha": sha, "size": size, "mtime_ns": st.st_mtime_ns}
+                if is_new:
+                    new_blobs += 1
+                    new_bytes += size
+            if n % 200 == 0 or n == total:
+                _report("FILES", n, total)
+
+        manifest["files"] = files
+        manifest["stats"] = {
+            "files": len(files),
+            "reused": reused,
+            "copied": new_blobs,
+            "copied_bytes": new_bytes,
+            "total_bytes": sum(int(f.get("size") or 0) for f in files.values()),
+        }
+        manifest["status"] = "COMPLETE"
+        manifest["finished_at_utc"] = datetime.utcnow().isoformat() + "Z"
+        _write_manifest(repo, manifest)
+    except Exception as e:
+        manifest["status"] = "FAILED"
+        manifest["error"] = str(e) or e.__class__.__name__
+        _write_manifest(repo, manifest)
+        raise
+
+    _report("PRUNE")
+    prune(app)
+    return manifest
+
+
+def prune(app, keep: int | None = None) -> dict:
+    """Keep the newest `keep` complete runs, drop the rest and unreferenced blobs."""
+    repo = repo_dir(app)
+    if keep is None:
+        keep = settings_service.get_int("BACKUP_RETENTION_RUNS", DEFAULT_RETENTION_RUNS)
+    keep = max(1, int(keep or 1))
+
+    runs_dir = os.path.join(repo, "runs")
+    manifests = []
+    for fn in sorted(os.listdir(runs_dir), reverse=True):
+        if fn.endswith(".json"):
+            try:
+                manifests.append(load_manifest(repo, fn[:-5]))
+            except Exception:
+                continue
+
+    running = []
+    for m in manifests:
+        if m.get("status") != "RUNNING":
+            continue
+        if _is_stale(m):
+            m["status"] = "FAILED"
+            m["error"] = "abandoned (no progress)"
+            _write_manifest(repo, m)
+        else:
+            running.append(m)
+
+    complete = [m for m in manifests if m.get("status") == "COMPLETE"]
+    keep_ids = {m["run_id"] for m in complete[:keep]}
+    # Never drop a run that is still in progress.
+    keep_ids |= {m["run_id"] for m in running}
+
+    removed_runs = 0
+    referenced = set()
+    for m in manifests:
+        if m["run_id"] not in keep_ids:
+            os.remove(_run_path(repo, m["run_id"]))
+            removed_runs += 1
+            continue
+        if m.get("db"):
+            referenced.add(m["db"]["sha"])
+        referenced.update(f["sha"] for f in (m.get("files") or {}).values())
+
+    if running:
+        # The in-progress run's blobs are not in any manifest yet; collect next time.
+        return {"removed_runs": removed_runs, "removed_blobs": 0, "gc_skipped": True}
+
+    removed_blobs = 0
+    blobs_dir = os.path.join(repo, "blobs")
+    for sub in os.listdir(blobs_dir):
+        sub_dir = os.path.join(blobs_dir, sub)
+        if not os.path.isdir(sub_dir):
+            continue
+        for sha in os.listdir(sub_dir):
+            if sha not in referenced:
+                os.remove(os.path.join(sub_dir, sha))
+                removed_blobs += 1
+
+    return {"removed_runs": removed_runs, "removed_blobs": removed_blobs, "gc_skipped": False}
+
+
+def _is_stale(manifest: dict) -> bool:
+    try:
+        started = datetime.fromisoformat(str(manifest.get("created_at_utc") or "").rstrip("Z"))
+    except ValueError:
+        return True
+    return (datetime.utcnow() - started).total_seconds() > STALE_RUN_HOURS * 3600
+
+
+# -------------------------
+# Restore / export
+# -------------------------
+
+def restore_run(app, run_id: str, restore_db, db_path: str, sources: dict[str, str] | None = None, progress=None) -> dict:
+    """Bring DB + files back to `run_id`.
+
+    restore_db(snapshot_path, dest_db) performs the DB step (admin's
+    _restore_sqlite_from_snapshot). Files are only written when missing or
+    different (size/mtime); files created after the run are left in place.
+    """
+    repo = repo_dir(app)
+    sources = sources or default_sources(app)
+    m = load_manifest(repo, run_id)
+    if m.get("status") != "COMPLETE":
+        raise ValueError("Backup run is not complete.")
+
+    if progress:
+        progress("DB", 0, 0)
+    restore_db(blob_path(repo, m["db"]["sha"]), db_path)
+
+    written = skipped = 0
+    items = list((m.get("files") or {}).items())
+    total = len(items)
+    for n, (arc, info) in enumerate(items, start=1):
+        prefix, _, rel = arc.partition("/")
+        prefix2, _, rel2 = rel.partition("/")
+        key = f"{prefix}/{prefix2}"
+        base = sources.get(key)
+        if not base or not rel2:
+            continue
+        dest = os.path.normpath(os.path.join(base, rel2))
+        if not dest.startswith(os.path.normpath(base) + os.sep):
+            continue
+        try:
+            st = os.stat(dest)
+            if st.st_size == info.get("size") and st.st_mtime_ns == info.get("mtime_ns"):
+                skipped += 1
+                continue
+        except OSError:
+            pass
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        shutil.copyfile(blob_path(repo, info["sha"]), dest)
+        if info.get("mtime_ns"):
+            os.utime(dest, ns=(info["mtime_ns"], info["mtime_ns"]))
+        written += 1
+        if progress and (n % 200 == 0 or n == total):
+            progress("FILES", n, total)
+
+    return {"written": written, "skipped": skipped}
+
+
+class _StreamSink:
+    """Write-only, non-seekable file object that collects ZIP output chunks."""
+
+    def __init__(self):
+        self._buf = bytearray()
+        self._pos = 0
+
+    def write(self, b):
+        self._buf += b
+        self._pos += len(b)
+        return len(b)
+
+    def tell(self):
+        return self._pos
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        out = bytes(self._buf)
+        self._buf.clear()
+        return out
+
+
+def iter_run_zip(app, run_id: str):
+    """Yield a ZIP (stored, not recompressed) of a run, in the legacy ZIP layout."""
+    repo = repo_dir(app)
+    m = load_manifest(repo, run_id)
+    sink = _StreamSink()
+    with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_STORED, allowZip64=True) as z:
+        meta = {
+            "created_at_utc": m.get("created_at_utc"),
+            "project": "Workflow-PNCECS",
+            "run_id": m.get("run_id"),
+            "includes": [DB_ARCNAME] + [f"{p}/*" for p in default_sources(app)],
+        }
+        z.writestr("backup_meta.json", json.dumps(meta, ensure_ascii=False, indent=2))
+        yield sink.drain()
+
+        entries = [(DB_ARCNAME, m["db"]["sha"])] + [(arc, f["sha"]) for arc, f in (m.get("files") or {}).items()]
+        for arc, sha in entries:
+            with open(blob_path(repo, sha), "rb") as fin, z.open(arc, "w", force_zip64=True) as fout:
+                while True:
+                    chunk = fin.read(COPY_CHUNK)
+                    if not chunk:
+                        break
+                    fout.write(chunk)
+                    data = sink.drain()
+                    if data:
+                        yield data
+            data = sink.drain()
+            if data:
+                yield data
+    yield sink.drain()
+
+
+# -------------------------
+# Background job
+# -------------------------
+
+def job_status() -> dict | None:
+    with _jobs_lock:
+        return dict(_JOB) if _JOB else None
+
+
+def _update(**kw):
+    with _jobs_lock:
+        if _JOB is not None:
+            _JOB.update(kw)
+
+
+def start_job(app, kind: str, fn) -> bool:
+    """Run fn(progress) in a daemon thread; one backup/restore job at a time."""
+    global _JOB
+    with _jobs_lock:
+        if _JOB and _JOB.get("state") == "RUNNING":
+            return False
+        _JOB = {
+            "kind": kind,
+            "state": "RUNNING",
+            "stage": "QUEUED",
+            "done": 0,
+            "total": 0,
+            "result": None,
+            "error": None,
+            "started_at": datetime.utcnow().isoformat(timespec="seconds"),
+            "finished_at": None,
+        }
+
+    def _worker():
+        with app.app_context():
+            try:
+                result = fn(lambda stage, done, total: _update(stage=stage, done=done, total=total))
+                if isinstance(result, dict):
+                    result = {k: v for k, v in result.items() if k != "files"}
+                _update(state="DONE", stage="DONE", result=result)
+            except Exception as e:
+                _update(state="FAILED", error=str(e) or e.__class__.__name__)
+            finally:
+                _update(finished_at=datetime.utcnow().isoformat(timespec="seconds"))
+
+    threading.Thread(target=_worker, daemon=True, name=f"backup-{kind.lower()}").start()
+    return True
@@ -0,0 +1,201 @@
+# services/dashboard_snapshot.py
+"""Admin dashboard aggregates as a shared, serialized snapshot.
+
+The dashboard and its Excel export read one snapshot (msgspec structs, plain
+values only - no ORM objects) stored in a cachelib FileSystemCache under
+instance/cache/dashboard, so every worker process shares it.
+
+Stale-while-revalidate:
+- fresh (younger than DASHBOARD_SNAPSHOT_TTL_SECONDS): served as-is;
+- stale: served as-is while one background thread recomputes it (a lock key
+  in the same cache keeps other workers from refreshing at the same time);
+- missing / unreadable: computed inline once.
+refresh() recomputes on demand (manual refresh button).
+"""
+
+import os
+import threading
+from datetime import datetime
+
+import msgspec
+from cachelib import FileSystemCache
+from sqlalchemy import case, func
+
+from extensions import db
+from models import ArchivedFile, WorkflowRequest
+from services import settings_service
+from filters.request_filters import get_sla_days
+from archive.services import get_trash_retention_days
+
+DEFAULT_TTL_SECONDS = 30
+REFRESH_LOCK_SECONDS = 120
+CACHE_DIRNAME = os.path.join("cache", "dashboard")
+SNAPSHOT_KEY = "admin_dashboard:v1"
+LOCK_KEY = "admin_dashboard:refreshing"
+FINAL_STATUSES = ("APPROVED", "REJECTED")
+AGING_ON_PAGE = 10
+
+_local_lock = threading.Lock()
+_caches: dict[str, FileSystemCache] = {}
+
+
+class OverdueRequest(msgspec.Struct):
+    id: int
+    title: str | None
+    status: str | None
+    created_at: datetime
+    is_escalated: bool
+    current_role: str | None
+
+
+class DashboardSnapshot(msgspec.Struct):
+    counters: dict[str, int]
+    archive_counters: dict[str, int]
+    overdue: list[OverdueRequest]
+    sla_days: int
+    trash_retention_days: int
+    computed_at: datetime
+
+
+_encoder = msgspec.msgpack.Encoder()
+_decoder = msgspec.msgpack.Decoder(DashboardSnapshot)
+
+
+def ttl_seconds() -> int:
+    return max(1, settings_service.get_int("DASHBOARD_SNAPSHOT_TTL_SECONDS", DEFAULT_TTL_SECONDS))
+
+
+def _cache(app) -> FileSystemCache:
+    d = os.path.join(app.instance_path, CACHE_DIRNAME)
+    c = _caches.get(d)
+    if c is None:
+        os.makedirs(d, exist_ok=True)
+        c = _caches[d] = FileSystemCache(d, threshold=50, default_timeout=0)
+    return c
+
+
+# -------------------------
+# Compute
+# -------------------------
+
+def compute(now: datetime | None = None) -> DashboardSnapshot:
+    now = now or datetime.utcnow()
+    total, approved, rejected, drafts, in_progress = db.session.query(
+        func.count(WorkflowRequest.id),
+        func.sum(case((WorkflowRequest.status == "APPROVED", 1), else_=0)),
+        func.sum(case((WorkflowRequest.status == "REJECTED", 1), else_=0)),
+        func.sum(case((WorkflowRequest.status == "DRAFT", 1), else_=0)),
+        func.sum(case((WorkflowRequest.status.notin_(FINAL_STATUSES + ("DRAFT",)), 1), else_=0)),
+    ).one()
+
+    archive_total, archive_deleted = db.session.query(
+        func.count(ArchivedFile.id),
+        func.sum(case((ArchivedFile.is_deleted.is_(True), 1), else_=0)),
+    ).one()
+
+    overdue = [
+        OverdueRequest(
+            id=r.id,
+            title=r.title,
+            status=r.status,
+            created_at=r.created_at,
+            is_escalated=bool(r.is_escalated),
+            current_role=r.current_role,
+        )
+        for r in db.session.query(
+            WorkflowRequest.id,
+            WorkflowRequest.title,
+            WorkflowRequest.status,
+            WorkflowRequest.created_at,
+            WorkflowRequest.is_escalated,
+            WorkflowRequest.current_role,
+        )
+        .filter(
+            WorkflowRequest.status.notin_(FINAL_STATUSES),
+            WorkflowRequest.sla_due_at <= now,
+        )
+        .order_by(WorkflowRequest.created_at.asc())
+        .all()
+    ]
+
+    return DashboardSnapshot(
+        counters={
+            "total": int(total or 0),
+            "approved": int(approved or 0),
+            "rejected": int(rejected or 0),
+            "drafts": int(drafts or 0),
+            "in_progress": int(in_progress or 0),
+            "delegated": 0,
+        },
+        archive_counters={
+            "total": int(archive_total or 0),
+            "active": int(archive_total or 0) - int(archive_deleted or 0),
+            "deleted": int(archive_deleted or 0),
+        },
+        overdue=overdue,
+        sla_days=get_sla_days(),
+        trash_retention_days=get_trash_retention_days(),
+        computed_at=now,
+    )
+
+
+def refresh(app) -> DashboardSnapshot:
+    """Recompute and store the snapshot (inside an app context)."""
+    snap = compute()
+    _cache(app).set(SNAPSHOT_KEY, _encoder.encode(snap), timeout=0)
+    return snap
+
+
+def _load(app) -> DashboardSnapshot | None:
+    raw = _cache(app).get(SNAPSHOT_KEY)
+    if not raw:
+        return None
+    try:
+        return _decoder.decode(raw)
+    except msgspec.DecodeError:
+        return None
+
+
+def _refresh_in_background(app) -> bool:
+    cache = _cache(app)
+    with _local_lock:
+        if not cache.add(LOCK_KEY, os.getpid(), timeout=REFRESH_LOCK_SECONDS):
+            return False
+
+    def _worker():
+        with app.app_context():
+            try:
+                refresh(app)
+            except Exception:
+                db.session.rollback()
+            finally:
+                cache.delete(LOCK_KEY)
+                db.session.remove()
+
+    threading.Thread(target=_worker, daemon=True, name="dashboard-snapshot").start()
+    return True
+
+
+def get_snapshot(app) -> tuple[DashboardSnapshot, bool]:
+    """(snapshot, is_stale). A stale snapshot is returned while a refresh runs in the background."""
+    snap = _load(app)
+    if snap is None:
+        return refresh(app), False
+    age = (datetime.utcnow() - snap.computed_at).total_seconds()
+    if age < ttl_seconds():
+        return snap, False
+    _refresh_in_background(app)
+    return snap, True
+
+
+def template_context(snap: DashboardSnapshot, stale: bool = False) -> dict:
+    return {
+        "counters": snap.counters,
+        "archive_counters": snap.archive_counters,
+        "aging_requests": snap.overdue[:AGING_ON_PAGE],
+        "overdue_total": len(snap.overdue),
+        "sla_days": snap.sla_days,
+        "trash_retention_days": snap.trash_retention_days,
+        "now": snap.computed_at,
+        "snapshot_stale": stale,
+    }
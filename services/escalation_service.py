@@ -1,24 +1,18 @@
 from datetime import datetime, timedelta
-from models import WorkflowRequest, AuditLog, SystemSetting
+from models import WorkflowRequest, AuditLog
 from extensions import db
-from filters.request_filters import get_sla_days, get_escalation_days
+from services import settings_service
 
 FINAL_STATUSES = ["APPROVED", "REJECTED"]
 THROTTLE_MINUTES = 10
 
 
 def _get_setting(key):
-    s = SystemSetting.query.filter_by(key=key).first()
-    return s.value if s else None
+    return settings_service.get(key)
 
 
 def _set_setting(key, value):
-    s = SystemSetting.query.filter_by(key=key).first()
-    if s:
-        s.value = value
-    else:
-        s = SystemSetting(key=key, value=value)
-        db.session.add(s)
+    settings_service.set_value(key, value)
 
     db.session.flush()   # يضمن توليد id
     db.session.commit()
@@ -34,15 +28,11 @@ def run_escalation_if_needed():
         if now - last_run < timedelta(minutes=THROTTLE_MINUTES):
             return  # throttle
 
-    esc_deadline = now - timedelta(
-        days=get_sla_days() + get_escalation_days()
-    )
-
     escalated_requests = (
         WorkflowRequest.query
         .filter(
             WorkflowRequest.status.notin_(FINAL_STATUSES),
-            WorkflowRequest.created_at < esc_deadline,
+            WorkflowRequest.escalation_due_at < now,
             WorkflowRequest.escalated_at.is_(None)
         )
         .all()
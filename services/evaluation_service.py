@@ -6,7 +6,8 @@ import json
 from sqlalchemy import func, and_, or_
 
 from extensions import db
-from models import AuditLog, ArchivedFile, WorkflowRequest, SystemSetting, EmployeeEvaluationRun, User
+from models import AuditLog, ArchivedFile, WorkflowRequest, EmployeeEvaluationRun, User
+from services import settings_service
 from utils.scoring import clamp, score_5_from_100
 
 
@@ -14,9 +15,9 @@ FINAL_STATUSES = ["APPROVED", "REJECTED"]
 
 
 def _get_setting_int(key: str, default: int) -> int:
-    s = SystemSetting.query.filter_by(key=key).first()
+    value = settings_service.get(key)
     try:
-        return int(s.value) if s and s.value is not None else default
+        return int(value) if value is not None else default
     except Exception:
         return default
 
@@ -0,0 +1,422 @@
+# services/fleet_analytics.py
+"""Fleet analytics cube: per (vehicle, month) aggregates of trips, fuel and maintenance.
+
+transport_fleet_month holds one row per (vehicle_id, month) with trip count,
+distance, fuel fills / litres / cost and maintenance count / cost. Every
+flush that touches a TransportTrip, TransportFuelFill, TransportMaintenance or
+TransportMaintenanceItem recomputes just the cells it touched (old and new
+vehicle / month of each row) from the base tables, inside the same
+transaction, so edits, moves between vehicles and deletes stay exact and a
+rollback leaves both consistent.
+
+Months: trip started_at, fuel fill_day, maintenance invoice_day (created_at
+when the day is empty). Trip distance is distance_km, else the odometer
+difference. Maintenance cost is the sum of item total_price (quantity *
+unit_price when the total is empty).
+
+The analytics page and the transport home cards read only the cube:
+km / litre, fuel cost per km, total cost per km and fuel efficiency flags
+(anomalies()). Rows written outside the ORM unit of work are reconciled on
+startup by ensure_cube_current() (row counts vs cube totals), like
+services/audit_rollup.py.
+"""
+
+import statistics
+from datetime import date, datetime
+
+from sqlalchemy import and_, case, delete, event, func, inspect, select
+from sqlalchemy.orm import Session
+
+from extensions import db
+from models import (
+    TransportFleetMonth,
+    TransportFuelFill,
+    TransportMaintenance,
+    TransportMaintenanceItem,
+    TransportTrip,
+    TransportVehicle,
+)
+from services import settings_service
+
+VALUE_COLS = (
+    "trips",
+    "distance_km",
+    "fuel_fills",
+    "fuel_liters",
+    "fuel_amount",
+    "maintenance_count",
+    "maintenance_cost",
+)
+
+DEFAULT_EFFICIENCY_TOLERANCE_PCT = 30.0
+BASELINE_MONTHS = 12
+MIN_BASELINE_MONTHS = 3
+FLEET_OUTLIER_Z = 3.5
+
+FLAG_LABELS = {
+    "LOW_EFFICIENCY": "استهلاك مرتفع (كم/لتر أقل من المعتاد)",
+    "HIGH_EFFICIENCY": "كم/لتر أعلى من المعتاد (تعبئات غير مسجلة؟)",
+    "FUEL_NO_DISTANCE": "تعبئة وقود بدون رحلات مسجلة",
+}
+
+
+# -------------------------
+# Month keys
+# -------------------------
+
+def month_key(day) -> str | None:
+    if day is None:
+        return None
+    if isinstance(day, (datetime, date)):
+        return day.strftime("%Y-%m")
+    s = str(day).strip()[:7]
+    return s or None
+
+
+def shift_month(month: str, delta: int) -> str:
+    y, m = int(month[:4]), int(month[5:7])
+    n = y * 12 + (m - 1) + delta
+    return f"{n // 12:04d}-{n % 12 + 1:02d}"
+
+
+def month_range(first: str, last: str) -> list:
+    out = []
+    m = first
+    while m <= last and len(out) < 240:
+        out.append(m)
+        m = shift_month(m, 1)
+    return out
+
+
+def _day_month(day_col, created_col):
+    """SQL twin of month_key(day or created_at)."""
+    return func.coalesce(
+        func.nullif(func.substr(func.trim(day_col), 1, 7), ""),
+        func.strftime("%Y-%m", created_col),
+    )
+
+
+_TRIP_MONTH = func.strftime("%Y-%m", TransportTrip.started_at)
+_FUEL_MONTH = _day_month(TransportFuelFill.fill_day, TransportFuelFill.created_at)
+_MAINT_MONTH = _day_month(TransportMaintenance.invoice_day, TransportMaintenance.created_at)
+
+_TRIP_KM = func.coalesce(
+    TransportTrip.distance_km,
+    case(
+        (
+            and_(
+                TransportTrip.start_odometer.isnot(None),
+                TransportTrip.end_odometer.isnot(None),
+                TransportTrip.end_odometer > TransportTrip.start_odometer,
+            ),
+            TransportTrip.end_odometer - TransportTrip.start_odometer,
+        ),
+        else_=0.0,
+    ),
+)
+_ITEM_COST = func.coalesce(
+    TransportMaintenanceItem.total_price,
+    TransportMaintenanceItem.quantity * TransportMaintenanceItem.unit_price,
+    0.0,
+)
+
+
+# -------------------------
+# Aggregation
+# -------------------------
+
+def _aggregates(connection, vehicle_ids=None, months=None) -> dict:
+    """{(vehicle_id, month): {col: value}} from the base tables (optionally narrowed)."""
+    out: dict = {}
+
+    def cell(vid, month):
+        return out.setdefault((vid, month), dict.fromkeys(VALUE_COLS, 0))
+
+    def narrow(stmt, vehicle_col, month_expr):
+        if vehicle_ids is not None:
+            stmt = stmt.where(vehicle_col.in_(vehicle_ids))
+        if months is not None:
+            stmt = stmt.where(month_expr.in_(months))
+        return stmt
+
+    trips = narrow(
+        select(TransportTrip.vehicle_id, _TRIP_MONTH, func.count(TransportTrip.id), func.sum(_TRIP_KM))
+        .where(TransportTrip.is_deleted.is_(False)),
+        TransportTrip.vehicle_id, _TRIP_MONTH,
+    ).group_by(TransportTrip.vehicle_id, _TRIP_MONTH)
+    for vid, month, n, km in connection.execute(trips):
+        c = cell(vid, month)
+        c["trips"] = int(n or 0)
+        c["distance_km"] = float(km or 0)
+
+    fuel = narrow(
+        select(
+            TransportFuelFill.vehicle_id,
+            _FUEL_MONTH,
+            func.count(TransportFuelFill.id),
+            func.sum(func.coalesce(TransportFuelFill.liters, 0.0)),
+            func.sum(func.coalesce(TransportFuelFill.amount, 0.0)),
+        ),
+        TransportFuelFill.vehicle_id, _FUEL_MONTH,
+    ).group_by(TransportFuelFill.vehicle_id, _FUEL_MONTH)
+    for vid, month, n, liters, amount in connection.execute(fuel):
+        c = cell(vid, month)
+        c["fuel_fills"] = int(n or 0)
+        c["fuel_liters"] = float(liters or 0)
+        c["fuel_amount"] = float(amount or 0)
+
+    maint = narrow(
+        select(
+            TransportMaintenance.vehicle_id,
+            _MAINT_MONTH,
+            func.count(func.distinct(TransportMaintenance.id)),
+            func.sum(_ITEM_COST),
+        ).outerjoin(TransportMaintenanceItem, TransportMaintenanceItem.maintenance_id == TransportMaintenance.id),
+        TransportMaintenance.vehicle_id, _MAINT_MONTH,
+    ).group_by(TransportMaintenance.vehicle_id, _MAINT_MONTH)
+    for vid, month, n, cost in connection.execute(maint):
+        c = cell(vid, month)
+        c["maintenance_count"] = int(n or 0)
+        c["maintenance_cost"] = float(cost or 0)
+
+    return {k: v for k, v in out.items() if k[0] is not None and k[1]}
+
+
+def _upsert(connection, cells: dict) -> None:
+    """Write {(vehicle_id, month): values} into the cube (values replace the row's)."""
+    if not cells:
+        return
+    table = TransportFleetMonth.__table__
+    if connection.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+
+    now = datetime.utcnow()
+    stmt = dialect_insert(table)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["vehicle_id", "month"],
+        set_={c: stmt.excluded[c] for c in VALUE_COLS + ("updated_at",)},
+    )
+    rows = [dict(vals, vehicle_id=vid, month=month, updated_at=now) for (vid, month), vals in cells.items()]
+    for i in range(0, len(rows), 500):
+        connection.execute(stmt, rows[i:i + 500])
+
+
+# -------------------------
+# Incremental maintenance
+# -------------------------
+
+def _values(obj, attr: str) -> list:
+    """Current value plus the pre-flush value when the attribute changed."""
+    hist = inspect(obj).attrs[attr].history
+    vals = list(hist.added or ()) + list(hist.unchanged or ()) + list(hist.deleted or ())
+    return vals or [getattr(obj, attr, None)]
+
+
+def _touched(obj, day_attr: str, created_attr: str | None, cells: set) -> None:
+    months = set()
+    for day in _values(obj, day_attr):
+        m = month_key(day)
+        if m:
+            months.add(m)
+        elif created_attr:
+            months.update(month_key(v) for v in _values(obj, created_attr))
+    for vid in _values(obj, "vehicle_id"):
+        for m in months:
+            if vid is not None and m:
+                cells.add((vid, m))
+
+
+@event.listens_for(Session, "after_flush")
+def _cube_after_flush(session, flush_context):
+    cells: set = set()
+    maint_ids: set = set()
+    for objs in (session.new, session.dirty, session.deleted):
+        for obj in objs:
+            if isinstance(obj, TransportTrip):
+                _touched(obj, "started_at", None, cells)
+            elif isinstance(obj, TransportFuelFill):
+                _touched(obj, "fill_day", "created_at", cells)
+            elif isinstance(obj, TransportMaintenance):
+                _touched(obj, "invoice_day", "created_at", cells)
+            elif isinstance(obj, TransportMaintenanceItem):
+                maint_ids.update(v for v in _values(obj, "maintenance_id") if v is not None)
+    if not (cells or maint_ids):
+        return
+
+    connection = session.connection()
+    if maint_ids:
+        cells.update(
+            (vid, m) for vid, m in connection.execute(
+                select(TransportMaintenance.vehicle_id, _MAINT_MONTH).where(TransportMaintenance.id.in_(maint_ids))
+            ) if vid is not None and m
+        )
+    if not cells:
+        return
+
+    fresh = _aggregates(
+        connection,
+        vehicle_ids={c[0] for c in cells},
+        months={c[1] for c in cells},
+    )
+    zero = dict.fromkeys(VALUE_COLS, 0)
+    _upsert(connection, {c: fresh.get(c, zero) for c in cells})
+
+
+# -------------------------
+# Backfill / reconcile
+# -------------------------
+
+def rebuild_cube() -> int:
+    """Recompute every cube row from the base tables (no commit). Returns cells written."""
+    connection = db.session.connection()
+    connection.execute(delete(TransportFleetMonth.__table__))
+    cells = _aggregates(connection)
+    _upsert(connection, cells)
+    return len(cells)
+
+
+def ensure_cube_current() -> bool:
+    """Rebuild when the cube's trip / fuel / maintenance counts no longer match the tables (commits)."""
+    raw = db.session.execute(select(
+        select(func.count(TransportTrip.id))
+        .where(TransportTrip.is_deleted.is_(False), TransportTrip.started_at.isnot(None))
+        .scalar_subquery(),
+        select(func.count(TransportFuelFill.id)).scalar_subquery(),
+        select(func.count(TransportMaintenance.id)).scalar_subquery(),
+    )).one()
+    cube = db.session.execute(select(
+        func.coalesce(func.sum(TransportFleetMonth.trips), 0),
+        func.coalesce(func.sum(TransportFleetMonth.fuel_fills), 0),
+        func.coalesce(func.sum(TransportFleetMonth.maintenance_count), 0),
+    )).one()
+    if tuple(int(x or 0) for x in raw) == tuple(int(x or 0) for x in cube):
+        return False
+    rebuild_cube()
+    db.session.commit()
+    return True
+
+
+# -------------------------
+# Reads (cube only)
+# -------------------------
+
+def ratios(d: dict) -> dict:
+    """Adds km_per_liter, fuel_cost_per_km, cost_per_km (None when undefined)."""
+    km = d.get("distance_km") or 0
+    liters = d.get("fuel_liters") or 0
+    fuel = d.get("fuel_amount") or 0
+    maint = d.get("maintenance_cost") or 0
+    d["km_per_liter"] = (km / liters) if km > 0 and liters > 0 else None
+    d["fuel_cost_per_km"] = (fuel / km) if km > 0 else None
+    d["cost_per_km"] = ((fuel + maint) / km) if km > 0 else None
+    return d
+
+
+def _sums():
+    return [func.coalesce(func.sum(getattr(TransportFleetMonth, c)), 0).label(c) for c in VALUE_COLS]
+
+
+def totals(first: str, last: str) -> dict:
+    row = db.session.execute(
+        select(*_sums()).where(TransportFleetMonth.month.between(first, last))
+    ).one()
+    return ratios(dict(row._mapping))
+
+
+def by_month(first: str, last: str) -> list:
+    """Fleet totals per month, every month of the range (empty months as zeros)."""
+    rows = {
+        r.month: dict(r._mapping)
+        for r in db.session.execute(
+            select(TransportFleetMonth.month, *_sums())
+            .where(TransportFleetMonth.month.between(first, last))
+            .group_by(TransportFleetMonth.month)
+        )
+    }
+    return [ratios(rows.get(m) or dict(dict.fromkeys(VALUE_COLS, 0), month=m)) for m in month_range(first, last)]
+
+
+def by_vehicle(first: str, last: str) -> list:
+    """Per vehicle totals over the range, most distance first."""
+    rows = db.session.execute(
+        select(TransportVehicle.id, TransportVehicle.plate_no, TransportVehicle.label, *_sums())
+        .join(TransportVehicle, TransportVehicle.id == TransportFleetMonth.vehicle_id)
+        .where(TransportFleetMonth.month.between(first, last))
+        .group_by(TransportVehicle.id, TransportVehicle.plate_no, TransportVehicle.label)
+    ).all()
+    out = [ratios(dict(r._mapping)) for r in rows]
+    out.sort(key=lambda d: (-(d["distance_km"] or 0), d["plate_no"] or ""))
+    return out
+
+
+def anomalies(first: str, last: str) -> list:
+    """Fuel efficiency outliers per (vehicle, month) in the range.
+
+    A month is compared with the vehicle's own median km / litre over the
+    BASELINE_MONTHS before it (at least MIN_BASELINE_MONTHS); without that
+    history, with the fleet's months in the range (robust z-score).
+    """
+    tol = max(0.0, settings_service.get_float("TRANSPORT_FLEET_EFFICIENCY_TOLERANCE_PCT", DEFAULT_EFFICIENCY_TOLERANCE_PCT)) / 100.0
+    rows = db.session.execute(
+        select(
+            TransportFleetMonth.vehicle_id, TransportFleetMonth.month,
+            TransportFleetMonth.distance_km, TransportFleetMonth.fuel_liters, TransportFleetMonth.fuel_amount,
+            TransportVehicle.plate_no, TransportVehicle.label,
+        )
+        .join(TransportVehicle, TransportVehicle.id == TransportFleetMonth.vehicle_id)
+        .where(TransportFleetMonth.month.between(shift_month(first, -BASELINE_MONTHS), last))
+        .order_by(TransportFleetMonth.vehicle_id, TransportFleetMonth.month)
+    ).all()
+
+    history: dict = {}
+    in_range = []
+    for r in rows:
+        kpl = (r.distance_km / r.fuel_liters) if r.distance_km > 0 and r.fuel_liters > 0 else None
+        if kpl is not None:
+            history.setdefault(r.vehicle_id, []).append((r.month, kpl))
+        if r.month >= first:
+            in_range.append((r, kpl))
+
+    fleet = [kpl for r, kpl in in_range if kpl is not None]
+    fleet_med = statistics.median(fleet) if len(fleet) >= 5 else None
+    fleet_mad = statistics.median([abs(x - fleet_med) for x in fleet]) if fleet_med is not None else None
+
+    out = []
+    for r, kpl in in_range:
+        flag, baseline = None, None
+        if r.fuel_liters > 0 and r.distance_km <= 0:
+            flag = "FUEL_NO_DISTANCE"
+        elif kpl is not None:
+            lo_month = shift_month(r.month, -BASELINE_MONTHS)
+            past = [x for m, x in history.get(r.vehicle_id, ()) if lo_month <= m < r.month]
+            if len(past) >= MIN_BASELINE_MONTHS:
+                baseline = statistics.median(past)
+                if kpl < baseline * (1 - tol):
+                    flag = "LOW_EFFICIENCY"
+                elif kpl > baseline * (1 + tol):
+                    flag = "HIGH_EFFICIENCY"
+            elif fleet_mad:
+                baseline = fleet_med
+                z = (kpl - fleet_med) / (1.4826 * fleet_mad)
+                if z < -FLEET_OUTLIER_Z:
+                    flag = "LOW_EFFICIENCY"
+                elif z > FLEET_OUTLIER_Z:
+                    flag = "HIGH_EFFICIENCY"
+        if flag:
+            out.append({
+                "vehicle_id": r.vehicle_id,
+                "plate_no": r.plate_no,
+                "label": r.label,
+                "month": r.month,
+                "distance_km": r.distance_km,
+                "fuel_liters": r.fuel_liters,
+                "fuel_amount": r.fuel_amount,
+                "km_per_liter": kpl,
+                "baseline": baseline,
+                "flag": flag,
+                "flag_label": FLAG_LABELS[flag],
+            })
+    out.sort(key=lambda d: (d["month"], d["plate_no"] or ""), reverse=True)
+    return out
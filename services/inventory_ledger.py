@@ -0,0 +1,825 @@
+"""Inventory stock ledger (InvStockMovement) + maintained balances (InvBalance).
+
+Every voucher create/edit/delete posts its lines to the ledger inside the caller's
+transaction (no commit here), and the affected (warehouse, item) balances are
+updated in place. Reports read InvBalance (one row per pair) and the item card
+reads the ledger with an indexed range scan instead of re-aggregating vouchers.
+
+Balance rules (same as the legacy full recomputation):
+- Inbound/Return: +
+- Issue (ROOM): - from warehouse
+- Issue (WAREHOUSE transfer): - from warehouse AND + to warehouse
+- Scrap: -
+- Stocktake: baseline per (warehouse, item): latest stocktake qty (by date, id),
+  then only movements dated strictly after it are applied.
+
+Historical ("as of") balances start from the nearest month-end InvBalanceSnapshot and
+replay only the ledger rows after it (see balances_as_of()).
+"""
+
+import calendar
+import json
+from datetime import datetime
+
+from sqlalchemy import func, insert
+
+from extensions import db
+from models import (
+    InvBalance,
+    InvBalanceSnapshot,
+    InvInboundVoucher,
+    InvInboundVoucherLine,
+    InvIssueVoucher,
+    InvIssueVoucherLine,
+    InvReturnVoucher,
+    InvReturnVoucherLine,
+    InvScrapVoucher,
+    InvScrapVoucherLine,
+    InvStockMovement,
+    InvStocktakeVoucher,
+    InvStocktakeVoucherLine,
+)
+
+
+KIND_STOCKTAKE = "STOCKTAKE"
+
+# voucher_type -> (voucher model, line model)
+VOUCHER_MODELS = {
+    "INBOUND": (InvInboundVoucher, InvInboundVoucherLine),
+    "RETURN": (InvReturnVoucher, InvReturnVoucherLine),
+    "ISSUE": (InvIssueVoucher, InvIssueVoucherLine),
+    "SCRAP": (InvScrapVoucher, InvScrapVoucherLine),
+    "STOCKTAKE": (InvStocktakeVoucher, InvStocktakeVoucherLine),
+}
+
+# Arabic labels used by the item card
+KIND_LABELS_AR = {
+    "INBOUND": "إدخال",
+    "RETURN": "إرجاع",
+    "ISSUE": "صرف",
+    "TRANSFER_IN": "إدخال (تحويل)",
+    "SCRAP": "إتلاف",
+    "STOCKTAKE": "جرد",
+}
+
+_EPS = 1e-9
+
+
+def _voucher_movements(voucher_type: str, v, item_id, qty, line_id=None) -> list[dict]:
+    """Ledger rows produced by one voucher line."""
+    if not v or not item_id or not getattr(v, "voucher_date", None):
+        return []
+
+    qty = float(qty or 0)
+    base = {
+        "item_id": int(item_id),
+        "movement_date": str(v.voucher_date),
+        "voucher_type": voucher_type,
+        "voucher_id": int(v.id),
+        "voucher_no": v.voucher_no,
+        "line_id": line_id,
+    }
+
+    out = []
+
+    def _mv(wh_id, kind, signed_qty):
+        if not wh_id:
+            return
+        out.append(dict(base, warehouse_id=int(wh_id), kind=kind, qty=float(signed_qty)))
+
+    if voucher_type in ("INBOUND", "RETURN"):
+        _mv(v.to_warehouse_id, voucher_type, qty)
+    elif voucher_type == "ISSUE":
+        _mv(v.from_warehouse_id, "ISSUE", -qty)
+        if (v.issue_kind or "").upper() == "WAREHOUSE" and v.to_warehouse_id:
+            _mv(v.to_warehouse_id, "TRANSFER_IN", qty)
+    elif voucher_type == "SCRAP":
+        _mv(v.from_warehouse_id, "SCRAP", -qty)
+    elif voucher_type == KIND_STOCKTAKE:
+        _mv(v.warehouse_id, KIND_STOCKTAKE, qty)
+
+    return out
+
+
+def _delete_voucher_movements(voucher_type: str, voucher_id: int) -> tuple[set[tuple[int, int]], str | None]:
+    """Delete a voucher's ledger rows. Returns (affected keys, earliest movement date)."""
+    rows = (
+        db.session.query(InvStockMovement.warehouse_id, InvStockMovement.item_id, InvStockMovement.movement_date)
+        .filter(InvStockMovement.voucher_type == voucher_type, InvStockMovement.voucher_id == int(voucher_id))
+        .distinct()
+        .all()
+    )
+    keys = {(int(wh), int(it)) for wh, it, _d in rows}
+    min_date = min((str(d) for _wh, _it, d in rows if d), default=None)
+    if keys:
+        (
+            InvStockMovement.query
+            .filter(InvStockMovement.voucher_type == voucher_type, InvStockMovement.voucher_id == int(voucher_id))
+            .delete(synchronize_session=False)
+        )
+    return keys, min_date
+
+
+def _sum_deltas_after(wh_id: int, item_id: int, after_date: str | None) -> float:
+    q = db.session.query(func.coalesce(func.sum(InvStockMovement.qty), 0.0)).filter(
+        InvStockMovement.warehouse_id == wh_id,
+        InvStockMovement.item_id == item_id,
+        InvStockMovement.kind != KIND_STOCKTAKE,
+    )
+    if after_date:
+        q = q.filter(InvStockMovement.movement_date > after_date)
+    return float(q.scalar() or 0)
+
+
+def _get_or_create_balance(wh_id: int, item_id: int) -> InvBalance:
+    bal = db.session.get(InvBalance, (wh_id, item_id))
+    if bal is None:
+        bal = InvBalance(warehouse_id=wh_id, item_id=item_id, qty=0.0)
+        db.session.add(bal)
+    return bal
+
+
+def recompute_balance(wh_id: int, item_id: int) -> InvBalance | None:
+    """Recompute one (warehouse, item) balance from the ledger (two indexed queries)."""
+    wh_id, item_id = int(wh_id), int(item_id)
+
+    base = (
+        db.session.query(
+            InvStockMovement.movement_date,
+            InvStockMovement.voucher_id,
+            func.sum(InvStockMovement.qty),
+        )
+        .filter(
+            InvStockMovement.warehouse_id == wh_id,
+            InvStockMovement.item_id == item_id,
+            InvStockMovement.kind == KIND_STOCKTAKE,
+        )
+        .group_by(InvStockMovement.movement_date, InvStockMovement.voucher_id)
+        .order_by(InvStockMovement.movement_date.desc(), InvStockMovement.voucher_id.desc())
+        .first()
+    )
+
+    has_any = (
+        db.session.query(InvStockMovement.id)
+        .filter(InvStockMovement.warehouse_id == wh_id, InvStockMovement.item_id == item_id)
+        .first()
+    )
+    bal = db.session.get(InvBalance, (wh_id, item_id))
+    if not has_any:
+        if bal is not None:
+            db.session.delete(bal)
+        return None
+
+    if bal is None:
+        bal = _get_or_create_balance(wh_id, item_id)
+
+    if base:
+        b_date, b_vid, b_qty = base
+        bal.baseline_date = str(b_date)
+        bal.baseline_voucher_id = int(b_vid)
+        bal.baseline_qty = float(b_qty or 0)
+        bal.qty = bal.baseline_qty + _sum_deltas_after(wh_id, item_id, bal.baseline_date)
+    else:
+        bal.baseline_date = None
+        bal.baseline_voucher_id = None
+        bal.baseline_qty = None
+        bal.qty = _sum_deltas_after(wh_id, item_id, None)
+    bal.updated_at = datetime.utcnow()
+    return bal
+
+
+def _apply_new_movements(rows: list[dict]) -> None:
+    """Incrementally fold freshly inserted movements into InvBalance."""
+    deltas: dict[tuple[int, int], list[tuple[str, float]]] = {}
+    stocktakes: dict[tuple[int, int], dict] = {}
+
+    for r in rows:
+        k = (r["warehouse_id"], r["item_id"])
+        if r["kind"] == KIND_STOCKTAKE:
+            st = stocktakes.setdefault(k, {"date": r["movement_date"], "voucher_id": r["voucher_id"], "qty": 0.0})
+            st["qty"] += r["qty"]
+        else:
+            deltas.setdefault(k, []).append((r["movement_date"], r["qty"]))
+
+    for k, st in stocktakes.items():
+        bal = _get_or_create_balance(*k)
+        cand = (st["date"], int(st["voucher_id"]))
+        prev = (bal.baseline_date, int(bal.baseline_voucher_id or 0)) if bal.baseline_date else None
+        if prev is None or cand > prev:
+            bal.baseline_date = st["date"]
+            bal.baseline_voucher_id = cand[1]
+            bal.baseline_qty = float(st["qty"])
+            # movements already in the ledger (incl. this flush) dated after the new baseline
+            db.session.flush()
+            bal.qty = bal.baseline_qty + _sum_deltas_after(k[0], k[1], bal.baseline_date)
+            bal.updated_at = datetime.utcnow()
+        # a new stocktake fully re-bases the pair; pending deltas are already counted
+        deltas.pop(k, None)
+
+    for k, items in deltas.items():
+        bal = _get_or_create_balance(*k)
+        for mv_date, qty in items:
+            if (not bal.baseline_date) or (mv_date > bal.baseline_date):
+                bal.qty = float(bal.qty or 0) + float(qty)
+        bal.updated_at = datetime.utcnow()
+
+
+def post_voucher(voucher_type: str, voucher_id: int) -> int:
+    """(Re)post a voucher's lines to the ledger and update balances. No commit.
+
+    Call after the voucher and its lines are flushed, for create and edit alike.
+    Returns the number of movement rows written.
+    """
+    voucher_type = (voucher_type or "").upper()
+    v_model, l_model = VOUCHER_MODELS[voucher_type]
+    v = db.session.get(v_model, int(voucher_id))
+
+    db.session.flush()
+    old_keys, old_min_date = _delete_voucher_movements(voucher_type, voucher_id)
+
+    rows: list[dict] = []
+    if v is not None:
+        lines = l_model.query.filter(l_model.voucher_id == v.id).order_by(l_model.id.asc()).all()
+        for ln in lines:
+            rows.extend(_voucher_movements(voucher_type, v, ln.item_id, ln.qty, ln.id))
+
+    now = datetime.utcnow()
+    for r in rows:
+        r["created_at"] = now
+    if rows:
+        db.session.execute(insert(InvStockMovement), rows)
+
+    dates = [r["movement_date"] for r in rows] + ([old_min_date] if old_min_date else [])
+    if dates:
+        invalidate_snapshots_from(min(dates))
+
+    if old_keys:
+        # Edit: the previous posting may have moved baselines; recompute from the ledger.
+        db.session.flush()
+        for k in old_keys | {(r["warehouse_id"], r["item_id"]) for r in rows}:
+            recompute_balance(*k)
+    else:
+        _apply_new_movements(rows)
+
+    return len(rows)
+
+
+def unpost_voucher(voucher_type: str, voucher_id: int) -> None:
+    """Remove a voucher's movements (voucher delete) and recompute affected balances. No commit."""
+    voucher_type = (voucher_type or "").upper()
+    db.session.flush()
+    keys, min_date = _delete_voucher_movements(voucher_type, voucher_id)
+    if min_date:
+        invalidate_snapshots_from(min_date)
+    for k in keys:
+        recompute_balance(*k)
+
+
+# ----------------------
+# Reads
+# ----------------------
+
+def get_balance(wh_id: int, item_id: int) -> float:
+    bal = db.session.get(InvBalance, (int(wh_id), int(item_id)))
+    return float(bal.qty or 0) if bal else 0.0
+
+
+def item_balance(item_id: int, warehouse_id: int | None = None) -> float:
+    """Current balance of one item (all warehouses, or one)."""
+    q = db.session.query(func.coalesce(func.sum(InvBalance.qty), 0.0)).filter(InvBalance.item_id == int(item_id))
+    if warehouse_id:
+        q = q.filter(InvBalance.warehouse_id == int(warehouse_id))
+    return float(q.scalar() or 0)
+
+
+def balances_map() -> dict[tuple[int, int], float]:
+    return {
+        (int(wh), int(it)): float(q or 0)
+        for wh, it, q in db.session.query(InvBalance.warehouse_id, InvBalance.item_id, InvBalance.qty).all()
+    }
+
+
+def warehouse_totals() -> dict[int, dict]:
+    """{warehouse_id: {"item_count", "total_qty"}} over non-zero balances."""
+    rows = (
+        db.session.query(InvBalance.warehouse_id, func.count(), func.sum(InvBalance.qty))
+        .filter(func.abs(InvBalance.qty) >= _EPS)
+        .group_by(InvBalance.warehouse_id)
+        .all()
+    )
+    return {int(wh): {"item_count": int(c or 0), "total_qty": float(s or 0)} for wh, c, s in rows}
+
+
+def item_totals() -> dict[int, float]:
+    rows = (
+        db.session.query(InvBalance.item_id, func.sum(InvBalance.qty))
+        .group_by(InvBalance.item_id)
+        .all()
+    )
+    return {int(it): float(s or 0) for it, s in rows}
+
+
+def item_card_movements(item_id: int, warehouse_id: int | None = None, from_date: str = "", to_date: str = "") -> list[dict]:
+    """Ledger rows for one item (indexed range scan on item_id/movement_date)."""
+    q = InvStockMovement.query.filter(
+        InvStockMovement.item_id == int(item_id),
+        InvStockMovement.kind != KIND_STOCKTAKE,
+    )
+    if warehouse_id:
+        q = q.filter(InvStockMovement.warehouse_id == int(warehouse_id))
+    if from_date:
+        q = q.filter(InvStockMovement.movement_date >= from_date)
+    if to_date:
+        q = q.filter(InvStockMovement.movement_date <= to_date)
+
+    out = []
+    for mv in q.order_by(InvStockMovement.movement_date.asc(), InvStockMovement.voucher_no.asc(), InvStockMovement.id.asc()).all():
+        out.append({
+            "date": mv.movement_date,
+            "type": KIND_LABELS_AR.get(mv.kind, mv.kind),
+            "voucher_no": mv.voucher_no,
+            "warehouse_id": mv.warehouse_id,
+            "qty": float(mv.qty or 0),
+        })
+    return out
+
+
+# ----------------------
+# Month-end snapshots / as-of balances
+# ----------------------
+
+def _period_of(d: str) -> str:
+    return str(d)[:7]
+
+
+def _period_end(period: str) -> str:
+    y, m = int(period[:4]), int(period[5:7])
+    return f"{period}-{calendar.monthrange(y, m)[1]:02d}"
+
+
+def _next_period(period: str) -> str:
+    y, m = int(period[:4]), int(period[5:7])
+    return f"{y + 1}-01" if m == 12 else f"{y}-{m + 1:02d}"
+
+
+def invalidate_snapshots_from(mv_date: str) -> None:
+    """Drop snapshots that a movement dated `mv_date` makes stale (its month and later). No commit."""
+    if not mv_date:
+        return
+    (
+        InvBalanceSnapshot.query
+        .filter(InvBalanceSnapshot.period >= _period_of(mv_date))
+        .delete(synchronize_session=False)
+    )
+
+
+def _replay(base: dict[tuple[int, int], float], after: str | None, upto: str,
+            warehouse_id: int | None = None, item_id: int | None = None) -> dict[tuple[int, int], float]:
+    """Apply ledger rows dated in (after, upto] on top of `base` (balances as of `after`)."""
+    q = db.session.query(
+        InvStockMovement.warehouse_id,
+        InvStockMovement.item_id,
+        InvStockMovement.movement_date,
+        InvStockMovement.voucher_id,
+        InvStockMovement.kind,
+        InvStockMovement.qty,
+    ).filter(InvStockMovement.movement_date <= upto)
+    if after:
+        q = q.filter(InvStockMovement.movement_date > after)
+    if warehouse_id:
+        q = q.filter(InvStockMovement.warehouse_id == int(warehouse_id))
+    if item_id:
+        q = q.filter(InvStockMovement.item_id == int(item_id))
+
+    stocktakes: dict[tuple[int, int], dict] = {}
+    deltas: dict[tuple[int, int], list[tuple[str, float]]] = {}
+    for wh, it, d, vid, kind, qty in q.all():
+        k = (int(wh), int(it))
+        if kind == KIND_STOCKTAKE:
+            cand = (str(d), int(vid))
+            st = stocktakes.get(k)
+            if st is None or cand > st["key"]:
+                stocktakes[k] = {"key": cand, "qty": float(qty or 0)}
+            elif cand == st["key"]:
+                st["qty"] += float(qty or 0)
+        else:
+            deltas.setdefault(k, []).append((str(d), float(qty or 0)))
+
+    out = dict(base)
+    for k in set(stocktakes) | set(deltas):
+        st = stocktakes.get(k)
+        if st:
+            st_date = st["key"][0]
+            out[k] = st["qty"] + sum(q for d, q in deltas.get(k, []) if d > st_date)
+        else:
+            out[k] = out.get(k, 0.0) + sum(q for _d, q in deltas.get(k, []))
+    return out
+
+
+def _load_snapshot(period: str, warehouse_id: int | None = None, item_id: int | None = None) -> dict[tuple[int, int], float]:
+    q = InvBalanceSnapshot.query.filter(InvBalanceSnapshot.period == period)
+    if warehouse_id:
+        q = q.filter(InvBalanceSnapshot.warehouse_id == int(warehouse_id))
+    out = {}
+    for snap in q.all():
+        try:
+            data = json.loads(snap.data or "{}")
+        except Exception:
+            data = {}
+        if item_id:
+            qty = data.get(str(int(item_id)))
+            if qty is not None:
+                out[(int(snap.warehouse_id), int(item_id))] = float(qty)
+            continue
+        for it, qty in data.items():
+            out[(int(snap.warehouse_id), int(it))] = float(qty)
+    return out
+
+
+def _latest_snapshot_period(as_of: str) -> str | None:
+    """Latest snapshot period whose month-end is on/before `as_of`."""
+    cur = _period_of(as_of)
+    period = (
+        db.session.query(func.max(InvBalanceSnapshot.period))
+        .filter(InvBalanceSnapshot.period <= cur)
+        .scalar()
+    )
+    if period and period == cur and as_of < _period_end(period):
+        period = (
+            db.session.query(func.max(InvBalanceSnapshot.period))
+            .filter(InvBalanceSnapshot.period < cur)
+            .scalar()
+        )
+    return period
+
+
+def balances_as_of(as_of: str, warehouse_id: int | None = None, item_id: int | None = None) -> dict[tuple[int, int], float]:
+    """Balances per (warehouse_id, item_id) at the end of day `as_of` (YYYY-MM-DD).
+
+    Starts from the nearest month-end snapshot and replays only the delta after it.
+    """
+    as_of = str(as_of)[:10]
+    period = _latest_snapshot_period(as_of)
+    if period:
+        base = _load_snapshot(period, warehouse_id, item_id)
+        after = _period_end(period)
+        if after >= as_of:
+            return base
+        return _replay(base, after, as_of, warehouse_id, item_id)
+    return _replay({}, None, as_of, warehouse_id, item_id)
+
+
+def _period_flows(after: str | None, upto: str) -> dict[int, dict[str, dict]]:
+    """Per warehouse: {voucher_type: {"qty", "vouchers"}} for ledger rows dated in (after, upto].
+
+    Transfer-in rows are skipped (the transfer is counted once, on the issuing warehouse);
+    issue/scrap quantities are reported positive, like the voucher lines.
+    """
+    q = db.session.query(
+        InvStockMovement.warehouse_id,
+        InvStockMovement.voucher_type,
+        func.sum(InvStockMovement.qty),
+        func.count(func.distinct(InvStockMovement.voucher_id)),
+    ).filter(
+        InvStockMovement.movement_date <= upto,
+        InvStockMovement.kind != "TRANSFER_IN",
+    )
+    if after:
+        q = q.filter(InvStockMovement.movement_date > after)
+
+    out: dict[int, dict[str, dict]] = {}
+    for wh, vtype, qty, vouchers in q.group_by(InvStockMovement.warehouse_id, InvStockMovement.voucher_type).all():
+        out.setdefault(int(wh), {})[str(vtype)] = {
+            "qty": round(abs(float(qty or 0)), 6),
+            "vouchers": int(vouchers or 0),
+        }
+    return out
+
+
+def _add_flows(acc: dict[str, dict], flows: dict[str, dict]) -> None:
+    for vtype, f in (flows or {}).items():
+        cur = acc.setdefault(vtype, {"qty": 0.0, "vouchers": 0})
+        cur["qty"] += float(f.get("qty") or 0)
+        cur["vouchers"] += int(f.get("vouchers") or 0)
+
+
+def yearly_flows(year: str = "") -> dict[str, dict[str, dict]]:
+    """{year: {voucher_type: {"qty", "vouchers"}}} from the month-end snapshots' flows.
+
+    Only ledger rows after the last snapshot are aggregated directly, so the cost does
+    not grow with the voucher history. `year` ("YYYY") limits the result to one year.
+    """
+    year = (year or "").strip()[:4]
+    out: dict[str, dict[str, dict]] = {}
+
+    last = db.session.query(func.max(InvBalanceSnapshot.period)).scalar()
+    if last:
+        q = db.session.query(InvBalanceSnapshot.period, InvBalanceSnapshot.flows)
+        if year:
+            q = q.filter(InvBalanceSnapshot.period >= f"{year}-01", InvBalanceSnapshot.period <= f"{year}-12")
+        for period, flows in q.all():
+            try:
+                data = json.loads(flows or "{}")
+            except Exception:
+                data = {}
+            if data:
+                _add_flows(out.setdefault(str(period)[:4], {}), data)
+
+    after = _period_end(last) if last else None
+    if year:
+        if after and after >= f"{year}-12-31":
+            return out
+        first = f"{year}-01-01"
+        # (after, upto] with `after` the day before the year starts when no snapshot covers it
+        if not after or after < first:
+            after = f"{int(year) - 1}-12-31"
+        upto = f"{year}-12-31"
+    else:
+        upto = "9999-12-31"
+
+    q = db.session.query(
+        func.substr(InvStockMovement.movement_date, 1, 4),
+        InvStockMovement.voucher_type,
+        func.sum(InvStockMovement.qty),
+        func.count(func.distinct(InvStockMovement.voucher_id)),
+    ).filter(
+        InvStockMovement.movement_date <= upto,
+        InvStockMovement.kind != "TRANSFER_IN",
+    )
+    if after:
+        q = q.filter(InvStockMovement.movement_date > after)
+    rows = q.group_by(func.substr(InvStockMovement.movement_date, 1, 4), InvStockMovement.voucher_type).all()
+    for y, vtype, qty, vouchers in rows:
+        if not y:
+            continue
+        _add_flows(out.setdefault(str(y), {}), {
+            str(vtype): {"qty": abs(float(qty or 0)), "vouchers": int(vouchers or 0)},
+        })
+    return out
+
+
+def build_monthly_snapshots(upto_period: str | None = None) -> int:
+    """Write missing month-end snapshots up to `upto_period` (default: last completed month). No commit.
+
+    Each month is produced from the previous snapshot + that month's ledger rows only,
+    together with that month's per-voucher-type flow totals. Returns the number of periods written.
+    """
+    if not upto_period:
+        today = datetime.utcnow().date()
+        upto_period = f"{today.year - 1}-12" if today.month == 1 else f"{today.year}-{today.month - 1:02d}"
+
+    last = db.session.query(func.max(InvBalanceSnapshot.period)).scalar()
+    if last:
+        state = _load_snapshot(last)
+        period = _next_period(last)
+        after = _period_end(last)
+    else:
+        first = db.session.query(func.min(InvStockMovement.movement_date)).scalar()
+        if not first:
+            return 0
+        state = {}
+        period = _period_of(first)
+        after = None
+
+    written = 0
+    now = datetime.utcnow()
+    while period <= upto_period:
+        end = _period_end(period)
+        state = _replay(state, after, end)
+        flows = _period_flows(after, end)
+
+        per_wh: dict[int, dict[str, float]] = {}
+        for (wh, it), qty in state.items():
+            if abs(qty) < _EPS:
+                continue
+            per_wh.setdefault(wh, {})[str(it)] = round(float(qty), 6)
+
+        rows = [
+            {
+                "period": period,
+                "warehouse_id": wh,
+                "data": json.dumps(per_wh.get(wh, {}), separators=(",", ":")),
+                "item_count": len(per_wh.get(wh, {})),
+                "total_qty": float(sum(per_wh.get(wh, {}).values())),
+                "flows": json.dumps(flows[wh], separators=(",", ":")) if wh in flows else None,
+                "created_at": now,
+            }
+            for wh in sorted(set(per_wh) | set(flows))
+        ]
+        if rows:
+            db.session.execute(insert(InvBalanceSnapshot), rows)
+        written += 1
+
+        after = end
+        period = _next_period(period)
+
+    db.session.flush()
+    return written
+
+
+# ----------------------
+# Full recomputation / rebuild
+# ----------------------
+
+def compute_balances_from_vouchers() -> dict[tuple[int, int], float]:
+    """Legacy full recomputation over all voucher lines (used to verify the ledger)."""
+    balances: dict[tuple[int, int], float] = {}
+
+    baseline_key: dict[tuple[int, int], tuple[str, int]] = {}
+    baseline_qty: dict[tuple[int, int], float] = {}
+
+    st_rows = (
+        db.session.query(
+            InvStocktakeVoucher.warehouse_id,
+            InvStocktakeVoucherLine.item_id,
+            InvStocktakeVoucher.voucher_date,
+            InvStocktakeVoucher.id,
+            func.sum(InvStocktakeVoucherLine.qty),
+        )
+        .join(InvStocktakeVoucherLine, InvStocktakeVoucherLine.voucher_id == InvStocktakeVoucher.id)
+        .group_by(
+            InvStocktakeVoucher.warehouse_id,
+            InvStocktakeVoucherLine.item_id,
+            InvStocktakeVoucher.voucher_date,
+            InvStocktakeVoucher.id,
+        )
+        .all()
+    )
+    for wh_id, item_id, v_date, v_id, s in st_rows:
+        if not wh_id or not item_id or not v_date:
+            continue
+        k = (int(wh_id), int(item_id))
+        cand = (str(v_date), int(v_id))
+        prev = baseline_key.get(k)
+        if prev is None or cand > prev:
+            baseline_key[k] = cand
+            baseline_qty[k] = float(s or 0)
+
+    for k, qty in baseline_qty.items():
+        balances[k] = float(qty or 0)
+
+    def _add(wh_id, item_id, v_date, delta: float):
+        if not wh_id or not item_id or not v_date:
+            return
+        k = (int(wh_id), int(item_id))
+        bk = baseline_key.get(k)
+        if bk and not (str(v_date) > bk[0]):
+            return
+        balances[k] = balances.get(k, 0.0) + float(delta or 0)
+
+    for v_model, l_model in (
+        (InvInboundVoucher, InvInboundVoucherLine),
+        (InvReturnVoucher, InvReturnVoucherLine),
+    ):
+        rows = (
+            db.session.query(v_model.to_warehouse_id, l_model.item_id, v_model.voucher_date, func.sum(l_model.qty))
+            .join(l_model, l_model.voucher_id == v_model.id)
+            .group_by(v_model.to_warehouse_id, l_model.item_id, v_model.voucher_date)
+            .all()
+        )
+        for wh_id, item_id, v_date, s in rows:
+            _add(wh_id, item_id, v_date, float(s or 0))
+
+    issue_rows = (
+        db.session.query(
+            InvIssueVoucher.issue_kind,
+            InvIssueVoucher.from_warehouse_id,
+            InvIssueVoucher.to_warehouse_id,
+            InvIssueVoucher.voucher_date,
+            InvIssueVoucherLine.item_id,
+            func.sum(InvIssueVoucherLine.qty),
+        )
+        .join(InvIssueVoucherLine, InvIssueVoucherLine.voucher_id == InvIssueVoucher.id)
+        .group_by(
+            InvIssueVoucher.issue_kind,
+            InvIssueVoucher.from_warehouse_id,
+            InvIssueVoucher.to_warehouse_id,
+            InvIssueVoucher.voucher_date,
+            InvIssueVoucherLine.item_id,
+        )
+        .all()
+    )
+    for kind, from_wh, to_wh, v_date, item_id, s in issue_rows:
+        qty = float(s or 0)
+        _add(from_wh, item_id, v_date, -qty)
+        if (kind or "").upper() == "WAREHOUSE" and to_wh:
+            _add(to_wh, item_id, v_date, qty)
+
+    scrap_rows = (
+        db.session.query(InvScrapVoucher.from_warehouse_id, InvScrapVoucherLine.item_id, InvScrapVoucher.voucher_date, func.sum(InvScrapVoucherLine.qty))
+        .join(InvScrapVoucherLine, InvScrapVoucherLine.voucher_id == InvScrapVoucher.id)
+        .group_by(InvScrapVoucher.from_warehouse_id, InvScrapVoucherLine.item_id, InvScrapVoucher.voucher_date)
+        .all()
+    )
+    for wh_id, item_id, v_date, s in scrap_rows:
+        _add(wh_id, item_id, v_date, -float(s or 0))
+
+    return balances
+
+
+def _balances_from_movements(rows: list[dict]) -> dict[tuple[int, int], dict]:
+    """Fold ledger rows into InvBalance column values (single pass, used by rebuild)."""
+    base: dict[tuple[int, int], dict] = {}
+    for r in rows:
+        if r["kind"] != KIND_STOCKTAKE:
+            continue
+        k = (r["warehouse_id"], r["item_id"])
+        cand = (r["movement_date"], r["voucher_id"])
+        b = base.get(k)
+        if b is None or cand > b["key"]:
+            base[k] = {"key": cand, "qty": r["qty"]}
+        elif cand == b["key"]:
+            b["qty"] += r["qty"]
+
+    out: dict[tuple[int, int], dict] = {}
+    for k, b in base.items():
+        out[k] = {
+            "warehouse_id": k[0],
+            "item_id": k[1],
+            "qty": float(b["qty"]),
+            "baseline_date": b["key"][0],
+            "baseline_voucher_id": int(b["key"][1]),
+            "baseline_qty": float(b["qty"]),
+        }
+
+    for r in rows:
+        if r["kind"] == KIND_STOCKTAKE:
+            continue
+        k = (r["warehouse_id"], r["item_id"])
+        cur = out.get(k)
+        if cur is None:
+            cur = out[k] = {
+                "warehouse_id": k[0], "item_id": k[1], "qty": 0.0,
+                "baseline_date": None, "baseline_voucher_id": None, "baseline_qty": None,
+            }
+        if (not cur["baseline_date"]) or (r["movement_date"] > cur["baseline_date"]):
+            cur["qty"] += float(r["qty"])
+    return out
+
+
+def verify_ledger(tolerance: float = 1e-6) -> list[dict]:
+    """Compare InvBalance against the full voucher recomputation. Returns mismatches."""
+    expected = compute_balances_from_vouchers()
+    actual = balances_map()
+    mismatches = []
+    for k in sorted(set(expected) | set(actual)):
+        e = float(expected.get(k, 0.0))
+        a = float(actual.get(k, 0.0))
+        if abs(e - a) > tolerance:
+            mismatches.append({"warehouse_id": k[0], "item_id": k[1], "expected": e, "actual": a})
+    return mismatches
+
+
+def rebuild_ledger(verify: bool = True) -> dict:
+    """Rebuild InvStockMovement + InvBalance from all vouchers. No commit.
+
+    Returns {"movements", "balances", "mismatches"}.
+    """
+    now = datetime.utcnow()
+    rows: list[dict] = []
+    for voucher_type, (v_model, l_model) in VOUCHER_MODELS.items():
+        pairs = (
+            db.session.query(v_model, l_model.id, l_model.item_id, l_model.qty)
+            .join(l_model, l_model.voucher_id == v_model.id)
+            .order_by(v_model.id.asc(), l_model.id.asc())
+            .all()
+        )
+        for v, line_id, item_id, qty in pairs:
+            for r in _voucher_movements(voucher_type, v, item_id, qty, line_id):
+                r["created_at"] = now
+                rows.append(r)
+
+    InvStockMovement.query.delete(synchronize_session=False)
+    InvBalance.query.delete(synchronize_session=False)
+    InvBalanceSnapshot.query.delete(synchronize_session=False)
+
+    if rows:
+        db.session.execute(insert(InvStockMovement), rows)
+
+    bal_rows = list(_balances_from_movements(rows).values())
+    for b in bal_rows:
+        b["updated_at"] = now
+    if bal_rows:
+        db.session.execute(insert(InvBalance), bal_rows)
+
+    db.session.flush()
+    return {
+        "movements": len(rows),
+        "balances": len(bal_rows),
+        "mismatches": verify_ledger() if verify else [],
+    }
+
+
+def ensure_ledger_seeded() -> bool:
+    """One-time backfill for databases created before the ledger existed (commits)."""
+    if db.session.query(InvStockMovement.id).first() is not None:
+        return False
+    has_vouchers = any(
+        db.session.query(v_model.id).first() is not None
+        for v_model, _ in VOUCHER_MODELS.values()
+    )
+    if not has_vouchers:
+        return False
+    rebuild_ledger(verify=False)
+    db.session.commit()
+    return True
@@ -0,0 +1,635 @@
+# services/payslip_import.py
+"""Bulk payslip import: single PDFs, ZIP archives and combined multi-page PDFs.
+
+The upload request only stores the files under instance/payslip_imports/<dir>
+and queues a PayslipImportBatch; a background worker does the rest:
+
+SCAN - every source is mapped to employees:
+  - NNNN.pdf (file name = employee number) -> the whole file;
+  - a ZIP -> each *.pdf member the same way (copied, never re-encoded);
+  - any other PDF (e.g. payroll's one 3,000-page file) is split by page: the
+    employee number is read from each page's text (PyPDF2) through
+    PAYSLIP_EMP_NO_PATTERN (a regex with one group). Only with the
+    PAYSLIP_UNLABELLED_MATCH setting on does a page without a labelled match
+    fall back to the only known employee number on it; those slips get a
+    review note and are listed in the batch notes. Pages without a match are
+    skipped and reported, or - with continue_pages, and if they carry no
+    labelled number - belong to the previous page's employee (multi-page
+    slips).
+SAVE - one PDF per employee (parts merged: whole files, then pages) goes to the
+  employee's upload dir and the month's PAYSLIP attachment is created or
+  replaced as a DRAFT; rows are committed every SAVE_BATCH employees together
+  with the batch's progress.
+
+Employee numbers are matched against an index loaded once per batch
+(normalized: trimmed, format characters removed, Arabic-Indic digits folded;
+zero-padded numbers also match when that is unambiguous), and the month's
+existing attachments are loaded in one query - no per-file lookups.
+
+One worker thread per process; without it (scripts) submit() runs inline.
+Batches left QUEUED, or RUNNING without a heartbeat for STALE_MINUTES, are
+re-queued when the worker starts. A FAILED batch keeps its uploaded files so
+retry() can queue it again; they are removed once a batch is DONE.
+"""
+
+import io
+import logging
+import queue
+import re
+import shutil
+import threading
+import unicodedata
+import uuid
+import zipfile
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from flask import current_app
+from sqlalchemy import or_, select, update
+
+from extensions import db
+from models import EmployeeAttachment, EmployeeFile, PayslipImportBatch
+from services import settings_service
+
+logger = logging.getLogger(__name__)
+
+SOURCES_DIRNAME = "payslip_imports"
+EXTRACTED_DIRNAME = "_extracted"  # ZIP members that must be split by page
+SAVE_BATCH = 100
+PROGRESS_EVERY = 50     # scanned pages / files between progress commits
+MAX_NOTES = 200
+STALE_MINUTES = 15
+MAX_MEMBER_BYTES = 512 * 1024 * 1024
+REVIEW_NOTE = "مطابقة دون عنوان الرقم الوظيفي - يرجى المراجعة قبل الإرسال"
+
+DEFAULT_EMP_NO_PATTERN = r"(?:الرقم\s*الوظيفي|رقم\s*الموظف|Employee\s*(?:No|Number|#)\.?)\s*[:：#]?\s*([0-9٠-٩۰-۹]+)"
+
+ACTIVE_STATUSES = ("QUEUED", "RUNNING")
+
+_DIGITS = str.maketrans("٠١٢٣٤٥٦٧٨٩۰۱۲۳۴۵۶۷۸۹", "01234567890123456789")
+_NUMBER_RE = re.compile(r"[0-9٠-٩۰-۹]+")
+
+_STOP = object()
+
+_queue: queue.Queue | None = None
+_thread: threading.Thread | None = None
+
+
+# -------------------------
+# Employee numbers
+# -------------------------
+
+def normalize_emp_no(value) -> str:
+    s = str(value or "")
+    s = "".join(ch for ch in s if unicodedata.category(ch) != "Cf")
+    return s.translate(_DIGITS).strip()
+
+
+def emp_no_from_filename(filename: str) -> str:
+    """12345.pdf / 12345_name.pdf / 12345 - x.pdf -> "12345" (first number of the first token)."""
+    stem = normalize_emp_no(Path(filename or "").stem)
+    stem = re.split(r"[\s_\-]+", stem)[0].strip()
+    m = re.search(r"(\d+)", stem)
+    return m.group(1) if m else stem
+
+
+def load_employee_index() -> dict:
+    """{normalized employee_no: user_id} for every employee file, in one query.
+
+    Numeric keys are also indexed without leading zeros unless two employees
+    would collide there; on exact duplicates the lowest user id wins.
+    """
+    rows = db.session.execute(
+        select(EmployeeFile.employee_no, EmployeeFile.user_id)
+        .where(EmployeeFile.employee_no.isnot(None))
+        .order_by(EmployeeFile.user_id.asc())
+    ).all()
+    exact: dict[str, int] = {}
+    for emp_no, user_id in rows:
+        key = normalize_emp_no(emp_no)
+        if key and user_id:
+            exact.setdefault(key, int(user_id))
+
+    stripped: dict[str, int | None] = {}
+    for key, user_id in exact.items():
+        if key.isdigit():
+            short = key.lstrip("0") or "0"
+            if short != key:
+                stripped[short] = user_id if stripped.get(short, user_id) == user_id else None
+
+    index = dict(exact)
+    for short, user_id in stripped.items():
+        if user_id is not None and short not in index:
+            index[short] = user_id
+    return index
+
+
+def _lookup(index: dict, emp_no: str) -> int | None:
+    if not emp_no:
+        return None
+    user_id = index.get(emp_no)
+    if user_id is None and emp_no.isdigit():
+        user_id = index.get(emp_no.lstrip("0") or "0")
+    return user_id
+
+
+def _emp_no_pattern():
+    raw = (settings_service.get_str("PAYSLIP_EMP_NO_PATTERN") or "").strip() or DEFAULT_EMP_NO_PATTERN
+    try:
+        return re.compile(raw)
+    except re.error:
+        logger.warning("invalid PAYSLIP_EMP_NO_PATTERN, using the default")
+        return re.compile(DEFAULT_EMP_NO_PATTERN)
+
+
+def match_page_text(text: str, index: dict, pattern, unlabelled: bool = False) -> tuple[int | None, bool]:
+    """(user_id, needs_review) for a page's text.
+
+    The labelled number wins; with `unlabelled`, a page without one falls back
+    to the only known number on it, and the match needs review.
+    """
+    text = text or ""
+    for m in pattern.finditer(text):
+        user_id = _lookup(index, normalize_emp_no(m.group(1) if m.groups() else m.group(0)))
+        if user_id is not None:
+            return user_id, False
+    if not unlabelled:
+        return None, False
+    found = set()
+    for m in _NUMBER_RE.finditer(text):
+        user_id = _lookup(index, normalize_emp_no(m.group(0)))
+        if user_id is not None:
+            found.add(user_id)
+            if len(found) > 1:
+                return None, False
+    return (found.pop(), True) if found else (None, False)
+
+
+# -------------------------
+# Files
+# -------------------------
+
+def _sources_root() -> Path:
+    return Path(current_app.instance_path) / SOURCES_DIRNAME
+
+
+def _source_dir(batch: PayslipImportBatch) -> Path:
+    return _sources_root() / batch.source_dir
+
+
+def _employee_dir(user_id: int) -> Path:
+    # same layout as portal.routes._employee_upload_dir
+    base = Path(current_app.instance_path) / "uploads" / "employees" / str(user_id)
+    base.mkdir(parents=True, exist_ok=True)
+    return base
+
+
+def _is_pdf(name: str) -> bool:
+    return normalize_emp_no(Path(name or "").suffix).lower() == ".pdf"
+
+
+def _is_zip(name: str) -> bool:
+    return normalize_emp_no(Path(name or "").suffix).lower() == ".zip"
+
+
+# -------------------------
+# Submit
+# -------------------------
+
+def submit(files, year: int, month: int, user_id: int | None = None, continue_pages: bool = False) -> PayslipImportBatch | None:
+    """Store the uploaded FileStorage objects and queue a batch; None when nothing usable was uploaded."""
+    token = uuid.uuid4().hex
+    dirp = _sources_root() / token
+    names = []
+    for i, f in enumerate(files or []):
+        original = Path(getattr(f, "filename", "") or "").name
+        if not original:
+            continue
+        dirp.mkdir(parents=True, exist_ok=True)
+        # keep the original name (employee number) after a collision-proof prefix
+        f.save(dirp / f"{i:05d}__{original}")
+        names.append(original)
+    if not names:
+        return None
+
+    batch = PayslipImportBatch(
+        payslip_year=int(year),
+        payslip_month=int(month),
+        source_dir=token,
+        source_names="\n".join(names),
+        continue_pages=bool(continue_pages),
+        status="QUEUED",
+        imported_by_id=user_id,
+    )
+    db.session.add(batch)
+    db.session.commit()
+
+    if is_running():
+        _queue.put(batch.id)
+    else:
+        run_batch(batch.id)
+        db.session.refresh(batch)
+    return batch
+
+
+# -------------------------
+# Run
+# -------------------------
+
+class _Progress:
+    """Counters + notes for one batch; flushed onto the row with each commit."""
+
+    def __init__(self, batch: PayslipImportBatch):
+        self.batch = batch
+        self.notes: list[str] = []
+        self.note_count = 0
+        self.review: set[int] = set()  # user ids matched without a labelled number
+
+    def note(self, msg: str):
+        self.note_count += 1
+        if len(self.notes) < MAX_NOTES:
+            self.notes.append(msg)
+
+    def stage(self, stage: str, total: int):
+        self.batch.stage = stage
+        self.batch.total_items = total
+        self.batch.processed_items = 0
+        self.flush()
+
+    def step(self, every: int = PROGRESS_EVERY) -> bool:
+        """Count one item; commit every `every` items (returns True when it committed)."""
+        self.batch.processed_items += 1
+        if self.batch.processed_items % every == 0:
+            self.flush()
+            return True
+        return False
+
+    def flush(self):
+        lines = list(self.notes)
+        if self.note_count > len(lines):
+            lines.append(f"... و {self.note_count - len(lines)} ملاحظة أخرى")
+        self.batch.errors = "\n".join(lines) or None
+        self.batch.heartbeat_at = datetime.utcnow()
+        db.session.commit()
+
+
+def _pdf_reader(source):
+    from PyPDF2 import PdfReader
+
+    reader = PdfReader(source if hasattr(source, "read") else str(source))
+    if reader.is_encrypted:
+        reader.decrypt("")
+    return reader
+
+
+def _scan_pages(path: Path, label: str, reader, parts: dict, index: dict, pattern, progress: _Progress, continue_pages: bool, unlabelled: bool):
+    original = f"payslip-{progress.batch.payslip_year:04d}-{progress.batch.payslip_month:02d}.pdf"
+    current = None
+    missing = []
+    for i, page in enumerate(reader.pages):
+        try:
+            text = page.extract_text() or ""
+        except Exception:
+            text = ""
+        user_id, needs_review = match_page_text(text, index, pattern, unlabelled)
+        if needs_review:
+            progress.review.add(user_id)
+        # a labelled but unknown number is someone else's slip, never a continuation
+        if user_id is None and continue_pages and not pattern.search(text):
+            user_id = current
+        if user_id is None:
+            missing.append(i + 1)
+        else:
+            parts.setdefault(user_id, []).append((path, i, f"{label} ص{i + 1}", original))
+        current = user_id
+        progress.step()
+    if missing:
+        pages = ", ".join(str(p) for p in missing[:30]) + (" ..." if len(missing) > 30 else "")
+        progress.batch.skipped += len(missing)
+        progress.note(f"{label}: {len(missing)} صفحة بلا رقم وظيفي معروف (الصفحات: {pages}).")
+
+
+def _scan(batch: PayslipImportBatch, index: dict, progress: _Progress, readers: dict) -> dict:
+    """{user_id: [(source, page_index | None, label, original_name), ...]}.
+
+    Whole files come first, then split pages in page order.
+    """
+    dirp = _source_dir(batch)
+    pattern = _emp_no_pattern()
+    unlabelled = settings_service.get_bool("PAYSLIP_UNLABELLED_MATCH", False)
+    extracted = dirp / EXTRACTED_DIRNAME
+    shutil.rmtree(extracted, ignore_errors=True)  # left over by an interrupted run
+
+    whole, split = [], []
+    for path in sorted(p for p in dirp.iterdir() if p.is_file()) if dirp.exists() else []:
+        original = path.name.split("__", 1)[-1]
+        if _is_zip(original):
+            try:
+                with zipfile.ZipFile(path) as zf:
+                    for k, m in enumerate(zf.infolist()):
+                        if m.is_dir() or m.filename.startswith("__MACOSX/"):
+                            continue
+                        name = Path(m.filename).name
+                        label = f"{original}/{name}"
+                        if not _is_pdf(name):
+                            batch.skipped += 1
+                            progress.note(f"{label}: ليس ملف PDF.")
+                            continue
+                        if m.file_size > MAX_MEMBER_BYTES:
+                            batch.skipped += 1
+                            progress.note(f"{label}: الملف أكبر من الحد المسموح.")
+                            continue
+                        user_id = _lookup(index, emp_no_from_filename(name))
+                        if user_id is not None:
+                            whole.append((user_id, (path, m.filename), label, name))
+                            continue
+                        # no employee number in the name: extract, then split by page text
+                        extracted.mkdir(exist_ok=True)
+                        out = extracted / f"{path.name}.{k:05d}.pdf"
+                        with zf.open(m) as src, open(out, "wb") as dst:
+                            shutil.copyfileobj(src, dst)
+                        split.append((out, label))
+            except zipfile.BadZipFile:
+                batch.skipped += 1
+                progress.note(f"{original}: ملف ZIP تالف.")
+        elif _is_pdf(original):
+            user_id = _lookup(index, emp_no_from_filename(original))
+            if user_id is not None:
+                whole.append((user_id, (path, None), original, original))
+            else:
+                split.append((path, original))
+        else:
+            batch.skipped += 1
+            progress.note(f"{original}: يجب أن يكون الملف PDF أو ZIP.")
+
+    total_pages = 0
+    for path, label in split:
+        try:
+            readers[path] = _pdf_reader(path)
+            total_pages += len(readers[path].pages)
+        except Exception as exc:
+            readers.pop(path, None)
+            batch.skipped += 1
+            progress.note(f"{label}: تعذرت قراءة ملف PDF ({type(exc).__name__}).")
+
+    parts: dict[int, list] = {}
+    progress.stage("SCAN", len(whole) + total_pages)
+    for user_id, source, label, original in whole:
+        parts.setdefault(user_id, []).append((source, None, label, original))
+        progress.step()
+    for path, label in split:
+        if path not in readers:
+            continue
+        try:
+            _scan_pages(path, label, readers[path], parts, index, pattern, progress, batch.continue_pages, unlabelled)
+        except Exception as exc:
+            batch.skipped += 1
+            progress.note(f"{label}: تعذرت قراءة ملف PDF ({type(exc).__name__}).")
+    progress.flush()
+    return parts
+
+
+def _write_pdf(items: list, dest: Path, readers: dict):
+    """One whole file is copied as-is; anything else is merged page by page."""
+    if len(items) == 1 and items[0][1] is None:
+        (path, member), _, _, _ = items[0]
+        if member is None:
+            shutil.copyfile(path, dest)
+        else:
+            with zipfile.ZipFile(path) as zf, zf.open(member) as src, open(dest, "wb") as dst:
+                shutil.copyfileobj(src, dst)
+        return
+
+    from PyPDF2 import PdfWriter
+
+    writer = PdfWriter()
+    for source, page_index, _, _ in items:
+        if page_index is None:
+            path, member = source
+            if member is None:
+                reader = _pdf_reader(path)
+            else:
+                with zipfile.ZipFile(path) as zf:
+                    reader = _pdf_reader(io.BytesIO(zf.read(member)))
+            for page in reader.pages:
+                writer.add_page(page)
+        else:
+            reader = readers.get(source)
+            if reader is None:
+                reader = readers[source] = _pdf_reader(source)
+            writer.add_page(reader.pages[page_index])
+    with open(dest, "wb") as fh:
+        writer.write(fh)
+
+
+def _save(batch: PayslipImportBatch, parts: dict, progress: _Progress, readers: dict):
+    year, month = batch.payslip_year, batch.payslip_month
+    existing = {}
+    for att in (
+        EmployeeAttachment.query
+        .filter(EmployeeAttachment.attachment_type == "PAYSLIP")
+        .filter(EmployeeAttachment.payslip_year == year)
+        .filter(EmployeeAttachment.payslip_month == month)
+        .order_by(EmployeeAttachment.id.asc())
+    ):
+        existing.setdefault(att.user_id, att)
+
+    progress.stage("SAVE", len(parts))
+    replaced: list[Path] = []
+    now = datetime.utcnow()
+    for user_id, items in parts.items():
+        label = items[0][2] if len(items) == 1 else f"{items[0][2]} (+{len(items) - 1})"
+        dirp = _employee_dir(user_id)
+        stored = f"{uuid.uuid4().hex}.pdf"
+        try:
+            _write_pdf(items, dirp / stored, readers)
+        except Exception as exc:
+            batch.skipped += 1
+            progress.note(f"{label}: تعذر حفظ الملف ({type(exc).__name__}: {exc}).")
+            if progress.step(every=SAVE_BATCH):
+                replaced = _unlink(replaced)
+            continue
+
+        original = items[0][3]
+        att = existing.get(user_id)
+        if att is not None:
+            if att.stored_name:
+                replaced.append(dirp / att.stored_name)
+            att.original_name = original
+            att.stored_name = stored
+            att.uploaded_by_id = batch.imported_by_id
+            att.uploaded_at = now
+        else:
+            att = EmployeeAttachment(
+                user_id=user_id,
+                attachment_type="PAYSLIP",
+                original_name=original,
+                stored_name=stored,
+                payslip_year=year,
+                payslip_month=month,
+                uploaded_by_id=batch.imported_by_id,
+                uploaded_at=now,
+            )
+            db.session.add(att)
+            existing[user_id] = att
+        if user_id in progress.review:
+            att.note = REVIEW_NOTE
+            progress.note(f"{label}: {REVIEW_NOTE}.")
+        else:
+            att.note = None
+        # Draft by default (not visible to employee until sent)
+        att.is_published = False
+        att.published_at = None
+        att.published_by_id = None
+        batch.saved += 1
+
+        if progress.step(every=SAVE_BATCH):
+            replaced = _unlink(replaced)
+    progress.flush()
+    _unlink(replaced)
+
+
+def _unlink(paths: list) -> list:
+    """Remove replaced payslip files (after the commit that stopped referencing them)."""
+    for fp in paths:
+        try:
+            if fp.exists():
+                fp.unlink()
+        except OSError:
+            pass
+    return []
+
+
+def run_batch(batch_id: int) -> bool:
+    """Claim and run one QUEUED batch in the current app context; False if not claimed or failed."""
+    now = datetime.utcnow()
+    claimed = db.session.execute(
+        update(PayslipImportBatch)
+        .where(PayslipImportBatch.id == batch_id, PayslipImportBatch.status == "QUEUED")
+        .values(status="RUNNING", started_at=now, heartbeat_at=now, error=None,
+                saved=0, skipped=0, errors=None, processed_items=0, total_items=0)
+    ).rowcount
+    db.session.commit()
+    if not claimed:
+        return False
+
+    batch = db.session.get(PayslipImportBatch, batch_id)
+    progress = _Progress(batch)
+    try:
+        readers: dict = {}
+        parts = _scan(batch, load_employee_index(), progress, readers)
+        _save(batch, parts, progress, readers)
+    except Exception as exc:
+        db.session.rollback()
+        logger.exception("payslip import %s failed", batch_id)
+        batch = db.session.get(PayslipImportBatch, batch_id)
+        batch.status = "FAILED"
+        batch.error = f"{type(exc).__name__}: {exc}"[:2000]
+        batch.finished_at = datetime.utcnow()
+        db.session.commit()
+        # sources stay on disk so the batch can be retried
+        return False
+
+    batch.status = "DONE"
+    batch.finished_at = datetime.utcnow()
+    progress.flush()
+    _remove_sources(batch)
+    return True
+
+
+def retry(batch_id: int) -> bool:
+    """Queue a FAILED batch again (its uploaded files are still on disk); False if it can't be."""
+    batch = db.session.get(PayslipImportBatch, batch_id)
+    if batch is None or batch.status != "FAILED" or not _source_dir(batch).is_dir():
+        return False
+    claimed = db.session.execute(
+        update(PayslipImportBatch)
+        .where(PayslipImportBatch.id == batch_id, PayslipImportBatch.status == "FAILED")
+        .values(status="QUEUED", finished_at=None)
+    ).rowcount
+    db.session.commit()
+    if not claimed:
+        return False
+    if is_running():
+        _queue.put(batch_id)
+    else:
+        run_batch(batch_id)
+    return True
+
+
+def _remove_sources(batch: PayslipImportBatch):
+    try:
+        shutil.rmtree(_source_dir(batch), ignore_errors=True)
+    except Exception:
+        pass
+
+
+# -------------------------
+# Worker
+# -------------------------
+
+def _run(app, q: queue.Queue):
+    while True:
+        batch_id = q.get()
+        if batch_id is _STOP:
+            break
+        with app.app_context():
+            try:
+                run_batch(batch_id)
+            except Exception:
+                db.session.rollback()
+                logger.exception("payslip import worker error")
+            finally:
+                db.session.remove()
+
+
+def _requeue_unfinished(q: queue.Queue) -> int:
+    stale = datetime.utcnow() - timedelta(minutes=STALE_MINUTES)
+    db.session.execute(
+        update(PayslipImportBatch)
+        .where(PayslipImportBatch.status == "RUNNING")
+        .where(or_(PayslipImportBatch.heartbeat_at.is_(None), PayslipImportBatch.heartbeat_at < stale))
+        .values(status="QUEUED")
+    )
+    db.session.commit()
+    ids = db.session.execute(
+        select(PayslipImportBatch.id)
+        .where(PayslipImportBatch.status == "QUEUED")
+        .order_by(PayslipImportBatch.id)
+    ).scalars().all()
+    for batch_id in ids:
+        q.put(batch_id)
+    return len(ids)
+
+
+def is_running() -> bool:
+    return _queue is not None and _thread is not None and _thread.is_alive()
+
+
+def init_app(app) -> bool:
+    """Start the import worker thread for this process."""
+    global _queue, _thread
+    if is_running():
+        return False
+    q = queue.Queue()
+    with app.app_context():
+        try:
+            _requeue_unfinished(q)
+        except Exception:
+            db.session.rollback()
+    _queue = q
+    _thread = threading.Thread(target=_run, args=(app, q), daemon=True, name="payslip-import")
+    _thread.start()
+    return True
+
+
+def shutdown(timeout: float = 5.0) -> None:
+    """Stop the worker after its current batch (queued ids stay QUEUED in the table)."""
+    global _queue, _thread
+    if _queue is None:
+        return
+    _queue.put(_STOP)
+    if _thread is not None:
+        _thread.join(timeout)
+    _queue = None
+    _thread = None
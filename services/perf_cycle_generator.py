@@ -0,0 +1,302 @@
+# services/perf_cycle_generator.py
+"""Set-based 360° assignment generator for HR performance cycles.
+
+The old per-employee loop resolved the primary unit, manager chain and peers
+with several queries per user. Here the org data is loaded once into plain
+dict indexes, all (evaluatee, evaluator, type) pairs are computed in one pass
+and new rows are bulk-inserted in chunks.
+
+Resolution rules are the same as the portal helpers:
+- primary unit: first is_primary assignment, else the latest assignment
+- manager: OrgUnitManager of the primary unit, then its parents
+  (TEAM -> SECTION -> DEPARTMENT -> DIRECTORATE -> ORGANIZATION), then the
+  user's department / directorate; manager first, deputy if the manager is
+  the user
+- peers: other users assigned to the same unit, ordered by name/email
+
+Generation runs in a background thread (one per cycle) and reports progress
+through job_status().
+"""
+
+import threading
+from datetime import datetime
+
+from sqlalchemy import insert
+
+from extensions import db
+from models import (
+    AuditLog,
+    Department,
+    Directorate,
+    HRPerformanceAssignment,
+    HRPerformanceCycle,
+    OrgUnitAssignment,
+    OrgUnitManager,
+    Section,
+    Team,
+    User,
+)
+
+INSERT_CHUNK = 1000
+
+_jobs_lock = threading.Lock()
+_JOBS: dict[int, dict] = {}
+
+
+# -------------------------
+# In-memory org indexes
+# -------------------------
+
+class _OrgIndex:
+    def __init__(self):
+        self.users: dict[int, tuple] = {}          # user_id -> (department_id, directorate_id)
+        self.sort_key: dict[int, tuple] = {}       # user_id -> peer ordering key
+        self.primary_unit: dict[int, tuple] = {}   # user_id -> (unit_type, unit_id)
+        self.unit_members: dict[tuple, list] = {}  # (unit_type, unit_id) -> [user_id, ...]
+        self.parent: dict[tuple, tuple] = {}       # (unit_type, unit_id) -> parent unit
+        self.managers: dict[tuple, tuple] = {}     # (unit_type, unit_id) -> (manager_id, deputy_id)
+
+    @classmethod
+    def load(cls):
+        idx = cls()
+
+        for uid, name, email, dept_id, dir_id in db.session.query(
+            User.id, User.name, User.email, User.department_id, User.directorate_id
+        ).all():
+            uid = int(uid)
+            idx.users[uid] = (int(dept_id) if dept_id else None, int(dir_id) if dir_id else None)
+            # Same order as lower(coalesce(nullif(trim(name), ''), email)), id (NULLs first)
+            label = (name or "").strip() or email
+            idx.sort_key[uid] = (label is not None, (label or "").lower(), uid)
+
+        primary: dict[int, tuple] = {}
+        latest: dict[int, tuple] = {}
+        members: dict[tuple, list] = {}
+        # is_primary desc, id desc == member order used for peers
+        for row_id, uid, ut, unit_id, is_primary in (
+            db.session.query(
+                OrgUnitAssignment.id, OrgUnitAssignment.user_id, OrgUnitAssignment.unit_type,
+                OrgUnitAssignment.unit_id, OrgUnitAssignment.is_primary,
+            )
+            .order_by(OrgUnitAssignment.id.asc())
+            .all()
+        ):
+            if not uid:
+                continue
+            uid = int(uid)
+            key = ((ut or "").upper(), int(unit_id)) if (ut and unit_id) else None
+            if is_primary and uid not in primary:
+                primary[uid] = key
+            latest[uid] = key
+            if key:
+                members.setdefault(key, []).append((bool(is_primary), int(row_id), uid))
+
+        for uid in set(primary) | set(latest):
+            key = primary[uid] if uid in primary else latest.get(uid)
+            if key:
+                idx.primary_unit[uid] = key
+        for key, rows in members.items():
+            rows.sort(key=lambda r: (not r[0], -r[1]))
+            idx.unit_members[key] = [uid for _, _, uid in rows]
+
+        for tid, sid in db.session.query(Team.id, Team.section_id).all():
+            if sid:
+                idx.parent[("TEAM", int(tid))] = ("SECTION", int(sid))
+        for sid, dept_id in db.session.query(Section.id, Section.department_id).all():
+            if dept_id:
+                idx.parent[("SECTION", int(sid))] = ("DEPARTMENT", int(dept_id))
+        for dept_id, dir_id in db.session.query(Department.id, Department.directorate_id).all():
+            if dir_id:
+                idx.parent[("DEPARTMENT", int(dept_id))] = ("DIRECTORATE", int(dir_id))
+        for dir_id, org_id in db.session.query(Directorate.id, Directorate.organization_id).all():
+            if org_id:
+                idx.parent[("DIRECTORATE", int(dir_id))] = ("ORGANIZATION", int(org_id))
+
+        for ut, unit_id, mgr, dep in (
+            db.session.query(
+                OrgUnitManager.unit_type, OrgUnitManager.unit_id,
+                OrgUnitManager.manager_user_id, OrgUnitManager.deputy_user_id,
+            )
+            .order_by(OrgUnitManager.id.asc())
+            .all()
+        ):
+            if ut and unit_id:
+                idx.managers.setdefault((ut, int(unit_id)), (mgr, dep))
+
+        return idx
+
+    def manager_for(self, uid: int):
+        candidates = []
+        unit = self.primary_unit.get(uid)
+        while unit:
+            candidates.append(unit)
+            unit = self.parent.get(unit)
+        dept_id, dir_id = self.users.get(uid, (None, None))
+        if dept_id:
+            candidates.append(("DEPARTMENT", dept_id))
+        if dir_id:
+            candidates.append(("DIRECTORATE", dir_id))
+
+        seen = set()
+        for key in candidates:
+            if key in seen:
+                continue
+            seen.add(key)
+            m = self.managers.get(key)
+            if not m:
+                continue
+            mgr, dep = m
+            if mgr and int(mgr) != uid:
+                return int(mgr) if int(mgr) in self.users else None
+            if dep and int(dep) != uid:
+                return int(dep) if int(dep) in self.users else None
+        return None
+
+    def peers_for(self, uid: int, peer_count: int, exclude: set[int]):
+        if peer_count <= 0:
+            return []
+        unit = self.primary_unit.get(uid)
+        if not unit:
+            return []
+        ids = {p for p in self.unit_members.get(unit, ()) if p not in exclude and p in self.users}
+        return sorted(ids, key=self.sort_key.__getitem__)[:peer_count]
+
+
+def compute_pairs(idx: _OrgIndex, peer_count: int, existing: set[tuple], progress=None):
+    """Return new (evaluatee, evaluator, type) tuples not in `existing`."""
+    out = []
+    total = len(idx.users)
+    for n, uid in enumerate(sorted(idx.users), start=1):
+        pairs = [(uid, uid, "SELF")]
+        mid = idx.manager_for(uid)
+        if mid:
+            pairs.append((uid, mid, "MANAGER"))
+        exclude = {uid} | ({mid} if mid else set())
+        pairs.extend((uid, pid, "PEER") for pid in idx.peers_for(uid, peer_count, exclude))
+
+        for key in pairs:
+            if key not in existing:
+                existing.add(key)
+                out.append(key)
+
+        if progress and (n % 200 == 0 or n == total):
+            progress(n, total)
+    return out
+
+
+def generate_cycle_assignments(cycle_id: int, created_by_id: int | None = None, progress=None) -> int:
+    """Generate missing SELF/MANAGER/PEER assignments for a cycle. Commits."""
+    c = HRPerformanceCycle.query.get(cycle_id)
+    if not c:
+        raise ValueError("Cycle not found.")
+    if c.status == "CLOSED":
+        raise ValueError("Cycle is closed.")
+
+    def _report(stage, done, total):
+        if progress:
+            progress(stage, done, total)
+
+    _report("LOADING", 0, 0)
+    idx = _OrgIndex.load()
+    existing = set(
+        db.session.query(
+            HRPerformanceAssignment.evaluatee_user_id,
+            HRPerformanceAssignment.evaluator_user_id,
+            HRPerformanceAssignment.evaluator_type,
+        ).filter(HRPerformanceAssignment.cycle_id == c.id).all()
+    )
+
+    pairs = compute_pairs(
+        idx, int(c.peer_count or 0), existing,
+        progress=lambda done, total: _report("COMPUTING", done, total),
+    )
+
+    now = datetime.utcnow()
+    total = len(pairs)
+    _report("INSERTING", 0, total)
+    for i in range(0, total, INSERT_CHUNK):
+        chunk = pairs[i:i + INSERT_CHUNK]
+        db.session.execute(insert(HRPerformanceAssignment), [
+            dict(
+                cycle_id=c.id,
+                evaluatee_user_id=ee,
+                evaluator_user_id=ev,
+                evaluator_type=etype,
+                status="PENDING",
+                created_at=now,
+                created_by_id=created_by_id,
+            )
+            for ee, ev, etype in chunk
+        ])
+        _report("INSERTING", min(i + INSERT_CHUNK, total), total)
+
+    if created_by_id:
+        db.session.add(AuditLog(
+            action="HR_PERF_ASSIGNMENTS_GENERATE",
+            note=f"cycle={c.id},created={total}",
+            user_id=created_by_id,
+            target_type="hr_perf_cycle",
+            target_id=c.id,
+            created_at=now,
+        ))
+    db.session.commit()
+    return total
+
+
+# -------------------------
+# Background job
+# -------------------------
+
+def job_status(cycle_id: int) -> dict | None:
+    with _jobs_lock:
+        job = _JOBS.get(int(cycle_id))
+        return dict(job) if job else None
+
+
+def start_generation_job(app, cycle_id: int, created_by_id: int | None = None) -> bool:
+    """Start generation in a daemon thread. Returns False if one is already running."""
+    cycle_id = int(cycle_id)
+    with _jobs_lock:
+        job = _JOBS.get(cycle_id)
+        if job and job.get("state") == "RUNNING":
+            return False
+        _JOBS[cycle_id] = {
+            "state": "RUNNING",
+            "stage": "QUEUED",
+            "done": 0,
+            "total": 0,
+            "created": None,
+            "error": None,
+            "started_at": datetime.utcnow().isoformat(timespec="seconds"),
+            "finished_at": None,
+        }
+
+    t = threading.Thread(
+        target=_worker, args=(app, cycle_id, created_by_id), daemon=True, name=f"hr-perf-generate-{cycle_id}"
+    )
+    t.start()
+    return True
+
+
+def _update(cycle_id: int, **kw):
+    with _jobs_lock:
+        job = _JOBS.get(cycle_id)
+        if job is not None:
+            job.update(kw)
+
+
+def _worker(app, cycle_id: int, created_by_id: int | None):
+    with app.app_context():
+        try:
+            created = generate_cycle_assignments(
+                cycle_id,
+                created_by_id=created_by_id,
+                progress=lambda stage, done, total: _update(cycle_id, stage=stage, done=done, total=total),
+            )
+            _update(cycle_id, state="DONE", stage="DONE", created=created)
+        except Exception as e:
+            db.session.rollback()
+            _update(cycle_id, state="FAILED", error=str(e) or e.__class__.__name__)
+        finally:
+            _update(cycle_id, finished_at=datetime.utcnow().isoformat(timespec="seconds"))
+            db.session.remove()
@@ -0,0 +1,422 @@
+# services/report_jobs.py
+"""Background report jobs with cached, downloadable results.
+
+Reports register a builder once (at import time):
+
+    report_jobs.register("hr_promotions", "استحقاق الترقيات", _job_hr_promotions)
+
+builder(params) runs in an app context without a request (no current_user)
+and returns (headers, rows) for the *whole* report - no row caps.
+
+submit(key, params, user_id):
+- params are normalized (stripped strings, empty values and "export" dropped)
+  and hashed together with the key;
+- a QUEUED / RUNNING job with the same hash, or a DONE one whose result has not
+  expired, is returned as-is, so identical requests share one run;
+- otherwise a ReportJob row is created and its id queued for the worker pool
+  (REPORT_JOB_WORKERS threads, default 2). A worker claims the job with a
+  conditional UPDATE, so a job queued twice still runs once.
+
+Results are stored column-wise (one list per column, msgpack, gzip) in
+instance/report_results and kept REPORT_RESULT_TTL_MINUTES (default 60);
+workers purge expired files (and job rows older than REPORT_JOB_KEEP_DAYS)
+when idle. load_result() / csv_chunks() / xlsx_file() read them back.
+
+Without the pool (scripts, REPORT_JOB_WORKERS=0) submit() runs the job
+inline. Jobs left QUEUED (or RUNNING for STALE_RUNNING_MINUTES) by a previous
+process are re-queued when the pool starts.
+"""
+
+import csv
+import gzip
+import hashlib
+import io
+import json
+import logging
+import os
+import queue
+import tempfile
+import threading
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+import msgspec
+from flask import current_app
+from sqlalchemy import update
+
+from extensions import db
+from models import ReportJob
+from services import settings_service
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WORKERS = 2
+DEFAULT_TTL_MINUTES = 60
+DEFAULT_KEEP_DAYS = 7
+STALE_RUNNING_MINUTES = 30
+IDLE_PURGE_SECONDS = 60
+CSV_CHUNK_ROWS = 500
+RESULTS_DIRNAME = "report_results"
+RESULT_VERSION = 1
+IGNORED_PARAMS = frozenset({"export", "csrf_token", "page"})
+
+ACTIVE_STATUSES = ("QUEUED", "RUNNING")
+
+_STOP = object()
+
+_registry: dict[str, dict] = {}
+_queue: queue.Queue | None = None
+_threads: list[threading.Thread] = []
+
+
+class ReportResult(msgspec.Struct):
+    version: int
+    report_key: str
+    columns: list[str]
+    data: list[list]  # one list per column
+    rows: int
+    created_at: datetime
+
+
+_encoder = msgspec.msgpack.Encoder()
+_decoder = msgspec.msgpack.Decoder(ReportResult)
+
+
+# -------------------------
+# Registry
+# -------------------------
+
+def register(key: str, title: str, builder, filename: str | None = None, perm: str | None = None) -> None:
+    """builder(params: dict) -> (headers, rows); filename is the download base name,
+    perm the permission needed to see / download the job (besides the page's own)."""
+    _registry[key] = {"key": key, "title": title, "builder": builder, "filename": filename or key, "perm": perm}
+
+
+def get_report(key: str) -> dict | None:
+    return _registry.get(key)
+
+
+# -------------------------
+# Parameters
+# -------------------------
+
+def normalize_params(params) -> dict:
+    """Stripped, non-empty string values (first value of a MultiDict), sorted by key."""
+    out = {}
+    for k, v in (params or {}).items():
+        if k in IGNORED_PARAMS or v is None:
+            continue
+        v = str(v).strip()
+        if v:
+            out[str(k)] = v
+    return dict(sorted(out.items()))
+
+
+def params_hash(report_key: str, params: dict) -> str:
+    raw = json.dumps([report_key, params], ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def ttl_minutes() -> int:
+    return max(1, settings_service.get_int("REPORT_RESULT_TTL_MINUTES", DEFAULT_TTL_MINUTES))
+
+
+# -------------------------
+# Result files
+# -------------------------
+
+def _results_dir() -> str:
+    d = os.path.join(current_app.instance_path, RESULTS_DIRNAME)
+    os.makedirs(d, exist_ok=True)
+    return d
+
+
+def _result_path(job: ReportJob) -> str | None:
+    if not job.result_file:
+        return None
+    return os.path.join(_results_dir(), os.path.basename(job.result_file))
+
+
+def _cell(v):
+    if v is None or isinstance(v, (bool, int, float, str)):
+        return v
+    if isinstance(v, datetime):
+        return v.strftime("%Y-%m-%d %H:%M:%S")
+    if isinstance(v, date):
+        return v.strftime("%Y-%m-%d")
+    if isinstance(v, Decimal):
+        return float(v)
+    return str(v)
+
+
+def _write_result(job: ReportJob, headers, rows) -> tuple[str, int, int]:
+    headers = [str(h) for h in headers]
+    columns = [[] for _ in headers]
+    n = 0
+    for row in rows:
+        row = list(row)
+        for i, col in enumerate(columns):
+            col.append(_cell(row[i]) if i < len(row) else None)
+        n += 1
+    payload = _encoder.encode(ReportResult(
+        version=RESULT_VERSION,
+        report_key=job.report_key,
+        columns=headers,
+        data=columns,
+        rows=n,
+        created_at=datetime.utcnow(),
+    ))
+    # job id in the name: a re-run of the same parameters never touches the old file
+    name = f"{job.params_hash[:16]}-{job.id}.rpt"
+    path = os.path.join(_results_dir(), name)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with gzip.open(tmp, "wb", compresslevel=6) as fh:
+        fh.write(payload)
+    os.replace(tmp, path)
+    return name, n, os.path.getsize(path)
+
+
+def load_result(job: ReportJob) -> ReportResult | None:
+    path = _result_path(job)
+    if job.status != "DONE" or not path or not os.path.exists(path):
+        return None
+    with gzip.open(path, "rb") as fh:
+        return _decoder.decode(fh.read())
+
+
+def iter_rows(result: ReportResult):
+    return zip(*result.data) if result.data else iter(())
+
+
+def csv_chunks(result: ReportResult):
+    """UTF-8 (BOM, for Excel) CSV in chunks of CSV_CHUNK_ROWS rows."""
+    buf = io.StringIO()
+    w = csv.writer(buf)
+    w.writerow(result.columns)
+    yield "\ufeff" + buf.getvalue()
+    buf.seek(0)
+    buf.truncate()
+    for i, row in enumerate(iter_rows(result), start=1):
+        w.writerow(["" if v is None else v for v in row])
+        if i % CSV_CHUNK_ROWS == 0:
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+    if buf.tell():
+        yield buf.getvalue()
+
+
+def xlsx_file(result: ReportResult):
+    """Write-only workbook in a spooled temp file (rewound, ready for send_file)."""
+    from openpyxl import Workbook
+
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Report")
+    ws.append(result.columns)
+    for row in iter_rows(result):
+        ws.append(list(row))
+    fh = tempfile.SpooledTemporaryFile(max_size=16 * 1024 * 1024)
+    wb.save(fh)
+    fh.seek(0)
+    return fh
+
+
+# -------------------------
+# Submit / run
+# -------------------------
+
+def _reusable(job: ReportJob | None, now: datetime) -> bool:
+    if job is None:
+        return False
+    if job.status in ACTIVE_STATUSES:
+        return True
+    if job.status != "DONE" or not job.expires_at or job.expires_at <= now:
+        return False
+    path = _result_path(job)
+    return bool(path and os.path.exists(path))
+
+
+def submit(report_key: str, params, user_id: int | None = None) -> ReportJob:
+    """Return the job for report_key + params, creating and queueing one if needed."""
+    if report_key not in _registry:
+        raise KeyError(report_key)
+    params = normalize_params(params)
+    h = params_hash(report_key, params)
+    now = datetime.utcnow()
+
+    existing = (
+        ReportJob.query
+        .filter(ReportJob.params_hash == h, ReportJob.status.in_(ACTIVE_STATUSES + ("DONE",)))
+        .order_by(ReportJob.id.desc())
+        .first()
+    )
+    if _reusable(existing, now):
+        return existing
+
+    job = ReportJob(
+        report_key=report_key,
+        params_json=json.dumps(params, ensure_ascii=False, sort_keys=True),
+        params_hash=h,
+        status="QUEUED",
+        requested_by_id=user_id,
+    )
+    db.session.add(job)
+    db.session.commit()
+
+    if is_running():
+        _queue.put(job.id)
+    else:
+        run_job(job.id)
+        db.session.refresh(job)
+    return job
+
+
+def run_job(job_id: int) -> bool:
+    """Claim and run one QUEUED job in the current app context; False if not claimed or failed."""
+    now = datetime.utcnow()
+    claimed = db.session.execute(
+        update(ReportJob)
+        .where(ReportJob.id == job_id, ReportJob.status == "QUEUED")
+        .values(status="RUNNING", started_at=now, error=None)
+    ).rowcount
+    db.session.commit()
+    if not claimed:
+        return False
+
+    job = db.session.get(ReportJob, job_id)
+    spec = _registry.get(job.report_key)
+    try:
+        if spec is None:
+            raise LookupError(f"unknown report: {job.report_key}")
+        headers, rows = spec["builder"](json.loads(job.params_json or "{}"))
+        name, n, size = _write_result(job, headers, rows)
+    except Exception as exc:
+        db.session.rollback()
+        logger.exception("report job %s (%s) failed", job_id, getattr(job, "report_key", "?"))
+        job = db.session.get(ReportJob, job_id)
+        job.status = "FAILED"
+        job.error = f"{type(exc).__name__}: {exc}"[:2000]
+        job.finished_at = datetime.utcnow()
+        db.session.commit()
+        return False
+
+    # builders only read; drop whatever they left on the session
+    db.session.rollback()
+    job = db.session.get(ReportJob, job_id)
+    finished = datetime.utcnow()
+    job.status = "DONE"
+    job.result_file = name
+    job.row_count = n
+    job.result_bytes = size
+    job.finished_at = finished
+    job.expires_at = finished + timedelta(minutes=ttl_minutes())
+    db.session.commit()
+    return True
+
+
+def purge_expired() -> int:
+    """Delete expired result files (job -> EXPIRED) and old job rows; returns files removed."""
+    now = datetime.utcnow()
+    removed = 0
+    expired = ReportJob.query.filter(ReportJob.status == "DONE", ReportJob.expires_at <= now).all()
+    for job in expired:
+        path = _result_path(job)
+        if path and os.path.exists(path):
+            try:
+                os.remove(path)
+                removed += 1
+            except OSError:
+                continue
+        job.status = "EXPIRED"
+    keep_days = max(1, settings_service.get_int("REPORT_JOB_KEEP_DAYS", DEFAULT_KEEP_DAYS))
+    (
+        ReportJob.query
+        .filter(ReportJob.created_at < now - timedelta(days=keep_days), ReportJob.status.notin_(ACTIVE_STATUSES + ("DONE",)))
+        .delete(synchronize_session=False)
+    )
+    db.session.commit()
+    return removed
+
+
+# -------------------------
+# Worker pool
+# -------------------------
+
+def _run(app, q: queue.Queue):
+    while True:
+        try:
+            job_id = q.get(timeout=IDLE_PURGE_SECONDS)
+        except queue.Empty:
+            job_id = None
+        if job_id is _STOP:
+            break
+        with app.app_context():
+            try:
+                if job_id is None:
+                    purge_expired()
+                else:
+                    run_job(job_id)
+            except Exception:
+                db.session.rollback()
+                logger.exception("report worker error")
+            finally:
+                db.session.remove()
+
+
+def _requeue_unfinished(q: queue.Queue) -> int:
+    stale = datetime.utcnow() - timedelta(minutes=STALE_RUNNING_MINUTES)
+    db.session.execute(
+        update(ReportJob)
+        .where(ReportJob.status == "RUNNING", ReportJob.started_at < stale)
+        .values(status="QUEUED")
+    )
+    db.session.commit()
+    ids = [r[0] for r in db.session.query(ReportJob.id).filter(ReportJob.status == "QUEUED").order_by(ReportJob.id).all()]
+    for job_id in ids:
+        q.put(job_id)
+    return len(ids)
+
+
+def is_running() -> bool:
+    return _queue is not None and any(t.is_alive() for t in _threads)
+
+
+def queue_depth() -> int:
+    return _queue.qsize() if _queue is not None else 0
+
+
+def init_app(app) -> bool:
+    """Start REPORT_JOB_WORKERS worker threads for this process (0 = run jobs inline)."""
+    global _queue
+    if is_running():
+        return False
+    with app.app_context():
+        workers = settings_service.get_int("REPORT_JOB_WORKERS", DEFAULT_WORKERS)
+        if workers <= 0:
+            return False
+        q = queue.Queue()
+        try:
+            _requeue_unfinished(q)
+        except Exception:
+            db.session.rollback()
+    _queue = q
+    _threads.clear()
+    for i in range(workers):
+        t = threading.Thread(target=_run, args=(app, q), daemon=True, name=f"report-jobs-{i + 1}")
+        t.start()
+        _threads.append(t)
+    return True
+
+
+def shutdown(timeout: float = 5.0) -> None:
+    """Stop the workers after their current job (queued ids stay QUEUED in the table)."""
+    global _queue
+    q = _queue
+    if q is None:
+        return
+    for _ in _threads:
+        q.put(_STOP)
+    for t in _threads:
+        t.join(timeout)
+    _threads.clear()
+    _queue = None
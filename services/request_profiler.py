@@ -0,0 +1,298 @@
+# services/request_profiler.py
+"""Per-endpoint query / latency profiler (rolling, in memory, per process).
+
+A sampled request records:
+- number of SQL statements and total SQL time (before/after_cursor_execute),
+- the slowest statements (text only, no parameters),
+- template render time (before_render_template / template_rendered),
+- total latency and response size.
+
+Samples are folded into per-endpoint aggregates plus a bounded window of
+recent samples (for p95). Settings:
+- PROFILER_SAMPLE_RATE: fraction of requests profiled (default 0.05; 0 = off,
+  1 = every request). Unsampled requests only pay one random() call.
+- PROFILER_BUDGETS: JSON {"<endpoint>" | "*": {"queries": n, "ms": n}}.
+  A sampled request over its budget is logged as a warning and counted.
+
+The cursor listeners are registered once on Engine; they return immediately
+when the current thread is not being profiled.
+"""
+
+import heapq
+import json
+import logging
+import random
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+from flask import before_render_template, request, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from services import settings_service
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SAMPLE_RATE = 0.05
+WINDOW = 200            # recent samples kept per endpoint
+SLOWEST_KEEP = 5        # slowest statements kept per endpoint
+STATEMENT_CHARS = 300
+SETTINGS_CHECK_SECONDS = 5.0
+
+_lock = threading.Lock()
+_local = threading.local()
+_stats: dict[str, dict] = {}
+_started_at = datetime.utcnow()
+_config = {"rate": DEFAULT_SAMPLE_RATE, "budgets": {}, "checked": 0.0}
+_installed = False
+
+
+# -------------------------
+# Settings
+# -------------------------
+
+def sample_rate() -> float:
+    try:
+        v = float(settings_service.get_str("PROFILER_SAMPLE_RATE") or DEFAULT_SAMPLE_RATE)
+    except (TypeError, ValueError):
+        v = DEFAULT_SAMPLE_RATE
+    return min(1.0, max(0.0, v))
+
+
+def budgets() -> dict:
+    """{endpoint: {"queries": int | None, "ms": float | None}}; invalid entries are ignored."""
+    raw = (settings_service.get_str("PROFILER_BUDGETS") or "").strip()
+    if not raw:
+        return {}
+    try:
+        d = json.loads(raw)
+    except ValueError:
+        return {}
+    if not isinstance(d, dict):
+        return {}
+    out = {}
+    for endpoint, b in d.items():
+        if not isinstance(b, dict):
+            continue
+        try:
+            queries = int(b["queries"]) if b.get("queries") is not None else None
+            ms = float(b["ms"]) if b.get("ms") is not None else None
+        except (TypeError, ValueError):
+            continue
+        out[str(endpoint)] = {"queries": queries, "ms": ms}
+    return out
+
+
+def _refresh_config():
+    now = time.monotonic()
+    if now - _config["checked"] < SETTINGS_CHECK_SECONDS:
+        return
+    _config.update(rate=sample_rate(), budgets=budgets(), checked=now)
+
+
+def reload_settings():
+    _config["checked"] = 0.0
+
+
+# -------------------------
+# SQL / template hooks
+# -------------------------
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if getattr(_local, "sample", None) is not None:
+        conn.info.setdefault("profiler_t0", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    sample = getattr(_local, "sample", None)
+    if sample is None:
+        return
+    starts = conn.info.get("profiler_t0")
+    if not starts:
+        return
+    ms = (time.perf_counter() - starts.pop()) * 1000.0
+    sample["queries"] += 1
+    sample["sql_ms"] += ms
+    slow = sample["slowest"]
+    item = (ms, statement[:STATEMENT_CHARS])
+    if len(slow) < SLOWEST_KEEP:
+        heapq.heappush(slow, item)
+    elif ms > slow[0][0]:
+        heapq.heapreplace(slow, item)
+
+
+def _before_render(sender, template, context, **extra):
+    sample = getattr(_local, "sample", None)
+    if sample is not None:
+        sample["render_stack"].append(time.perf_counter())
+
+
+def _rendered(sender, template, context, **extra):
+    sample = getattr(_local, "sample", None)
+    if sample is not None and sample["render_stack"]:
+        t0 = sample["render_stack"].pop()
+        if not sample["render_stack"]:
+            sample["template_ms"] += (time.perf_counter() - t0) * 1000.0
+
+
+# -------------------------
+# Request lifecycle
+# -------------------------
+
+def _start():
+    _local.sample = None
+    _refresh_config()
+    rate = _config["rate"]
+    if rate <= 0 or (rate < 1 and random.random() >= rate):
+        return
+    _local.sample = {
+        "t0": time.perf_counter(),
+        "queries": 0,
+        "sql_ms": 0.0,
+        "template_ms": 0.0,
+        "slowest": [],
+        "render_stack": [],
+    }
+
+
+def _finish(response):
+    sample = getattr(_local, "sample", None)
+    if sample is None:
+        return response
+    _local.sample = None
+    endpoint = request.endpoint or (request.url_rule.rule if request.url_rule else "<404>")
+    size = 0
+    if not response.is_streamed:
+        size = response.calculate_content_length() or 0
+    record(
+        endpoint,
+        ms=(time.perf_counter() - sample["t0"]) * 1000.0,
+        queries=sample["queries"],
+        sql_ms=sample["sql_ms"],
+        template_ms=sample["template_ms"],
+        size=size,
+        status=response.status_code,
+        slowest=sample["slowest"],
+    )
+    return response
+
+
+def _teardown(exc):
+    _local.sample = None
+
+
+def record(endpoint, ms, queries, sql_ms, template_ms, size, status, slowest=()):
+    budget = _config["budgets"].get(endpoint) or _config["budgets"].get("*") or {}
+    over = []
+    if budget.get("queries") is not None and queries > budget["queries"]:
+        over.append(f"queries {queries} > {budget['queries']}")
+    if budget.get("ms") is not None and ms > budget["ms"]:
+        over.append(f"{ms:.0f} ms > {budget['ms']:.0f} ms")
+    if over:
+        logger.warning("profiler budget exceeded on %s: %s", endpoint, ", ".join(over))
+
+    with _lock:
+        s = _stats.get(endpoint)
+        if s is None:
+            s = _stats[endpoint] = {
+                "endpoint": endpoint,
+                "samples": 0,
+                "total_ms": 0.0,
+                "max_ms": 0.0,
+                "queries": 0,
+                "max_queries": 0,
+                "sql_ms": 0.0,
+                "template_ms": 0.0,
+                "bytes": 0,
+                "errors": 0,
+                "violations": 0,
+                "last_violation": None,
+                "last_seen": None,
+                "slowest": [],
+                "window": deque(maxlen=WINDOW),
+            }
+        s["samples"] += 1
+        s["total_ms"] += ms
+        s["max_ms"] = max(s["max_ms"], ms)
+        s["queries"] += queries
+        s["max_queries"] = max(s["max_queries"], queries)
+        s["sql_ms"] += sql_ms
+        s["template_ms"] += template_ms
+        s["bytes"] += size
+        if status >= 500:
+            s["errors"] += 1
+        if over:
+            s["violations"] += 1
+            s["last_violation"] = ", ".join(over)
+        s["last_seen"] = datetime.utcnow()
+        s["window"].append((ms, queries))
+        s["slowest"] = heapq.nlargest(SLOWEST_KEEP, list(s["slowest"]) + list(slowest))
+
+
+# -------------------------
+# Read side
+# -------------------------
+
+def _p95(values: list) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(0.95 * (len(values) - 1))))]
+
+
+def snapshot(sort: str = "total_ms") -> list[dict]:
+    """Per-endpoint rows (averages in ms, sorted desc by `sort`)."""
+    with _lock:
+        items = [(dict(s), list(s["window"])) for s in _stats.values()]
+    rows = []
+    for s, window in items:
+        n = s["samples"] or 1
+        rows.append({
+            "endpoint": s["endpoint"],
+            "samples": s["samples"],
+            "avg_ms": round(s["total_ms"] / n, 1),
+            "p95_ms": round(_p95([w[0] for w in window]), 1),
+            "max_ms": round(s["max_ms"], 1),
+            "total_ms": round(s["total_ms"], 1),
+            "avg_queries": round(s["queries"] / n, 1),
+            "p95_queries": _p95([w[1] for w in window]),
+            "max_queries": s["max_queries"],
+            "avg_sql_ms": round(s["sql_ms"] / n, 1),
+            "avg_template_ms": round(s["template_ms"] / n, 1),
+            "avg_bytes": int(s["bytes"] / n),
+            "errors": s["errors"],
+            "violations": s["violations"],
+            "last_violation": s["last_violation"],
+            "last_seen": s["last_seen"].isoformat(timespec="seconds") if s["last_seen"] else None,
+            "slowest": [{"ms": round(ms, 2), "sql": sql} for ms, sql in s["slowest"]],
+        })
+    rows.sort(key=lambda r: r.get(sort) or 0, reverse=True)
+    return rows
+
+
+def started_at() -> datetime:
+    return _started_at
+
+
+def reset():
+    global _started_at
+    with _lock:
+        _stats.clear()
+        _started_at = datetime.utcnow()
+
+
+def init_app(app):
+    """Register the request hooks and (once per process) the SQL / template listeners."""
+    global _installed
+    if not _installed:
+        event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+        before_render_template.connect(_before_render)
+        template_rendered.connect(_rendered)
+        _installed = True
+    # first, so the latency includes the other before_request hooks
+    app.before_request_funcs.setdefault(None, []).insert(0, _start)
+    app.after_request(_finish)
+    app.teardown_request(_teardown)
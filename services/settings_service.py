@@ -0,0 +1,123 @@
+# services/settings_service.py
+"""Process-wide SystemSetting cache.
+
+All SystemSetting rows are loaded into one immutable snapshot (key -> value).
+Readers only compare a version stamp and rebuild the snapshot when a write
+bumped it, so helpers called per table row (get_sla_state, ...) no longer hit
+the database.
+
+The stamp is kept by utils.versioned_cache: a local counter bumped on
+flush/bulk writes/rollback of SystemSetting changes (this process sees its own
+writes immediately) plus the mtime of instance/settings.version, touched after
+such a commit so other worker processes notice the change on their next stat
+(checked at most every SETTINGS_STAMP_CHECK_SECONDS).
+"""
+
+import math
+from types import MappingProxyType
+
+from extensions import db
+from models import SystemSetting
+from utils.versioned_cache import VersionedCache
+
+SETTINGS_STAMP_CHECK_SECONDS = 1.0
+STAMP_FILENAME = "settings.version"
+
+_cache = VersionedCache(
+    "settings",
+    (SystemSetting,),
+    stamp_filename=STAMP_FILENAME,
+    stamp_check_seconds=SETTINGS_STAMP_CHECK_SECONDS,
+)
+
+
+def _load():
+    rows = db.session.query(SystemSetting.key, SystemSetting.value).all()
+    return MappingProxyType({k: v for k, v in rows if k is not None})
+
+
+def snapshot():
+    """Immutable mapping of all settings (key -> value)."""
+    return _cache.get(_load)
+
+
+def invalidate() -> None:
+    _cache.invalidate()
+
+
+# -------------------------
+# Read helpers
+# -------------------------
+
+def get(key: str, default=None):
+    """Stored value for `key` (may be None/''), or `default` when the row is missing."""
+    data = snapshot()
+    if key in data:
+        return data[key]
+    return default
+
+
+def get_str(key: str, default: str | None = None) -> str | None:
+    """Value when present and non-empty, else `default`."""
+    v = get(key, None)
+    if v is None or v == "":
+        return default
+    return v
+
+
+def get_int(key: str, default: int = 0) -> int:
+    v = get(key, None)
+    if v is None:
+        return default
+    try:
+        v = str(v).strip()
+        if v == "":
+            return default
+        return int(float(v))
+    except Exception:
+        return default
+
+
+def get_float(key: str, default: float = 0.0) -> float:
+    v = get(key, None)
+    if v is None:
+        return default
+    try:
+        v = str(v).strip()
+        if v == "":
+            return default
+        f = float(v)
+    except Exception:
+        return default
+    return f if math.isfinite(f) else default
+
+
+def get_bool(key: str, default: bool = False) -> bool:
+    v = get(key, None)
+    if v is None:
+        return default
+    v = str(v).strip().lower()
+    if v in ("1", "true", "yes", "on", "نعم", "فعال", "enable", "enabled"):
+        return True
+    if v in ("0", "false", "no", "off", "لا", "غير فعال", "disable", "disabled"):
+        return False
+    return default
+
+
+def with_prefix(prefix: str) -> dict:
+    return {k: v for k, v in snapshot().items() if k.startswith(prefix)}
+
+
+# -------------------------
+# Write helper
+# -------------------------
+
+def set_value(key: str, value: str | None) -> SystemSetting:
+    """Upsert a setting row (no commit). The cache is refreshed on flush."""
+    row = SystemSetting.query.filter_by(key=key).first()
+    if not row:
+        row = SystemSetting(key=key, value=value)
+        db.session.add(row)
+    else:
+        row.value = value
+    return row
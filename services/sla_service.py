@@ -0,0 +1,158 @@
+# services/sla_service.py
+"""Persisted SLA deadlines for workflow requests.
+
+SLA state used to be derived from created_at + SLA_DAYS / ESCALATION_DAYS on
+every read (per row in templates, per counter in the inbox). The deadlines are
+now stored:
+
+- WorkflowRequest.sla_due_at        = created_at + SLA_DAYS
+- WorkflowRequest.escalation_due_at = created_at + SLA_DAYS + ESCALATION_DAYS
+
+so SLA filters/counters and the escalation sweeps compare a column with "now"
+and can use the (status, *_due_at) indexes.
+
+New requests are stamped in before_flush (the settings are read there, not
+inside the flush). When SLA_DAYS / ESCALATION_DAYS change, the
+stored deadlines are recomputed (ensure_deadlines_current); the settings the
+current values were computed with are kept in SLA_DEADLINES_BASIS.
+"""
+
+from datetime import datetime, timedelta
+
+from sqlalchemy import case, event, func, update
+from sqlalchemy.orm import Session
+
+from extensions import db
+from filters.request_filters import get_escalation_days, get_sla_days
+from models import WorkflowRequest
+from services import settings_service
+
+FINAL_STATUSES = ("APPROVED", "REJECTED")
+BASIS_KEY = "SLA_DEADLINES_BASIS"
+RECOMPUTE_CHUNK = 1000
+
+
+def _basis() -> str:
+    return f"{get_sla_days()}:{get_escalation_days()}"
+
+
+def request_deadlines(created_at: datetime, sla_days: int | None = None, esc_days: int | None = None):
+    """(sla_due_at, escalation_due_at) for a request created at `created_at`."""
+    sla_days = get_sla_days() if sla_days is None else sla_days
+    esc_days = get_escalation_days() if esc_days is None else esc_days
+    sla_due = created_at + timedelta(days=sla_days)
+    return sla_due, sla_due + timedelta(days=esc_days)
+
+
+# -------------------------
+# Query helpers
+# -------------------------
+
+def open_clause():
+    return WorkflowRequest.status.notin_(FINAL_STATUSES)
+
+
+def sla_state_clauses(state: str, now: datetime | None = None) -> list:
+    """Filter conditions for ON_TRACK / BREACHED / ESCALATED (open requests only)."""
+    now = now or datetime.utcnow()
+    conds = [open_clause()]
+    if state == "ON_TRACK":
+        conds.append(WorkflowRequest.sla_due_at >= now)
+    elif state == "BREACHED":
+        conds += [WorkflowRequest.sla_due_at < now, WorkflowRequest.escalation_due_at >= now]
+    elif state == "ESCALATED":
+        conds.append(WorkflowRequest.escalation_due_at < now)
+    return conds
+
+
+def sla_counts(query, now: datetime | None = None) -> dict:
+    """on_track / breached / escalated counts of `query` in one aggregate."""
+    now = now or datetime.utcnow()
+    on_track, breached, escalated = (
+        query.filter(open_clause())
+        .with_entities(
+            func.sum(case((WorkflowRequest.sla_due_at >= now, 1), else_=0)),
+            func.sum(case(
+                ((WorkflowRequest.sla_due_at < now) & (WorkflowRequest.escalation_due_at >= now), 1),
+                else_=0,
+            )),
+            func.sum(case((WorkflowRequest.escalation_due_at < now, 1), else_=0)),
+        )
+        .order_by(None)
+        .one()
+    )
+    return {
+        "on_track": int(on_track or 0),
+        "breached": int(breached or 0),
+        "escalated": int(escalated or 0),
+    }
+
+
+def sla_state(req, now: datetime | None = None) -> str | None:
+    """ON_TRACK / BREACHED / ESCALATED for one request (None when final)."""
+    if req.status in FINAL_STATUSES:
+        return None
+    sla_due, esc_due = req.sla_due_at, req.escalation_due_at
+    if sla_due is None or esc_due is None:
+        sla_due, esc_due = request_deadlines(req.created_at or datetime.utcnow())
+    now = now or datetime.utcnow()
+    if now <= sla_due:
+        return "ON_TRACK"
+    if now <= esc_due:
+        return "BREACHED"
+    return "ESCALATED"
+
+
+# -------------------------
+# Recompute
+# -------------------------
+
+def recompute_deadlines() -> int:
+    """Recompute stored deadlines with the current settings (no commit). Returns rows updated."""
+    sla_days, esc_days = get_sla_days(), get_escalation_days()
+    n = 0
+
+    rows = db.session.query(WorkflowRequest.id, WorkflowRequest.created_at).all()
+    for i in range(0, len(rows), RECOMPUTE_CHUNK):
+        params = []
+        for rid, created_at in rows[i:i + RECOMPUTE_CHUNK]:
+            sla_due, esc_due = request_deadlines(created_at or datetime.utcnow(), sla_days, esc_days)
+            params.append({"id": rid, "sla_due_at": sla_due, "escalation_due_at": esc_due})
+        db.session.execute(update(WorkflowRequest), params)
+        n += len(params)
+
+    settings_service.set_value(BASIS_KEY, f"{sla_days}:{esc_days}")
+    return n
+
+
+def ensure_deadlines_current() -> bool:
+    """Recompute when settings changed or rows were never stamped (commits)."""
+    stale = settings_service.get(BASIS_KEY) != _basis()
+    if not stale:
+        stale = db.session.query(WorkflowRequest.id).filter(WorkflowRequest.sla_due_at.is_(None)).first() is not None
+    if not stale:
+        return False
+    recompute_deadlines()
+    db.session.commit()
+    return True
+
+
+# -------------------------
+# Stamp new rows
+# -------------------------
+
+@event.listens_for(Session, "before_flush")
+def _stamp_new_requests(session, flush_context, instances):
+    new = [
+        o for o in session.new
+        if isinstance(o, WorkflowRequest) and (o.sla_due_at is None or o.escalation_due_at is None)
+    ]
+    if not new:
+        return
+    with session.no_autoflush:
+        sla_days, esc_days = get_sla_days(), get_escalation_days()
+    now = datetime.utcnow()
+    for req in new:
+        if req.created_at is None:
+            req.created_at = now
+        req.sla_due_at, req.escalation_due_at = request_deadlines(req.created_at, sla_days, esc_days)
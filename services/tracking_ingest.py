@@ -0,0 +1,893 @@
+# services/tracking_ingest.py
+"""GPS tracking ingestion into TransportTripPoint.
+
+Sources:
+- devices push batches to /portal/transport/tracking/push (bearer token,
+  TRANSPORT_TRACKING_PUSH_TOKEN);
+- the provider poller pulls from TRANSPORT_TRACKING_BASE_URL every
+  TRANSPORT_TRACKING_SYNC_SECONDS when TRANSPORT_TRACKING_ENABLED=1.
+  TRANSPORT_TRACKING_PROVIDER picks the provider: "http" (JSON API) or
+  "file" (a JSON-lines file read incrementally - the local stand-in for
+  tests and vendor dumps); register_provider() adds others.
+
+Both normalize points (device uid, UTC time, lat/lng, speed, heading).
+
+Pushed batches are offer()ed to a bounded in-memory buffer
+(TRACKING_BUFFER_MAX points). A batch that does not fit is rejected as a
+whole (backpressure): the endpoint answers 429 + Retry-After so the device
+resends. An accepted batch is first appended to this process's spool segment
+(instance/tracking_spool/*.jsonl), so the 202 survives a crash; a segment is
+deleted once the writer has stored every point queued up to its end.
+
+The poller writes each fetched page itself (write_points(), in
+TRACKING_BATCH_SIZE chunks) and only then moves TRANSPORT_TRACKING_CURSOR
+past it; a crash in between re-fetches the page and the unique key drops
+the repeats.
+
+One writer thread per process drains the buffer TRACKING_BATCH_SIZE points
+at a time (or every TRACKING_FLUSH_MS) and:
+- matches each point to a trip through the vehicle's tracking_device_uid: the
+  trip that started before the point and is still open, or ended no more than
+  TRACKING_LATE_MINUTES ago (late uploads) and not before the point. Trips are
+  loaded in one query and cached (TRIP_REFRESH_SECONDS, or sooner when an
+  unknown device shows up);
+- sets seq = milliseconds since the trip started, so a resent point maps to
+  the same (trip_id, seq);
+- inserts the batch with one executemany INSERT .. ON CONFLICT DO NOTHING on
+  the unique (trip_id, seq) index - no ORM objects per point.
+
+Points of unknown devices or outside any trip are counted and dropped. A
+batch that cannot be written goes to a separate spool file.
+
+Every process starts a poller thread, but only the holder of the
+TRANSPORT_TRACKING_POLLER_LEASE row (system_setting, renewed each cycle,
+taken over once it expires) polls, writes spool files left by a crashed
+process or a failed batch, and hands closed trips to
+trip_tracks.compact_due(), which packs their rows into one
+TransportTripTrack blob.
+stats() feeds the tracking settings page. Without the writer thread
+(scripts, TRACKING_INGEST_THREADS=0) offer() writes inline.
+"""
+
+import atexit
+import hmac
+import json
+import logging
+import math
+import os
+import socket
+import threading
+import time
+import uuid
+from collections import deque
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import and_, func, inspect, insert, or_, select, update
+from sqlalchemy.exc import IntegrityError, OperationalError
+
+from extensions import db
+from models import SystemSetting, TransportTrip, TransportTripPoint, TransportVehicle
+from services import settings_service, trip_tracks
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUFFER_MAX = 50000
+DEFAULT_BATCH_SIZE = 2000
+DEFAULT_FLUSH_MS = 500
+DEFAULT_LATE_MINUTES = 30
+DEFAULT_SYNC_SECONDS = 60
+TRIP_REFRESH_SECONDS = 15.0
+TRIP_MISS_REFRESH_SECONDS = 2.0
+MAX_PUSH_POINTS = 5000
+FILE_READ_BYTES = 8 * 1024 * 1024
+HTTP_TIMEOUT = 20
+WRITE_RETRIES = 3
+SPOOL_DIRNAME = "tracking_spool"
+SPOOL_SEGMENT_BYTES = 8 * 1024 * 1024
+SPOOL_STALE_SECONDS = 120  # a spool file untouched this long has no live writer
+LEASE_KEY = "TRANSPORT_TRACKING_POLLER_LEASE"
+
+_DEVICE_KEYS = ("device_uid", "device", "device_id", "imei", "unit_id", "tracker_id")
+_TIME_KEYS = ("recorded_at", "ts", "timestamp", "time", "fix_time")
+_LAT_KEYS = ("lat", "latitude")
+_LNG_KEYS = ("lng", "lon", "long", "longitude")
+_SPEED_KEYS = ("speed", "speed_kmh")
+_HEADING_KEYS = ("heading", "course", "bearing")
+
+_lock = threading.Lock()
+_buffer = None
+_writer: threading.Thread | None = None
+_poller: threading.Thread | None = None
+_poller_stop = threading.Event()
+_spool = None
+_owner = ""
+_app = None
+_batch_size = DEFAULT_BATCH_SIZE
+_flush_seconds = DEFAULT_FLUSH_MS / 1000.0
+_providers: dict[str, type] = {}
+_stats = {
+    "received": 0,
+    "invalid": 0,
+    "rejected": 0,
+    "inserted": 0,
+    "duplicates": 0,
+    "unmatched": 0,
+    "failed": 0,
+    "batches": 0,
+    "max_depth": 0,
+    "last_batch_rows": 0,
+    "last_batch_ms": 0.0,
+    "last_flush_at": None,
+    "last_error": None,
+}
+
+
+def _count(**kw):
+    with _lock:
+        for k, v in kw.items():
+            _stats[k] += v
+
+
+def _note(**kw):
+    with _lock:
+        _stats.update(kw)
+
+
+def stats() -> dict:
+    with _lock:
+        out = dict(_stats)
+    out["running"] = is_running()
+    out["polling"] = lease_holder() is not None
+    out["depth"] = len(_buffer) if _buffer is not None else 0
+    out["capacity"] = _buffer.maxsize if _buffer is not None else 0
+    out["batch_size"] = _batch_size
+    out["flush_ms"] = int(_flush_seconds * 1000)
+    return out
+
+
+# -------------------------
+# Normalization
+# -------------------------
+
+def normalize_device(uid) -> str:
+    return str(uid or "").strip().upper()
+
+
+def _first(d: dict, keys):
+    for k in keys:
+        v = d.get(k)
+        if v is not None and v != "":
+            return v
+    return None
+
+
+def _num(v, lo: float | None = None, hi: float | None = None) -> float | None:
+    try:
+        x = float(v)
+    except (TypeError, ValueError):
+        return None
+    if not math.isfinite(x):
+        return None
+    if (lo is not None and x < lo) or (hi is not None and x > hi):
+        return None
+    return x
+
+
+def parse_time(v) -> datetime | None:
+    """Epoch seconds / milliseconds or ISO 8601 -> naive UTC datetime."""
+    if v is None or v == "":
+        return None
+    if isinstance(v, datetime):
+        dt = v
+    else:
+        s = str(v).strip()
+        x = _num(s)
+        if x is not None:
+            if x > 1e11:  # milliseconds
+                x /= 1000.0
+            try:
+                return datetime.fromtimestamp(x, tz=timezone.utc).replace(tzinfo=None)
+            except (OverflowError, OSError, ValueError):
+                return None
+        try:
+            dt = datetime.fromisoformat(s[:-1] + "+00:00" if s.endswith(("Z", "z")) else s)
+        except ValueError:
+            return None
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return dt
+
+
+def normalize_point(d: dict, device_uid=None, keep_raw: bool = False):
+    """(device, recorded_at, lat, lng, speed, heading, raw_json) or None when unusable."""
+    if not isinstance(d, dict):
+        return None
+    device = normalize_device(_first(d, _DEVICE_KEYS) or device_uid)
+    lat = _num(_first(d, _LAT_KEYS), -90.0, 90.0)
+    lng = _num(_first(d, _LNG_KEYS), -180.0, 180.0)
+    if not device or lat is None or lng is None:
+        return None
+    recorded_at = parse_time(_first(d, _TIME_KEYS)) or datetime.utcnow()
+    speed = _num(_first(d, _SPEED_KEYS), 0.0)
+    heading = _num(_first(d, _HEADING_KEYS))
+    if heading is not None:
+        heading %= 360.0
+    raw = json.dumps(d, ensure_ascii=False, default=str) if keep_raw else None
+    return (device, recorded_at, lat, lng, speed, heading, raw)
+
+
+def parse_payload(payload, keep_raw: bool | None = None) -> tuple[list, int]:
+    """{"device_uid": .., "points": [..]} / [{..}, ..] / {..} -> (points, invalid count)."""
+    if keep_raw is None:
+        keep_raw = settings_service.get_bool("TRANSPORT_TRACKING_KEEP_RAW", False)
+    device_uid = None
+    if isinstance(payload, dict) and isinstance(payload.get("points"), list):
+        device_uid = _first(payload, _DEVICE_KEYS)
+        items = payload["points"]
+    elif isinstance(payload, list):
+        items = payload
+    else:
+        items = [payload]
+    points = []
+    for d in items:
+        p = normalize_point(d, device_uid=device_uid, keep_raw=keep_raw)
+        if p is not None:
+            points.append(p)
+    invalid = len(items) - len(points)
+    if invalid:
+        _count(invalid=invalid)
+    return points, invalid
+
+
+# -------------------------
+# Buffer
+# -------------------------
+
+class _Buffer:
+    """Bounded FIFO of points; put_many() takes a batch whole or not at all."""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.closed = False
+        self.enqueued = 0  # points ever queued (the spool's positions)
+        self._items = deque()
+        self._cond = threading.Condition()
+
+    def __len__(self):
+        return len(self._items)
+
+    def put_many(self, items: list, timeout: float = 0.0) -> bool:
+        if len(items) > self.maxsize:
+            return False
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while len(self._items) + len(items) > self.maxsize and not self.closed:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+            if self.closed:
+                return False
+            self._items.extend(items)
+            self.enqueued += len(items)
+            self._cond.notify_all()
+        return True
+
+    def take(self, limit: int, first_wait: float, fill_wait: float) -> list:
+        """Up to limit points: waits first_wait for one, then up to fill_wait for a full batch."""
+        with self._cond:
+            if not self._items and not self.closed:
+                self._cond.wait(first_wait)
+            if not self._items:
+                return []
+            deadline = time.monotonic() + fill_wait
+            while len(self._items) < limit and not self.closed:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            out = [self._items.popleft() for _ in range(min(limit, len(self._items)))]
+            self._cond.notify_all()  # room for waiting producers
+        return out
+
+    def close(self):
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+
+
+# -------------------------
+# Spool
+# -------------------------
+
+def _encode(p) -> list:
+    return [p[0], p[1].isoformat(), *p[2:]]
+
+
+def _decode(d) -> tuple:
+    return (d[0], datetime.fromisoformat(d[1]), *d[2:])
+
+
+class _Spool:
+    """Points accepted by offer() but not written yet, one JSON line per batch.
+
+    Segments are named <pid>-<token>-<n>.jsonl. Each one remembers the buffer
+    position its last line reaches; release(done) deletes the segments whose
+    points the writer has all stored (or moved to a failed-*.jsonl file).
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.prefix = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.lock = threading.Lock()
+        self.fh = None
+        self.current = None
+        self.end = 0
+        self.closed: list[tuple[str, int]] = []
+        self.n = 0
+        self.hold = False  # a failed batch could not be spooled: keep every segment
+        os.makedirs(path, exist_ok=True)
+
+    def append(self, points: list, end: int) -> None:
+        line = json.dumps([_encode(p) for p in points], ensure_ascii=False) + "\n"
+        with self.lock:
+            if self.fh is None:
+                self.current = os.path.join(self.path, f"{self.prefix}-{self.n:06d}.jsonl")
+                self.n += 1
+                self.fh = open(self.current, "a", encoding="utf-8")
+            self.fh.write(line)
+            self.fh.flush()
+            self.end = max(self.end, end)
+            if self.fh.tell() >= SPOOL_SEGMENT_BYTES:
+                self._rotate()
+
+    def _rotate(self):
+        self.fh.close()
+        self.closed.append((self.current, self.end))
+        self.fh = None
+        self.current = None
+
+    def release(self, done: int) -> None:
+        with self.lock:
+            if self.fh is not None and self.end <= done:
+                self._rotate()
+            if self.hold:
+                return
+            keep = []
+            for path, end in self.closed:
+                if end <= done:
+                    _unlink(path)
+                else:
+                    keep.append((path, end))
+            self.closed = keep
+
+    def spool_failed(self, points: list) -> bool:
+        with self.lock:
+            self.n += 1
+            path = os.path.join(self.path, f"{self.prefix}-failed-{self.n:06d}.jsonl")
+            try:
+                with open(path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps([_encode(p) for p in points], ensure_ascii=False) + "\n")
+                return True
+            except OSError:
+                logger.exception("tracking spool: cannot write %s", path)
+                self.hold = True
+                return False
+
+    def own(self) -> set:
+        with self.lock:
+            return {self.current} | {path for path, _ in self.closed}
+
+
+def _unlink(path: str) -> None:
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def replay_spool() -> int:
+    """Write spool files no live writer owns (crashed process, failed batches); returns points handled."""
+    sp = _spool
+    if sp is None:
+        return 0
+    own = sp.own()
+    stale = time.time() - SPOOL_STALE_SECONDS
+    handled = 0
+    for name in sorted(os.listdir(sp.path)):
+        path = os.path.join(sp.path, name)
+        try:
+            if not name.endswith(".jsonl") or path in own or os.path.getmtime(path) > stale:
+                continue
+            with open(path, encoding="utf-8") as f:
+                lines = f.readlines()
+        except OSError:
+            continue
+        for line in lines:
+            try:
+                points = [_decode(d) for d in json.loads(line)]
+            except (ValueError, TypeError, IndexError):
+                continue  # torn last line of a crashed process
+            for i in range(0, len(points), _batch_size):
+                write_points(points[i:i + _batch_size])
+            handled += len(points)
+        _unlink(path)
+    return handled
+
+
+def offer(points: list, timeout: float = 0.0) -> bool:
+    """Queue normalized points; False when the buffer cannot take them (caller retries later).
+
+    With the writer running, True means the points are in the spool too.
+    """
+    if not points:
+        return True
+    buf = _buffer
+    if buf is None or not is_running():
+        _count(received=len(points))
+        write_points(points)
+        return True
+    if not buf.put_many(points, timeout=timeout):
+        _count(rejected=len(points))
+        return False
+    _spool.append(points, buf.enqueued)
+    _count(received=len(points))
+    depth = len(buf)
+    with _lock:
+        if depth > _stats["max_depth"]:
+            _stats["max_depth"] = depth
+    return True
+
+
+# -------------------------
+# Trip matching + writing
+# -------------------------
+
+class _TripIndex:
+    """device uid -> [(started_at, ended_at, trip_id)] newest first, for tracked vehicles."""
+
+    def __init__(self):
+        self.by_device: dict[str, list] = {}
+        self.loaded_at = 0.0
+
+    def refresh(self):
+        late = max(0, settings_service.get_int("TRACKING_LATE_MINUTES", DEFAULT_LATE_MINUTES))
+        cutoff = datetime.utcnow() - timedelta(minutes=late)
+        rows = db.session.execute(
+            select(TransportTrip.id, TransportTrip.started_at, TransportTrip.ended_at, TransportVehicle.tracking_device_uid)
+            .join(TransportVehicle, TransportVehicle.id == TransportTrip.vehicle_id)
+            .where(TransportVehicle.tracking_enabled.is_(True))
+            .where(TransportVehicle.tracking_device_uid.isnot(None))
+            .where(TransportTrip.is_deleted.is_(False))
+            .where(or_(TransportTrip.ended_at.is_(None), TransportTrip.ended_at >= cutoff))
+        ).all()
+        by_device: dict[str, list] = {}
+        for trip_id, started_at, ended_at, uid in rows:
+            key = normalize_device(uid)
+            if key and started_at:
+                by_device.setdefault(key, []).append((started_at, ended_at, trip_id))
+        for trips in by_device.values():
+            trips.sort(reverse=True)
+        self.by_device = by_device
+        self.loaded_at = time.monotonic()
+
+    def age(self) -> float:
+        return time.monotonic() - self.loaded_at
+
+    def match(self, device: str, t: datetime):
+        for started_at, ended_at, trip_id in self.by_device.get(device, ()):
+            if started_at <= t and (ended_at is None or t <= ended_at):
+                return trip_id, started_at
+        return None
+
+
+_trips = _TripIndex()
+_unique_key: bool | None = None
+
+_MS = timedelta(milliseconds=1)
+
+
+def _has_unique_key() -> bool:
+    """True when (trip_id, seq) is backed by a unique index (ON CONFLICT needs one)."""
+    global _unique_key
+    if _unique_key is None:
+        try:
+            indexes = inspect(db.engine).get_indexes(TransportTripPoint.__tablename__)
+            _unique_key = any(ix.get("unique") and list(ix["column_names"]) == ["trip_id", "seq"] for ix in indexes)
+        except Exception:
+            _unique_key = False
+        if not _unique_key:
+            logger.warning("transport_trip_point has no unique (trip_id, seq) index; deduplicating with a lookup")
+    return _unique_key
+
+
+def _insert(rows: list[dict]) -> int:
+    table = TransportTripPoint.__table__
+    if _has_unique_key():
+        if db.engine.dialect.name == "postgresql":
+            from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        stmt = dialect_insert(table).on_conflict_do_nothing(index_elements=["trip_id", "seq"])
+        result = db.session.execute(stmt, rows)
+        n = result.rowcount
+        return n if n is not None and n >= 0 else len(rows)
+
+    # no unique index (old DB with duplicate rows): skip keys that already exist
+    trip_ids = {r["trip_id"] for r in rows}
+    lo = min(r["seq"] for r in rows)
+    hi = max(r["seq"] for r in rows)
+    existing = set(db.session.execute(
+        select(table.c.trip_id, table.c.seq)
+        .where(and_(table.c.trip_id.in_(trip_ids), table.c.seq.between(lo, hi)))
+    ).tuples())
+    rows = [r for r in rows if (r["trip_id"], r["seq"]) not in existing]
+    if rows:
+        db.session.execute(insert(table), rows)
+    return len(rows)
+
+
+def write_points(points: list) -> int:
+    """Match points to trips and insert them in one transaction; returns rows inserted."""
+    if not points:
+        return 0
+    started = time.perf_counter()
+    if _trips.age() > TRIP_REFRESH_SECONDS:
+        _trips.refresh()
+
+    rows: dict[tuple, dict] = {}
+    unmatched = []
+    for p in points:
+        m = _trips.match(p[0], p[1])
+        if m is None:
+            unmatched.append(p)
+            continue
+        _add_row(rows, m, p)
+    if unmatched and _trips.age() > TRIP_MISS_REFRESH_SECONDS:
+        # a trip may have started since the last refresh
+        _trips.refresh()
+        retry, unmatched = unmatched, []
+        for p in retry:
+            m = _trips.match(p[0], p[1])
+            if m is None:
+                unmatched.append(p)
+            else:
+                _add_row(rows, m, p)
+
+    inserted = 0
+    if rows:
+        values = list(rows.values())
+        for attempt in range(WRITE_RETRIES):
+            try:
+                inserted = _insert(values)
+                db.session.commit()
+                break
+            except OperationalError:
+                db.session.rollback()
+                if attempt == WRITE_RETRIES - 1:
+                    raise
+                time.sleep(0.2 * (attempt + 1))
+
+    _count(
+        inserted=inserted,
+        duplicates=len(points) - len(unmatched) - inserted,
+        unmatched=len(unmatched),
+        batches=1,
+    )
+    _note(
+        last_batch_rows=len(points),
+        last_batch_ms=round((time.perf_counter() - started) * 1000, 1),
+        last_flush_at=datetime.utcnow().isoformat(timespec="seconds"),
+    )
+    return inserted
+
+
+def _add_row(rows: dict, match, p):
+    trip_id, trip_started = match
+    seq = (p[1] - trip_started) // _MS
+    key = (trip_id, seq)
+    if key not in rows:
+        rows[key] = {
+            "trip_id": trip_id,
+            "seq": seq,
+            "recorded_at": p[1],
+            "lat": p[2],
+            "lng": p[3],
+            "speed": p[4],
+            "heading": p[5],
+            "raw_json": p[6],
+        }
+
+
+def _run_writer(app, buf: _Buffer, spool: _Spool):
+    done = 0
+    with app.app_context():
+        while True:
+            batch = buf.take(_batch_size, first_wait=5.0, fill_wait=_flush_seconds)
+            if not batch:
+                if buf.closed:
+                    break
+                continue
+            try:
+                write_points(batch)
+            except Exception as e:
+                db.session.rollback()
+                _count(failed=len(batch))
+                _note(last_error=str(e) or e.__class__.__name__)
+                logger.exception("tracking writer: batch of %s points failed", len(batch))
+                spool.spool_failed(batch)  # the lease holder retries it later
+            finally:
+                db.session.remove()
+            done += len(batch)
+            spool.release(done)
+
+
+# -------------------------
+# Providers (poller)
+# -------------------------
+
+def register_provider(name: str, cls) -> None:
+    """cls(base_url, token).fetch(cursor) -> (list of point dicts, new cursor)."""
+    _providers[(name or "").strip().lower()] = cls
+
+
+class FileProvider:
+    """JSON lines appended to a local file (one point, a list, or {"points": [...]} per line).
+
+    The cursor is the byte offset already read; a shorter file (rotation) restarts at 0.
+    """
+
+    def __init__(self, base_url: str, token: str = ""):
+        self.path = base_url[len("file://"):] if base_url.startswith("file://") else base_url
+
+    def fetch(self, cursor: str | None):
+        offset = int(cursor or 0)
+        size = os.path.getsize(self.path)
+        if size < offset:
+            offset = 0
+        with open(self.path, "rb") as f:
+            f.seek(offset)
+            data = f.read(FILE_READ_BYTES)
+        end = data.rfind(b"\n") + 1  # whole lines only
+        items = []
+        for line in data[:end].splitlines():
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                d = json.loads(line)
+            except ValueError:
+                continue
+            if isinstance(d, dict) and isinstance(d.get("points"), list):
+                uid = _first(d, _DEVICE_KEYS)
+                items.extend({**p, "device_uid": p.get("device_uid") or uid} for p in d["points"] if isinstance(p, dict))
+            elif isinstance(d, list):
+                items.extend(d)
+            else:
+                items.append(d)
+        return items, str(offset + end)
+
+
+class HttpProvider:
+    """GET base_url?since=<cursor> with a bearer token.
+
+    Expects {"points": [...], "cursor": "..."} (or a bare list; the cursor then
+    becomes the newest point time seen).
+    """
+
+    def __init__(self, base_url: str, token: str = ""):
+        self.base_url = base_url
+        self.token = token
+
+    def fetch(self, cursor: str | None):
+        import requests
+
+        headers = {"Accept": "application/json"}
+        if self.token:
+            headers["Authorization"] = f"Bearer {self.token}"
+        params = {"since": cursor} if cursor else {}
+        resp = requests.get(self.base_url, headers=headers, params=params, timeout=HTTP_TIMEOUT)
+        resp.raise_for_status()
+        payload = resp.json()
+        if isinstance(payload, dict):
+            return list(payload.get("points") or []), payload.get("cursor") or cursor
+        items = payload if isinstance(payload, list) else []
+        times = [t for t in (parse_time(_first(d, _TIME_KEYS)) for d in items if isinstance(d, dict)) if t]
+        return items, (max(times).isoformat() + "Z") if times else cursor
+
+
+register_provider("file", FileProvider)
+register_provider("http", HttpProvider)
+
+
+def poll_once() -> int:
+    """Fetch one page from the configured provider and write it; returns points fetched.
+
+    The cursor (TRANSPORT_TRACKING_CURSOR) only advances once the page is stored.
+    """
+    name = (settings_service.get_str("TRANSPORT_TRACKING_PROVIDER") or "").strip().lower()
+    base_url = (settings_service.get_str("TRANSPORT_TRACKING_BASE_URL") or "").strip()
+    cls = _providers.get(name)
+    if cls is None or not base_url:
+        return 0
+    token = settings_service.get_str("TRANSPORT_TRACKING_TOKEN") or ""
+    cursor = settings_service.get_str("TRANSPORT_TRACKING_CURSOR") or None
+
+    items, new_cursor = cls(base_url, token).fetch(cursor)
+    points, _invalid = parse_payload(items)
+    _count(received=len(points))
+    for i in range(0, len(points), _batch_size):
+        write_points(points[i:i + _batch_size])
+    settings_service.set_value("TRANSPORT_TRACKING_CURSOR", None if new_cursor is None else str(new_cursor)[:255])
+    settings_service.set_value("TRANSPORT_TRACKING_LAST_SYNC_AT", datetime.utcnow().isoformat(timespec="seconds"))
+    settings_service.set_value("TRANSPORT_TRACKING_LAST_ERROR", None)
+    db.session.commit()
+    return len(points)
+
+
+# -------------------------
+# Poller lease
+# -------------------------
+
+def _lease_value(expires: int, owner: str) -> str:
+    # fixed-width expiry first, so an expired lease compares lower than "now"
+    return f"{expires:012d} {owner}"[:255]
+
+
+def take_lease(seconds: int) -> bool:
+    """Take or renew the poller lease for this process; False while another process holds it."""
+    now = int(time.time())
+    value = _lease_value(now + seconds, _owner)
+    table = SystemSetting.__table__
+    # own connection: the lease is not a setting (no settings cache invalidation)
+    with db.engine.begin() as conn:
+        taken = conn.execute(
+            update(table)
+            .where(table.c.key == LEASE_KEY)
+            .where(or_(
+                table.c.value.is_(None),
+                table.c.value < f"{now:012d}",
+                func.substr(table.c.value, 14) == _owner,
+            ))
+            .values(value=value)
+        ).rowcount
+        exists = taken or conn.execute(select(table.c.id).where(table.c.key == LEASE_KEY)).first() is not None
+    if exists:
+        return bool(taken)
+    try:
+        with db.engine.begin() as conn:
+            conn.execute(insert(table).values(key=LEASE_KEY, value=value))
+        return True
+    except IntegrityError:
+        return False  # another process inserted it first
+
+
+def release_lease() -> None:
+    table = SystemSetting.__table__
+    with db.engine.begin() as conn:
+        conn.execute(
+            update(table)
+            .where(table.c.key == LEASE_KEY, func.substr(table.c.value, 14) == _owner)
+            .values(value=None)
+        )
+
+
+def lease_holder() -> str | None:
+    """Owner (host:pid) of an unexpired poller lease, else None."""
+    table = SystemSetting.__table__
+    try:
+        with db.engine.connect() as conn:
+            value = conn.execute(select(table.c.value).where(table.c.key == LEASE_KEY)).scalar()
+    except Exception:
+        return None
+    if not value or value[:12] < f"{int(time.time()):012d}":
+        return None
+    return value[13:]
+
+
+def _run_poller(app):
+    with app.app_context():
+        while not _poller_stop.is_set():
+            interval = max(10, settings_service.get_int("TRANSPORT_TRACKING_SYNC_SECONDS", DEFAULT_SYNC_SECONDS))
+            try:
+                leader = take_lease(interval * 3)
+            except Exception as e:
+                logger.warning("tracking poller lease: %s", e)
+                leader = False
+            if not leader:
+                db.session.remove()
+                _poller_stop.wait(interval)
+                continue
+            try:
+                replay_spool()
+            except Exception as e:
+                db.session.rollback()
+                logger.warning("tracking spool replay: %s", e)
+            try:
+                if settings_service.get_bool("TRANSPORT_TRACKING_ENABLED", False):
+                    poll_once()
+            except Exception as e:
+                db.session.rollback()
+                logger.warning("tracking poller: %s", e)
+                try:
+                    settings_service.set_value("TRANSPORT_TRACKING_LAST_ERROR", f"{type(e).__name__}: {e}"[:255])
+                    db.session.commit()
+                except Exception:
+                    db.session.rollback()
+            try:
+                # closed trips past the late-upload window -> one packed track each
+                late = settings_service.get_int("TRACKING_LATE_MINUTES", DEFAULT_LATE_MINUTES)
+                trip_tracks.compact_due(late)
+            except Exception as e:
+                db.session.rollback()
+                logger.warning("trip track compaction: %s", e)
+            finally:
+                db.session.remove()
+            _poller_stop.wait(interval)
+
+
+# -------------------------
+# Push auth
+# -------------------------
+
+def push_token_ok(header_value: str | None) -> bool:
+    """Authorization: Bearer <TRANSPORT_TRACKING_PUSH_TOKEN> (no token configured = push disabled)."""
+    expected = (settings_service.get_str("TRANSPORT_TRACKING_PUSH_TOKEN") or "").strip()
+    got = (header_value or "").strip()
+    if got.lower().startswith("bearer "):
+        got = got[7:].strip()
+    return bool(expected) and hmac.compare_digest(got.encode(), expected.encode())
+
+
+# -------------------------
+# Lifecycle
+# -------------------------
+
+def is_running() -> bool:
+    return _writer is not None and _writer.is_alive()
+
+
+def init_app(app) -> bool:
+    """Start the writer and poller threads for this process (TRACKING_INGEST_THREADS=0 = inline).
+
+    The poller only works while this process holds the lease.
+    """
+    global _buffer, _writer, _poller, _batch_size, _flush_seconds, _spool, _owner, _app
+    if os.getenv("TRACKING_INGEST_THREADS", "1").strip() == "0" or is_running():
+        return False
+    _app = app
+    _owner = f"{socket.gethostname()}:{os.getpid()}"
+    _spool = _Spool(os.path.join(app.instance_path, SPOOL_DIRNAME))
+    with app.app_context():
+        _batch_size = max(1, settings_service.get_int("TRACKING_BATCH_SIZE", DEFAULT_BATCH_SIZE))
+        _flush_seconds = max(10, settings_service.get_int("TRACKING_FLUSH_MS", DEFAULT_FLUSH_MS)) / 1000.0
+        maxsize = max(_batch_size, settings_service.get_int("TRACKING_BUFFER_MAX", DEFAULT_BUFFER_MAX))
+    _buffer = _Buffer(maxsize)
+    _writer = threading.Thread(target=_run_writer, args=(app, _buffer, _spool), daemon=True, name="tracking-writer")
+    _writer.start()
+    _poller_stop.clear()
+    _poller = threading.Thread(target=_run_poller, args=(app,), daemon=True, name="tracking-poller")
+    _poller.start()
+    return True
+
+
+def shutdown(timeout: float = 10.0) -> None:
+    """Stop polling, write what is buffered, stop the writer (unwritten points stay spooled)."""
+    global _writer, _poller
+    _poller_stop.set()
+    buf, t = _buffer, _writer
+    if buf is not None:
+        buf.close()
+    if t is not None and t.is_alive():
+        t.join(timeout)
+    if _app is not None and _poller is not None:
+        try:
+            with _app.app_context():
+                release_lease()
+        except Exception:
+            pass
+    _writer = None
+    _poller = None
+
+
+atexit.register(shutdown)
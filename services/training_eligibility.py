@@ -0,0 +1,272 @@
+# services/training_eligibility.py
+"""Training program conditions compiled to SQL predicates over EmployeeFile.
+
+Each HRTrainingCondition (field code + operator + values) becomes a clause on
+the employee's row; a program's conditions are AND-ed. Queries select from
+User OUTER JOIN EmployeeFile, so:
+
+    eligible_users_select(conds)            -> every eligible user, one query
+    eligible_program_ids(user_id, cond_map) -> every eligible program, one query
+
+Two modes, matching the Python evaluators in portal/routes.py
+(_training_eval_condition / _training_eval_condition_strict):
+- lenient (strict=False): missing employee file, missing / unparsable value,
+  unknown field or unparsable condition values PASS;
+- strict (strict=True): all of those FAIL.
+
+AGE / SERVICE_YEARS compare the stored YYYY-MM-DD string with cutoff dates
+computed for `today` (age >= k  <=>  birth_date <= today minus k years), so
+no date arithmetic runs in SQL. Dates must be zero-padded YYYY-MM-DD (the
+Python parser also accepts 2020-1-5; the SQL treats it as unparsable); a
+trailing " HH:MM:SS" is ignored.
+
+EDU_DEGREE / EDU_SPEC read the employee's most recent EmployeeQualification
+through a correlated subquery.
+
+tools/check_training_eligibility.py cross-checks the compiled predicates
+against the Python evaluators on the current data.
+"""
+
+import math
+from datetime import date
+
+from sqlalchemy import and_, false, func, or_, select, true
+
+from models import EmployeeFile, EmployeeQualification, User
+
+# Field code -> EmployeeFile column (lookup / org ids)
+ID_FIELDS = {
+    "JOB_TITLE": "job_title_lookup_id",
+    "APPOINTMENT_TYPE": "appointment_type_lookup_id",
+    "JOB_CATEGORY": "job_category_lookup_id",
+    "JOB_GRADE": "job_grade_lookup_id",
+    "DIRECTORATE": "directorate_id",
+    "DEPARTMENT": "department_id",
+    "WORK_GOV": "work_governorate_lookup_id",
+    "WORK_LOC": "work_location_lookup_id",
+    "ADMIN_TITLE": "admin_title_lookup_id",
+}
+
+# Field code -> EmployeeFile date column (whole years until today)
+YEARS_FIELDS = {
+    "AGE": "birth_date",
+    "SERVICE_YEARS": "hire_date",
+}
+
+# Field code -> EmployeeQualification column (most recent qualification)
+QUALIFICATION_FIELDS = {
+    "EDU_DEGREE": "degree_lookup_id",
+    "EDU_SPEC": "specialization_lookup_id",
+}
+
+NUMERIC_OPS = ("GT", "LT", "GTE", "LTE")
+
+
+def _to_num(x):
+    s = str(x or "").strip()
+    if not s:
+        return None
+    try:
+        if s.isdigit() or (s.startswith("-") and s[1:].isdigit()):
+            return int(s)
+        v = float(s)
+    except ValueError:
+        return None
+    return v if math.isfinite(v) else None
+
+
+def _int_literal(v1: str):
+    """The int v1 spells, as the Python evaluators compare it (str(x) == v1 or int(v1) == x)."""
+    if v1.isdigit():
+        return int(v1)
+    try:
+        n = int(v1)
+    except ValueError:
+        return None
+    return n if str(n) == v1 else None
+
+
+def condition_code(cond) -> str:
+    try:
+        return ((cond.field_lookup.code if cond.field_lookup else "") or "").strip().upper()
+    except Exception:
+        return ""
+
+
+# -------------------------
+# Value comparisons
+# -------------------------
+
+def _compare(expr, op: str, v1: str, v2: str):
+    """Clause for a non-NULL numeric expr; None when the condition values do not parse."""
+    if op == "BETWEEN":
+        a, b = _to_num(v1), _to_num(v2)
+        if a is None or b is None:
+            return None
+        lo, hi = (a, b) if a <= b else (b, a)
+        return expr.between(lo, hi)
+    if op in NUMERIC_OPS:
+        a = _to_num(v1)
+        if a is None:
+            return None
+        return {"GT": expr > a, "LT": expr < a, "GTE": expr >= a, "LTE": expr <= a}[op]
+    k = _int_literal(v1)
+    if op == "NEQ":
+        return true() if k is None else expr != k
+    return false() if k is None else expr == k
+
+
+def _years_bounds(op: str, v1: str, v2: str):
+    """Whole-years condition as inclusive integer bounds (lo, hi); None = values do not parse,
+    "none" = no integer satisfies it, ("neq", k) for NEQ."""
+    if op == "BETWEEN":
+        a, b = _to_num(v1), _to_num(v2)
+        if a is None or b is None:
+            return None
+        lo, hi = (a, b) if a <= b else (b, a)
+        return math.ceil(lo), math.floor(hi)
+    if op in NUMERIC_OPS:
+        a = _to_num(v1)
+        if a is None:
+            return None
+        if op == "GT":
+            return math.floor(a) + 1, None
+        if op == "GTE":
+            return math.ceil(a), None
+        if op == "LT":
+            return None, math.ceil(a) - 1
+        return None, math.floor(a)
+    k = _int_literal(v1)
+    if op == "NEQ":
+        return ("neq", k)
+    if k is None:
+        return "none"
+    return k, k
+
+
+def _cutoff(today: date, years: int) -> str:
+    # (y, m, d) <= (today.year - years, today.month, today.day); works for Feb 29 as a string
+    return f"{today.year - years:04d}-{today.month:02d}-{today.day:02d}"
+
+
+def _years_clause(day, op: str, v1: str, v2: str, today: date):
+    """Clause on a valid YYYY-MM-DD string `day`: whole years since day vs the condition."""
+    bounds = _years_bounds(op, v1, v2)
+    if bounds is None:
+        return None
+    if bounds == "none":
+        return false()
+    if bounds[0] == "neq":
+        k = bounds[1]
+        if k is None:
+            return true()
+        # years != k  <=>  years >= k + 1 or years <= k - 1
+        return or_(day <= _cutoff(today, k + 1), day > _cutoff(today, k))
+    lo, hi = bounds
+    clauses = []
+    if lo is not None:
+        clauses.append(day <= _cutoff(today, lo))       # years >= lo
+    if hi is not None:
+        clauses.append(day > _cutoff(today, hi + 1))    # years <= hi
+    return and_(*clauses)
+
+
+def _latest_qualification(column: str):
+    col = getattr(EmployeeQualification, column)
+    return (
+        select(col)
+        .where(EmployeeQualification.user_id == EmployeeFile.user_id)
+        .order_by(
+            EmployeeQualification.qualification_date.desc().nullslast(),
+            EmployeeQualification.created_at.desc(),
+        )
+        .limit(1)
+        .correlate(EmployeeFile)
+        .scalar_subquery()
+    )
+
+
+# -------------------------
+# Compile
+# -------------------------
+
+def condition_clause(cond, strict: bool = True, today: date | None = None):
+    """One HRTrainingCondition as a clause over EmployeeFile (outer-joined to User)."""
+    today = today or date.today()
+    code = condition_code(cond)
+    op = (cond.operator or "EQ").strip().upper()
+    v1 = (cond.value1 or "").strip()
+    v2 = (cond.value2 or "").strip()
+    unknown = false() if strict else true()
+
+    if code in YEARS_FIELDS:
+        raw = getattr(EmployeeFile, YEARS_FIELDS[code])
+        text = func.trim(raw)
+        day = func.substr(text, 1, 10)
+        # date(x, '+0 days') normalizes 2000-02-30 to 2000-03-01, so only real dates equal themselves
+        valid = and_(
+            raw.isnot(None),
+            or_(func.length(text) == 10, func.substr(text, 11, 1) == " "),
+            func.coalesce(func.date(day, "+0 days") == day, False),
+        )
+        cmp = _years_clause(day, op, v1, v2, today)
+        if cmp is None:
+            return unknown
+        return and_(valid, cmp) if strict else or_(~valid, cmp)
+
+    if code in ID_FIELDS:
+        expr = getattr(EmployeeFile, ID_FIELDS[code])
+    elif code in QUALIFICATION_FIELDS:
+        expr = _latest_qualification(QUALIFICATION_FIELDS[code])
+    else:
+        return unknown
+
+    cmp = _compare(expr, op, v1, v2)
+    if cmp is None:
+        return unknown
+    return and_(expr.isnot(None), cmp) if strict else or_(expr.is_(None), cmp)
+
+
+def program_clause(conds, strict: bool = True, today: date | None = None):
+    """All conditions AND-ed (no conditions -> true()). Strict needs an employee file."""
+    conds = list(conds or [])
+    if not conds:
+        return true()
+    today = today or date.today()
+    clauses = [condition_clause(c, strict=strict, today=today) for c in conds]
+    if strict:
+        clauses.insert(0, EmployeeFile.user_id.isnot(None))
+    return and_(*clauses)
+
+
+def _users_join(stmt):
+    return stmt.select_from(User).outerjoin(EmployeeFile, EmployeeFile.user_id == User.id)
+
+
+def eligible_users_select(conds, strict: bool = True, today: date | None = None):
+    """SELECT users.id of every user meeting all conditions (add .where() to narrow)."""
+    return _users_join(select(User.id)).where(program_clause(conds, strict=strict, today=today))
+
+
+def is_eligible(session, user_id: int, conds, strict: bool = True, today: date | None = None) -> bool:
+    conds = list(conds or [])
+    if not conds:
+        return True
+    stmt = eligible_users_select(conds, strict=strict, today=today).where(User.id == user_id)
+    return session.execute(select(stmt.exists())).scalar() is True
+
+
+def eligible_program_ids(session, user_id: int, cond_map: dict, strict: bool = True, today: date | None = None) -> set:
+    """{program_id: [conditions]} -> ids of the programs the user meets, in one query."""
+    if not cond_map:
+        return set()
+    today = today or date.today()
+    keys = list(cond_map.keys())
+    cols = [
+        func.coalesce(program_clause(cond_map[pid], strict=strict, today=today), False).label(f"p{i}")
+        for i, pid in enumerate(keys)
+    ]
+    row = session.execute(_users_join(select(*cols)).where(User.id == user_id)).first()
+    if row is None:
+        return set()
+    return {pid for pid, ok in zip(keys, row) if ok}
@@ -0,0 +1,331 @@
+# services/trip_tracks.py
+"""Compact storage of closed trips' GPS tracks (TransportTripTrack).
+
+While a trip is open, services/tracking_ingest.py writes one
+TransportTripPoint row per fix. Once the trip has been closed for longer than
+the late-upload window, compact_due() (run by the tracking poller thread)
+packs those rows into one TransportTripTrack row and deletes them:
+
+- data: the full track as four delta-encoded integer arrays, zlib-compressed:
+  time (ms since base_at), lat / lng (1e-5 degree, ~1 m) and speed (0.1 km/h,
+  -1 = unknown). Heading and raw_json are not kept.
+- simplified: the same encoding for the Douglas-Peucker reduced line
+  (TRANSPORT_TRACK_SIMPLIFY_METERS, default 10 m), which is what the trip
+  track page draws.
+- gps_distance_km: haversine sum over the whole track in one pass (cosines
+  computed once per point), skipping jumps faster than TRANSPORT_TRACK_MAX_KMH.
+
+The odometer cross-check (odometer distance vs GPS distance, tolerance
+TRANSPORT_TRACK_ODOMETER_TOLERANCE_PCT) is computed at compaction and
+refreshed from the stored distance when the trip's odometer is edited. A trip
+without odometer readings gets distance_km from GPS.
+
+Points that arrive after compaction (a reopened trip, a very late upload) are
+merged into the existing track on the next compact_due() run.
+"""
+
+import logging
+import math
+import struct
+import sys
+import zlib
+from array import array
+from datetime import datetime, timedelta
+from itertools import accumulate
+
+from sqlalchemy import delete, select
+
+from extensions import db
+from models import TransportTrip, TransportTripPoint, TransportTripTrack
+from services import settings_service
+
+logger = logging.getLogger(__name__)
+
+FORMAT_VERSION = 1
+COORD_SCALE = 100000  # 1e-5 degree
+SPEED_SCALE = 10      # 0.1 km/h
+NO_SPEED = -1
+
+DEFAULT_SIMPLIFY_METERS = 10.0
+DEFAULT_MAX_KMH = 200.0
+DEFAULT_ODOMETER_TOLERANCE_PCT = 15.0
+COMPACT_BATCH = 50
+
+EARTH_RADIUS_KM = 6371.0088
+
+_HEADER = struct.Struct("<4sBI")  # magic, version, point count
+_MAGIC = b"TTRK"
+_MS = timedelta(milliseconds=1)
+_SWAP = sys.byteorder != "little"
+
+
+# -------------------------
+# Encoding
+# -------------------------
+
+def _delta(values: list, typecode: str) -> bytes:
+    out = array(typecode, [b - a for a, b in zip([0] + values, values)])
+    if _SWAP:
+        out.byteswap()
+    return out.tobytes()
+
+
+def _undelta(buf: bytes, typecode: str) -> list:
+    a = array(typecode)
+    a.frombytes(buf)
+    if _SWAP:
+        a.byteswap()
+    return list(accumulate(a))
+
+
+def encode(times_ms: list, lats: list, lngs: list, speeds: list) -> bytes:
+    """Parallel lists (time offsets in ms, degrees, km/h or None) -> packed blob."""
+    n = len(times_ms)
+    body = b"".join((
+        _delta([int(t) for t in times_ms], "q"),
+        _delta([round(x * COORD_SCALE) for x in lats], "i"),
+        _delta([round(x * COORD_SCALE) for x in lngs], "i"),
+        _delta([NO_SPEED if s is None else round(s * SPEED_SCALE) for s in speeds], "i"),
+    ))
+    return _HEADER.pack(_MAGIC, FORMAT_VERSION, n) + zlib.compress(body, 6)
+
+
+def decode(blob: bytes):
+    """Packed blob -> (times_ms, lats, lngs, speeds) lists."""
+    magic, version, n = _HEADER.unpack_from(blob)
+    if magic != _MAGIC or version != FORMAT_VERSION:
+        raise ValueError(f"unknown track format {magic!r} v{version}")
+    body = zlib.decompress(blob[_HEADER.size:])
+    tq = array("q").itemsize * n
+    ti = array("i").itemsize * n
+    times = _undelta(body[:tq], "q")
+    lats = [v / COORD_SCALE for v in _undelta(body[tq:tq + ti], "i")]
+    lngs = [v / COORD_SCALE for v in _undelta(body[tq + ti:tq + 2 * ti], "i")]
+    speeds = [None if v < 0 else v / SPEED_SCALE for v in _undelta(body[tq + 2 * ti:], "i")]
+    return times, lats, lngs, speeds
+
+
+# -------------------------
+# Geometry
+# -------------------------
+
+def segment_km(lats: list, lngs: list) -> list:
+    """Haversine length of each consecutive segment (n - 1 values)."""
+    if len(lats) < 2:
+        return []
+    phi = [math.radians(x) for x in lats]
+    lam = [math.radians(x) for x in lngs]
+    cos_phi = [math.cos(x) for x in phi]
+    sin, asin, sqrt = math.sin, math.asin, math.sqrt
+    d = 2.0 * EARTH_RADIUS_KM
+    return [
+        d * asin(min(1.0, sqrt(sin((p2 - p1) * 0.5) ** 2 + c1 * c2 * sin((l2 - l1) * 0.5) ** 2)))
+        for p1, p2, l1, l2, c1, c2 in zip(phi, phi[1:], lam, lam[1:], cos_phi, cos_phi[1:])
+    ]
+
+
+def path_km(times_ms: list, lats: list, lngs: list, max_kmh: float | None = None) -> float:
+    """Track length; segments implying more than max_kmh (GPS jumps) are left out."""
+    seg = segment_km(lats, lngs)
+    if max_kmh:
+        limit = max_kmh / 3600000.0  # km per ms
+        seg = [s for s, t1, t2 in zip(seg, times_ms, times_ms[1:]) if s <= limit * max(t2 - t1, 1000)]
+    return math.fsum(seg)
+
+
+def simplify(lats: list, lngs: list, tolerance_m: float) -> list:
+    """Douglas-Peucker; returns the kept indices (first and last always kept)."""
+    n = len(lats)
+    if n <= 2 or tolerance_m <= 0:
+        return list(range(n))
+    # local equirectangular projection (metres) around the first point
+    lat0 = math.radians(lats[0])
+    kx = 111320.0 * math.cos(lat0)
+    ky = 110540.0
+    xs = [(x - lngs[0]) * kx for x in lngs]
+    ys = [(y - lats[0]) * ky for y in lats]
+    tol2 = tolerance_m * tolerance_m
+
+    keep = bytearray(n)
+    keep[0] = keep[n - 1] = 1
+    stack = [(0, n - 1)]
+    while stack:
+        i, j = stack.pop()
+        if j - i < 2:
+            continue
+        ax, ay = xs[i], ys[i]
+        dx, dy = xs[j] - ax, ys[j] - ay
+        seg2 = dx * dx + dy * dy
+        best, best_k = -1.0, -1
+        for k in range(i + 1, j):
+            px, py = xs[k] - ax, ys[k] - ay
+            if seg2 > 0:
+                t = (px * dx + py * dy) / seg2
+                t = 0.0 if t < 0 else (1.0 if t > 1 else t)
+                ex, ey = px - t * dx, py - t * dy
+            else:
+                ex, ey = px, py
+            d2 = ex * ex + ey * ey
+            if d2 > best:
+                best, best_k = d2, k
+        if best > tol2:
+            keep[best_k] = 1
+            stack.append((i, best_k))
+            stack.append((best_k, j))
+    return [k for k in range(n) if keep[k]]
+
+
+def svg_points(lats: list, lngs: list, width: int, height: int, pad: int = 12) -> list:
+    """[(x, y)] fitted into width x height (equirectangular, north up) for an SVG polyline."""
+    if not lats:
+        return []
+    kx = math.cos(math.radians(sum(lats) / len(lats)))
+    xs = [x * kx for x in lngs]
+    min_x, max_x, min_y, max_y = min(xs), max(xs), min(lats), max(lats)
+    scale = min((width - 2 * pad) / ((max_x - min_x) or 1e-9), (height - 2 * pad) / ((max_y - min_y) or 1e-9))
+    return [(round(pad + (x - min_x) * scale, 1), round(height - pad - (y - min_y) * scale, 1)) for x, y in zip(xs, lats)]
+
+
+# -------------------------
+# Odometer cross-check
+# -------------------------
+
+def odometer_check(trip, gps_km: float | None) -> tuple[float | None, str]:
+    """(odometer distance, OK / MISMATCH / NO_ODOMETER)."""
+    if trip.start_odometer is None or trip.end_odometer is None:
+        return None, "NO_ODOMETER"
+    odo_km = max(0.0, float(trip.end_odometer) - float(trip.start_odometer))
+    if gps_km is None:
+        return odo_km, "NO_ODOMETER"
+    tol = max(0.0, settings_service.get_float("TRANSPORT_TRACK_ODOMETER_TOLERANCE_PCT", DEFAULT_ODOMETER_TOLERANCE_PCT))
+    # at least 1 km slack for short trips
+    allowed = max(1.0, max(odo_km, gps_km) * tol / 100.0)
+    return odo_km, ("OK" if abs(odo_km - gps_km) <= allowed else "MISMATCH")
+
+
+def refresh_odometer_check(trip) -> None:
+    """After a trip's odometer is edited: re-check against the stored GPS distance (no decode)."""
+    track = TransportTripTrack.query.filter_by(trip_id=trip.id).first()
+    if track is None:
+        return
+    track.odometer_distance_km, track.odometer_check = odometer_check(trip, track.gps_distance_km)
+    if trip.distance_km is None and track.gps_distance_km is not None:
+        trip.distance_km = round(track.gps_distance_km, 1)
+
+
+# -------------------------
+# Compaction
+# -------------------------
+
+def _point_rows(trip_id: int):
+    return db.session.execute(
+        select(TransportTripPoint.recorded_at, TransportTripPoint.lat, TransportTripPoint.lng, TransportTripPoint.speed)
+        .where(TransportTripPoint.trip_id == trip_id)
+        .order_by(TransportTripPoint.seq.asc())
+    ).all()
+
+
+def _merge(track, rows, base_at: datetime):
+    """Stored track + point rows -> sorted, de-duplicated (times, lats, lngs, speeds)."""
+    by_t = {}
+    for t, lat, lng, speed in rows:
+        if t is None or lat is None or lng is None:
+            continue
+        by_t.setdefault((t - base_at) // _MS, (lat, lng, speed))
+    if track is not None:
+        for t, lat, lng, speed in zip(*decode(track.data)):
+            by_t[t] = (lat, lng, speed)
+    times = sorted(by_t)
+    vals = [by_t[t] for t in times]
+    return times, [v[0] for v in vals], [v[1] for v in vals], [v[2] for v in vals]
+
+
+def compact_trip(trip_id: int):
+    """Pack the trip's point rows (plus any existing track) into its TransportTripTrack
+    and delete the rows. Does not commit; returns the track or None (no points)."""
+    trip = db.session.get(TransportTrip, trip_id)
+    if trip is None:
+        return None
+    track = TransportTripTrack.query.filter_by(trip_id=trip_id).first()
+    base_at = track.base_at if track is not None else trip.started_at
+    times, lats, lngs, speeds = _merge(track, _point_rows(trip_id), base_at)
+    if not times:
+        db.session.execute(delete(TransportTripPoint).where(TransportTripPoint.trip_id == trip_id))
+        return track
+
+    tolerance = max(0.0, settings_service.get_float("TRANSPORT_TRACK_SIMPLIFY_METERS", DEFAULT_SIMPLIFY_METERS))
+    max_kmh = settings_service.get_float("TRANSPORT_TRACK_MAX_KMH", DEFAULT_MAX_KMH)
+    kept = simplify(lats, lngs, tolerance)
+    gps_km = path_km(times, lats, lngs, max_kmh=max_kmh)
+
+    if track is None:
+        track = TransportTripTrack(trip_id=trip_id, base_at=base_at)
+        db.session.add(track)
+    track.data = encode(times, lats, lngs, speeds)
+    track.simplified = encode(
+        [times[k] for k in kept], [lats[k] for k in kept], [lngs[k] for k in kept], [speeds[k] for k in kept]
+    )
+    track.point_count = len(times)
+    track.simplified_count = len(kept)
+    track.simplify_tolerance_m = tolerance
+    track.first_at = base_at + times[0] * _MS
+    track.last_at = base_at + times[-1] * _MS
+    track.gps_distance_km = round(gps_km, 3)
+    track.max_speed = max((s for s in speeds if s is not None), default=None)
+    track.compacted_at = datetime.utcnow()
+
+    track.odometer_distance_km, track.odometer_check = odometer_check(trip, track.gps_distance_km)
+    if trip.distance_km is None:
+        trip.distance_km = round(gps_km, 1)
+
+    db.session.execute(delete(TransportTripPoint).where(TransportTripPoint.trip_id == trip_id))
+    return track
+
+
+def due_trip_ids(late_minutes: int, limit: int = COMPACT_BATCH) -> list:
+    """Closed trips (ended more than late_minutes ago) that still have point rows."""
+    cutoff = datetime.utcnow() - timedelta(minutes=max(0, late_minutes))
+    return list(db.session.execute(
+        select(TransportTripPoint.trip_id)
+        .join(TransportTrip, TransportTrip.id == TransportTripPoint.trip_id)
+        .where(TransportTrip.ended_at.isnot(None), TransportTrip.ended_at <= cutoff)
+        .group_by(TransportTripPoint.trip_id)
+        .limit(limit)
+    ).scalars())
+
+
+def compact_due(late_minutes: int, limit: int = COMPACT_BATCH) -> int:
+    """Compact up to `limit` due trips, one commit per trip; returns trips compacted."""
+    done = 0
+    for trip_id in due_trip_ids(late_minutes, limit):
+        try:
+            compact_trip(trip_id)
+            db.session.commit()
+            done += 1
+        except Exception:
+            db.session.rollback()
+            logger.exception("trip track compaction failed for trip %s", trip_id)
+    return done
+
+
+# -------------------------
+# Reading
+# -------------------------
+
+def load_track(trip, simplified: bool = True):
+    """(times_ms, lats, lngs, speeds) for display, plus the base datetime.
+
+    Closed trips read one blob; an open trip (or points not compacted yet)
+    reads its rows and is simplified on the fly.
+    """
+    track = TransportTripTrack.query.filter_by(trip_id=trip.id).first()
+    rows = _point_rows(trip.id)
+    if track is not None and not rows:
+        return decode(track.simplified if simplified else track.data), track.base_at
+    base_at = track.base_at if track is not None else trip.started_at
+    times, lats, lngs, speeds = _merge(track, rows, base_at)
+    if simplified:
+        tolerance = max(0.0, settings_service.get_float("TRANSPORT_TRACK_SIMPLIFY_METERS", DEFAULT_SIMPLIFY_METERS))
+        kept = simplify(lats, lngs, tolerance)
+        times, lats, lngs, speeds = ([a[k] for k in kept] for a in (times, lats, lngs, speeds))
+    return (times, lats, lngs, speeds), base_at
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+r"""
+Benchmark: one-by-one workflow decisions vs decide_steps_bulk().
+
+Runs against a throwaway SQLite file (never instance/workflow.db):
+- seeds a requester, two ROLE approvers and a 2-step template
+- starts N requests per round and approves step 1 either
+  * sequentially (decide_step + commit per item, like the request page), or
+  * in batches of the given size (single transaction + coalesced notifications)
+
+Prints per-item cost so the effect of batch size is visible.
+
+How to run:
+  python tools/bench_bulk_decisions.py --items 200 --sizes 1,10,50,200
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, BASE_DIR)
+
+from flask import Flask
+
+from extensions import db
+from models import Notification, User, WorkflowRequest, WorkflowTemplate, WorkflowTemplateStep
+from workflow.engine import decide_step, decide_steps_bulk, start_workflow_for_request
+
+
+def _make_app(db_path: str) -> Flask:
+    app = Flask("bench_bulk_decisions")
+    app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{db_path}"
+    app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    db.init_app(app)
+    return app
+
+
+def _seed():
+    requester = User(email="requester@bench.local", password_hash="x", role="EMPLOYEE")
+    approver = User(email="approver@bench.local", password_hash="x", role="BENCH_APPROVER")
+    second = User(email="second@bench.local", password_hash="x", role="BENCH_SECOND")
+    db.session.add_all([requester, approver, second])
+    db.session.flush()
+
+    tpl = WorkflowTemplate(name="Bench", is_active=True, created_by_id=requester.id)
+    db.session.add(tpl)
+    db.session.flush()
+    db.session.add_all([
+        WorkflowTemplateStep(template_id=tpl.id, step_order=1, approver_kind="ROLE", approver_role="BENCH_APPROVER"),
+        WorkflowTemplateStep(template_id=tpl.id, step_order=2, approver_kind="ROLE", approver_role="BENCH_SECOND"),
+    ])
+    db.session.commit()
+    return requester, approver, tpl
+
+
+def _start_requests(requester, tpl, n: int) -> list[int]:
+    ids = []
+    for i in range(n):
+        req = WorkflowRequest(title=f"Bench #{i}", status="IN_PROGRESS", requester_id=requester.id)
+        db.session.add(req)
+        db.session.flush()
+        start_workflow_for_request(req, tpl, requester.id)
+        ids.append(req.id)
+    db.session.commit()
+    return ids
+
+
+def run(items: int, sizes: list[int]):
+    fd, path = tempfile.mkstemp(suffix=".db", prefix="bench_bulk_")
+    os.close(fd)
+    app = _make_app(path)
+    try:
+        with app.app_context():
+            db.create_all()
+            requester, approver, tpl = _seed()
+
+            print(f"{'mode':<14}{'items':>7}{'total ms':>11}{'ms/item':>10}{'notifs':>9}")
+
+            ids = _start_requests(requester, tpl, items)
+            n0 = Notification.query.count()
+            t0 = time.perf_counter()
+            for rid in ids:
+                decide_step(rid, 1, approver.id, "APPROVED", note="ok", auto_commit=True)
+            dt = (time.perf_counter() - t0) * 1000
+            print(f"{'sequential':<14}{items:>7}{dt:>11.1f}{dt / items:>10.2f}{Notification.query.count() - n0:>9}")
+
+            for size in sizes:
+                ids = _start_requests(requester, tpl, items)
+                n0 = Notification.query.count()
+                t0 = time.perf_counter()
+                for k in range(0, len(ids), size):
+                    chunk = ids[k:k + size]
+                    results = decide_steps_bulk([(rid, 1, "APPROVED", "ok") for rid in chunk], approver.id)
+                    bad = [r for r in results if not r["ok"]]
+                    if bad:
+                        raise SystemExit(f"bulk decision failed: {bad[:3]}")
+                dt = (time.perf_counter() - t0) * 1000
+                print(f"{'bulk x' + str(size):<14}{items:>7}{dt:>11.1f}{dt / items:>10.2f}{Notification.query.count() - n0:>9}")
+    finally:
+        for suffix in ("", "-wal", "-shm", "-journal"):
+            try:
+                os.remove(path + suffix)
+            except OSError:
+                pass
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark bulk workflow decisions")
+    ap.add_argument("--items", type=int, default=200)
+    ap.add_argument("--sizes", default="1,10,50,200")
+    args = ap.parse_args()
+    sizes = [int(x) for x in args.sizes.split(",") if x.strip()]
+    run(args.items, sizes)
+
+
+if __name__ == "__main__":
+    main()
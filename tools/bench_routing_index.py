@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+r"""
+Benchmark: legacy routing-rule selection vs the compiled routing index.
+
+Runs against a throwaway SQLite file (never instance/workflow.db):
+- seeds an org (directorates/departments + an OrgNode tree), request types,
+  templates, N users and M routing rules with random scopes
+- legacy: per call, load the active rules of the request type, walk the node
+  ancestors one query per level, filter + sort with specificity_score()
+  (the pre-index _select_template_for), timed on a sample of users
+- indexed: routing_index.match() for every (user, request type) pair
+
+Both paths are compared on the sample; any mismatch aborts.
+
+How to run:
+  python tools/bench_routing_index.py --rules 10000 --users 5000 --legacy-sample 300
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, BASE_DIR)
+
+from flask import Flask
+from sqlalchemy import insert
+
+from extensions import db
+from models import (
+    Department,
+    Directorate,
+    OrgNode,
+    OrgNodeType,
+    Organization,
+    RequestType,
+    User,
+    WorkflowRoutingRule,
+    WorkflowTemplate,
+)
+from utils.org_dynamic import ensure_dynamic_org_seed
+from workflow import routing_index
+
+
+def _make_app(db_path: str) -> Flask:
+    app = Flask("bench_routing_index")
+    app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{db_path}"
+    app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    db.init_app(app)
+    return app
+
+
+def _seed(rng: random.Random, n_rules: int, n_users: int, n_types: int):
+    ensure_dynamic_org_seed()
+
+    org = Organization(name_ar="Bench Org")
+    db.session.add(org)
+    db.session.flush()
+    dirs = [Directorate(organization_id=org.id, name_ar=f"D{i}") for i in range(20)]
+    db.session.add_all(dirs)
+    db.session.flush()
+    depts = [Department(directorate_id=rng.choice(dirs).id, name_ar=f"Dept{i}") for i in range(120)]
+    db.session.add_all(depts)
+    db.session.flush()
+
+    # OrgNode tree: 1 root, 20 children, 120 grandchildren, 600 leaves
+    type_id = OrgNodeType.query.first().id
+    levels = [[OrgNode(type_id=type_id, name_ar="root")]]
+    db.session.add(levels[0][0])
+    db.session.flush()
+    for size in (20, 120, 600):
+        level = [OrgNode(type_id=type_id, parent_id=rng.choice(levels[-1]).id, name_ar="n") for _ in range(size)]
+        db.session.add_all(level)
+        db.session.flush()
+        levels.append(level)
+    node_ids = [n.id for lvl in levels for n in lvl]
+
+    rts = [RequestType(code=f"RT{i}", name_ar=f"RT{i}") for i in range(n_types)]
+    tpls = [WorkflowTemplate(name=f"T{i}", is_active=True) for i in range(50)]
+    db.session.add_all(rts + tpls)
+    db.session.flush()
+
+    db.session.execute(insert(User), [
+        dict(
+            email=f"u{i}@bench.local", password_hash="x", role="EMPLOYEE",
+            department_id=(dp := rng.choice(depts)).id,
+            directorate_id=(dp.directorate_id if rng.random() < 0.5 else None),
+            org_node_id=(rng.choice(node_ids) if rng.random() < 0.8 else None),
+        )
+        for i in range(n_users)
+    ])
+
+    rules = []
+    for _ in range(n_rules):
+        dp = rng.choice(depts)
+        r = dict(
+            request_type_id=rng.choice(rts).id,
+            template_id=rng.choice(tpls).id,
+            organization_id=org.id if rng.random() < 0.3 else None,
+            directorate_id=dp.directorate_id if rng.random() < 0.3 else None,
+            department_id=dp.id if rng.random() < 0.3 else None,
+            org_node_id=rng.choice(node_ids) if rng.random() < 0.4 else None,
+            match_subtree=rng.random() < 0.7,
+            priority=rng.choice((10, 50, 100, 100, 200)),
+            is_active=rng.random() < 0.95,
+        )
+        rules.append(r)
+    db.session.execute(insert(WorkflowRoutingRule), rules)
+    db.session.commit()
+    return [rt.id for rt in rts]
+
+
+def _legacy_select(user, request_type_id: int):
+    """The pre-index _select_template_for (hierarchy + ancestor walk + Python filter/sort)."""
+    dept_id = user.department_id
+    dir_id = user.directorate_id
+    if dir_id is None and dept_id:
+        dept = db.session.get(Department, int(dept_id))
+        dir_id = int(dept.directorate_id or 0) or None if dept else None
+    org_id = None
+    if dir_id:
+        d = db.session.get(Directorate, int(dir_id))
+        org_id = d.organization_id if d else None
+
+    user_node_id = user.org_node_id
+    anc = set()
+    cur = user_node_id
+    while cur and cur not in anc:
+        anc.add(cur)
+        cur = db.session.query(OrgNode.parent_id).filter(OrgNode.id == cur).scalar()
+
+    candidates = []
+    for r in WorkflowRoutingRule.query.filter_by(request_type_id=request_type_id, is_active=True).all():
+        if r.org_node_id is not None:
+            if not user_node_id:
+                continue
+            if r.match_subtree:
+                if int(r.org_node_id) not in anc:
+                    continue
+            elif int(r.org_node_id) != int(user_node_id):
+                continue
+        if r.organization_id is not None and r.organization_id != org_id:
+            continue
+        if r.directorate_id is not None and r.directorate_id != dir_id:
+            continue
+        if r.department_id is not None and r.department_id != dept_id:
+            continue
+        candidates.append(r)
+    if not candidates:
+        return None
+    candidates.sort(key=lambda x: (-x.specificity_score(), int(x.priority or 100), -int(x.id or 0)))
+    return candidates[0].id
+
+
+def run(n_rules: int, n_users: int, n_types: int, legacy_sample: int, seed: int):
+    rng = random.Random(seed)
+    fd, path = tempfile.mkstemp(suffix=".db", prefix="bench_routing_")
+    os.close(fd)
+    app = _make_app(path)
+    try:
+        with app.app_context():
+            db.create_all()
+            rt_ids = _seed(rng, n_rules, n_users, n_types)
+            users = User.query.all()
+            print(f"rules={n_rules} users={len(users)} request_types={n_types}")
+
+            t0 = time.perf_counter()
+            routing_index.invalidate()
+            routing_index.get_snapshot()
+            print(f"compile index: {(time.perf_counter() - t0) * 1000:.1f} ms")
+
+            ctxs = {u.id: routing_index.user_context(u) for u in users}
+            pairs = [(u, rng.choice(rt_ids)) for u in users]
+
+            t0 = time.perf_counter()
+            picked = {u.id: routing_index.match(rt, ctxs[u.id]) for u, rt in pairs}
+            dt = (time.perf_counter() - t0) * 1000
+            print(f"{'indexed':<10}{len(pairs):>7} calls {dt:>10.1f} ms {dt * 1000 / len(pairs):>9.1f} us/call")
+
+            sample = pairs[:legacy_sample]
+            t0 = time.perf_counter()
+            legacy = {u.id: _legacy_select(u, rt) for u, rt in sample}
+            dt = (time.perf_counter() - t0) * 1000
+            print(f"{'legacy':<10}{len(sample):>7} calls {dt:>10.1f} ms {dt * 1000 / max(1, len(sample)):>9.1f} us/call")
+
+            bad = [
+                (u.id, rt, legacy[u.id], picked[u.id].id if picked[u.id] else None)
+                for u, rt in sample
+                if legacy[u.id] != (picked[u.id].id if picked[u.id] else None)
+            ]
+            if bad:
+                raise SystemExit(f"index disagrees with legacy selection: {bad[:5]}")
+            print(f"verified {len(sample)} selections against legacy")
+    finally:
+        for suffix in ("", "-wal", "-shm", "-journal"):
+            try:
+                os.remove(path + suffix)
+            except OSError:
+                pass
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark routing-rule template selection")
+    ap.add_argument("--rules", type=int, default=10000)
+    ap.add_argument("--users", type=int, default=5000)
+    ap.add_argument("--types", type=int, default=20)
+    ap.add_argument("--legacy-sample", type=int, default=300)
+    ap.add_argument("--seed", type=int, default=1)
+    args = ap.parse_args()
+    run(args.rules, args.users, args.types, args.legacy_sample, args.seed)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+r"""
+Check: fail when a page lazy-loads the same relationship once per row (N+1).
+
+Requests each URL with the Flask test client (GET only) as the given user
+and counts per-row lazy loads by relationship (utils.loader_profiles
+.NPlusOneDetector). Any relationship loaded lazily more than --threshold
+times in one request is reported and the script exits with status 1, so it
+can gate CI or a pre-release check.
+
+Runs against the app's configured database (instance/workflow.db); use a
+copy with realistic data - empty tables cannot show N+1 patterns.
+
+How to run:
+  python tools/check_n_plus_one.py --user admin@example.com
+  python tools/check_n_plus_one.py --user admin@example.com --threshold 3 /portal/transport/trips /messages/inbox
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, BASE_DIR)
+
+from app import app
+from models import User
+from utils.loader_profiles import NPlusOneDetector
+
+DEFAULT_URLS = [
+    "/portal/transport/trips",
+    "/portal/transport/permits",
+    "/portal/transport/tasks",
+    "/portal/transport/maintenance",
+    "/portal/transport/fuel",
+    "/messages/inbox",
+    "/messages/sent",
+    "/audit/timeline",
+    "/admin/workflow-routing",
+    "/admin/escalations",
+    "/archive/shared-files",
+    "/portal/admin/access-requests",
+    "/portal/admin/hr/performance/cycles",
+    "/portal/hr/approvals?status=ALL",
+    "/portal/hr/alerts",
+    "/portal/hr/leaves/admin",
+    "/portal/hr/leaves/report",
+    "/portal/hr/me/permissions",
+    "/portal/hr/missions",
+    "/portal/hr/occasions",
+    "/portal/hr/attendance/closing",
+    "/portal/hr/attendance/daily",
+    "/portal/hr/attendance/monthly-schedule",
+    "/portal/hr/deductions/log",
+    "/portal/hr/discipline",
+    "/portal/hr/docs",
+    "/portal/hr/training/log",
+    "/portal/hr/org-structure?include_people=1",
+    "/portal/hr/reports/employees/promotions",
+    "/portal/hr/reports/employees/retirement",
+    "/portal/corr/inbound",
+    "/portal/corr/outbound",
+    "/portal/inventory/requests",
+    "/portal/inventory/vouchers/inbound/list",
+    "/portal/inventory/vouchers/issue/list",
+    "/portal/inventory/vouchers/return/list",
+    "/portal/inventory/vouchers/scrap/list",
+    "/portal/inventory/vouchers/stocktake/list",
+    "/portal/inventory/custody/vouchers/list",
+    "/portal/inventory/custody/overview",
+    "/portal/inventory/custody/items",
+    "/portal/inventory/reports/issue-log",
+    "/portal/store",
+]
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("urls", nargs="*", default=DEFAULT_URLS)
+    ap.add_argument("--user", required=True, help="email of the user to request the pages as")
+    ap.add_argument("--threshold", type=int, default=5, help="max lazy loads per relationship per request")
+    args = ap.parse_args()
+
+    with app.app_context():
+        user = User.query.filter(User.email == args.user).first()
+        if not user:
+            print(f"user not found: {args.user}")
+            return 2
+        user_id = user.id
+
+    client = app.test_client()
+    with client.session_transaction() as s:
+        s["_user_id"] = str(user_id)
+        s["_fresh"] = True
+
+    # The first portal request runs one-time schema bootstraps that commit and
+    # expire the rows already loaded; keep that out of the measured requests.
+    client.get("/portal/")
+
+    failed = 0
+    for url in args.urls:
+        with NPlusOneDetector(threshold=args.threshold) as d:
+            resp = client.get(url)
+        offenders = d.offenders()
+        lazy_total = sum(d.counts.values())
+        status = "FAIL" if offenders else "ok"
+        print(f"{status:4}  {resp.status_code}  {url}  ({lazy_total} lazy load(s))")
+        for rel, n in offenders:
+            print(f"        {rel}: {n}")
+        if offenders:
+            failed += 1
+
+    if failed:
+        print(f"\n{failed} page(s) with N+1 relationship loads")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
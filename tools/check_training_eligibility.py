@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+r"""
+Check: the SQL training eligibility predicates agree with the Python evaluators.
+
+For every training program that has conditions, and every user, compares
+services.training_eligibility (is_eligible and eligible_users_select, in
+lenient and strict mode) with portal.routes._training_eval_condition /
+_training_eval_condition_strict. Mismatches are printed and the script
+exits with status 1.
+
+Runs against the app's configured database (instance/workflow.db); use a
+copy with realistic employee files and conditions.
+
+How to run:
+  python tools/check_training_eligibility.py
+  python tools/check_training_eligibility.py --program 12 --limit 20
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, BASE_DIR)
+
+from app import app
+from extensions import db
+from models import EmployeeFile, HRTrainingCondition, User
+from portal.routes import _training_eval_condition, _training_eval_condition_strict
+from services import training_eligibility
+
+
+def _python_eligible(ef, conds, strict: bool) -> bool:
+    if strict:
+        return ef is not None and all(_training_eval_condition_strict(ef, c) for c in conds)
+    return all(_training_eval_condition(ef, c) for c in conds)
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--program", type=int, action="append", help="program id (repeatable); default: all with conditions")
+    ap.add_argument("--limit", type=int, default=50, help="max mismatches printed (default 50)")
+    args = ap.parse_args()
+
+    with app.app_context():
+        cond_map: dict[int, list] = {}
+        for c in HRTrainingCondition.query.order_by(HRTrainingCondition.id.asc()).all():
+            if args.program and c.program_id not in args.program:
+                continue
+            cond_map.setdefault(c.program_id, []).append(c)
+
+        users = User.query.order_by(User.id.asc()).all()
+        files = {ef.user_id: ef for ef in EmployeeFile.query.all()}
+
+        checked = 0
+        mismatches = []
+        for strict in (False, True):
+            for pid, conds in cond_map.items():
+                in_sql = set(db.session.execute(
+                    training_eligibility.eligible_users_select(conds, strict=strict)
+                ).scalars())
+                for u in users:
+                    expected = _python_eligible(files.get(u.id), conds, strict)
+                    one = training_eligibility.is_eligible(db.session, u.id, conds, strict=strict)
+                    checked += 1
+                    if one != expected or (u.id in in_sql) != expected:
+                        mismatches.append((pid, u.id, strict, expected, one, u.id in in_sql))
+
+        for pid, uid, strict, expected, one, listed in mismatches[:args.limit]:
+            mode = "strict" if strict else "lenient"
+            print(f"program {pid} user {uid} ({mode}): python={expected} is_eligible={one} select={listed}")
+
+        print(f"{len(cond_map)} program(s), {len(users)} user(s), {checked} check(s), {len(mismatches)} mismatch(es)")
+        return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
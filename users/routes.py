@@ -7,6 +7,7 @@ from . import users_bp
 from extensions import db
 from permissions import roles_required
 from models import User, AuditLog, Department, Directorate, Unit, Section, Division, Organization, Role, EmployeeFile, EmployeeAttachment
+from services import audit_writer
 from utils.events import emit_event
 
 from utils import system_search
@@ -400,13 +401,13 @@ def _validate_role(role: str) -> bool:
     r = Role.query.filter_by(code=role).first()
     return bool(r and r.is_active)
 def _audit(action: str, target_user: User, note: str):
-    db.session.add(AuditLog(
+    audit_writer.add(
         action=action,
         user_id=current_user.id,
         target_type="User",
         target_id=target_user.id,
         note=note
-    ))
+    )
 
 
 @users_bp.route("/")
@@ -0,0 +1,230 @@
+# utils/loader_profiles.py
+"""Named relationship-loading profiles, applied per query.
+
+Relationships in models.py load lazily ("select") so counts, .first() and
+id-only queries no longer drag in multi-table joins. Views ask for what they
+render instead:
+
+    TransportTrip.query.options(*loader_profiles.options(TransportTrip, "list"))
+
+A profile is a list of dotted relationship paths ("permit.vehicle").
+Many-to-one steps become joinedload (one row per parent, no fan-out),
+collections selectinload.
+
+Profiles are keyed by model *name* to avoid importing models here (same as
+utils/portal_query.py). Conventional names: "list", "detail", "export".
+
+NPlusOneDetector counts per-row lazy loads by relationship; tools/
+check_n_plus_one.py uses it to fail on routes that issue N+1 queries.
+"""
+
+from __future__ import annotations
+
+import threading
+from collections import Counter
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session, joinedload, selectinload
+
+PROFILES: dict[str, dict[str, tuple[str, ...]]] = {
+    "TransportTrip": {
+        "list": ("vehicle", "driver"),
+        "detail": ("vehicle", "driver", "permit", "created_by"),
+        "export": ("vehicle", "driver", "permit", "created_by"),
+    },
+    "TransportTripPoint": {
+        "list": (),
+        "detail": ("trip.vehicle", "trip.driver"),
+    },
+    "TransportPermit": {
+        "list": ("requester", "vehicle", "driver", "origin_zone", "dest_zone"),
+        "detail": ("requester", "approver", "vehicle", "driver", "origin_zone", "dest_zone"),
+    },
+    "TransportDriverTask": {
+        "list": ("driver",),
+        "detail": ("driver", "permit", "trip", "created_by"),
+    },
+    "TransportMaintenance": {
+        "list": ("vehicle", "garage_lookup"),
+        "detail": ("vehicle", "garage_lookup", "created_by"),
+    },
+    "TransportMaintenanceItem": {
+        "list": ("maintenance_type_lookup",),
+    },
+    "TransportFuelFill": {
+        "list": ("vehicle", "station_lookup", "payment_method_lookup"),
+    },
+    "Message": {
+        "list": ("recipients.recipient",),
+        "detail": ("sender", "recipients.recipient"),
+    },
+    "HRLeaveRequest": {
+        "list": ("user", "leave_type", "admin_status"),
+        "export": ("user", "leave_type", "approver_user"),
+    },
+    "HRPermissionRequest": {
+        "list": ("user", "permission_type", "approver_user"),
+    },
+    "HROfficialMission": {
+        "list": ("user", "status_def"),
+    },
+    "HROfficialOccasionRange": {
+        "list": ("type", "work_governorate_lookup", "work_location_lookup"),
+    },
+    "HRAttendanceClosing": {
+        "list": ("created_by", "work_governorate", "work_location"),
+    },
+    "AttendanceDailySummary": {
+        "list": ("user", "schedule"),
+        "export": ("user", "schedule"),
+    },
+    "WorkAssignment": {
+        "list": ("schedule", "created_by"),
+    },
+    "HRAttendanceDeductionRun": {
+        "list": ("created_by",),
+    },
+    "HRDisciplinaryCase": {
+        "list": ("employee",),
+    },
+    "HRDoc": {
+        "list": ("created_by",),
+    },
+    "HRTrainingProgram": {
+        "list": ("course", "country_lookup"),
+    },
+    "HRPerformanceCycle": {
+        "list": ("form",),
+    },
+    "PortalAccessRequest": {
+        "list": ("user", "assigned_to"),
+    },
+    "StoreFile": {
+        "list": ("category", "uploader"),
+    },
+    "HRAttendanceDeductionItem": {
+        "export": ("run", "user.employee_file"),
+    },
+    "RequestEscalation": {
+        "list": ("from_user", "to_user"),
+        "export": ("from_user", "to_user"),
+    },
+    "WorkflowRoutingRule": {
+        "list": ("request_type", "template", "organization", "directorate", "department", "org_node.type"),
+        "export": ("request_type", "template", "organization", "directorate", "department", "org_node.type"),
+    },
+    "OrgUnitManager": {
+        "list": ("manager_user", "deputy_user"),
+    },
+    "OrgNodeAssignment": {
+        "list": ("user",),
+    },
+    "EmployeeFile": {
+        "list": ("user",),
+    },
+    "InvRequest": {
+        "list": ("department", "work_location", "entered_by"),
+    },
+    "InvInboundVoucher": {
+        "list": ("to_warehouse",),
+    },
+    "InvIssueVoucher": {
+        "list": ("from_warehouse", "to_warehouse"),
+    },
+    "InvIssueVoucherLine": {
+        "list": ("item",),
+    },
+    "InvReturnVoucher": {
+        "list": ("to_warehouse",),
+    },
+    "InvScrapVoucher": {
+        "list": ("from_warehouse",),
+    },
+    "InvStocktakeVoucher": {
+        "list": ("warehouse", "created_by"),
+    },
+    "InvCustodyVoucher": {
+        "list": ("holder_user", "holder_room"),
+    },
+    "InvCustodyVoucherLine": {
+        "list": ("item",),
+    },
+    "FilePermission": {
+        "list": ("file", "user"),
+    },
+    "AuditLog": {
+        "list": ("user", "on_behalf_of_user"),
+        "export": ("user", "on_behalf_of_user"),
+    },
+}
+
+_lock = threading.Lock()
+_built: dict[tuple[type, str], tuple] = {}
+
+
+def _path_option(model, path: str):
+    opt = None
+    cls = model
+    for key in path.split("."):
+        rel = inspect(cls).relationships[key]
+        attr = getattr(cls, key)
+        if opt is None:
+            opt = selectinload(attr) if rel.uselist else joinedload(attr)
+        else:
+            opt = opt.selectinload(attr) if rel.uselist else opt.joinedload(attr)
+        cls = rel.mapper.class_
+    return opt
+
+
+def options(model, profile: str = "list") -> tuple:
+    """Loader options for model / profile (unknown profile -> no options)."""
+    key = (model, profile)
+    opts = _built.get(key)
+    if opts is None:
+        paths = PROFILES.get(model.__name__, {}).get(profile, ())
+        opts = tuple(_path_option(model, p) for p in paths)
+        with _lock:
+            _built[key] = opts
+    return opts
+
+
+# -------------------------
+# N+1 detection
+# -------------------------
+
+_local = threading.local()
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _count_lazy_loads(orm_execute_state):
+    counts = getattr(_local, "counts", None)
+    if counts is None or orm_execute_state.lazy_loaded_from is None:
+        return
+    path = orm_execute_state.loader_strategy_path
+    if path:
+        counts[str(path[-1])] += 1
+
+
+class NPlusOneDetector:
+    """Count lazy loads per relationship in this thread while active.
+
+        with NPlusOneDetector(threshold=5) as d:
+            client.get("/portal/transport/trips")
+        d.offenders()  # [("TransportTrip.vehicle", 40), ...]
+    """
+
+    def __init__(self, threshold: int = 5):
+        self.threshold = threshold
+        self.counts: Counter = Counter()
+
+    def __enter__(self):
+        self.counts = Counter()
+        _local.counts = self.counts
+        return self
+
+    def __exit__(self, *exc):
+        _local.counts = None
+        return False
+
+    def offenders(self) -> list[tuple[str, int]]:
+        return [(k, n) for k, n in self.counts.most_common() if n > self.threshold]
@@ -4,29 +4,24 @@ from datetime import datetime
 import json
 
 from sqlalchemy import inspect, text as sa_text
-from sqlalchemy.orm import selectinload
 
 from extensions import db
 from models import (
-    SystemSetting,
     OrgNodeType, OrgNode, OrgNodeManager, OrgNodeAssignment,
     Organization, Directorate, Unit, Department, Section, Division, Team,
-    OrgUnitManager, OrgUnitAssignment,
+    OrgUnitManager, OrgUnitAssignment, User,
 )
+from services import settings_service
+from utils import loader_profiles
+from utils import org_tree
 
 
 def _get_setting(key: str) -> str | None:
-    row = SystemSetting.query.filter_by(key=key).first()
-    return (row.value if row else None)
+    return settings_service.get(key)
 
 
 def _set_setting(key: str, value: str):
-    row = SystemSetting.query.filter_by(key=key).first()
-    if not row:
-        row = SystemSetting(key=key, value=value, created_at=datetime.utcnow())
-        db.session.add(row)
-    else:
-        row.value = value
+    settings_service.set_value(key, value)
 
 
 DEFAULT_TYPES = [
@@ -143,18 +138,8 @@ def sync_legacy_now():
 
 
 def get_node_ancestor_ids(node_id: int) -> set[int]:
-    """Return {node_id, parent_id, ...} up to root."""
-    ids: set[int] = set()
-    cur = int(node_id) if node_id else None
-    guard = 0
-    while cur and guard < 200:
-        if cur in ids:
-            break
-        ids.add(cur)
-        parent = db.session.query(OrgNode.parent_id).filter(OrgNode.id == cur).scalar()
-        cur = parent
-        guard += 1
-    return ids
+    """Return {node_id, parent_id, ...} up to root (cached org tree, no SQL when warm)."""
+    return set(org_tree.ancestor_ids(node_id))
 
 
 def resolve_user_org_node_id(user) -> int | None:
@@ -210,27 +195,19 @@ def build_chart_tree(include_people: bool = False) -> list[dict]:
     """
     ensure_dynamic_org_seed()
 
-    types = OrgNodeType.query.filter_by(is_active=True).all()
-    type_by_id = {t.id: t for t in types}
-
-    nodes = (
-        OrgNode.query
-        .filter(OrgNode.is_active == True)
-        .order_by(OrgNode.parent_id.asc().nullslast(), OrgNode.type_id.asc(), OrgNode.sort_order.asc().nullslast(), OrgNode.name_ar.asc())
-        .all()
-    )
-
-    node_by_id = {n.id: n for n in nodes}
-    children_map: dict[int | None, list[int]] = {}
-    for n in nodes:
-        children_map.setdefault(n.parent_id, []).append(n.id)
+    snap = org_tree.get_snapshot()
 
     mgr_rows = OrgNodeManager.query.all()
     mgr_map = {m.node_id: m for m in mgr_rows}
 
     people_map: dict[int, list[dict]] = {}
     if include_people:
-        assigns = OrgNodeAssignment.query.order_by(OrgNodeAssignment.is_primary.desc(), OrgNodeAssignment.id.asc()).all()
+        assigns = (
+            OrgNodeAssignment.query
+            .options(*loader_profiles.options(OrgNodeAssignment, "list"))
+            .order_by(OrgNodeAssignment.is_primary.desc(), OrgNodeAssignment.id.asc())
+            .all()
+        )
         for a in assigns:
             if not a.user:
                 continue
@@ -261,14 +238,15 @@ def build_chart_tree(include_people: bool = False) -> list[dict]:
         return u.full_name if u else None
 
     def _build(node_id: int):
-        n = node_by_id.get(node_id)
+        n = snap.nodes.get(node_id)
         if not n:
             return []
-        t = type_by_id.get(n.type_id)
-        visible = bool(t and t.show_in_chart)
+        type_id, _pid, name_ar, name_en, code, _sort, _active = n
+        t = snap.types.get(type_id)
+        visible = bool(t and t["is_active"] and t["show_in_chart"])
 
         kids_out: list[dict] = []
-        for cid in children_map.get(node_id, []):
+        for cid in snap.active_children.get(node_id, ()):
             built = _build(cid)
             if isinstance(built, list):
                 kids_out.extend(built)
@@ -280,17 +258,33 @@ def build_chart_tree(include_people: bool = False) -> list[dict]:
 
         mgr = mgr_map.get(node_id)
         return {
-            "id": n.id,
-            "type": (t.code if t else "NODE"),
-            "name_ar": n.name_ar,
-            "name_en": n.name_en,
-            "code": n.code,
+            "id": node_id,
+            "type": (t["code"] if t else "NODE"),
+            "name_ar": name_ar,
+            "name_en": name_en,
+            "code": code,
             "manager": _mgr_name(getattr(mgr, "manager_user_id", None)),
             "deputy": _mgr_name(getattr(mgr, "deputy_user_id", None)),
             "members": people_map.get(node_id, []) if include_people else [],
             "children": kids_out,
         }
 
+    # Roots: active nodes without an active parent
+    roots: list[int] = []
+    for pid, ids in sorted(snap.active_children.items(), key=lambda kv: (kv[0] is not None, kv[0] or 0)):
+        if pid is None or not (pid in snap.nodes and snap.nodes[pid][6]):
+            roots.extend(ids)
+
+    out: list[dict] = []
+    for rid in roots:
+        built = _build(rid)
+        if isinstance(built, list):
+            out.extend(built)
+        else:
+            out.append(built)
+
+    return out
+
 
 def build_org_node_picker_tree(mode: str = "all") -> list[dict]:
     """Build a nested tree for *picking* an OrgNode in UI.
@@ -302,96 +296,47 @@ def build_org_node_picker_tree(mode: str = "all") -> list[dict]:
       - routes:    OrgNodeType.show_in_routes
       - chart:     OrgNodeType.show_in_chart
       - all:       all active nodes eligible
+
+    Built from the cached org tree snapshot and reused until the org changes
+    (the returned list is shared: do not mutate it).
     """
     ensure_dynamic_org_seed()
 
     m = (mode or "all").strip().lower()
+    return org_tree.snapshot_memo(("picker", m), lambda snap: _picker_tree(snap, m))
 
-    nodes = (
-        OrgNode.query
-        .options(selectinload(OrgNode.type))
-        .filter(OrgNode.is_active == True)
-        .order_by(
-            OrgNode.parent_id.asc().nullslast(),
-            OrgNode.type_id.asc(),
-            OrgNode.sort_order.asc().nullslast(),
-            OrgNode.name_ar.asc(),
-        )
-        .all()
-    )
 
-    children_map: dict[int | None, list[OrgNode]] = {}
-    for n in nodes:
-        children_map.setdefault(n.parent_id, []).append(n)
-
-    def _eligible(n: OrgNode) -> bool:
-        t = getattr(n, "type", None)
-        if m == "approvals":
-            return bool(t and getattr(t, "allow_in_approvals", False))
-        if m == "routes":
-            return bool(t and getattr(t, "show_in_routes", False))
-        if m == "chart":
-            return bool(t and getattr(t, "show_in_chart", False))
-        return True
-
-    def to_dict(n: OrgNode) -> dict | None:
-        t = getattr(n, "type", None)
-        type_name = (t.name_ar if t else "")
-        type_code = (t.code if t else "")
-        label = f"{(type_name or type_code).strip()} — {n.name_ar}".strip(" —")
-        children = [to_dict(ch) for ch in children_map.get(n.id, [])]
+def _picker_tree(snap, m: str) -> list[dict]:
+    flag = {"approvals": "allow_in_approvals", "routes": "show_in_routes", "chart": "show_in_chart"}.get(m)
+
+    def to_dict(nid: int) -> dict | None:
+        type_id, _pid, name_ar, _en, code, _sort, _active = snap.nodes[nid]
+        t = snap.types.get(type_id)
+        type_name = (t["name_ar"] if t else "") or ""
+        type_code = (t["code"] if t else "") or ""
+        label = f"{(type_name or type_code).strip()} — {name_ar}".strip(" —")
+        children = [to_dict(ch) for ch in snap.active_children.get(nid, ())]
         children = [c for c in children if c is not None]
 
-        eligible = bool(_eligible(n))
+        eligible = bool(t and t[flag]) if flag else True
         # prune nodes that are neither eligible nor have eligible descendants
         if m != "all" and (not eligible) and (not children):
             return None
 
         return {
-            "id": n.id,
+            "id": nid,
             "label": label,
-            "name_ar": n.name_ar,
-            "code": n.code,
+            "name_ar": name_ar,
+            "code": code,
             "type_name": type_name,
             "type_code": type_code,
             "eligible": eligible,
             "children": children,
         }
 
-    roots = [to_dict(n) for n in children_map.get(None, [])]
+    roots = [to_dict(nid) for nid in snap.active_children.get(None, ())]
     return [r for r in roots if r is not None]
 
-    roots: list[int] = []
-    for n in nodes:
-        if not n.parent_id or n.parent_id not in node_by_id:
-            roots.append(n.id)
-
-    out: list[dict] = []
-    for rid in roots:
-        built = _build(rid)
-        if isinstance(built, list):
-            out.extend(built)
-        else:
-            out.append(built)
-
-    return out
-
-    # Sync legacy only once
-    if (_get_setting("ORG_NODE_SYNC_LEGACY_V1") or "").strip() == "1":
-        return
-
-    try:
-        _sync_legacy_nodes()
-        _sync_legacy_managers()
-        _sync_legacy_assignments()
-        _set_setting("ORG_NODE_SYNC_LEGACY_V1", "1")
-        db.session.commit()
-    except Exception:
-        try:
-            db.session.rollback()
-        except Exception:
-            pass
-
 
 def _type_id_by_code() -> dict[str, int]:
     rows = OrgNodeType.query.all()
@@ -0,0 +1,150 @@
+# utils/org_tree.py
+"""OrgNode hierarchy: cached tree snapshot.
+
+Reads use one immutable snapshot per process (nodes, types, parent/children
+maps), dropped (utils.versioned_cache) on every OrgNode / OrgNodeType change,
+on the rollback of such a change, and in other worker processes once it
+commits (instance/org_tree.version). A short TTL also covers writes made
+outside the ORM. Ancestor / descendant checks are in-memory lookups on the
+snapshot.
+"""
+
+from extensions import db
+from models import OrgNode, OrgNodeType
+from utils.versioned_cache import VersionedCache
+
+ORG_TREE_TTL = 60  # seconds (writes made outside the ORM)
+STAMP_FILENAME = "org_tree.version"
+
+_cache = VersionedCache("org_tree", (OrgNode, OrgNodeType), stamp_filename=STAMP_FILENAME, ttl=ORG_TREE_TTL)
+
+
+class _Snapshot:
+    __slots__ = (
+        "nodes", "types", "parent", "children",
+        "active_children", "_ancestors", "_descendants", "_memo",
+    )
+
+    def __init__(self):
+        # node_id -> (type_id, parent_id, name_ar, name_en, code, sort_order, is_active)
+        self.nodes: dict[int, tuple] = {}
+        # type_id -> {"code", "name_ar", "is_active", "show_in_chart", "show_in_routes", "allow_in_approvals"}
+        self.types: dict[int, dict] = {}
+        self.parent: dict[int, int | None] = {}
+        self.children: dict[int | None, tuple[int, ...]] = {}
+        # Active nodes only, in display order (type, sort_order, name)
+        self.active_children: dict[int | None, tuple[int, ...]] = {}
+        self._ancestors: dict[int, frozenset] = {}
+        self._descendants: dict[int, frozenset] = {}
+        self._memo: dict = {}
+
+
+def _build() -> _Snapshot:
+    snap = _Snapshot()
+
+    for tid, code, name_ar, is_active, show_in_chart, show_in_routes, allow_in_approvals in db.session.query(
+        OrgNodeType.id, OrgNodeType.code, OrgNodeType.name_ar, OrgNodeType.is_active,
+        OrgNodeType.show_in_chart, OrgNodeType.show_in_routes, OrgNodeType.allow_in_approvals,
+    ).all():
+        snap.types[int(tid)] = {
+            "code": code,
+            "name_ar": name_ar,
+            "is_active": bool(is_active),
+            "show_in_chart": bool(show_in_chart),
+            "show_in_routes": bool(show_in_routes),
+            "allow_in_approvals": bool(allow_in_approvals),
+        }
+
+    children: dict[int | None, list[int]] = {}
+    active: dict[int | None, list[int]] = {}
+    for nid, type_id, parent_id, name_ar, name_en, code, sort_order, is_active in db.session.query(
+        OrgNode.id, OrgNode.type_id, OrgNode.parent_id, OrgNode.name_ar, OrgNode.name_en,
+        OrgNode.code, OrgNode.sort_order, OrgNode.is_active,
+    ).all():
+        nid = int(nid)
+        pid = int(parent_id) if parent_id else None
+        snap.nodes[nid] = (type_id, pid, name_ar, name_en, code, sort_order, bool(is_active))
+        snap.parent[nid] = pid
+        children.setdefault(pid, []).append(nid)
+        if is_active:
+            active.setdefault(pid, []).append(nid)
+
+    def _order(nid: int):
+        type_id, _pid, name_ar, _en, _code, sort_order, _act = snap.nodes[nid]
+        # Same as ORDER BY type_id, sort_order NULLS LAST, name_ar
+        return (type_id or 0, sort_order is None, sort_order or 0, name_ar or "")
+
+    snap.children = {pid: tuple(ids) for pid, ids in children.items()}
+    snap.active_children = {pid: tuple(sorted(ids, key=_order)) for pid, ids in active.items()}
+    return snap
+
+
+def get_snapshot() -> _Snapshot:
+    return _cache.get(_build)
+
+
+def invalidate() -> None:
+    """Drop the cached snapshot (next read rebuilds it)."""
+    _cache.invalidate()
+
+
+def snapshot_memo(key, builder):
+    """Cache a value derived from the current snapshot (e.g. a rendered tree).
+
+    The cached value is shared between callers and must not be mutated.
+    """
+    snap = get_snapshot()
+    hit = snap._memo.get(key)
+    if hit is None:
+        hit = builder(snap)
+        snap._memo[key] = hit
+    return hit
+
+
+# -------------------------
+# Lookups (no SQL once the snapshot is warm)
+# -------------------------
+
+def ancestor_ids(node_id: int) -> frozenset:
+    """{node_id, parent_id, ...} up to the root (empty if node_id is falsy)."""
+    if not node_id:
+        return frozenset()
+    snap = get_snapshot()
+    nid = int(node_id)
+    hit = snap._ancestors.get(nid)
+    if hit is not None:
+        return hit
+
+    ids: list[int] = []
+    seen: set[int] = set()
+    cur = nid
+    while cur and cur not in seen and len(seen) < 200:
+        seen.add(cur)
+        ids.append(cur)
+        cur = snap.parent.get(cur)
+    out = frozenset(ids)
+    snap._ancestors[nid] = out
+    return out
+
+
+def descendant_ids(node_id: int) -> frozenset:
+    """{node_id} + every node below it (active or not)."""
+    if not node_id:
+        return frozenset()
+    snap = get_snapshot()
+    nid = int(node_id)
+    hit = snap._descendants.get(nid)
+    if hit is not None:
+        return hit
+
+    out: set[int] = set()
+    stack = [nid]
+    while stack:
+        cur = stack.pop()
+        if cur in out:
+            continue
+        out.add(cur)
+        stack.extend(snap.children.get(cur, ()))
+    res = frozenset(out)
+    snap._descendants[nid] = res
+    return res
@@ -0,0 +1,200 @@
+# utils/versioned_cache.py
+"""Process-wide cache invalidated by ORM writes to a set of models.
+
+One VersionedCache holds one cached value (or, through stamp() and
+on_invalidate, guards a cache the caller keeps itself). The value is valid
+for a stamp = (local generation, mtime of instance/<stamp_filename>):
+
+- a flush or bulk update/delete touching a watched model bumps the
+  generation at once, so this process sees its own writes (even before the
+  commit) and a value built from flushed rows is not reused;
+- the stamp file is touched after the outermost commit of such a
+  transaction, so other worker processes notice on their next stat (at most
+  every `stamp_check_seconds`);
+- a rollback of such a transaction (or of a SAVEPOINT inside it) bumps the
+  generation again: the value may have been built from rows that are gone.
+
+`ttl` (seconds) additionally expires the value, for writes that bypass the
+ORM session (scripts, raw SQL).
+"""
+
+import os
+import threading
+import time
+
+from flask import current_app, has_app_context
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+
+class VersionedCache:
+    """Generation counter + stamp file + optional TTL for one cached value.
+
+    watched: model classes whose writes invalidate the cache.
+    touches(obj, is_dirty): optional finer check for flushed objects (e.g.
+      only some columns matter); defaults to isinstance(obj, watched).
+    match_unmapped: also invalidate on bulk statements without a mapper
+      (Core / text UPDATE and DELETE).
+    """
+
+    def __init__(
+        self,
+        name: str,
+        watched: tuple,
+        *,
+        stamp_filename: str | None = None,
+        stamp_check_seconds: float = 1.0,
+        ttl: float | None = None,
+        touches=None,
+        match_unmapped: bool = True,
+        on_invalidate=None,
+    ):
+        self.name = name
+        self.watched = tuple(watched)
+        self.stamp_filename = stamp_filename
+        self.stamp_check_seconds = stamp_check_seconds
+        self.ttl = ttl
+        self.touches = touches
+        self.match_unmapped = match_unmapped
+        self.on_invalidate = on_invalidate
+        # Re-entrant: building the value may autoflush, and after_flush invalidates.
+        self.lock = threading.RLock()
+        self._flag = f"{name}_changed"
+        self._generation = 0
+        self._file_stamp = 0
+        self._file_checked_at = 0.0
+        self._entry = None  # (stamp, built_at, value)
+
+        event.listen(Session, "after_flush", self._after_flush)
+        event.listen(Session, "do_orm_execute", self._bulk_write)
+        event.listen(Session, "after_commit", self._after_commit)
+        event.listen(Session, "after_rollback", self._after_rollback)
+        event.listen(Session, "after_transaction_end", self._after_transaction_end)
+
+    # -------------------------
+    # Stamp
+    # -------------------------
+
+    def _stamp_path(self) -> str | None:
+        if not self.stamp_filename or not has_app_context():
+            return None
+        try:
+            return os.path.join(current_app.instance_path, self.stamp_filename)
+        except Exception:
+            return None
+
+    def stamp(self) -> tuple[int, int]:
+        """Current (generation, stamp file mtime); equal stamps = nothing changed."""
+        now = time.monotonic()
+        if self.stamp_filename and now - self._file_checked_at >= self.stamp_check_seconds:
+            self._file_checked_at = now
+            path = self._stamp_path()
+            if path:
+                try:
+                    self._file_stamp = os.stat(path).st_mtime_ns
+                except OSError:
+                    self._file_stamp = 0
+        return (self._generation, self._file_stamp)
+
+    def touch(self) -> None:
+        """Tell other processes (through the stamp file) that the data changed."""
+        path = self._stamp_path()
+        if not path:
+            return
+        try:
+            with open(path, "w", encoding="utf-8") as fh:
+                fh.write(str(time.time_ns()))
+        except OSError:
+            pass
+
+    # -------------------------
+    # Value
+    # -------------------------
+
+    def _fresh(self, entry, stamp) -> bool:
+        return (
+            entry is not None
+            and entry[0] == stamp
+            and (self.ttl is None or time.monotonic() - entry[1] < self.ttl)
+        )
+
+    def get(self, build):
+        """The cached value, rebuilt with build() when the stamp moved or the TTL expired."""
+        entry = self._entry
+        if self._fresh(entry, self.stamp()):
+            return entry[2]
+        with self.lock:
+            stamp = self.stamp()
+            entry = self._entry
+            if self._fresh(entry, stamp):
+                return entry[2]
+            value = build()
+            # Keep the stamp taken before building: a concurrent bump forces a rebuild.
+            self._entry = (stamp, time.monotonic(), value)
+            return value
+
+    def invalidate(self) -> None:
+        """Drop the cached value in this process (next read rebuilds it)."""
+        with self.lock:
+            self._generation += 1
+            self._entry = None
+            if self.on_invalidate is not None:
+                self.on_invalidate()
+
+    # -------------------------
+    # Session hooks
+    # -------------------------
+
+    def _touched(self, obj, is_dirty: bool) -> bool:
+        if self.touches is not None:
+            return self.touches(obj, is_dirty)
+        return isinstance(obj, self.watched)
+
+    def _changed(self, session) -> None:
+        session.info[self._flag] = True
+        self.invalidate()
+
+    def _after_flush(self, session, flush_context):
+        try:
+            hit = any(self._touched(o, False) for o in session.new) or \
+                any(self._touched(o, False) for o in session.deleted) or \
+                any(self._touched(o, True) for o in session.dirty)
+        except Exception:
+            hit = True
+        if hit:
+            self._changed(session)
+
+    def _bulk_write(self, orm_execute_state):
+        # Bulk query.update()/delete() bypass the unit of work.
+        if not (orm_execute_state.is_update or orm_execute_state.is_delete):
+            return
+        try:
+            mapper = orm_execute_state.bind_mapper
+            cls = mapper.class_ if mapper is not None else None
+        except Exception:
+            cls = None
+        if cls is None:
+            hit = self.match_unmapped
+        else:
+            hit = isinstance(cls, type) and issubclass(cls, self.watched)
+        if hit:
+            self._changed(orm_execute_state.session)
+
+    def _after_commit(self, session):
+        # after_commit also fires when a SAVEPOINT is released; wait for the real commit.
+        if session.in_nested_transaction():
+            return
+        if session.info.pop(self._flag, False):
+            self.invalidate()
+            self.touch()
+
+    def _after_rollback(self, session):
+        # The value may have been built from flushed-but-rolled-back rows. A
+        # SAVEPOINT rollback keeps the flag: the outer commit still has to
+        # tell the other processes about the writes made before it.
+        if session.info.get(self._flag):
+            self.invalidate()
+
+    def _after_transaction_end(self, session, transaction):
+        if transaction.parent is None and not transaction.nested:
+            session.info.pop(self._flag, None)
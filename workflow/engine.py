@@ -1,13 +1,14 @@
 # workflow/engine.py
 
 from datetime import datetime, timedelta
+import threading
 import uuid
 
+from sqlalchemy import insert
 from sqlalchemy.exc import IntegrityError
 
 from extensions import db
 from models import (
-    AuditLog,
     Notification,
     User,
     WorkflowRequest,
@@ -17,12 +18,10 @@ from models import (
     WorkflowInstance,
     WorkflowInstanceStep,
     WorkflowStepTask,
-    Department,
     Directorate,
-    CommitteeAssignee,
-    OrgUnitManager,
-    OrgNodeManager,
 )
+from services import audit_writer
+from workflow import resolver_cache
 
 # =========================
 # SLA helpers
@@ -40,9 +39,6 @@ def _step_due_at(template_sla_days, step_sla_days):
 # =========================
 # Approver resolution
 # =========================
-from sqlalchemy import or_
-
-
 def _norm_role(value: str | None) -> str:
     s = (value or '').strip().lower()
     if not s:
@@ -91,33 +87,24 @@ def _resolve_committee_users(committee_id: int | None, delivery_mode: str | None
         return []
 
     mode = (delivery_mode or 'Committee_ALL').strip().upper()
-    q = CommitteeAssignee.query.filter_by(committee_id=int(committee_id), is_active=True)
-
     if mode == 'COMMITTEE_CHAIR':
-        q = q.filter(or_(CommitteeAssignee.member_role == 'CHAIR', CommitteeAssignee.member_role == 'chair'))
+        wanted = ('CHAIR', 'chair')
     elif mode == 'COMMITTEE_SECRETARY':
-        q = q.filter(or_(CommitteeAssignee.member_role == 'SECRETARY', CommitteeAssignee.member_role == 'secretary'))
+        wanted = ('SECRETARY', 'secretary')
+    else:
+        wanted = None
 
-    members = q.all()
     user_ids: set[int] = set()
 
-    for m in members:
-        kind = (getattr(m, 'kind', '') or '').strip().upper()
-        if kind == 'USER' and getattr(m, 'user_id', None):
-            try:
-                user_ids.add(int(m.user_id))
-            except Exception:
-                pass
-        elif kind == 'ROLE' and getattr(m, 'role', None):
-            role = (m.role or '').strip()
-            vars_ = _role_variants(role)
-            uq = User.query
-            if vars_:
-                uq = uq.filter(or_(*[User.role.ilike(v) for v in vars_]))
-            else:
-                uq = uq.filter(User.role.ilike(role))
-            for u in uq.all():
-                user_ids.add(int(u.id))
+    # Active members come from the in-process resolver snapshot (no per-call queries)
+    for kind, member_user_id, member_role_name, member_role in resolver_cache.committee_members(int(committee_id)):
+        if wanted is not None and member_role not in wanted:
+            continue
+        if kind == 'USER' and member_user_id:
+            user_ids.add(int(member_user_id))
+        elif kind == 'ROLE' and member_role_name:
+            role = (member_role_name or '').strip()
+            user_ids.update(resolver_cache.users_for_role_patterns(_role_variants(role) or [role]))
 
     return sorted(user_ids)
 
@@ -137,37 +124,17 @@ def _resolve_users_by_kind(kind: str, user_id=None, role=None, dept_id=None, dir
         if not uid:
             return []
 
-        ut = (unit_type or '').upper().strip()
-        row = None
         try:
-            if ut == 'ORG_NODE':
-                row = OrgNodeManager.query.filter_by(node_id=uid).first()
-            else:
-                row = OrgUnitManager.query.filter_by(unit_type=ut, unit_id=uid).first()
+            return resolver_cache.org_manager_ids(unit_type, uid)
         except Exception:
-            row = None
-        if not row:
             return []
-        ids: list[int] = []
-        if getattr(row, 'manager_user_id', None):
-            ids.append(int(row.manager_user_id))
-        if getattr(row, 'deputy_user_id', None):
-            ids.append(int(row.deputy_user_id))
-        return ids
 
 
     if kind == 'USER' and user_id:
         return [int(user_id)]
 
     if kind == 'ROLE' and role:
-        vars_ = _role_variants(role)
-        q = User.query
-        if vars_:
-            q = q.filter(or_(*[User.role.ilike(v) for v in vars_]))
-        else:
-            q = q.filter(User.role.ilike((role or '').strip()))
-        users = q.all()
-        return [int(u.id) for u in users]
+        return resolver_cache.users_for_role_patterns(_role_variants(role) or [(role or '').strip()])
 
     if kind == 'DIRECTORATE' and dir_id:
         did = int(dir_id)
@@ -176,12 +143,7 @@ def _resolve_users_by_kind(kind: str, user_id=None, role=None, dept_id=None, dir
         if ids:
             return ids
         # Fallback: role-based (legacy)
-        users = (
-            User.query.join(Department, User.department_id == Department.id)
-            .filter(Department.directorate_id == did, User.role.ilike('directorate_head'))
-            .all()
-        )
-        return [int(u.id) for u in users]
+        return resolver_cache.legacy_directorate_heads(did)
 
     if kind == 'UNIT' and unit_id:
         return _resolve_org_manager_ids('UNIT', unit_id)
@@ -201,8 +163,7 @@ def _resolve_users_by_kind(kind: str, user_id=None, role=None, dept_id=None, dir
         if ids:
             return ids
         # Fallback: role-based (legacy)
-        users = User.query.filter(User.department_id == int(dept_id), User.role.ilike('dept_head')).all()
-        return [int(u.id) for u in users]
+        return resolver_cache.legacy_department_heads(int(dept_id))
 
     if kind == 'COMMITTEE' and committee_id:
         return _resolve_committee_users(int(committee_id), committee_delivery_mode)
@@ -260,6 +221,9 @@ def _resolve_parallel_extra_assignees(template_id: int | None, step_order: int)
         return []
 
 
+_notify_buffer = threading.local()
+
+
 def _notify_users(user_ids, message, ntype="WORKFLOW", role=None, actor_id=None, track_for_actor=False):
     """
     Your Notification model has: message, type, role, is_read, created_at
@@ -268,9 +232,19 @@ def _notify_users(user_ids, message, ntype="WORKFLOW", role=None, actor_id=None,
     if not user_ids:
         return
 
+    unique_ids = set(int(uid) for uid in user_ids if uid)
+
+    # Bulk decisions: collect and emit one notification per recipient at the end.
+    pending = getattr(_notify_buffer, "items", None)
+    if pending is not None:
+        for uid in unique_ids:
+            pending.append((uid, ntype, role, message, actor_id, False))
+        if track_for_actor and actor_id and int(actor_id) not in unique_ids:
+            pending.append((int(actor_id), ntype, role, f"متابعة: {message}", int(actor_id), True))
+        return
+
     now = datetime.utcnow()
     event_key = uuid.uuid4().hex
-    unique_ids = set(int(uid) for uid in user_ids if uid)
 
     # Recipient notifications
     for uid in unique_ids:
@@ -482,7 +456,7 @@ def start_workflow_for_request(
     db.session.add(req)
     db.session.flush()
 
-    db.session.add(AuditLog(
+    audit_writer.add(
         request_id=req.id,
         user_id=created_by_user_id,
         action="WORKFLOW_STARTED",
@@ -491,7 +465,7 @@ def start_workflow_for_request(
         note=f"Template: {template.name} (#{template.id})",
         target_type="WORKFLOW",
         target_id=inst.id
-    ))
+    )
 
     # notify first step approvers
     first = WorkflowInstanceStep.query.filter_by(
@@ -581,15 +555,13 @@ def _bypass_parallel_task_legacy(
     task.bypass_reason = reason
     task.bypassed_at = now
 
-    db.session.add(
-        AuditLog(
-            action="PARALLEL_SYNC_BYPASS",
-            user_id=actor_user_id,
-            on_behalf_of_id=on_behalf_of_id,
-            target_type="WORKFLOW_STEP_TASK",
-            target_id=task.id,
-            note=f"Bypass assignee {assignee_user_id} at step {step_order}. Reason: {reason}",
-        )
+    audit_writer.add(
+        action="PARALLEL_SYNC_BYPASS",
+        user_id=actor_user_id,
+        on_behalf_of_id=on_behalf_of_id,
+        target_type="WORKFLOW_STEP_TASK",
+        target_id=task.id,
+        note=f"Bypass assignee {assignee_user_id} at step {step_order}. Reason: {reason}",
     )
 
     # If step is complete, close it and advance
@@ -693,15 +665,13 @@ def bypass_parallel_task(
     # eff_user loaded above
     eff_label = (eff_user.full_name if eff_user else f"User#{effective_user_id}")
     actor_display = actor_label if not on_behalf_of_id else f"{actor_label} (مفوّض عن {eff_label})"
-    db.session.add(
-        AuditLog(
-            user_id=actor_user_id,
-            action="PARALLEL_SYNC_BYPASS",
-            target_type="WORKFLOW_STEP_TASK",
-            target_id=task.id,
-            note=f"bypass step={step_order} assignee={assignee_user_id} by={actor_display} reason={task.bypass_reason}",
-            on_behalf_of_id=on_behalf_of_id,
-        )
+    audit_writer.add(
+        user_id=actor_user_id,
+        action="PARALLEL_SYNC_BYPASS",
+        target_type="WORKFLOW_STEP_TASK",
+        target_id=task.id,
+        note=f"bypass step={step_order} assignee={assignee_user_id} by={actor_display} reason={task.bypass_reason}",
+        on_behalf_of_id=on_behalf_of_id,
     )
 
     # If all responded/bypassed, close step and advance
@@ -720,15 +690,13 @@ def bypass_parallel_task(
             inst.is_completed = True
             req.status = "APPROVED"
             req.completed_at = now
-            db.session.add(
-                AuditLog(
-                    user_id=actor_user_id,
-                    action="WORKFLOW_COMPLETED",
-                    target_type="WORKFLOW_REQUEST",
-                    target_id=req.id,
-                    note=f"Workflow completed after PARALLEL_SYNC step {step_order} by {actor_display}",
-                    on_behalf_of_id=on_behalf_of_id,
-                )
+            audit_writer.add(
+                user_id=actor_user_id,
+                action="WORKFLOW_COMPLETED",
+                target_type="WORKFLOW_REQUEST",
+                target_id=req.id,
+                note=f"Workflow completed after PARALLEL_SYNC step {step_order} by {actor_display}",
+                on_behalf_of_id=on_behalf_of_id,
             )
             _notify_users([req.requester_id], message=f"تم إنجاز الطلب #{req.id} ✅", ntype="WORKFLOW", actor_id=actor_user_id, track_for_actor=True)
         else:
@@ -815,15 +783,13 @@ def bypass_all_parallel_tasks(
     eff_label = (eff_user.full_name if eff_user else f"User#{effective_user_id}")
     actor_display = actor_label if not on_behalf_of_id else f"{actor_label} (مفوّض عن {eff_label})"
 
-    db.session.add(
-        AuditLog(
-            user_id=actor_user_id,
-            action="PARALLEL_SYNC_BYPASS_ALL",
-            target_type="WORKFLOW_INSTANCE_STEP",
-            target_id=step.id,
-            note=f"bypass_all step={step_order} count={len(pending_tasks)} by={actor_display} reason={reason[:500]}",
-            on_behalf_of_id=on_behalf_of_id,
-        )
+    audit_writer.add(
+        user_id=actor_user_id,
+        action="PARALLEL_SYNC_BYPASS_ALL",
+        target_type="WORKFLOW_INSTANCE_STEP",
+        target_id=step.id,
+        note=f"bypass_all step={step_order} count={len(pending_tasks)} by={actor_display} reason={reason[:500]}",
+        on_behalf_of_id=on_behalf_of_id,
     )
 
     # After bypassing all remaining pending tasks, the step MUST be complete.
@@ -841,15 +807,13 @@ def bypass_all_parallel_tasks(
             inst.is_completed = True
             req.status = "APPROVED"
             req.completed_at = now
-            db.session.add(
-                AuditLog(
-                    user_id=actor_user_id,
-                    action="WORKFLOW_COMPLETED",
-                    target_type="WORKFLOW_REQUEST",
-                    target_id=req.id,
-                    note=f"Workflow completed after PARALLEL_SYNC step {step_order} by {actor_display}",
-                    on_behalf_of_id=on_behalf_of_id,
-                )
+            audit_writer.add(
+                user_id=actor_user_id,
+                action="WORKFLOW_COMPLETED",
+                target_type="WORKFLOW_REQUEST",
+                target_id=req.id,
+                note=f"Workflow completed after PARALLEL_SYNC step {step_order} by {actor_display}",
+                on_behalf_of_id=on_behalf_of_id,
             )
             _notify_users([req.requester_id], message=f"تم إنجاز الطلب #{req.id} ✅", ntype="WORKFLOW", actor_id=actor_user_id, track_for_actor=True)
         else:
@@ -905,6 +869,31 @@ def decide_step(
     if step.status != "PENDING":
         raise ValueError("Step already decided.")
 
+    _apply_decision(
+        req, inst, step, actor_user_id, decision, note,
+        effective_user_id=effective_user_id,
+        on_behalf_of_id=on_behalf_of_id,
+        delegation_id=delegation_id,
+    )
+
+    if auto_commit:
+        db.session.commit()
+
+
+def _apply_decision(
+    req: WorkflowRequest,
+    inst: WorkflowInstance,
+    step: WorkflowInstanceStep,
+    actor_user_id: int,
+    decision: str,
+    note: str = "",
+    effective_user_id: int | None = None,
+    on_behalf_of_id: int | None = None,
+    delegation_id: int | None = None,
+):
+    """Apply an already-validated decision on loaded objects (no commit)."""
+    step_order = step.step_order
+
     # Delegation-aware context:
     # - actor_user_id: the logged-in user who performed the action (delegatee)
     # - effective_user_id: the user whose authority is used for approval (delegator)
@@ -953,7 +942,7 @@ def decide_step(
         task.responded_at = now
         task.note = note
 
-        db.session.add(AuditLog(
+        audit_writer.add(
             request_id=req.id,
             user_id=actor_user_id,
             on_behalf_of_id=on_behalf_of_id,
@@ -964,7 +953,7 @@ def decide_step(
             note=f"Step {step.step_order}: {task.response}. {note}".strip(),
             target_type="PARALLEL_TASK",
             target_id=task.id,
-        ))
+        )
 
         # If everyone responded/bypassed => close step and advance.
         if _parallel_total(inst.id, step.step_order) == 0 or _parallel_is_complete(inst.id, step.step_order):
@@ -991,7 +980,7 @@ def decide_step(
                 req.status = "APPROVED"
                 inst.is_completed = True
                 inst.current_step_order = next_order
-                db.session.add(AuditLog(
+                audit_writer.add(
                     request_id=req.id,
                     user_id=actor_user_id,
                     on_behalf_of_id=on_behalf_of_id,
@@ -1002,7 +991,7 @@ def decide_step(
                     note=f"Completed after PARALLEL_SYNC step {step.step_order}.",
                     target_type="WORKFLOW",
                     target_id=inst.id,
-                ))
+                )
             else:
                 inst.current_step_order = next_order
                 # ensure tasks if the next step is also parallel, otherwise notify approvers
@@ -1019,8 +1008,6 @@ def decide_step(
                         track_for_actor=True
                     )
 
-        if auto_commit:
-            db.session.commit()
         return
 
     # -------------------------------------------------
@@ -1037,19 +1024,17 @@ def decide_step(
     step.note = note
     db.session.add(step)
 
-    db.session.add(
-        AuditLog(
-            request_id=req.id,
-            user_id=actor_user_id,
-            on_behalf_of_id=on_behalf_of_id,
-            delegation_id=delegation_id,
-            action=f"STEP_{decision}",
-            old_status=None,
-            new_status=None,
-            note=f"Step {step_order}: {note}".strip(),
-            target_type="WORKFLOW_STEP",
-            target_id=step.id,
-        )
+    audit_writer.add(
+        request_id=req.id,
+        user_id=actor_user_id,
+        on_behalf_of_id=on_behalf_of_id,
+        delegation_id=delegation_id,
+        action=f"STEP_{decision}",
+        old_status=None,
+        new_status=None,
+        note=f"Step {step_order}: {note}".strip(),
+        target_type="WORKFLOW_STEP",
+        target_id=step.id,
     )
 
     if decision == "REJECTED":
@@ -1073,8 +1058,6 @@ def decide_step(
                 fmsg += f" | السبب/التعليق: {note}"
             _notify_users(sorted(follower_ids), message=fmsg, ntype="WORKFLOW")
 
-        if auto_commit:
-            db.session.commit()
         return
 
     # move to next step
@@ -1105,8 +1088,6 @@ def decide_step(
                 ntype="WORKFLOW",
             )
 
-        if auto_commit:
-            db.session.commit()
         return
 
     inst.current_step_order = next_order
@@ -1141,5 +1122,188 @@ def decide_step(
             ntype="WORKFLOW",
         )
 
+
+# =========================
+# Bulk decisions
+# =========================
+BULK_DECISION_MAX = 500
+
+
+NOTIFICATION_MESSAGE_MAX = 255  # Notification.message length
+
+
+def _merge_messages(messages: list[str], prefix: str = "") -> str:
+    """One message for several updates: the first ones that fit, then "and K more"."""
+    body = [m[len(prefix):] if prefix and m.startswith(prefix) else m for m in messages]
+    head = f"{prefix}{len(body)} تحديثات على طلبات سير العمل: "
+
+    shown: list[str] = []
+    for i, m in enumerate(body):
+        rest = len(body) - i - 1
+        tail = f" | و{rest} أخرى" if rest else ""
+        text = " | ".join(shown + [m])
+        if len(head) + len(text) + len(tail) > NOTIFICATION_MESSAGE_MAX:
+            break
+        shown.append(m)
+
+    if not shown:
+        # Not even the first update fits whole: cut it, keep the count visible.
+        tail = f" | و{len(body) - 1} أخرى"
+        room = NOTIFICATION_MESSAGE_MAX - len(head) - len(tail) - 1
+        return f"{head}{body[0][:max(room, 0)]}…{tail}"
+
+    more = len(body) - len(shown)
+    return head + " | ".join(shown) + (f" | و{more} أخرى" if more else "")
+
+
+def _flush_coalesced_notifications(items, actor_user_id: int | None = None):
+    """Write buffered notifications: one row per (recipient, type, mirror flag)."""
+    if not items:
+        return 0
+
+    groups: dict[tuple, list] = {}
+    for uid, ntype, role, message, actor_id, is_mirror in items:
+        groups.setdefault((int(uid), ntype, bool(is_mirror)), []).append((role, message, actor_id))
+
+    now = datetime.utcnow()
+    # The batch is one event on purpose: recipients get one row each (covering
+    # several requests), so there is no per-request row to key on. The actor's
+    # single coalesced follow-up row is marked read once every recipient of the
+    # batch has read theirs (_sync_mirror_for_event in workflow/routes.py).
+    event_key = uuid.uuid4().hex
+    rows = []
+    for (uid, ntype, is_mirror), entries in groups.items():
+        messages = list(dict.fromkeys(m for _, m, _ in entries if m))
+        if len(messages) <= 1:
+            role, message, actor_id = entries[0]
+            message = messages[0] if messages else message
+        else:
+            roles = {r for r, _, _ in entries}
+            role = roles.pop() if len(roles) == 1 else None
+            actor_id = entries[0][2]
+            message = _merge_messages(messages, "متابعة: " if is_mirror else "")
+
+        rows.append(dict(
+            user_id=uid,
+            type=ntype,
+            role=role,
+            message=message,
+            is_read=False,
+            created_at=now,
+            actor_id=(actor_id if actor_id is not None else actor_user_id),
+            event_key=event_key,
+            is_mirror=is_mirror,
+        ))
+
+    db.session.execute(insert(Notification), rows)
+    return len(rows)
+
+
+def decide_steps_bulk(
+    items,
+    actor_user_id: int,
+    can_act=None,
+    auto_commit: bool = True,
+):
+    """
+    Approve/Reject many pending steps in one transaction.
+
+    items: iterable of (request_id, step_order, decision, note)
+    can_act: optional callable(req, step) -> (effective_user_id, on_behalf_of_id, delegation_id)
+             or None when the actor may not act on that step.
+
+    Requests/instances/steps are loaded in one pass, each item is applied inside a
+    SAVEPOINT (a failing item does not undo the others) and notifications are
+    coalesced per recipient under one event key for the batch. Returns a list of per-item result dicts.
+    """
+    items = list(items or [])
+    if len(items) > BULK_DECISION_MAX:
+        raise ValueError(f"Too many items (max {BULK_DECISION_MAX}).")
+
+    results = []
+    parsed = []
+    for raw in items:
+        try:
+            req_id, step_order, decision, note = (list(raw) + [None, None, None, None])[:4]
+            req_id = int(req_id)
+            step_order = int(step_order)
+        except Exception:
+            results.append({"request_id": None, "step_order": None, "ok": False, "error": "Invalid item."})
+            continue
+        decision = (decision or "").strip().upper()
+        note = (note or "").strip()
+        res = {"request_id": req_id, "step_order": step_order, "decision": decision, "ok": False, "error": None}
+        results.append(res)
+        if decision not in ("APPROVED", "REJECTED"):
+            res["error"] = "Invalid decision (must be APPROVED or REJECTED)."
+            continue
+        parsed.append((res, req_id, step_order, decision, note))
+
+    if not parsed:
+        return results
+
+    req_ids = sorted({p[1] for p in parsed})
+    reqs = {r.id: r for r in WorkflowRequest.query.filter(WorkflowRequest.id.in_(req_ids)).all()}
+    insts = {i.request_id: i for i in WorkflowInstance.query.filter(WorkflowInstance.request_id.in_(req_ids)).all()}
+    inst_ids = [i.id for i in insts.values()]
+    steps = {}
+    if inst_ids:
+        for st in WorkflowInstanceStep.query.filter(WorkflowInstanceStep.instance_id.in_(inst_ids)).all():
+            steps[(st.instance_id, st.step_order)] = st
+
+    _notify_buffer.items = []
+    try:
+        seen = set()
+        for res, req_id, step_order, decision, note in parsed:
+            req = reqs.get(req_id)
+            inst = insts.get(req_id)
+            step = steps.get((inst.id, step_order)) if inst else None
+            if not req or not inst or not step:
+                res["error"] = "Step not found."
+                continue
+            if (req_id, step_order) in seen:
+                res["error"] = "Duplicate item."
+                continue
+            seen.add((req_id, step_order))
+            if step.status != "PENDING" or inst.is_completed:
+                res["error"] = "Step already decided."
+                continue
+            if int(inst.current_step_order or 0) != int(step_order):
+                res["error"] = "Step is not the current step."
+                continue
+
+            ctx = (int(actor_user_id), None, None)
+            if can_act is not None:
+                ctx = can_act(req, step)
+                if not ctx:
+                    res["error"] = "Not allowed to act on this step."
+                    continue
+
+            effective_user_id, on_behalf_of_id, delegation_id = ctx
+            mark = len(_notify_buffer.items)
+            try:
+                with db.session.begin_nested():
+                    _apply_decision(
+                        req, inst, step, actor_user_id, decision, note,
+                        effective_user_id=effective_user_id,
+                        on_behalf_of_id=on_behalf_of_id,
+                        delegation_id=delegation_id,
+                    )
+                    db.session.flush()
+            except Exception as e:
+                # SAVEPOINT rolled back (objects expired); drop this item's notifications too.
+                del _notify_buffer.items[mark:]
+                res["error"] = str(e) or e.__class__.__name__
+                continue
+
+            res["ok"] = True
+            res["request_status"] = req.status
+
+        _flush_coalesced_notifications(_notify_buffer.items, actor_user_id=actor_user_id)
+    finally:
+        _notify_buffer.items = None
+
     if auto_commit:
-        db.session.commit()
\ No newline at end of file
+        db.session.commit()
+
+    return results
@@ -0,0 +1,219 @@
+# workflow/resolver_cache.py
+"""In-process cache for workflow approver resolution.
+
+The engine resolves approvers (ROLE / org managers / committees) on every step
+transition, notification and bypass. Instead of re-querying users and manager
+tables each time, we keep one immutable snapshot per process:
+
+- role index: distinct User.role value -> user ids (matched with the same
+  case-insensitive LIKE semantics the engine used in SQL)
+- org manager map: (unit_type, unit_id) -> [manager, deputy]; ORG_NODE included
+- committee members: committee_id -> active assignee rows
+- user -> department/directorate and department -> directorate (legacy heads)
+
+The snapshot is dropped (utils.versioned_cache) when a flush touches users
+(role/department), managers, committees or departments, again if that
+transaction rolls back, and in other worker processes once it commits
+(instance/resolver.version). A short TTL also covers writes made outside
+the ORM.
+"""
+
+import functools
+import re
+
+from sqlalchemy import inspect
+
+from extensions import db
+from models import (
+    CommitteeAssignee,
+    Department,
+    OrgNodeManager,
+    OrgUnitManager,
+    User,
+)
+from utils.versioned_cache import VersionedCache
+
+RESOLVER_CACHE_TTL = 60  # seconds (writes made outside the ORM)
+STAMP_FILENAME = "resolver.version"
+
+# Only these User columns affect resolution (avoid invalidating on last-login updates, etc.)
+_USER_ATTRS = ("role", "department_id", "directorate_id")
+_WATCHED = (CommitteeAssignee, Department, OrgNodeManager, OrgUnitManager)
+
+
+def _touches_resolution(obj, is_dirty: bool) -> bool:
+    if isinstance(obj, _WATCHED):
+        return True
+    if isinstance(obj, User):
+        if not is_dirty:
+            return True
+        try:
+            state = inspect(obj)
+            return any(
+                name in state.attrs and state.attrs[name].history.has_changes()
+                for name in _USER_ATTRS
+            )
+        except Exception:
+            return True
+    return False
+
+
+_cache = VersionedCache(
+    "resolver",
+    _WATCHED + (User,),
+    stamp_filename=STAMP_FILENAME,
+    ttl=RESOLVER_CACHE_TTL,
+    touches=_touches_resolution,
+)
+
+
+class _Snapshot:
+    __slots__ = (
+        "role_users", "user_dept", "user_dir", "dept_dir",
+        "unit_managers", "committees", "_role_memo",
+    )
+
+    def __init__(self):
+        self.role_users: dict[str, tuple[int, ...]] = {}
+        self.user_dept: dict[int, int | None] = {}
+        self.user_dir: dict[int, int | None] = {}
+        self.dept_dir: dict[int, int | None] = {}
+        self.unit_managers: dict[tuple[str, int], tuple[int, ...]] = {}
+        self.committees: dict[int, tuple[tuple, ...]] = {}
+        self._role_memo: dict[tuple[str, ...], tuple[int, ...]] = {}
+
+
+@functools.lru_cache(maxsize=1024)
+def _like_regex(pattern: str):
+    """SQL (i)LIKE pattern -> compiled regex ('%' any run, '_' any single char)."""
+    out = []
+    for ch in pattern:
+        if ch == "%":
+            out.append(".*")
+        elif ch == "_":
+            out.append(".")
+        else:
+            out.append(re.escape(ch))
+    return re.compile("".join(out), re.IGNORECASE | re.DOTALL)
+
+
+def _build() -> _Snapshot:
+    snap = _Snapshot()
+
+    role_users: dict[str, list[int]] = {}
+    for uid, role, dept_id, dir_id in db.session.query(User.id, User.role, User.department_id, User.directorate_id).all():
+        snap.user_dept[int(uid)] = int(dept_id) if dept_id else None
+        snap.user_dir[int(uid)] = int(dir_id) if dir_id else None
+        if role is not None:
+            role_users.setdefault(str(role), []).append(int(uid))
+    snap.role_users = {r: tuple(ids) for r, ids in role_users.items()}
+
+    for dept_id, dir_id in db.session.query(Department.id, Department.directorate_id).all():
+        snap.dept_dir[int(dept_id)] = int(dir_id) if dir_id else None
+
+    for ut, unit_id, mgr, dep in db.session.query(
+        OrgUnitManager.unit_type, OrgUnitManager.unit_id, OrgUnitManager.manager_user_id, OrgUnitManager.deputy_user_id
+    ).all():
+        if unit_id is None:
+            continue
+        key = ((ut or "").upper().strip(), int(unit_id))
+        # first row wins (same as .first() in the legacy query)
+        snap.unit_managers.setdefault(key, tuple(int(x) for x in (mgr, dep) if x))
+
+    for node_id, mgr, dep in db.session.query(
+        OrgNodeManager.node_id, OrgNodeManager.manager_user_id, OrgNodeManager.deputy_user_id
+    ).all():
+        if node_id is None:
+            continue
+        snap.unit_managers.setdefault(("ORG_NODE", int(node_id)), tuple(int(x) for x in (mgr, dep) if x))
+
+    committees: dict[int, list[tuple]] = {}
+    for cid, kind, uid, role, member_role in db.session.query(
+        CommitteeAssignee.committee_id, CommitteeAssignee.kind, CommitteeAssignee.user_id,
+        CommitteeAssignee.role, CommitteeAssignee.member_role,
+    ).filter(CommitteeAssignee.is_active.is_(True)).order_by(CommitteeAssignee.id.asc()).all():
+        committees.setdefault(int(cid), []).append(
+            ((kind or "").strip().upper(), int(uid) if uid else None, role, member_role)
+        )
+    snap.committees = {cid: tuple(rows) for cid, rows in committees.items()}
+    return snap
+
+
+def get_snapshot() -> _Snapshot:
+    return _cache.get(_build)
+
+
+def invalidate() -> None:
+    """Drop the cached snapshot (next resolution rebuilds it)."""
+    _cache.invalidate()
+
+
+# -------------------------
+# Lookups (no SQL once the snapshot is warm)
+# -------------------------
+
+def users_for_role_patterns(patterns: list[str]) -> list[int]:
+    """User ids whose role matches any pattern with ILIKE semantics."""
+    snap = get_snapshot()
+    key = tuple(sorted(set(p for p in patterns if p)))
+    hit = snap._role_memo.get(key)
+    if hit is not None:
+        return list(hit)
+
+    regs = [_like_regex(p) for p in key]
+    ids: list[int] = []
+    for role_value, uids in snap.role_users.items():
+        if any(rx.fullmatch(role_value) for rx in regs):
+            ids.extend(uids)
+    result = tuple(sorted(set(ids)))
+    snap._role_memo[key] = result
+    return list(result)
+
+
+def org_manager_ids(unit_type: str, unit_id: int) -> list[int]:
+    snap = get_snapshot()
+    return list(snap.unit_managers.get(((unit_type or "").upper().strip(), int(unit_id)), ()))
+
+
+def legacy_department_heads(dept_id: int, role_pattern: str = "dept_head") -> list[int]:
+    snap = get_snapshot()
+    role_ids = set(users_for_role_patterns([role_pattern]))
+    return [uid for uid in sorted(role_ids) if snap.user_dept.get(uid) == int(dept_id)]
+
+
+def legacy_directorate_heads(dir_id: int, role_pattern: str = "directorate_head") -> list[int]:
+    snap = get_snapshot()
+    role_ids = set(users_for_role_patterns([role_pattern]))
+    out = []
+    for uid in sorted(role_ids):
+        dept_id = snap.user_dept.get(uid)
+        if dept_id and snap.dept_dir.get(dept_id) == int(dir_id):
+            out.append(uid)
+    return out
+
+
+def role_matches(patterns: list[str], value: str | None) -> bool:
+    """ILIKE-style match of `value` against any pattern (no SQL)."""
+    if value is None:
+        return False
+    return any(_like_regex(p).fullmatch(str(value)) for p in patterns if p)
+
+
+def users_in_directorate(user_ids, dir_id: int) -> list[int]:
+    """Filter user ids by explicit directorate_id or department -> directorate."""
+    snap = get_snapshot()
+    did = int(dir_id)
+    out = []
+    for uid in user_ids:
+        if snap.user_dir.get(int(uid)) == did:
+            out.append(int(uid))
+            continue
+        dept_id = snap.user_dept.get(int(uid))
+        if dept_id and snap.dept_dir.get(dept_id) == did:
+            out.append(int(uid))
+    return sorted(set(out))
+
+
+def committee_members(committee_id: int) -> tuple[tuple, ...]:
+    """Active assignees as (kind, user_id, role, member_role)."""
+    return get_snapshot().committees.get(int(committee_id), ())
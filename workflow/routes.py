@@ -54,7 +54,6 @@ from models import (
     RequestAttachment,
     Approval,
     RequestType,
-    WorkflowRoutingRule,
     Department,
     Directorate,
     Unit,
@@ -64,17 +63,14 @@ from models import (
     Committee,
     CommitteeAssignee,
 
-    OrgUnitManager,
-
     OrgNode,
     OrgNodeAssignment,
-    OrgNodeManager,
 
 )
 
-from utils.org_dynamic import resolve_user_org_node_id, get_node_ancestor_ids
 
-from workflow.engine import start_workflow_for_request, decide_step, bypass_parallel_task, bypass_all_parallel_tasks
+from workflow.engine import start_workflow_for_request, decide_step, decide_steps_bulk, bypass_parallel_task, bypass_all_parallel_tasks
+from workflow import resolver_cache, routing_index
 
 logger = logging.getLogger(__name__)
 
@@ -292,31 +288,8 @@ def _directorate_head_user_ids(directorate_id: int | None) -> list[int]:
         return []
 
     role_vars = _role_variants('directorate_head')
-
-    # departments belonging to this directorate (for users without explicit directorate_id)
-    dept_ids: list[int] = []
-    try:
-        dept_ids = [int(did) for (did,) in (
-            db.session.query(Department.id)
-            .filter(Department.directorate_id == int(directorate_id))
-            .all()
-        )]
-    except Exception:
-        dept_ids = []
-
-    q = User.query
-    if role_vars:
-        q = q.filter(or_(*[User.role.ilike(v) for v in role_vars]))
-    else:
-        q = q.filter(User.role.ilike('directorate_head'))
-
-    if dept_ids:
-        q = q.filter(or_(User.directorate_id == int(directorate_id), User.department_id.in_(dept_ids)))
-    else:
-        q = q.filter(User.directorate_id == int(directorate_id))
-
-    users = q.all()
-    return sorted({int(u.id) for u in users if u and getattr(u, 'id', None)})
+    role_ids = resolver_cache.users_for_role_patterns(role_vars or ['directorate_head'])
+    return resolver_cache.users_in_directorate(role_ids, int(directorate_id))
 
 
 def _step_actor_user_ids(step) -> list[int]:
@@ -336,26 +309,12 @@ def _step_actor_user_ids(step) -> list[int]:
         role = (getattr(step, 'approver_role', None) or '').strip()
         if not role:
             return []
-        vars_ = _role_variants(role)
-        q = User.query
-        if vars_:
-            q = q.filter(or_(*[User.role.ilike(v) for v in vars_]))
-        else:
-            q = q.filter(User.role.ilike(role))
-        users = q.all()
-        return sorted({int(u.id) for u in users if u and getattr(u, 'id', None)})
+        return resolver_cache.users_for_role_patterns(_role_variants(role) or [role])
 
     if kind == 'DEPARTMENT':
         if not getattr(step, 'approver_department_id', None):
             return []
-        vars_ = _role_variants('dept_head')
-        q = User.query.filter(User.department_id == int(step.approver_department_id))
-        if vars_:
-            q = q.filter(or_(*[User.role.ilike(v) for v in vars_]))
-        else:
-            q = q.filter(User.role.ilike('dept_head'))
-        users = q.all()
-        return sorted({int(u.id) for u in users if u and getattr(u, 'id', None)})
+        return resolver_cache.legacy_department_heads(int(step.approver_department_id))
 
     if kind == 'DIRECTORATE':
         if not getattr(step, 'approver_directorate_id', None):
@@ -363,28 +322,8 @@ def _step_actor_user_ids(step) -> list[int]:
 
         role_vars = _role_variants('directorate_head') + _role_variants('directorate_deputy')
         role_vars = sorted({v for v in role_vars if v})
-
-        dept_ids: list[int] = []
-        try:
-            dept_ids = [int(did) for (did,) in (
-                db.session.query(Department.id)
-                .filter(Department.directorate_id == int(step.approver_directorate_id))
-                .all()
-            )]
-        except Exception:
-            dept_ids = []
-
-        q = User.query
-        if role_vars:
-            q = q.filter(or_(*[User.role.ilike(v) for v in role_vars]))
-
-        if dept_ids:
-            q = q.filter(or_(User.directorate_id == int(step.approver_directorate_id), User.department_id.in_(dept_ids)))
-        else:
-            q = q.filter(User.directorate_id == int(step.approver_directorate_id))
-
-        users = q.all()
-        return sorted({int(u.id) for u in users if u and getattr(u, 'id', None)})
+        role_ids = resolver_cache.users_for_role_patterns(role_vars)
+        return resolver_cache.users_in_directorate(role_ids, int(step.approver_directorate_id))
 
     return []
 # =========================
@@ -526,90 +465,13 @@ def _is_inline_previewable(mime: str) -> bool:
         return True
     return False
 
-def _get_user_hierarchy(user):
-    """Return (organization_id, directorate_id, department_id) for user, best-effort."""
-    dept_id = getattr(user, "department_id", None)
-    org_id = None
-
-    # Prefer explicit directorate assignment on the user (helps directorate heads)
-    dir_id = getattr(user, "directorate_id", None)
-    try:
-        if dir_id is not None and str(dir_id).isdigit():
-            dir_id = int(dir_id)
-        else:
-            dir_id = None
-    except Exception:
-        dir_id = None
-
-    # Fallback: derive from department
-    if dir_id is None and dept_id:
-        try:
-            dept = Department.query.get(int(dept_id))
-            if dept:
-                dir_id = int(getattr(dept, "directorate_id", None) or 0) or None
-        except Exception:
-            dir_id = None
-
-    # Derive organization from directorate if possible
-    if dir_id:
-        try:
-            d = Directorate.query.get(int(dir_id))
-            if d:
-                org_id = d.organization_id
-        except Exception:
-            org_id = None
-
-    return org_id, dir_id, dept_id
-
-
 def _select_template_for(user, request_type_id: int):
-    """Pick best WorkflowTemplate by routing rules for this user + request_type."""
-    org_id, dir_id, dept_id = _get_user_hierarchy(user)
-
-    user_node_id = None
-    user_node_anc = set()
-    try:
-        user_node_id = resolve_user_org_node_id(user)
-        if user_node_id:
-            user_node_anc = get_node_ancestor_ids(int(user_node_id))
-    except Exception:
-        user_node_id = None
-        user_node_anc = set()
-
-    rules = (
-        WorkflowRoutingRule.query
-        .filter_by(request_type_id=request_type_id, is_active=True)
-        .all()
-    )
+    """Pick best WorkflowTemplate by routing rules for this user + request_type.
 
-    candidates = []
-    for r in rules:
-        # Dynamic org node targeting (exact or subtree)
-        if getattr(r, "org_node_id", None) is not None:
-            if not user_node_id:
-                continue
-            if getattr(r, "match_subtree", False):
-                if int(r.org_node_id) not in user_node_anc:
-                    continue
-            else:
-                if int(r.org_node_id) != int(user_node_id):
-                    continue
-
-        if r.organization_id is not None and r.organization_id != org_id:
-            continue
-        if r.directorate_id is not None and r.directorate_id != dir_id:
-            continue
-        if r.department_id is not None and r.department_id != dept_id:
-            continue
-        candidates.append(r)
-
-    if not candidates:
-        return None, None
-
-    # specificity DESC, priority ASC, id DESC
-    candidates.sort(key=lambda x: (-x.specificity_score(), int(x.priority or 100), -int(x.id or 0)))
-    best = candidates[0]
-    return best.template, best
+    Uses the compiled routing index (workflow/routing_index.py); selection order
+    is specificity DESC, priority ASC, id DESC.
+    """
+    return routing_index.select_for_user(user, request_type_id)
 
 
 def _is_admin(user) -> bool:
@@ -1343,22 +1205,9 @@ def _user_can_act_on_step(user, step: WorkflowInstanceStep) -> bool:
         if not uid:
             return False
         try:
-            row = OrgUnitManager.query.filter_by(
-                unit_type=(unit_type or "").strip().upper(),
-                unit_id=uid,
-            ).first()
-        except Exception:
-            row = None
-        if not row:
-            return False
-        try:
-            if getattr(row, "manager_user_id", None) and int(row.manager_user_id) == int(actor.id):
-                return True
-            if getattr(row, "deputy_user_id", None) and int(row.deputy_user_id) == int(actor.id):
-                return True
+            return int(actor.id) in resolver_cache.org_manager_ids(unit_type, uid)
         except Exception:
             return False
-        return False
 
     for u in actor_users:
         if kind == "USER" and step.approver_user_id:
@@ -1403,40 +1252,25 @@ def _user_can_act_on_step(user, step: WorkflowInstanceStep) -> bool:
                 return True
 
         elif kind == "ORG_NODE" and getattr(step, "approver_org_node_id", None):
-            mgr = OrgNodeManager.query.filter_by(node_id=int(step.approver_org_node_id)).first()
-            if mgr and u.id in (mgr.manager_user_id, mgr.deputy_user_id):
+            if _is_org_manager("ORG_NODE", step.approver_org_node_id, u):
                 return True
 
         elif kind == "COMMITTEE" and getattr(step, "approver_committee_id", None):
             cmode = (getattr(step, "committee_delivery_mode", None) or "Committee_ALL")
             cmode_up = cmode.strip().upper()
 
-            q = CommitteeAssignee.query.filter_by(
-                committee_id=int(step.approver_committee_id),
-                is_active=True,
-            )
-
-            role_vars = _role_variants(getattr(u, "role", "") or "")
-            role_clause = (
-                db.or_(*[CommitteeAssignee.role.ilike(v) for v in role_vars])
-                if role_vars else CommitteeAssignee.role.ilike(getattr(u, "role", "") or "")
-            )
-
-            q = q.filter(
-                db.or_(
-                    db.and_(CommitteeAssignee.kind == "USER", CommitteeAssignee.user_id == u.id),
-                    db.and_(CommitteeAssignee.kind == "ROLE", role_clause),
-                )
-            )
-
-            # Delivery mode filter
-            if "CHAIR" in cmode_up:
-                q = q.filter(CommitteeAssignee.member_role.ilike("CHAIR"))
-            elif "SECRETARY" in cmode_up:
-                q = q.filter(CommitteeAssignee.member_role.ilike("SECRETARY"))
+            role_vars = _role_variants(getattr(u, "role", "") or "") or [getattr(u, "role", "") or ""]
 
-            if q.first() is not None:
-                return True
+            for m_kind, m_user_id, m_role, m_member_role in resolver_cache.committee_members(int(step.approver_committee_id)):
+                # Delivery mode filter
+                if "CHAIR" in cmode_up and (m_member_role or "").upper() != "CHAIR":
+                    continue
+                elif "SECRETARY" in cmode_up and (m_member_role or "").upper() != "SECRETARY":
+                    continue
+                if m_kind == "USER" and m_user_id and int(m_user_id) == int(u.id):
+                    return True
+                if m_kind == "ROLE" and resolver_cache.role_matches(role_vars, m_role):
+                    return True
 
     return False
 def _user_can_view_request(user, req: WorkflowRequest) -> bool:
@@ -3257,6 +3091,77 @@ def decide_request_step(request_id, step_order):
     return redirect(url_for("workflow.view_request", request_id=req.id))
 
 
+# =========================
+# Bulk Decide (Approve/Reject many steps)
+# =========================
+@workflow_bp.route("/decide-bulk", methods=["POST"])
+@login_required
+def decide_bulk():
+    """
+    JSON: {"items": [{"request_id", "step_order", "decision", "note"}, ...]}
+    Form (inbox): item=<request_id>:<step_order> (multiple) + decision + note
+    """
+    items = []
+    if request.is_json:
+        payload = request.get_json(silent=True) or {}
+        for it in (payload.get("items") or []):
+            if not isinstance(it, dict):
+                items.append((None, None, None, None))
+                continue
+            items.append((it.get("request_id"), it.get("step_order"), it.get("decision"), it.get("note")))
+    else:
+        decision = (request.form.get("decision") or "").strip().upper()
+        note = (request.form.get("note") or "").strip()
+        for raw in request.form.getlist("item"):
+            rid, _, order = (raw or "").partition(":")
+            items.append((rid, order, decision, note))
+
+    delegations = get_active_delegations() or []
+
+    def _can_act(req, step):
+        actor_users = [current_user] + [getattr(d, "from_user", None) for d in delegations]
+        if not any(u and _user_can_view_request(u, req) for u in actor_users):
+            return None
+        if _user_can_act_on_step(current_user, step):
+            return (current_user.id, None, None)
+        for d in delegations:
+            u = getattr(d, "from_user", None)
+            if u and _user_can_act_on_step(u, step):
+                return (u.id, u.id, d.id)
+        return None
+
+    try:
+        results = decide_steps_bulk(items, current_user.id, can_act=_can_act)
+    except ValueError as e:
+        if request.is_json:
+            return jsonify({"ok": False, "error": str(e)}), 400
+        flash(str(e), "danger")
+        return redirect(url_for("workflow.inbox"))
+    except Exception as e:
+        db.session.rollback()
+        logger.exception("Bulk decision failed")
+        if request.is_json:
+            return jsonify({"ok": False, "error": str(e)}), 500
+        flash(f"خطأ أثناء حفظ الإجراءات: {e}", "danger")
+        return redirect(url_for("workflow.inbox"))
+
+    done = sum(1 for r in results if r.get("ok"))
+    if request.is_json:
+        return jsonify({"ok": True, "done": done, "failed": len(results) - done, "results": results})
+
+    if done:
+        flash(f"تم حفظ الإجراء على {done} طلب/طلبات.", "success")
+    failed = [r for r in results if not r.get("ok")]
+    if failed:
+        flash(
+            "تعذر تنفيذ الإجراء على: " + "، ".join(
+                f"#{r.get('request_id')} ({r.get('error')})" for r in failed[:10]
+            ),
+            "warning",
+        )
+    return redirect(url_for("workflow.inbox"))
+
+
 # =========================
 # PARALLEL_SYNC - Bypass assignee
 # =========================
@@ -0,0 +1,258 @@
+# workflow/routing_index.py
+"""Precompiled index of WorkflowRoutingRule for template selection.
+
+Active rules are compiled once per process into:
+
+    request_type_id -> node key -> (organization_id, directorate_id, department_id) -> [rules]
+
+node key is None (no org node scope), ("EXACT", node_id) or ("SUB", node_id).
+Every bucket is pre-sorted by the selection order (specificity DESC,
+priority ASC, id DESC), so matching a user is a fixed number of dict lookups:
+node keys {None, EXACT(user node), SUB(each ancestor)} x the 8 combinations of
+(org|None, dir|None, dept|None), keeping the best head of each bucket.
+
+Node ancestors come from the cached org tree (utils/org_tree), which is
+invalidated on its own when the org structure changes. The index is dropped
+(utils.versioned_cache) when a flush touches routing rules, departments or
+directorates, again if that transaction rolls back, and in other worker
+processes once it commits (instance/routing_index.version). A short TTL also
+covers writes made outside the ORM.
+"""
+
+from itertools import product
+
+from extensions import db
+from models import Department, Directorate, WorkflowRoutingRule
+from utils import org_tree
+from utils.org_dynamic import resolve_user_org_node_id
+from utils.versioned_cache import VersionedCache
+
+ROUTING_INDEX_TTL = 60  # seconds (writes made outside the ORM)
+STAMP_FILENAME = "routing_index.version"
+
+_WATCHED = (WorkflowRoutingRule, Department, Directorate)
+
+_cache = VersionedCache("routing", _WATCHED, stamp_filename=STAMP_FILENAME, ttl=ROUTING_INDEX_TTL)
+
+
+class _Rule:
+    __slots__ = (
+        "id", "template_id", "organization_id", "directorate_id", "department_id",
+        "org_node_id", "match_subtree", "priority", "specificity",
+    )
+
+    def __init__(self, row):
+        rid, tpl_id, org_id, dir_id, dept_id, node_id, subtree, priority = row
+        self.id = int(rid)
+        self.template_id = int(tpl_id) if tpl_id else None
+        self.organization_id = org_id
+        self.directorate_id = dir_id
+        self.department_id = dept_id
+        self.org_node_id = node_id
+        self.match_subtree = bool(subtree)
+        self.priority = int(priority or 100)
+        # The model's weights; _Rule carries the same scope attributes it reads.
+        self.specificity = WorkflowRoutingRule.specificity_score(self)
+
+    @property
+    def sort_key(self):
+        return (-self.specificity, self.priority, -self.id)
+
+    @property
+    def node_key(self):
+        if self.org_node_id is None:
+            return None
+        return ("SUB" if self.match_subtree else "EXACT", int(self.org_node_id))
+
+    def as_dict(self) -> dict:
+        return {
+            "rule_id": self.id,
+            "template_id": self.template_id,
+            "organization_id": self.organization_id,
+            "directorate_id": self.directorate_id,
+            "department_id": self.department_id,
+            "org_node_id": self.org_node_id,
+            "match_subtree": self.match_subtree,
+            "priority": self.priority,
+            "specificity": self.specificity,
+        }
+
+
+class _Snapshot:
+    __slots__ = ("by_type", "rules_by_type", "dept_dir", "dir_org")
+
+    def __init__(self):
+        # request_type_id -> {node_key: {(org, dir, dept): (rule, ...)}}
+        self.by_type: dict[int, dict] = {}
+        # request_type_id -> all active rules in selection order (for explain)
+        self.rules_by_type: dict[int, tuple] = {}
+        self.dept_dir: dict[int, int | None] = {}
+        self.dir_org: dict[int, int | None] = {}
+
+
+def _build() -> _Snapshot:
+    snap = _Snapshot()
+
+    rows = db.session.query(
+        WorkflowRoutingRule.request_type_id,
+        WorkflowRoutingRule.id,
+        WorkflowRoutingRule.template_id,
+        WorkflowRoutingRule.organization_id,
+        WorkflowRoutingRule.directorate_id,
+        WorkflowRoutingRule.department_id,
+        WorkflowRoutingRule.org_node_id,
+        WorkflowRoutingRule.match_subtree,
+        WorkflowRoutingRule.priority,
+    ).filter(WorkflowRoutingRule.is_active.is_(True)).all()
+
+    by_type: dict[int, dict] = {}
+    all_rules: dict[int, list] = {}
+    for rt_id, *rest in rows:
+        rule = _Rule(rest)
+        all_rules.setdefault(int(rt_id), []).append(rule)
+        hier = (rule.organization_id, rule.directorate_id, rule.department_id)
+        by_type.setdefault(int(rt_id), {}).setdefault(rule.node_key, {}).setdefault(hier, []).append(rule)
+
+    for rt_id, nodes in by_type.items():
+        snap.by_type[rt_id] = {
+            nk: {hk: tuple(sorted(rules, key=lambda r: r.sort_key)) for hk, rules in hier_map.items()}
+            for nk, hier_map in nodes.items()
+        }
+    snap.rules_by_type = {rt: tuple(sorted(rules, key=lambda r: r.sort_key)) for rt, rules in all_rules.items()}
+
+    for dept_id, dir_id in db.session.query(Department.id, Department.directorate_id).all():
+        snap.dept_dir[int(dept_id)] = int(dir_id) if dir_id else None
+    for dir_id, org_id in db.session.query(Directorate.id, Directorate.organization_id).all():
+        snap.dir_org[int(dir_id)] = int(org_id) if org_id else None
+    return snap
+
+
+def get_snapshot() -> _Snapshot:
+    return _cache.get(_build)
+
+
+def invalidate() -> None:
+    """Drop the compiled index (next selection rebuilds it)."""
+    _cache.invalidate()
+
+
+# -------------------------
+# Matching
+# -------------------------
+
+def user_context(user) -> dict:
+    """(organization, directorate, department, org node) used for routing.
+
+    Directorate: the user's explicit directorate_id, else the department's.
+    Organization: derived from the directorate.
+    """
+    snap = get_snapshot()
+
+    dept_id = getattr(user, "department_id", None)
+    dept_id = int(dept_id) if dept_id else None
+
+    dir_id = getattr(user, "directorate_id", None)
+    dir_id = int(dir_id) if (dir_id is not None and str(dir_id).isdigit()) else None
+    if dir_id is None and dept_id:
+        dir_id = snap.dept_dir.get(dept_id)
+
+    org_id = snap.dir_org.get(dir_id) if dir_id else None
+
+    try:
+        node_id = resolve_user_org_node_id(user)
+    except Exception:
+        node_id = None
+
+    return {
+        "organization_id": org_id,
+        "directorate_id": dir_id,
+        "department_id": dept_id,
+        "org_node_id": int(node_id) if node_id else None,
+    }
+
+
+def _node_keys(node_id: int | None) -> list:
+    keys = [None]
+    if node_id:
+        keys.append(("EXACT", int(node_id)))
+        keys.extend(("SUB", a) for a in org_tree.ancestor_ids(node_id))
+    return keys
+
+
+def match(request_type_id: int, ctx: dict):
+    """Best matching rule (a compiled rule: .id / .template_id) or None."""
+    snap = get_snapshot()
+    nodes = snap.by_type.get(int(request_type_id))
+    if not nodes:
+        return None
+
+    org_id, dir_id, dept_id = ctx.get("organization_id"), ctx.get("directorate_id"), ctx.get("department_id")
+    hier_keys = list(product({None, org_id}, {None, dir_id}, {None, dept_id}))
+
+    best = None
+    for nk in _node_keys(ctx.get("org_node_id")):
+        hier_map = nodes.get(nk)
+        if not hier_map:
+            continue
+        for hk in hier_keys:
+            bucket = hier_map.get(hk)
+            if bucket and (best is None or bucket[0].sort_key < best.sort_key):
+                best = bucket[0]
+    return best
+
+
+def select_for_user(user, request_type_id: int):
+    """(WorkflowTemplate, WorkflowRoutingRule) for the user, or (None, None)."""
+    rule = match(request_type_id, user_context(user))
+    if rule is None:
+        return None, None
+    row = db.session.get(WorkflowRoutingRule, rule.id)
+    if row is None:
+        return None, None
+    return row.template, row
+
+
+def _why_not(rule: _Rule, ctx: dict, ancestors) -> str | None:
+    if rule.org_node_id is not None:
+        if not ctx.get("org_node_id"):
+            return "user has no org node"
+        if rule.match_subtree and int(rule.org_node_id) not in ancestors:
+            return "org node is outside the rule subtree"
+        if not rule.match_subtree and int(rule.org_node_id) != int(ctx["org_node_id"]):
+            return "org node does not match exactly"
+    for field in ("organization_id", "directorate_id", "department_id"):
+        want = getattr(rule, field)
+        if want is not None and want != ctx.get(field):
+            return f"{field} mismatch ({want} != {ctx.get(field)})"
+    return None
+
+
+def explain(request_type_id: int, ctx: dict) -> dict:
+    """Why a template is (or is not) selected: every active rule with its verdict.
+
+    Rules are listed in selection order; the first matching one is `selected`.
+    """
+    snap = get_snapshot()
+    node_id = ctx.get("org_node_id")
+    ancestors = org_tree.ancestor_ids(node_id) if node_id else frozenset()
+
+    rules = []
+    selected = None
+    for r in snap.rules_by_type.get(int(request_type_id), ()):
+        reason = _why_not(r, ctx, ancestors)
+        d = r.as_dict()
+        d["matched"] = reason is None
+        d["reason"] = reason
+        if reason is None and selected is None:
+            selected = d
+        rules.append(d)
+
+    best = match(request_type_id, ctx)
+    return {
+        "request_type_id": int(request_type_id),
+        "context": dict(ctx, org_node_ancestors=sorted(ancestors)),
+        "selected": selected,
+        "index_agrees": (best.id if best else None) == (selected["rule_id"] if selected else None),
+        "order": "specificity DESC, priority ASC, id DESC",
+        "rules": rules,
+    }